@@ -0,0 +1,18 @@
+"""
+Benchmarks for performance-critical parts of xcube server.
+
+Benchmarks are not run by the unit-test suite. Each benchmark module can be run on its own, e.g.::
+
+    python -m test.benchmarks.bench_places
+
+The benchmark suite in :mod:`test.benchmarks.suite` runs benchmarks for tile serving, time-series
+extraction, place queries, WMTS capabilities, and caches against a synthetic cube, e.g.::
+
+    python -m test.benchmarks.suite --output results.json
+    python -m test.benchmarks.suite --compare results.json
+
+The load test in :mod:`test.benchmarks.loadtest` measures the end-to-end latency and throughput of the
+HTTP service by replaying the tile access patterns of map clients, e.g.::
+
+    python -m test.benchmarks.loadtest --concurrency 16 --duration 60
+"""
@@ -0,0 +1,125 @@
+"""
+Benchmark for place queries: linear scan versus :class:`xcube_server.placestore.PlaceStore`,
+and the bounding box prefilter: scan of the bounds array versus :class:`xcube_server.placeindex.PackedRTree`.
+
+Usage::
+
+    python -m test.benchmarks.bench_places [NUM_FEATURES] [NUM_QUERIES]
+"""
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+import fiona
+import numpy as np
+import shapely.geometry
+
+from xcube_server.perf import measure_time
+from xcube_server.placeindex import PackedRTree
+from xcube_server.placestore import PlaceStore
+
+
+def new_features(num_features: int, seed: int = 0):
+    random = np.random.RandomState(seed)
+    lons = random.uniform(-180.0, 180.0, num_features)
+    lats = random.uniform(-90.0, 90.0, num_features)
+    sizes = random.uniform(0.0, 0.5, num_features)
+    features = []
+    for i in range(num_features):
+        if i % 2 == 0:
+            geometry = shapely.geometry.Point(lons[i], lats[i])
+        else:
+            geometry = shapely.geometry.box(lons[i], lats[i], lons[i] + sizes[i], lats[i] + sizes[i])
+        features.append(dict(type="Feature",
+                             id=str(i),
+                             geometry=shapely.geometry.mapping(geometry),
+                             properties=dict(name=f"Place {i}")))
+    return features
+
+
+def new_query_geometries(num_queries: int, seed: int = 1):
+    random = np.random.RandomState(seed)
+    lons = random.uniform(-180.0, 170.0, num_queries)
+    lats = random.uniform(-90.0, 80.0, num_queries)
+    return [shapely.geometry.box(lon, lat, lon + 10.0, lat + 10.0) for lon, lat in zip(lons, lats)]
+
+
+def find_places_by_scan(features, query_geometry):
+    # The approach used before place indexes were introduced
+    matching_places = []
+    for place in features:
+        geometry = shapely.geometry.shape(place["geometry"])
+        if geometry.intersects(query_geometry):
+            matching_places.append(place)
+    return matching_places
+
+
+def find_bounds_by_scan(bounds, query_geometry):
+    # The bounding box prefilter used before place stores had an R-tree
+    x_min, y_min, x_max, y_max = query_geometry.bounds
+    x_overlaps = (bounds[:, 0] <= x_max) & (bounds[:, 2] >= x_min)
+    y_overlaps = (bounds[:, 1] <= y_max) & (bounds[:, 3] >= y_min)
+    return np.nonzero(x_overlaps & y_overlaps)[0]
+
+
+def run(num_features: int = 100000, num_queries: int = 20):
+    features = new_features(num_features)
+    query_geometries = new_query_geometries(num_queries)
+
+    temp_dir = tempfile.mkdtemp(prefix="xcube-bench-places-")
+    try:
+        path = os.path.join(temp_dir, "places.geojson")
+        with open(path, "w") as fp:
+            json.dump(dict(type="FeatureCollection", features=features), fp)
+        cache_dir = os.path.join(temp_dir, "cache")
+
+        with measure_time() as load_cm:
+            with fiona.open(path) as feature_collection:
+                loaded_features = [feature for feature in feature_collection]
+
+        with measure_time() as build_cm:
+            PlaceStore(path, cache_dir).sync()
+
+        with measure_time() as open_cm:
+            store = PlaceStore(path, cache_dir)
+            store.sync()
+
+        with measure_time() as scan_cm:
+            scan_results = [find_places_by_scan(loaded_features, g) for g in query_geometries]
+
+        with measure_time() as store_cm:
+            store_results = [store.find_features(g) for g in query_geometries]
+
+        assert [len(r) for r in scan_results] == [len(r) for r in store_results], "store and scan results differ"
+
+        bounds = np.array([shapely.geometry.shape(f["geometry"]).bounds for f in features])
+        with measure_time() as rtree_build_cm:
+            rtree = PackedRTree.build(bounds)
+
+        with measure_time() as bounds_scan_cm:
+            bounds_scan_results = [find_bounds_by_scan(bounds, g) for g in query_geometries]
+
+        with measure_time() as rtree_cm:
+            rtree_results = [rtree.query(g.bounds) for g in query_geometries]
+
+        assert all(np.array_equal(r1, r2) for r1, r2 in zip(bounds_scan_results, rtree_results)), \
+            "R-tree and bounds scan results differ"
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    print(f"features: {num_features}, queries: {num_queries}")
+    print(f"fiona load:    {load_cm.duration * 1000:10.2f} ms")
+    print(f"store build:   {build_cm.duration * 1000:10.2f} ms")
+    print(f"store open:    {open_cm.duration * 1000:10.2f} ms")
+    print(f"scan queries:  {scan_cm.duration * 1000 / num_queries:10.2f} ms per query")
+    print(f"store queries: {store_cm.duration * 1000 / num_queries:10.2f} ms per query")
+    print(f"R-tree build:  {rtree_build_cm.duration * 1000:10.2f} ms")
+    print(f"bounds scans:  {bounds_scan_cm.duration * 1000 / num_queries:10.2f} ms per query")
+    print(f"R-tree scans:  {rtree_cm.duration * 1000 / num_queries:10.2f} ms per query")
+
+
+if __name__ == "__main__":
+    run(*[int(arg) for arg in sys.argv[1:]])
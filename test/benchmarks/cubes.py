@@ -0,0 +1,180 @@
+"""
+Synthetic data cubes and service contexts for benchmarks.
+"""
+
+import json
+import os
+from typing import Any, Dict, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+import yaml
+
+from test.helpers import get_res_test_dir
+from xcube_server.context import ServiceContext
+
+CUBE_FORMATS = ("zarr", "nc")
+
+
+def new_cube(width: int = 2000,
+             height: int = 1000,
+             num_times: int = 5,
+             var_names: Sequence[str] = ("conc_chl", "conc_tsm"),
+             dtype: str = "float32",
+             chunks: Tuple[int, int, int] = (1, 250, 250),
+             lon_min: float = 0.0,
+             lat_min: float = 50.0,
+             res: float = 0.0025,
+             seed: int = 0) -> xr.Dataset:
+    """
+    Create a synthetic data cube with dimensions (time, lat, lon), similar to the demo cube.
+    Variable values are random; integer variables use the maximum value of *dtype* as fill value.
+
+    :param width: number of longitudes
+    :param height: number of latitudes
+    :param num_times: number of time steps
+    :param var_names: names of the variables
+    :param dtype: data type of the variables
+    :param chunks: chunk sizes as (time, lat, lon), used when the cube is written
+    :param lon_min: minimum longitude of the cube's extent
+    :param lat_min: minimum latitude of the cube's extent
+    :param res: spatial resolution in degrees
+    :param seed: random seed
+    :return: the cube
+    """
+    random = np.random.RandomState(seed)
+    dtype = np.dtype(dtype)
+    lon = np.linspace(lon_min + res / 2, lon_min + (width - 0.5) * res, width)
+    # Latitudes are decreasing as in the demo cube
+    lat = np.linspace(lat_min + (height - 0.5) * res, lat_min + res / 2, height)
+    time = pd.date_range("2017-01-01T10:00:00", periods=num_times, freq="D").values
+
+    data_vars = dict()
+    shape = (num_times, height, width)
+    for var_name in var_names:
+        if dtype.kind == "f":
+            values = random.uniform(0.0, 20.0, shape).astype(dtype)
+            values[:, :height // 10, :width // 10] = np.nan
+            attrs = dict(valid_min=0.0, valid_max=20.0)
+            encoding = dict(_FillValue=np.nan)
+        else:
+            fill_value = np.iinfo(dtype).max
+            values = random.randint(0, 200, shape).astype(dtype)
+            values[:, :height // 10, :width // 10] = fill_value
+            attrs = dict(valid_min=0, valid_max=200)
+            encoding = dict(_FillValue=fill_value)
+        data_vars[var_name] = xr.DataArray(values, dims=("time", "lat", "lon"), attrs=attrs)
+        data_vars[var_name].encoding.update(encoding, chunksizes=chunks)
+
+    return xr.Dataset(data_vars, coords=dict(time=time, lat=lat, lon=lon))
+
+
+def write_cube(cube: xr.Dataset, path: str, format: str = "zarr") -> str:
+    """
+    Write *cube* using the chunk sizes given when it was created, see :func:`new_cube`.
+
+    :param cube: the cube
+    :param path: the output path
+    :param format: either "zarr" or "nc"
+    :return: the output path
+    """
+    if format not in CUBE_FORMATS:
+        raise ValueError(f"format must be one of {CUBE_FORMATS}")
+    encoding = dict()
+    for var_name, var in cube.data_vars.items():
+        var_encoding = dict(var.encoding)
+        chunks = var_encoding.pop("chunksizes")
+        if format == "zarr":
+            var_encoding["chunks"] = chunks
+        else:
+            var_encoding.update(chunksizes=chunks, zlib=True, complevel=4)
+        encoding[var_name] = var_encoding
+    if format == "zarr":
+        cube.to_zarr(path, encoding=encoding, mode="w")
+    else:
+        cube.to_netcdf(path, encoding=encoding)
+    return path
+
+
+def write_places(path: str, cube: xr.Dataset, num_places: int, seed: int = 1) -> str:
+    """
+    Write a GeoJSON feature collection of *num_places* random points and boxes within the extent of *cube*.
+
+    :param path: the output path
+    :param cube: the cube
+    :param num_places: number of places
+    :param seed: random seed
+    :return: the output path
+    """
+    random = np.random.RandomState(seed)
+    lon_min, lon_max = float(cube.lon.min()), float(cube.lon.max())
+    lat_min, lat_max = float(cube.lat.min()), float(cube.lat.max())
+    size = 0.02 * (lon_max - lon_min)
+    lons = random.uniform(lon_min, lon_max - size, num_places)
+    lats = random.uniform(lat_min, lat_max - size, num_places)
+    features = []
+    for i in range(num_places):
+        x, y = float(lons[i]), float(lats[i])
+        if i % 2 == 0:
+            geometry = dict(type="Point", coordinates=[x, y])
+        else:
+            geometry = dict(type="Polygon",
+                            coordinates=[[[x, y], [x + size, y], [x + size, y + size], [x, y + size], [x, y]]])
+        features.append(dict(type="Feature", id=str(i), geometry=geometry, properties=dict(name=f"Place {i}")))
+    with open(path, "w") as fp:
+        json.dump(dict(type="FeatureCollection", features=features), fp)
+    return path
+
+
+def new_benchmark_config(base_dir: str,
+                         cube: xr.Dataset,
+                         format: str = "zarr",
+                         num_places: int = 1000) -> Dict[str, Any]:
+    """
+    Write *cube* and a place group into *base_dir* and create a service configuration that serves them
+    as dataset "bench" and place group "bench-places".
+
+    :param base_dir: the directory into which the cube and the places are written
+    :param cube: the cube, see :func:`new_cube`
+    :param format: either "zarr" or "nc"
+    :param num_places: number of places
+    :return: the service configuration
+    """
+    cube_path = write_cube(cube, os.path.join(base_dir, f"cube.{format}"), format=format)
+    places_path = write_places(os.path.join(base_dir, "places.geojson"), cube, num_places)
+    with open(os.path.join(get_res_test_dir(), "config.yml")) as fp:
+        service_provider = yaml.safe_load(fp)["ServiceProvider"]
+    color_mappings = {var_name: dict(ColorBar="plasma", ValueRange=[0., 20.]) for var_name in cube.data_vars}
+    return dict(Datasets=[dict(Identifier="bench",
+                               Title="Synthetic benchmark cube",
+                               Path=cube_path,
+                               Format=format,
+                               Style="default")],
+                PlaceGroups=[dict(Identifier="bench-places",
+                                  Title="Synthetic benchmark places",
+                                  Path=places_path)],
+                Styles=[dict(Identifier="default", ColorMappings=color_mappings)],
+                ServiceProvider=service_provider)
+
+
+def new_benchmark_context(base_dir: str,
+                          cube: xr.Dataset,
+                          format: str = "zarr",
+                          num_places: int = 1000,
+                          mem_tile_cache_capacity: int = None) -> ServiceContext:
+    """
+    Create a service context for the configuration created by :func:`new_benchmark_config`.
+
+    :param base_dir: the directory into which the cube, the places, and the place cache are written
+    :param cube: the cube, see :func:`new_cube`
+    :param format: either "zarr" or "nc"
+    :param num_places: number of places
+    :param mem_tile_cache_capacity: optional capacity of the in-memory tile cache in bytes
+    :return: the service context
+    """
+    config = new_benchmark_config(base_dir, cube, format=format, num_places=num_places)
+    return ServiceContext(base_dir=base_dir,
+                          config=config,
+                          mem_tile_cache_capacity=mem_tile_cache_capacity,
+                          place_cache_dir=os.path.join(base_dir, "place-cache"))
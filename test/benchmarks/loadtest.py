@@ -0,0 +1,444 @@
+"""
+HTTP load test that replays the tile access patterns of map clients against the xcube server.
+
+Unless the URL of a running server is given, a synthetic cube is written into a temporary directory
+and a server created by :func:`xcube_server.app.new_application` is started in a separate process.
+A number of concurrent clients then run sessions that replay the requests of
+
+* OpenLayers ("ol"): a viewport of XYZ tiles that is panned and zoomed, tiles are requested
+  from the viewport center outwards, tiles already loaded in a session are not requested again;
+* Cesium ("cesium"): like OpenLayers, but for each view the covering tiles of all coarser levels
+  are requested first, as Cesium refines its quadtree from level zero;
+* WMTS ("wmts"): like OpenLayers, but using WMTS KVP GetTile requests;
+* time-series ("ts"): point time-series requests at random locations.
+
+The report comprises the 50th, 95th, and 99th latency percentiles per session type, the throughput,
+and the hit rates of the server's caches during the test.
+
+Usage::
+
+    python -m test.benchmarks.loadtest [--url URL] [--concurrency 8] [--duration 30] [--requests N]
+                                       [--mix ol=4,cesium=2,wmts=2,ts=1] [--tile-cache-size 512M]
+                                       [--width 2000] [--height 1000] [--times 5] [--chunks 1,250,250]
+                                       [--format zarr] [--seed 0] [--output REPORT]
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import multiprocessing
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import time
+import urllib.parse
+from typing import Any, Dict, Iterator, List, NamedTuple, Tuple
+
+import numpy as np
+from tornado.httpclient import AsyncHTTPClient
+from tornado.httpserver import HTTPServer
+from tornado.netutil import bind_sockets
+
+from test.benchmarks.cubes import new_cube, new_benchmark_config, CUBE_FORMATS
+from xcube_server.app import new_application
+from xcube_server.context import ServiceContext
+from xcube_server.defaults import API_PREFIX, DEFAULT_NAME
+from xcube_server.service import parse_tile_cache_config
+
+SESSION_TYPES = ("ol", "cesium", "wmts", "ts")
+
+DEFAULT_MIX = "ol=4,cesium=2,wmts=2,ts=1"
+
+# Viewport size in tiles of a typical browser window
+VIEWPORT_SIZE = (4, 3)
+
+# Number of pan or zoom steps per map session
+NUM_VIEW_STEPS = 8
+
+# Number of requests per time-series session
+NUM_TIME_SERIES_POINTS = 3
+
+# A request sample: session type, HTTP status code, latency in seconds, response size in bytes
+Sample = Tuple[str, int, float, int]
+
+_CACHE_COUNTER_PATTERN = re.compile(r'^xcube_cache_(hits|misses)_total\{cache="([^"]*)"\} (\S+)$')
+
+
+class TileGridInfo(NamedTuple):
+    """Tile grid of a dataset variable, as obtained from its Cesium tile grid options."""
+    num_levels: int
+    num_level_zero_tiles_x: int
+    num_level_zero_tiles_y: int
+    west: float
+    south: float
+    east: float
+    north: float
+
+    def num_tiles(self, z: int) -> Tuple[int, int]:
+        return self.num_level_zero_tiles_x << z, self.num_level_zero_tiles_y << z
+
+    @classmethod
+    def from_cesium_options(cls, options: Dict[str, Any]) -> 'TileGridInfo':
+        tiling_scheme = options["tilingScheme"]
+        rectangle = options["rectangle"]
+        return TileGridInfo(num_levels=options["maximumLevel"] + 1,
+                            num_level_zero_tiles_x=tiling_scheme["numberOfLevelZeroTilesX"],
+                            num_level_zero_tiles_y=tiling_scheme["numberOfLevelZeroTilesY"],
+                            west=rectangle["west"],
+                            south=rectangle["south"],
+                            east=rectangle["east"],
+                            north=rectangle["north"])
+
+
+class Workload:
+    """
+    Generates the request paths of client sessions.
+
+    :param ds_id: dataset identifier
+    :param var_name: variable name
+    :param tile_grid: the variable's tile grid
+    :param times: the dataset's time coordinates as ISO-format strings
+    :param rng: random number generator
+    """
+
+    def __init__(self, ds_id: str, var_name: str, tile_grid: TileGridInfo, times: List[str], rng: random.Random):
+        self.ds_id = ds_id
+        self.var_name = var_name
+        self.tile_grid = tile_grid
+        self.times = times
+        self.rng = rng
+
+    def new_session(self, session_type: str) -> Iterator[str]:
+        if session_type == "ts":
+            return self.time_series_session()
+        if session_type not in SESSION_TYPES:
+            raise ValueError(f"session type must be one of {SESSION_TYPES}")
+        return self.map_session(session_type)
+
+    def map_session(self, session_type: str) -> Iterator[str]:
+        """Generate the tile request paths of a map client that pans and zooms a viewport."""
+        time_value = self.rng.choice(self.times)
+        loaded = set()
+        for z, cx, cy in self._iter_views():
+            levels = range(z + 1) if session_type == "cesium" else (z,)
+            for level in levels:
+                scale = 2 ** (z - level)
+                for x, y in self._get_viewport_tiles(level, cx / scale, cy / scale):
+                    if (level, x, y) not in loaded:
+                        loaded.add((level, x, y))
+                        yield self._get_tile_path(session_type, level, x, y, time_value)
+
+    def time_series_session(self) -> Iterator[str]:
+        """Generate the request paths of a client requesting time-series at random points."""
+        grid = self.tile_grid
+        for _ in range(NUM_TIME_SERIES_POINTS):
+            lon = self.rng.uniform(grid.west, grid.east)
+            lat = self.rng.uniform(grid.south, grid.north)
+            yield f"/ts/{self.ds_id}/{self.var_name}/point?lon={lon:.5f}&lat={lat:.5f}"
+
+    def _iter_views(self) -> Iterator[Tuple[int, float, float]]:
+        """Generate a sequence of views given as level and center in tile coordinates of that level."""
+        grid = self.tile_grid
+        z = self.rng.randrange(grid.num_levels)
+        num_tiles_x, num_tiles_y = grid.num_tiles(z)
+        cx, cy = self.rng.uniform(0, num_tiles_x), self.rng.uniform(0, num_tiles_y)
+        for _ in range(NUM_VIEW_STEPS):
+            yield z, cx, cy
+            action = self.rng.random()
+            if action < 0.15 and z < grid.num_levels - 1:
+                z, cx, cy = z + 1, cx * 2, cy * 2
+            elif action < 0.3 and z > 0:
+                z, cx, cy = z - 1, cx / 2, cy / 2
+            else:
+                cx += self.rng.uniform(-1.5, 1.5)
+                cy += self.rng.uniform(-1.0, 1.0)
+            num_tiles_x, num_tiles_y = grid.num_tiles(z)
+            cx = min(max(cx, 0.0), num_tiles_x)
+            cy = min(max(cy, 0.0), num_tiles_y)
+
+    def _get_viewport_tiles(self, z: int, cx: float, cy: float) -> List[Tuple[int, int]]:
+        """Get the tiles of a viewport centered at (cx, cy), ordered by distance from the center."""
+        num_tiles_x, num_tiles_y = self.tile_grid.num_tiles(z)
+        w, h = VIEWPORT_SIZE
+        x1, x2 = max(0, math.floor(cx - w / 2)), min(num_tiles_x, math.ceil(cx + w / 2))
+        y1, y2 = max(0, math.floor(cy - h / 2)), min(num_tiles_y, math.ceil(cy + h / 2))
+        tiles = [(x, y) for y in range(y1, y2) for x in range(x1, x2)]
+        tiles.sort(key=lambda tile: (tile[0] + 0.5 - cx) ** 2 + (tile[1] + 0.5 - cy) ** 2)
+        return tiles
+
+    def _get_tile_path(self, session_type: str, z: int, x: int, y: int, time_value: str) -> str:
+        quoted_time = urllib.parse.quote(time_value)
+        if session_type == "wmts":
+            return (f"/wmts/kvp?Service=WMTS&Request=GetTile&Version=1.0.0"
+                    f"&Layer={self.ds_id}.{self.var_name}&Format=image/png"
+                    f"&TileMatrix={z}&TileRow={y}&TileCol={x}&time={quoted_time}")
+        return f"/datasets/{self.ds_id}/vars/{self.var_name}/tiles/{z}/{x}/{y}.png?time={quoted_time}"
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    """
+    Parse a session mix such as "ol=4,cesium=2,wmts=2,ts=1" into weights per session type.
+
+    :raise ValueError: if *mix* is invalid
+    """
+    weights = dict()
+    for item in mix.split(","):
+        try:
+            session_type, weight = item.split("=")
+            weight = float(weight)
+        except ValueError as e:
+            raise ValueError(f"invalid session mix item {item!r}, expected TYPE=WEIGHT") from e
+        if session_type not in SESSION_TYPES:
+            raise ValueError(f"invalid session type {session_type!r}, must be one of {SESSION_TYPES}")
+        if weight < 0:
+            raise ValueError(f"weight of session type {session_type!r} must not be negative")
+        weights[session_type] = weight
+    if sum(weights.values()) <= 0:
+        raise ValueError("at least one session type must have a positive weight")
+    return weights
+
+
+def parse_cache_counters(metrics_text: str) -> Dict[str, Tuple[float, float]]:
+    """Parse the cache hits and misses from the server's metrics into a mapping from cache name to (hits, misses)."""
+    counters = dict()
+    for line in metrics_text.splitlines():
+        match = _CACHE_COUNTER_PATTERN.match(line)
+        if match:
+            kind, cache_name, value = match.groups()
+            hits, misses = counters.get(cache_name, (0.0, 0.0))
+            if kind == "hits":
+                hits = float(value)
+            else:
+                misses = float(value)
+            counters[cache_name] = hits, misses
+    return counters
+
+
+def get_report(samples: List[Sample],
+               elapsed: float,
+               cache_counters_before: Dict[str, Tuple[float, float]],
+               cache_counters_after: Dict[str, Tuple[float, float]]) -> Dict[str, Any]:
+    """
+    Compute latency percentiles per session type and in total, the throughput, and the cache hit rates.
+
+    :param samples: the request samples
+    :param elapsed: the duration of the test in seconds
+    :param cache_counters_before: cache hits and misses before the test, see :func:`parse_cache_counters`
+    :param cache_counters_after: cache hits and misses after the test
+    :return: a JSON-serializable report
+    """
+
+    def get_stats(group: List[Sample]) -> Dict[str, Any]:
+        latencies = np.array([sample[2] for sample in group]) * 1000.
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if len(latencies) else (math.nan,) * 3
+        return dict(requests=len(group),
+                    errors=sum(1 for sample in group if sample[1] != 200),
+                    bytes=sum(sample[3] for sample in group),
+                    p50=float(p50),
+                    p95=float(p95),
+                    p99=float(p99))
+
+    latency = dict()
+    for session_type in SESSION_TYPES:
+        group = [sample for sample in samples if sample[0] == session_type]
+        if group:
+            latency[session_type] = get_stats(group)
+    latency["total"] = get_stats(samples)
+
+    cache_hit_rates = dict()
+    for cache_name, (hits, misses) in cache_counters_after.items():
+        hits_before, misses_before = cache_counters_before.get(cache_name, (0.0, 0.0))
+        hits, misses = hits - hits_before, misses - misses_before
+        if hits + misses > 0:
+            cache_hit_rates[cache_name] = hits / (hits + misses)
+
+    return dict(elapsed=elapsed,
+                throughput=len(samples) / elapsed if elapsed > 0 else math.nan,
+                latency=latency,
+                cache_hit_rates=cache_hit_rates)
+
+
+async def run_load_test(api_url: str,
+                        ds_id: str = "bench",
+                        var_name: str = "conc_chl",
+                        concurrency: int = 8,
+                        duration: float = 30.,
+                        max_requests: int = None,
+                        mix: str = DEFAULT_MIX,
+                        seed: int = 0) -> Dict[str, Any]:
+    """
+    Run a load test against a running server.
+
+    :param api_url: the server's API URL, e.g. "http://localhost:8080/xcube/api/0.1.0.dev6"
+    :param ds_id: identifier of the dataset to be requested
+    :param var_name: name of the variable to be requested
+    :param concurrency: number of concurrent clients
+    :param duration: maximum duration of the test in seconds
+    :param max_requests: optional maximum number of requests
+    :param mix: weights of the session types, see :func:`parse_mix`
+    :param seed: random seed
+    :return: the report, see :func:`get_report`
+    """
+    weights = parse_mix(mix)
+    session_types = list(weights.keys())
+    session_weights = [weights[session_type] for session_type in session_types]
+
+    http_client = AsyncHTTPClient(force_instance=True, max_clients=concurrency)
+    try:
+        response = await http_client.fetch(f"{api_url}/datasets/{ds_id}/vars/{var_name}/tilegrid?tiles=cesium")
+        tile_grid = TileGridInfo.from_cesium_options(json.loads(response.body))
+        response = await http_client.fetch(f"{api_url}/datasets/{ds_id}/coords/time")
+        # The tile operations expect time values without time zone
+        times = [time_value.rstrip("Z") for time_value in json.loads(response.body)["coordinates"]]
+        response = await http_client.fetch(f"{api_url}/metrics")
+        cache_counters_before = parse_cache_counters(response.body.decode("utf-8"))
+
+        samples = []  # type: List[Sample]
+        start_time = time.perf_counter()
+        deadline = start_time + duration
+
+        def is_done() -> bool:
+            return time.perf_counter() >= deadline or (max_requests is not None and len(samples) >= max_requests)
+
+        async def run_client(client_index: int):
+            rng = random.Random(seed * 1000 + client_index)
+            workload = Workload(ds_id, var_name, tile_grid, times, rng)
+            while not is_done():
+                session_type = rng.choices(session_types, weights=session_weights)[0]
+                for path in workload.new_session(session_type):
+                    if is_done():
+                        return
+                    t0 = time.perf_counter()
+                    response = await http_client.fetch(api_url + path, raise_error=False)
+                    latency = time.perf_counter() - t0
+                    samples.append((session_type, response.code, latency, len(response.body or b"")))
+
+        await asyncio.gather(*[run_client(client_index) for client_index in range(concurrency)])
+        elapsed = time.perf_counter() - start_time
+
+        response = await http_client.fetch(f"{api_url}/metrics")
+        cache_counters_after = parse_cache_counters(response.body.decode("utf-8"))
+    finally:
+        http_client.close()
+
+    report = get_report(samples, elapsed, cache_counters_before, cache_counters_after)
+    report["config"] = dict(concurrency=concurrency, duration=duration, max_requests=max_requests, mix=mix,
+                            seed=seed)
+    return report
+
+
+def start_server(config: Dict[str, Any],
+                 base_dir: str,
+                 tile_cache_size: str = "512M") -> Tuple[multiprocessing.Process, str]:
+    """
+    Start a server for the given service configuration in a new process.
+
+    :param config: the service configuration
+    :param base_dir: the service's base directory
+    :param tile_cache_size: in-memory tile cache size, e.g. "512M", or "off"
+    :return: the server process and the server's API URL
+    """
+    mp_context = multiprocessing.get_context("spawn")
+    port_queue = mp_context.Queue()
+    process = mp_context.Process(target=_serve, args=(config, base_dir, tile_cache_size, port_queue), daemon=True)
+    process.start()
+    port = port_queue.get(timeout=60)
+    return process, f"http://127.0.0.1:{port}/{DEFAULT_NAME}{API_PREFIX}"
+
+
+def _serve(config: Dict[str, Any], base_dir: str, tile_cache_size: str, port_queue):
+    asyncio.run(_serve_async(config, base_dir, tile_cache_size, port_queue))
+
+
+async def _serve_async(config: Dict[str, Any], base_dir: str, tile_cache_size: str, port_queue):
+    tile_cache_config = parse_tile_cache_config(tile_cache_size)
+    application = new_application()
+    application.service_context = ServiceContext(base_dir=base_dir,
+                                                 config=config,
+                                                 mem_tile_cache_capacity=tile_cache_config.get("capacity"),
+                                                 place_cache_dir=os.path.join(base_dir, "place-cache"))
+    application.time_of_last_activity = time.process_time()
+    sockets = bind_sockets(0, "127.0.0.1")
+    server = HTTPServer(application)
+    server.add_sockets(sockets)
+    port_queue.put(sockets[0].getsockname()[1])
+    await asyncio.Event().wait()
+
+
+def _print_report(report: Dict[str, Any]):
+    print(f"requests: {report['latency']['total']['requests']}, "
+          f"elapsed: {report['elapsed']:.2f} s, throughput: {report['throughput']:.1f} requests/s")
+    print(f"{'session':10s} {'requests':>9s} {'errors':>7s} {'p50 ms':>10s} {'p95 ms':>10s} {'p99 ms':>10s}")
+    for session_type, stats in report["latency"].items():
+        print(f"{session_type:10s} {stats['requests']:9d} {stats['errors']:7d} "
+              f"{stats['p50']:10.2f} {stats['p95']:10.2f} {stats['p99']:10.2f}")
+    for cache_name, hit_rate in report["cache_hit_rates"].items():
+        print(f"cache {cache_name}: hit rate {hit_rate * 100:.1f}%")
+
+
+def main(args: List[str] = None):
+    parser = argparse.ArgumentParser(description="Run an HTTP load test against the xcube server.")
+    parser.add_argument("--url", help="API URL of a running server, e.g. http://localhost:8080/xcube/api/0.1.0; "
+                                      "if not given, a server for a synthetic cube is started")
+    parser.add_argument("--dataset", default="bench", help="identifier of the dataset to be requested")
+    parser.add_argument("--variable", default="conc_chl", help="name of the variable to be requested")
+    parser.add_argument("--concurrency", type=int, default=8, help="number of concurrent clients")
+    parser.add_argument("--duration", type=float, default=30., help="maximum duration of the test in seconds")
+    parser.add_argument("--requests", type=int, help="maximum number of requests")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="weights of the session types")
+    parser.add_argument("--tile-cache-size", default="512M", help="in-memory tile cache size of the started server")
+    parser.add_argument("--width", type=int, default=2000, help="number of longitudes of the synthetic cube")
+    parser.add_argument("--height", type=int, default=1000, help="number of latitudes of the synthetic cube")
+    parser.add_argument("--times", type=int, default=5, help="number of time steps of the synthetic cube")
+    parser.add_argument("--chunks", default="1,250,250", help="chunk sizes of the synthetic cube as TIME,LAT,LON")
+    parser.add_argument("--format", default="zarr", choices=CUBE_FORMATS, help="format of the synthetic cube")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument("--output", help="JSON file into which the report is written")
+    args = parser.parse_args(args)
+
+    try:
+        parse_mix(args.mix)
+    except ValueError as e:
+        parser.error(str(e))
+
+    process = None
+    temp_dir = None
+    try:
+        if args.url:
+            api_url = args.url.rstrip("/")
+        else:
+            temp_dir = tempfile.mkdtemp(prefix="xcube-loadtest-")
+            cube = new_cube(width=args.width, height=args.height, num_times=args.times,
+                            chunks=tuple(int(c) for c in args.chunks.split(",")))
+            config = new_benchmark_config(temp_dir, cube, format=args.format)
+            process, api_url = start_server(config, temp_dir, tile_cache_size=args.tile_cache_size)
+
+        report = asyncio.run(run_load_test(api_url,
+                                           ds_id=args.dataset,
+                                           var_name=args.variable,
+                                           concurrency=args.concurrency,
+                                           duration=args.duration,
+                                           max_requests=args.requests,
+                                           mix=args.mix,
+                                           seed=args.seed))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.join()
+        if temp_dir is not None:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    _print_report(report)
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump(report, fp, indent=2)
+    if report["latency"]["total"]["errors"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
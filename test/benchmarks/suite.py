@@ -0,0 +1,315 @@
+"""
+Benchmark suite for tile serving, time-series extraction, place queries, WMTS capabilities, and caches.
+
+A synthetic cube of configurable size, chunking, and data type is written into a temporary directory,
+then each benchmark is run repeatedly against a service context that serves the cube.
+Results can be written to a JSON file and compared with the results of a previous run,
+so that regressions and improvements can be tracked over time.
+
+Usage::
+
+    python -m test.benchmarks.suite [--width 2000] [--height 1000] [--times 5] [--chunks 1,250,250]
+                                    [--dtype float32] [--format zarr] [--places 1000] [--repeat 20]
+                                    [--filter PATTERN] [--output RESULTS] [--compare BASELINE_RESULTS]
+"""
+
+import argparse
+import fnmatch
+import itertools
+import json
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+from test.benchmarks.cubes import new_cube, new_benchmark_context, CUBE_FORMATS
+from test.helpers import RequestParamsMock
+from xcube_server import __version__
+from xcube_server.cache import Cache, MemoryCacheStore
+from xcube_server.context import ServiceContext
+from xcube_server.controllers.places import find_places
+from xcube_server.controllers.tiles import get_dataset_tile
+from xcube_server.controllers.time_series import get_time_series_for_point, get_time_series_for_geometry, \
+    get_time_series_for_geometry_collection
+from xcube_server.controllers.wmts import get_wmts_capabilities
+
+# A benchmark factory prepares a benchmark for a given service context and returns the function to be timed
+BenchmarkFactory = Callable[[ServiceContext], Callable[[], Any]]
+
+BENCHMARKS = []  # type: List[tuple]
+
+DATASET_NAME = "bench"
+VAR_NAME = "conc_chl"
+BASE_URL = "http://localhost:8080"
+
+
+def benchmark(name: str):
+    """Decorator that registers a benchmark factory under the given *name*."""
+
+    def register(factory: BenchmarkFactory) -> BenchmarkFactory:
+        BENCHMARKS.append((name, factory))
+        return factory
+
+    return register
+
+
+def _tile_benchmark(tile_comp_mode: int) -> BenchmarkFactory:
+    def factory(ctx: ServiceContext):
+        tile_grid = ctx.get_tile_grid(DATASET_NAME)
+        z = tile_grid.num_levels - 1
+        times = ctx.get_dataset(DATASET_NAME).time.values
+        # Cycle through all tiles of the highest resolution level and all time steps,
+        # so that neither tiles nor chunks are reused between consecutive calls
+        tiles = itertools.cycle([(str(x), str(y), str(t))
+                                 for t in np.datetime_as_string(times)
+                                 for y in range(tile_grid.num_tiles_y(z))
+                                 for x in range(tile_grid.num_tiles_x(z))])
+        z = str(z)
+
+        def get_tile():
+            x, y, t = next(tiles)
+            return get_dataset_tile(ctx, DATASET_NAME, VAR_NAME, x, y, z,
+                                    RequestParamsMock(mode=str(tile_comp_mode), time=t))
+
+        return get_tile
+
+    return factory
+
+
+benchmark("tiles.get_dataset_tile[mode=0]")(_tile_benchmark(0))
+benchmark("tiles.get_dataset_tile[mode=1]")(_tile_benchmark(1))
+
+
+def _get_cube_center_and_size(ctx: ServiceContext):
+    dataset = ctx.get_dataset(DATASET_NAME)
+    lon_min, lon_max = float(dataset.lon.min()), float(dataset.lon.max())
+    lat_min, lat_max = float(dataset.lat.min()), float(dataset.lat.max())
+    return (lon_min + lon_max) / 2, (lat_min + lat_max) / 2, lon_max - lon_min, lat_max - lat_min
+
+
+def _new_box_geometry(lon: float, lat: float, width: float, height: float) -> Dict:
+    return dict(type="Polygon",
+                coordinates=[[[lon, lat], [lon + width, lat], [lon + width, lat + height],
+                              [lon, lat + height], [lon, lat]]])
+
+
+@benchmark("time_series.point")
+def _time_series_for_point(ctx: ServiceContext):
+    lon, lat, _, _ = _get_cube_center_and_size(ctx)
+    return lambda: get_time_series_for_point(ctx, DATASET_NAME, VAR_NAME, lon, lat)
+
+
+@benchmark("time_series.geometry")
+def _time_series_for_geometry(ctx: ServiceContext):
+    lon, lat, width, height = _get_cube_center_and_size(ctx)
+    geometry = _new_box_geometry(lon, lat, width / 10, height / 10)
+    return lambda: get_time_series_for_geometry(ctx, DATASET_NAME, VAR_NAME, geometry)
+
+
+@benchmark("time_series.geometry_collection")
+def _time_series_for_geometry_collection(ctx: ServiceContext):
+    lon, lat, width, height = _get_cube_center_and_size(ctx)
+    geometry_collection = dict(type="GeometryCollection",
+                               geometries=[_new_box_geometry(lon - i * width / 20, lat - i * height / 20,
+                                                             width / 20, height / 20) for i in range(5)])
+    return lambda: get_time_series_for_geometry_collection(ctx, DATASET_NAME, VAR_NAME, geometry_collection)
+
+
+@benchmark("places.find_places[box]")
+def _find_places_by_box(ctx: ServiceContext):
+    lon, lat, width, height = _get_cube_center_and_size(ctx)
+    box_coords = f"{lon - width / 4},{lat - height / 4},{lon + width / 4},{lat + height / 4}"
+    return lambda: find_places(ctx, "bench-places", box_coords=box_coords, limit=100)
+
+
+@benchmark("places.find_places[query]")
+def _find_places_by_query(ctx: ServiceContext):
+    return lambda: find_places(ctx, "bench-places", query_expr="name:\"Place 1*\"", limit=100)
+
+
+@benchmark("wmts.get_capabilities[cold]")
+def _get_wmts_capabilities_cold(ctx: ServiceContext):
+    def get_capabilities():
+        # Force recomputation of the dataset fragments and the document
+        # noinspection PyProtectedMember
+        ctx._dataset_fragment_cache.clear()
+        # noinspection PyProtectedMember
+        ctx._document_cache.clear()
+        return get_wmts_capabilities(ctx, BASE_URL)
+
+    return get_capabilities
+
+
+@benchmark("wmts.get_capabilities[warm]")
+def _get_wmts_capabilities_warm(ctx: ServiceContext):
+    get_wmts_capabilities(ctx, BASE_URL)
+    return lambda: get_wmts_capabilities(ctx, BASE_URL)
+
+
+@benchmark("cache.put_get[hits]")
+def _cache_hits(ctx: ServiceContext):
+    cache = Cache(MemoryCacheStore(), capacity=1000 * 1024)
+    values = [np.zeros(256, dtype=np.uint8) for _ in range(1000)]
+    for i, value in enumerate(values):
+        cache.put_value(i, value)
+    keys = list(range(1000))
+
+    def get_values():
+        for key in keys:
+            cache.get_value(key)
+
+    return get_values
+
+
+@benchmark("cache.put_get[evictions]")
+def _cache_evictions(ctx: ServiceContext):
+    # Capacity for 100 values only, so that most puts trigger a trim
+    cache = Cache(MemoryCacheStore(), capacity=100 * 256)
+    values = [np.zeros(256, dtype=np.uint8) for _ in range(1000)]
+
+    def put_and_get_values():
+        for i, value in enumerate(values):
+            cache.put_value(i, value)
+            cache.get_value(i)
+
+    return put_and_get_values
+
+
+def time_benchmark(func: Callable[[], Any], repeat: int, warmup: int = 1) -> Dict[str, float]:
+    """
+    Call *func* *warmup* times without timing it, then *repeat* times with timing it.
+
+    :param func: the function to be timed
+    :param repeat: the number of timed calls
+    :param warmup: the number of untimed calls
+    :return: the minimum, median, mean, and maximum durations in milliseconds, and the number of calls
+    """
+    for _ in range(warmup):
+        func()
+    durations = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        durations.append((time.perf_counter() - t0) * 1000.)
+    return dict(min=min(durations),
+                median=statistics.median(durations),
+                mean=statistics.mean(durations),
+                max=max(durations),
+                repeat=repeat)
+
+
+def run(width: int = 2000,
+        height: int = 1000,
+        num_times: int = 5,
+        chunks=(1, 250, 250),
+        dtype: str = "float32",
+        format: str = "zarr",
+        num_places: int = 1000,
+        repeat: int = 20,
+        name_pattern: str = None,
+        verbose: bool = True) -> Dict[str, Any]:
+    """
+    Run the benchmark suite.
+
+    :param width: number of longitudes of the synthetic cube
+    :param height: number of latitudes of the synthetic cube
+    :param num_times: number of time steps of the synthetic cube
+    :param chunks: chunk sizes of the synthetic cube as (time, lat, lon)
+    :param dtype: data type of the synthetic cube's variables
+    :param format: format of the synthetic cube, either "zarr" or "nc"
+    :param num_places: number of places of the synthetic place group
+    :param repeat: the number of timed calls per benchmark
+    :param name_pattern: optional wildcard pattern, only benchmarks whose names match are run
+    :param verbose: whether to print the results while running
+    :return: a JSON-serializable dictionary with the suite's configuration and the benchmark results
+    """
+    config = dict(width=width, height=height, num_times=num_times, chunks=list(chunks), dtype=dtype,
+                  format=format, num_places=num_places, repeat=repeat)
+    results = dict()
+    temp_dir = tempfile.mkdtemp(prefix="xcube-bench-suite-")
+    try:
+        cube = new_cube(width=width, height=height, num_times=num_times, dtype=dtype, chunks=tuple(chunks))
+        ctx = new_benchmark_context(temp_dir, cube, format=format, num_places=num_places)
+        for name, factory in BENCHMARKS:
+            if name_pattern and not fnmatch.fnmatch(name, name_pattern):
+                continue
+            results[name] = time_benchmark(factory(ctx), repeat)
+            if verbose:
+                _print_result(name, results[name])
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+    return dict(version=__version__,
+                python=platform.python_version(),
+                platform=platform.platform(),
+                config=config,
+                results=results)
+
+
+def compare(results: Dict[str, Any], baseline_results: Dict[str, Any]) -> Dict[str, float]:
+    """
+    Compare the median durations of *results* with those of *baseline_results*.
+
+    :return: the ratios of the median durations per benchmark name, values below one are improvements
+    """
+    ratios = dict()
+    for name, result in results["results"].items():
+        baseline_result = baseline_results["results"].get(name)
+        if baseline_result and baseline_result["median"] > 0:
+            ratios[name] = result["median"] / baseline_result["median"]
+    return ratios
+
+
+def _print_result(name: str, result: Dict[str, float], ratio: Optional[float] = None):
+    line = f"{name:40s} min {result['min']:10.3f} ms   median {result['median']:10.3f} ms"
+    if ratio is not None:
+        line += f"   {ratio:6.2f}x baseline"
+    print(line)
+
+
+def main(args: List[str] = None):
+    parser = argparse.ArgumentParser(description="Run the xcube server benchmark suite.")
+    parser.add_argument("--width", type=int, default=2000, help="number of longitudes of the synthetic cube")
+    parser.add_argument("--height", type=int, default=1000, help="number of latitudes of the synthetic cube")
+    parser.add_argument("--times", type=int, default=5, help="number of time steps of the synthetic cube")
+    parser.add_argument("--chunks", default="1,250,250", help="chunk sizes of the synthetic cube as TIME,LAT,LON")
+    parser.add_argument("--dtype", default="float32", help="data type of the synthetic cube's variables")
+    parser.add_argument("--format", default="zarr", choices=CUBE_FORMATS, help="format of the synthetic cube")
+    parser.add_argument("--places", type=int, default=1000, help="number of places of the synthetic place group")
+    parser.add_argument("--repeat", type=int, default=20, help="number of timed calls per benchmark")
+    parser.add_argument("--filter", help="wildcard pattern for the names of the benchmarks to be run")
+    parser.add_argument("--output", help="JSON file into which the results are written")
+    parser.add_argument("--compare", help="JSON file with the results of a previous run to compare with")
+    args = parser.parse_args(args)
+
+    results = run(width=args.width,
+                  height=args.height,
+                  num_times=args.times,
+                  chunks=[int(c) for c in args.chunks.split(",")],
+                  dtype=args.dtype,
+                  format=args.format,
+                  num_places=args.places,
+                  repeat=args.repeat,
+                  name_pattern=args.filter,
+                  verbose=not args.compare)
+
+    if args.compare:
+        with open(args.compare) as fp:
+            baseline_results = json.load(fp)
+        if baseline_results.get("config") != results["config"]:
+            print("warning: the baseline results were obtained using a different configuration", file=sys.stderr)
+        ratios = compare(results, baseline_results)
+        for name, result in results["results"].items():
+            _print_result(name, result, ratio=ratios.get(name))
+
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump(results, fp, indent=2)
+
+
+if __name__ == "__main__":
+    main()
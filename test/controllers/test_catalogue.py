@@ -1,9 +1,14 @@
+import copy
+import json
 import unittest
 
 from test.helpers import new_test_service_context
 from xcube_server.context import ServiceContext
-from xcube_server.controllers.catalogue import get_datasets, get_color_bars
+from xcube_server.controllers.catalogue import get_datasets, get_color_bars, get_datasets_document, \
+    get_dataset_document, get_dataset
+from xcube_server.defaults import MAX_DOCUMENT_VARIANTS
 from xcube_server.errors import ServiceBadRequestError
+from xcube_server.jsonenc import to_json
 
 
 class CatalogueControllerTest(unittest.TestCase):
@@ -37,6 +42,100 @@ class CatalogueControllerTest(unittest.TestCase):
         self.assertIn("variables", dataset)
         self.assertIn("dimensions", dataset)
 
+    def test_datasets_document_is_cached(self):
+        ctx = new_test_service_context()
+
+        document = get_datasets_document(ctx, details=True, base_url="http://test")
+        self.assertEqual('application/json', document.content_type)
+        self.assertEqual(json.loads(to_json(get_datasets(ctx, details=True, base_url="http://test"))),
+                         json.loads(document.text))
+        self.assertIs(document, get_datasets_document(ctx, details=True, base_url="http://test"))
+        self.assertIsNot(document, get_datasets_document(ctx, details=True, base_url="http://test2"))
+        self.assertIsNot(document, get_datasets_document(ctx, details=False, base_url="http://test"))
+
+        # Reloading an unchanged configuration keeps the document
+        ctx.config = copy.deepcopy(ctx.config)
+        self.assertIs(document, get_datasets_document(ctx, details=True, base_url="http://test"))
+
+        # Changing a dataset's configuration updates the document
+        config = copy.deepcopy(ctx.config)
+        config['Datasets'][0]['Title'] = 'Bibo Cube'
+        ctx.config = config
+        new_document = get_datasets_document(ctx, details=True, base_url="http://test")
+        self.assertIsNot(document, new_document)
+        self.assertEqual('Bibo Cube', json.loads(new_document.text)["datasets"][0]["title"])
+
+        # Changing the styles updates the document
+        document = new_document
+        config = copy.deepcopy(ctx.config)
+        config['Styles'][0]['ColorMappings']['conc_chl']['ColorBar'] = 'viridis'
+        ctx.config = config
+        new_document = get_datasets_document(ctx, details=True, base_url="http://test")
+        self.assertIsNot(document, new_document)
+        variables = json.loads(new_document.text)["datasets"][0]["variables"]
+        self.assertIn('viridis', [variable["colorBarName"] for variable in variables])
+
+    def test_dataset_document_is_cached(self):
+        ctx = new_test_service_context()
+
+        document = get_dataset_document(ctx, 'demo', client='ol4', base_url="http://test")
+        self.assertEqual(json.loads(to_json(get_dataset(ctx, 'demo', client='ol4', base_url="http://test"))),
+                         json.loads(document.text))
+        self.assertIs(document, get_dataset_document(ctx, 'demo', client='ol4', base_url="http://test"))
+        self.assertIsNot(document, get_dataset_document(ctx, 'demo', client='cesium', base_url="http://test"))
+
+        pretty_document = get_dataset_document(ctx, 'demo', client='ol4', base_url="http://test", pretty=True)
+        self.assertIsNot(document, pretty_document)
+        self.assertEqual(json.loads(document.text), json.loads(pretty_document.text))
+        self.assertNotIn('\n', document.text)
+        self.assertIn('\n  "id": "demo",\n', pretty_document.text)
+
+    def test_documents_are_recomputed_if_dataset_is_reopened(self):
+        ctx = new_test_service_context()
+
+        document = get_dataset_document(ctx, 'demo', client='ol4', base_url="http://test")
+        datasets_document = get_datasets_document(ctx, details=True, client='ol4', base_url="http://test")
+        # noinspection PyProtectedMember
+        ctx._close_datasets({'demo'})
+        ctx.get_dataset('demo')
+        new_document = get_dataset_document(ctx, 'demo', client='ol4', base_url="http://test")
+        self.assertIsNot(document, new_document)
+        self.assertEqual(json.loads(document.text), json.loads(new_document.text))
+        new_datasets_document = get_datasets_document(ctx, details=True, client='ol4', base_url="http://test")
+        self.assertIsNot(datasets_document, new_datasets_document)
+        self.assertEqual(json.loads(datasets_document.text), json.loads(new_datasets_document.text))
+
+    def test_dataset_does_not_modify_cached_fragment(self):
+        ctx = new_test_service_context()
+
+        dataset = get_dataset(ctx, 'demo')
+        dataset["title"] = "Changed"
+        self.assertNotEqual("Changed", get_dataset(ctx, 'demo')["title"])
+
+    def test_unknown_tile_client(self):
+        ctx = new_test_service_context()
+        with self.assertRaises(ServiceBadRequestError) as cm:
+            get_datasets_document(ctx, details=True, client='bibo', base_url='http://bibo')
+        self.assertEqual('HTTP 400: Unknown tile client "bibo"', f'{cm.exception}')
+        with self.assertRaises(ServiceBadRequestError):
+            get_dataset_document(ctx, 'demo', client='bibo', base_url='http://bibo')
+        # noinspection PyProtectedMember
+        self.assertEqual({}, ctx._document_cache)
+
+    def test_documents_cache_is_bounded(self):
+        ctx = new_test_service_context()
+        for i in range(2 * MAX_DOCUMENT_VARIANTS):
+            get_datasets_document(ctx, details=True, client='ol4', base_url=f'http://host{i}')
+            get_dataset_document(ctx, 'demo', client='ol4', base_url=f'http://host{i}')
+        # noinspection PyProtectedMember
+        self.assertEqual(2, len(ctx._document_cache))
+        # noinspection PyProtectedMember
+        for variants in ctx._document_cache.values():
+            self.assertEqual(MAX_DOCUMENT_VARIANTS, len(variants))
+        # noinspection PyProtectedMember
+        for variants in ctx._dataset_fragment_cache.values():
+            self.assertEqual(MAX_DOCUMENT_VARIANTS, len(variants))
+
     def test_get_colorbars(self):
         ctx = ServiceContext()
 
@@ -55,6 +55,68 @@ class FeaturesControllerTest(unittest.TestCase):
             find_places(ctx, "all", geojson_obj=geojson_obj)
         self.assertEqual("HTTP 400: Received invalid GeoJSON object", f"{cm.exception}")
 
+    def test_find_places_by_query(self):
+        ctx = new_test_service_context()
+        places = find_places(ctx, "all", query_expr="Name:*3")
+        self._assertPlaceGroup(places, 1, {'2'})
+
+        places = find_places(ctx, "all", query_expr='Sub_Region_Name:outside Name:"station 6"')
+        self._assertPlaceGroup(places, 1, {'5'})
+
+        places = find_places(ctx, "all", query_expr="Name=Station\\ 1 Name>=Station\\ 6", comb_op="or")
+        self._assertPlaceGroup(places, 2, {'0', '5'})
+
+        places = find_places(ctx, "all", box_coords="-1,49,2,55", query_expr="Sub_Region_Name:Inside")
+        self._assertPlaceGroup(places, 1, {'0'})
+
+        places = find_places(ctx, "all", box_coords="-1,49,2,55", query_expr="Name:*6", comb_op="or")
+        self._assertPlaceGroup(places, 3, {'0', '3', '5'})
+
+        places = find_places(ctx, "all", query_expr="Bibo:*")
+        self._assertPlaceGroup(places, 0, set())
+
+        with self.assertRaises(ServiceBadRequestError) as cm:
+            find_places(ctx, "all", query_expr="Name")
+        self.assertEqual("HTTP 400: Invalid query expression: invalid query term 'Name'", f"{cm.exception}")
+
+        with self.assertRaises(ServiceBadRequestError) as cm:
+            find_places(ctx, "all", query_expr="Name:*3", comb_op="xor")
+        self.assertEqual('HTTP 400: Invalid combination operation "xor", must be "and" or "or"', f"{cm.exception}")
+
+    def test_find_places_paginated(self):
+        ctx = new_test_service_context()
+        places = find_places(ctx, "all", limit=4)
+        self._assertPlaceGroup(places, 4, {'0', '1', '2', '3'})
+        self.assertIn("nextCursor", places)
+
+        places = find_places(ctx, "all", limit=4, cursor=places["nextCursor"])
+        self._assertPlaceGroup(places, 2, {'4', '5'})
+        self.assertNotIn("nextCursor", places)
+
+        places = find_places(ctx, "all", limit=2, offset=2)
+        self._assertPlaceGroup(places, 2, {'2', '3'})
+
+        places = find_places(ctx, "all", box_coords="-1,50,3,55", limit=1, offset=3)
+        self._assertPlaceGroup(places, 1, {'4'})
+
+        with self.assertRaises(ServiceBadRequestError) as cm:
+            find_places(ctx, "all", limit=2, cursor="bibo")
+        self.assertEqual("HTTP 400: Invalid cursor", f"{cm.exception}")
+
+        with self.assertRaises(ServiceBadRequestError) as cm:
+            find_places(ctx, "all", limit=-1)
+        self.assertEqual("HTTP 400: Limit must not be negative", f"{cm.exception}")
+
+    def test_find_places_with_projection(self):
+        ctx = new_test_service_context()
+        places = find_places(ctx, "inside-cube", property_names=["Name", "Bibo"])
+        self._assertPlaceGroup(places, 3, {'0', '1', '2'})
+        self.assertEqual([{'Name': 'Station 1'}, {'Name': 'Station 2'}, {'Name': 'Station 3'}],
+                         [feature["properties"] for feature in places["features"]])
+        # Projection must not modify the place group
+        self.assertEqual(['Name', 'Region_Name', 'Sub_Region_Name'],
+                         sorted(ctx.get_place_group("inside-cube")["features"][0]["properties"].keys()))
+
     def test_find_dataset_features(self):
         ctx = new_test_service_context()
         places = find_dataset_places(ctx, "all", "demo")
@@ -4,7 +4,9 @@ import numpy as np
 
 from test.helpers import new_test_service_context
 from xcube_server.controllers.time_series import get_time_series_info, get_time_series_for_point, \
-    get_time_series_for_geometry, get_time_series_for_geometry_collection
+    get_time_series_for_geometry, get_time_series_for_geometry_collection, iter_time_series_for_point, \
+    iter_time_series_for_geometry, iter_time_series_for_geometry_collection
+from xcube_server.errors import ServiceBadRequestError
 
 
 class TimeSeriesControllerTest(unittest.TestCase):
@@ -118,6 +120,46 @@ class TimeSeriesControllerTest(unittest.TestCase):
 
         self.assertEqual(expected_dict, time_series)
 
+    def test_iter_time_series_for_point(self):
+        ctx = new_test_service_context()
+        blocks = iter_time_series_for_point(ctx, 'demo', 'conc_tsm',
+                                            lon=2.1, lat=51.4,
+                                            start_date=np.datetime64('2017-01-15'),
+                                            end_date=np.datetime64('2017-01-29'))
+        results = [result for block in blocks for result in block]
+        self.assertEqual(get_time_series_for_point(ctx, 'demo', 'conc_tsm',
+                                                   lon=2.1, lat=51.4,
+                                                   start_date=np.datetime64('2017-01-15'),
+                                                   end_date=np.datetime64('2017-01-29'))['results'],
+                         results)
+        self.assertEqual(4, len(results))
+
+        blocks = iter_time_series_for_point(ctx, 'demo', 'conc_tsm', lon=-150.0, lat=-30.0)
+        self.assertEqual([], list(blocks))
+
+    def test_iter_time_series_for_geometry(self):
+        ctx = new_test_service_context()
+        polygon = dict(type="Polygon", coordinates=[[[1., 51.], [2., 51.], [2., 52.], [1., 52.], [1., 51.]]])
+        blocks = iter_time_series_for_geometry(ctx, 'demo', 'conc_tsm', polygon)
+        results = [result for block in blocks for result in block]
+        self.assertEqual(get_time_series_for_geometry(ctx, 'demo', 'conc_tsm', polygon)['results'],
+                         results)
+        self.assertEqual(5, len(results))
+
+        with self.assertRaises(ServiceBadRequestError):
+            iter_time_series_for_geometry(ctx, 'demo', 'conc_tsm', dict(type="Point"))
+
+    def test_iter_time_series_for_geometries(self):
+        ctx = new_test_service_context()
+        point = dict(type="Point", coordinates=[2.1, 51.4])
+        polygon = dict(type="Polygon", coordinates=[[[1., 51.], [2., 51.], [2., 52.], [1., 52.], [1., 51.]]])
+        blocks = iter_time_series_for_geometry_collection(ctx, 'demo', 'conc_tsm',
+                                                          dict(type="GeometryCollection",
+                                                               geometries=[point, polygon]))
+        results = [result for block in blocks for result in block]
+        self.assertEqual(10, len(results))
+        self.assertEqual([0] * 5 + [1] * 5, [result['geometryIndex'] for result in results])
+
     def test_get_time_series_info(self):
         ctx = new_test_service_context()
         info = get_time_series_info(ctx)
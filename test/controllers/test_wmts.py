@@ -1,8 +1,11 @@
+import copy
+import gzip
 import os
 import unittest
 
 from test.helpers import get_res_test_dir, new_test_service_context
-from xcube_server.controllers.wmts import get_wmts_capabilities_xml
+from xcube_server.controllers.wmts import get_wmts_capabilities_xml, get_wmts_capabilities
+from xcube_server.defaults import MAX_DOCUMENT_VARIANTS
 
 
 class WmtsControllerTest(unittest.TestCase):
@@ -17,3 +20,37 @@ class WmtsControllerTest(unittest.TestCase):
         # print(capabilities)
         # print(80 * '=')
         self.assertEqual(expected_capabilities.replace(' ', ''), capabilities.replace(' ', ''))
+
+    def test_get_wmts_capabilities_is_cached(self):
+        ctx = new_test_service_context()
+        capabilities = get_wmts_capabilities(ctx, 'http://bibo')
+        self.assertEqual('application/xml', capabilities.content_type)
+        self.assertEqual(capabilities.text.encode('utf-8'), capabilities.data)
+        self.assertEqual(capabilities.data, gzip.decompress(capabilities.gzipped_data))
+        self.assertIs(capabilities, get_wmts_capabilities(ctx, 'http://bibo'))
+        self.assertIsNot(capabilities, get_wmts_capabilities(ctx, 'http://bibo2'))
+
+        # Reloading an unchanged configuration keeps the document
+        ctx.config = copy.deepcopy(ctx.config)
+        self.assertIs(capabilities, get_wmts_capabilities(ctx, 'http://bibo'))
+
+        # Changing a dataset's configuration updates the document
+        config = copy.deepcopy(ctx.config)
+        config['Datasets'][0]['Title'] = 'Bibo Cube'
+        ctx.config = config
+        new_capabilities = get_wmts_capabilities(ctx, 'http://bibo')
+        self.assertIsNot(capabilities, new_capabilities)
+        self.assertIn('<ows:Title>Bibo Cube</ows:Title>', new_capabilities.text)
+
+    def test_get_wmts_capabilities_cache_is_bounded(self):
+        ctx = new_test_service_context()
+        capabilities = get_wmts_capabilities(ctx, 'http://bibo')
+        for i in range(2 * MAX_DOCUMENT_VARIANTS):
+            get_wmts_capabilities(ctx, f'http://host{i}')
+        # noinspection PyProtectedMember
+        self.assertEqual(MAX_DOCUMENT_VARIANTS, len(ctx._document_cache['wmts']))
+        # noinspection PyProtectedMember
+        for variants in ctx._dataset_fragment_cache.values():
+            self.assertEqual(MAX_DOCUMENT_VARIANTS, len(variants))
+        # The least recently used variant has been evicted
+        self.assertIsNot(capabilities, get_wmts_capabilities(ctx, 'http://bibo'))
@@ -1,7 +1,8 @@
 from unittest import TestCase
 
 from xcube_server.im import GLOBAL_GEO_EXTENT
-from xcube_server.im.tilegrid import TileGrid, pow2_1d_subdivisions, pow2_2d_subdivision
+from xcube_server.im.tilegrid import TileGrid, pow2_1d_subdivisions, pow2_2d_subdivision, get_aligned_tile_size, \
+    MODE_GE
 
 
 class TilingSchemeTest(TestCase):
@@ -113,8 +114,37 @@ class TilingSchemeTest(TestCase):
         with self.assertRaises(ValueError):
             TileGrid.create(50, 25, 5, 5, (0., -90.0, 25., -77.5), inv_y=True)
 
+    def test_create_aligned_with_chunks(self):
+        self.assertEqual(TileGrid.create(2000, 1000, 300, 300, (0., 50., 5., 52.5)),
+                         TileGrid(3, 2, 1, 250, 250, (0., 50., 5., 52.5), inv_y=False))
+        self.assertEqual(TileGrid.create(2000, 1000, 300, 300, (0., 50., 5., 52.5),
+                                         chunk_width=300, chunk_height=300),
+                         TileGrid(2, 7, 2, 150, 300, (0., 50., 5.25, 53.0), inv_y=False))
+        # No aligned subdivision for widths of 2000, so tile widths are not aligned
+        self.assertEqual(TileGrid.create(2000, 1000, 333, 250, (0., 50., 5., 52.5),
+                                         chunk_width=333, chunk_height=250),
+                         TileGrid(3, 2, 1, 250, 250, (0., 50., 5., 52.5), inv_y=False))
+
+
+class AlignedTileSizeTest(TestCase):
+    def test_get_aligned_tile_size(self):
+        self.assertEqual(250, get_aligned_tile_size(2000, 250, s_mode=MODE_GE))
+        self.assertEqual(1000, get_aligned_tile_size(2000, 1000, s_mode=MODE_GE))
+        self.assertEqual(250, get_aligned_tile_size(2000, 1000, s_mode=MODE_GE, ts_opt=256))
+        self.assertEqual(900, get_aligned_tile_size(7200, 1800, s_mode=MODE_GE))
+        self.assertEqual(100, get_aligned_tile_size(100, 100))
+        self.assertIsNone(get_aligned_tile_size(2000, 333, s_mode=MODE_GE))
+        with self.assertRaises(ValueError):
+            get_aligned_tile_size(2000, 0)
+
 
 class Subdivision2DTest(TestCase):
+    def test_pow2_2d_subdivision_is_memoized(self):
+        pow2_2d_subdivision.cache_clear()
+        pow2_2d_subdivision(720, 360)
+        pow2_2d_subdivision(720, 360)
+        self.assertEqual(1, pow2_2d_subdivision.cache_info().hits)
+
     def test_pow2_2d_subdivision_obvious(self):
         # Aerosol CCI - monthly
         self.assertEqual(pow2_2d_subdivision(360, 180), ((360, 180), (360, 180), (1, 1), 1))
@@ -0,0 +1,83 @@
+import random
+import unittest
+
+from test.benchmarks.loadtest import TileGridInfo, Workload, parse_mix, parse_cache_counters, get_report
+from test.benchmarks.suite import run, compare, BENCHMARKS
+
+
+class BenchmarkSuiteTest(unittest.TestCase):
+
+    def test_run(self):
+        results = run(width=200, height=100, num_times=2, chunks=(1, 50, 50), num_places=20, repeat=1,
+                      verbose=False)
+        self.assertEqual(dict(width=200, height=100, num_times=2, chunks=[1, 50, 50], dtype="float32",
+                              format="zarr", num_places=20, repeat=1),
+                         results["config"])
+        self.assertEqual([name for name, _ in BENCHMARKS], list(results["results"].keys()))
+        for result in results["results"].values():
+            self.assertEqual(1, result["repeat"])
+            self.assertTrue(result["min"] <= result["median"] <= result["max"])
+
+        ratios = compare(results, results)
+        self.assertEqual(len(BENCHMARKS), len(ratios))
+        self.assertTrue(all(ratio == 1.0 for ratio in ratios.values()))
+
+    def test_run_filtered(self):
+        results = run(width=200, height=100, num_times=2, chunks=(1, 50, 50), format="nc", dtype="int16",
+                      num_places=20, repeat=1, name_pattern="tiles.*", verbose=False)
+        self.assertEqual(["tiles.get_dataset_tile[mode=0]", "tiles.get_dataset_tile[mode=1]"],
+                         list(results["results"].keys()))
+
+
+class LoadTestTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tile_grid = TileGridInfo(num_levels=3, num_level_zero_tiles_x=2, num_level_zero_tiles_y=1,
+                                      west=0.0, south=50.0, east=5.0, north=52.5)
+
+    def test_map_sessions(self):
+        workload = Workload("bench", "conc_chl", self.tile_grid, ["2017-01-01T10:00:00"], random.Random(0))
+        for session_type in ("ol", "cesium", "wmts"):
+            paths = list(workload.new_session(session_type))
+            self.assertTrue(len(paths) > 0)
+            self.assertEqual(len(paths), len(set(paths)), "tiles must not be requested twice per session")
+            for path in paths:
+                if session_type == "wmts":
+                    self.assertTrue(path.startswith("/wmts/kvp?Service=WMTS&Request=GetTile"))
+                else:
+                    self.assertRegex(path, r"^/datasets/bench/vars/conc_chl/tiles/\d/\d+/\d+\.png\?time=")
+
+        cesium_paths = list(Workload("bench", "conc_chl", self.tile_grid, ["2017-01-01"],
+                                     random.Random(1)).new_session("cesium"))
+        self.assertTrue(cesium_paths[0].startswith("/datasets/bench/vars/conc_chl/tiles/0/"))
+
+    def test_time_series_session(self):
+        workload = Workload("bench", "conc_chl", self.tile_grid, ["2017-01-01"], random.Random(0))
+        paths = list(workload.new_session("ts"))
+        self.assertEqual(3, len(paths))
+        for path in paths:
+            self.assertRegex(path, r"^/ts/bench/conc_chl/point\?lon=[\d.]+&lat=[\d.]+$")
+
+    def test_parse_mix(self):
+        self.assertEqual(dict(ol=4.0, ts=1.0), parse_mix("ol=4,ts=1"))
+        with self.assertRaises(ValueError):
+            parse_mix("ol")
+        with self.assertRaises(ValueError):
+            parse_mix("leaflet=1")
+        with self.assertRaises(ValueError):
+            parse_mix("ol=0")
+
+    def test_get_report(self):
+        metrics_before = ('xcube_cache_hits_total{cache="mem_tile"} 10.0\n'
+                          'xcube_cache_misses_total{cache="mem_tile"} 10.0\n')
+        metrics_after = ('xcube_cache_hits_total{cache="mem_tile"} 13.0\n'
+                         'xcube_cache_misses_total{cache="mem_tile"} 11.0\n')
+        samples = [("ol", 200, 0.01, 100), ("ol", 200, 0.03, 100), ("ts", 500, 0.02, 10)]
+        report = get_report(samples, 2.0, parse_cache_counters(metrics_before), parse_cache_counters(metrics_after))
+        self.assertEqual(1.5, report["throughput"])
+        self.assertEqual(dict(mem_tile=0.75), report["cache_hit_rates"])
+        self.assertEqual(["ol", "ts", "total"], list(report["latency"].keys()))
+        self.assertEqual(2, report["latency"]["ol"]["requests"])
+        self.assertEqual(0, report["latency"]["ol"]["errors"])
+        self.assertAlmostEqual(20.0, report["latency"]["ol"]["p50"])
+        self.assertEqual(1, report["latency"]["total"]["errors"])
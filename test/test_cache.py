@@ -1,8 +1,17 @@
+import multiprocessing
 import os
 import shutil
+import sys
+import tempfile
+import time
+import unittest
 from unittest import TestCase
 
-from xcube_server.cache import CacheStore, Cache, MemoryCacheStore, FileCacheStore
+import numpy as np
+
+from xcube_server.cache import CacheStore, Cache, MemoryCacheStore, FileCacheStore, SharedMemoryCacheStore, \
+    NdarrayFileCacheStore
+from xcube_server.metrics import REGISTRY
 
 
 class MemoryCacheStoreTest(TestCase):
@@ -92,6 +101,181 @@ class FileCacheStoreTest(TestCase):
         with self.assertRaises(FileNotFoundError):
             self.cache_store.restore_value('c', self.stored_value_c)
 
+    def test_capacity_is_shared_by_stores_of_same_directory(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            # Two stores using the same directory, as in two worker processes
+            cache_stores = [FileCacheStore(cache_dir, '.dat', capacity=100) for _ in range(2)]
+            for i in range(10):
+                cache_stores[i % 2].store_value(f'ds/k{i}', bytes(20))
+                sizes = [entry.stat().st_size
+                         for entry in os.scandir(os.path.join(cache_dir, 'ds')) if entry.name.endswith('.dat')]
+                self.assertLessEqual(sum(sizes), 100)
+            # Least recently used values are removed first
+            self.assertTrue(cache_stores[0].can_load_from_key('ds/k9'))
+            self.assertFalse(cache_stores[0].can_load_from_key('ds/k0'))
+
+    def test_clear(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache_store = FileCacheStore(cache_dir, '.dat', capacity=100)
+            cache_store.store_value('ds/k0', bytes(20))
+            cache_store.store_value('k1', bytes(20))
+            with open(os.path.join(cache_dir, 'other.txt'), 'w') as fp:
+                fp.write('not a cached value')
+            other_cache_store = FileCacheStore(cache_dir, '.dat', capacity=100)
+            other_cache_store.clear()
+            self.assertFalse(cache_store.can_load_from_key('ds/k0'))
+            self.assertFalse(cache_store.can_load_from_key('k1'))
+            self.assertTrue(os.path.exists(os.path.join(cache_dir, 'other.txt')))
+            # The recorded size has been reset
+            for i in range(4):
+                cache_store.store_value(f'k{i}', bytes(20))
+            self.assertTrue(all(cache_store.can_load_from_key(f'k{i}') for i in range(4)))
+
+    def test_capacity_keeps_recently_restored_values(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache_store = FileCacheStore(cache_dir, '.dat', capacity=100)
+            cache_store.store_value('k0', bytes(20))
+            os.utime(os.path.join(cache_dir, 'k0.dat'), (0, 0))
+            for i in range(1, 5):
+                cache_store.store_value(f'k{i}', bytes(20))
+                os.utime(os.path.join(cache_dir, f'k{i}.dat'), (i, i))
+            cache_store.restore_value('k0', None)
+            cache_store.store_value('k5', bytes(20))
+            self.assertTrue(cache_store.can_load_from_key('k0'))
+            self.assertFalse(cache_store.can_load_from_key('k1'))
+            self.assertTrue(cache_store.can_load_from_key('k5'))
+
+
+class NdarrayFileCacheStoreTest(TestCase):
+    def test_store_and_restore_value(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache_store = NdarrayFileCacheStore(cache_dir)
+            value = np.arange(12, dtype=np.float32).reshape((3, 4))
+            stored_value, size = cache_store.store_value('ds/conc_chl/0.0', value)
+            self.assertEqual(os.path.join(cache_dir, 'ds', 'conc_chl', '0.0.npy'), stored_value)
+            self.assertTrue(size > value.nbytes)
+            restored_value = cache_store.restore_value('ds/conc_chl/0.0', stored_value)
+            np.testing.assert_equal(value, restored_value)
+            self.assertEqual(np.float32, restored_value.dtype)
+
+
+def _store_values_in_child(cache_store, keys):
+    for key in keys:
+        cache_store.store_value(key, key.encode('utf-8') * 10)
+
+
+def _die_while_holding_lock(cache_store: SharedMemoryCacheStore):
+    cache_store._acquire_lock(None)
+    os._exit(1)
+
+
+class SharedMemoryCacheStoreTest(TestCase):
+    def setUp(self):
+        self.cache_store = SharedMemoryCacheStore(10000, num_slots=64)
+
+    def tearDown(self):
+        self.cache_store.close()
+
+    def test_props(self):
+        self.assertEqual(10000, self.cache_store.capacity)
+        self.assertEqual(64, self.cache_store.num_slots)
+
+    def test_store_and_restore_value(self):
+        self.assertEqual(('a', 3), self.cache_store.store_value('a', b'abc'))
+        self.assertEqual(('b', 3), self.cache_store.store_value('b', b'def'))
+        self.assertTrue(self.cache_store.can_load_from_key('a'))
+        self.assertFalse(self.cache_store.can_load_from_key('c'))
+        self.assertEqual(('a', 3), self.cache_store.load_from_key('a'))
+        self.assertEqual(b'abc', self.cache_store.restore_value('a', 'a'))
+        self.assertEqual(b'def', self.cache_store.restore_value('b', 'b'))
+        self.assertIsNone(self.cache_store.restore_value('c', 'c'))
+
+        self.cache_store.store_value('a', b'ghij')
+        self.assertEqual(b'ghij', self.cache_store.restore_value('a', 'a'))
+
+        # Values are evicted by the store itself
+        self.cache_store.discard_value('a', 'a')
+        self.assertEqual(b'ghij', self.cache_store.restore_value('a', 'a'))
+
+        with self.assertRaises(TypeError):
+            self.cache_store.store_value('c', 'ghi')
+
+    def test_clear(self):
+        self.cache_store.store_value('a', b'abc')
+        self.cache_store.clear()
+        self.assertFalse(self.cache_store.can_load_from_key('a'))
+        self.assertIsNone(self.cache_store.restore_value('a', 'a'))
+        self.cache_store.store_value('b', b'def')
+        self.assertEqual(b'def', self.cache_store.restore_value('b', 'b'))
+
+        # A cache finds values stored by other caches sharing the store, so the store must be cleared too
+        cache = Cache(self.cache_store, capacity=10000)
+        cache.put_value('c', b'old tile')
+        other_cache = Cache(self.cache_store, capacity=10000)
+        self.assertEqual(b'old tile', other_cache.get_value('c'))
+        cache.clear()
+        self.assertIsNone(cache.get_value('c'))
+        self.assertIsNone(other_cache.get_value('c'))
+
+    def test_oldest_values_are_overwritten(self):
+        for i in range(50):
+            self.cache_store.store_value(f'k{i}', bytes(500))
+        self.assertFalse(self.cache_store.can_load_from_key('k0'))
+        self.assertTrue(self.cache_store.can_load_from_key('k49'))
+        num_values = sum(1 for i in range(50) if self.cache_store.can_load_from_key(f'k{i}'))
+        self.assertLessEqual(num_values, 10000 // 500)
+        # Too large
+        self.cache_store.store_value('k50', bytes(5000))
+        self.assertFalse(self.cache_store.can_load_from_key('k50'))
+
+    def test_restored_values_get_second_chance(self):
+        self.cache_store.store_value('hot', b'x' * 500)
+        for i in range(40):
+            self.assertEqual(b'x' * 500, self.cache_store.restore_value('hot', 'hot'))
+            self.cache_store.store_value(f'k{i}', bytes(500))
+        self.assertTrue(self.cache_store.can_load_from_key('hot'))
+        self.assertFalse(self.cache_store.can_load_from_key('k0'))
+
+    @unittest.skipIf(sys.platform == 'win32', 'requires os.fork()')
+    def test_shared_with_forked_processes(self):
+        process = multiprocessing.get_context('fork').Process(target=_store_values_in_child,
+                                                              args=(self.cache_store, ['a', 'b']))
+        process.start()
+        process.join(timeout=10)
+        self.assertEqual(0, process.exitcode)
+        self.assertEqual(b'a' * 10, self.cache_store.restore_value('a', 'a'))
+        self.assertEqual(b'b' * 10, self.cache_store.restore_value('b', 'b'))
+
+        cache = Cache(self.cache_store, capacity=10000)
+        self.assertEqual(b'a' * 10, cache.get_value('a'))
+        self.assertEqual(10, cache.size)
+
+    @unittest.skipIf(sys.platform == 'win32', 'requires os.fork()')
+    def test_lock_is_released_if_holder_dies(self):
+        process = multiprocessing.get_context('fork').Process(target=_die_while_holding_lock,
+                                                              args=(self.cache_store,))
+        process.start()
+        process.join(timeout=10)
+        self.assertEqual(1, process.exitcode)
+        t0 = time.perf_counter()
+        self.cache_store.store_value('a', b'abc')
+        self.assertLess(time.perf_counter() - t0, 0.5)
+        self.assertEqual(b'abc', self.cache_store.restore_value('a', 'a'))
+
+    def test_value_is_not_stored_if_lock_is_held(self):
+        cache_store = SharedMemoryCacheStore(10000, num_slots=64, lock_timeout=0.01)
+        try:
+            self.assertTrue(cache_store._acquire_lock(None))
+            try:
+                cache_store.store_value('a', b'abc')
+            finally:
+                cache_store._release_lock()
+            self.assertFalse(cache_store.can_load_from_key('a'))
+            cache_store.store_value('a', b'abc')
+            self.assertTrue(cache_store.can_load_from_key('a'))
+        finally:
+            cache_store.close()
+
 
 class TracingCacheStore(CacheStore):
     def __init__(self):
@@ -188,3 +372,57 @@ class CacheTest(TestCase):
         self.assertEqual(cache.get_value('k5'), 'yyyy')
         self.assertEqual(cache.size, 600)
         self.assertEqual(cache_store.trace, 'can_load_from_key(k5);load_from_key(k5);restore(k5, S/yyyy);')
+
+    def test_metrics(self):
+        cache = Cache(store=MemoryCacheStore(), capacity=1000, threshold=0.75, name='test_metrics')
+        hits = REGISTRY.get('xcube_cache_hits_total').labels('test_metrics')
+        misses = REGISTRY.get('xcube_cache_misses_total').labels('test_metrics')
+        evictions = REGISTRY.get('xcube_cache_evictions_total').labels('test_metrics')
+        size = REGISTRY.get('xcube_cache_size').labels('test_metrics')
+
+        cache.put_value('k1', 'x' * 200)
+        cache.put_value('k2', 'x' * 200)
+        self.assertEqual(cache.size, size.value)
+        self.assertIsNotNone(cache.get_value('k1'))
+        self.assertIsNone(cache.get_value('k3'))
+        self.assertEqual(1, hits.value)
+        self.assertEqual(1, misses.value)
+        self.assertEqual(0, evictions.value)
+
+        cache.put_value('k3', 'x' * 400)
+        self.assertEqual(1, evictions.value)
+        self.assertEqual(cache.size, size.value)
+
+    def test_write_through_shared_file_cache(self):
+        cache_dir = '__test_shared_file_cache__'
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        self.addCleanup(shutil.rmtree, cache_dir, ignore_errors=True)
+
+        # Two processes, each with its own memory cache on top of a file cache sharing the same directory
+        file_cache_1 = Cache(FileCacheStore(cache_dir, '.dat'), capacity=10000)
+        mem_cache_1 = Cache(MemoryCacheStore(), capacity=1000, parent_cache=file_cache_1, write_through=True)
+        file_cache_2 = Cache(FileCacheStore(cache_dir, '.dat'), capacity=10000)
+        mem_cache_2 = Cache(MemoryCacheStore(), capacity=1000, parent_cache=file_cache_2, write_through=True)
+        self.assertTrue(mem_cache_1.write_through)
+        self.assertIs(file_cache_1, mem_cache_1.parent_cache)
+
+        mem_cache_1.put_value('k1', b'abc')
+        self.assertEqual(['k1.dat'], os.listdir(cache_dir))
+        self.assertEqual(b'abc', mem_cache_1.get_value('k1'))
+        self.assertEqual(b'abc', mem_cache_2.get_value('k1'))
+        self.assertGreater(mem_cache_2.size, 0)
+        self.assertEqual(3, file_cache_2.size)
+
+        # Another process has discarded the value from the shared directory
+        file_cache_1.remove_value('k1')
+        self.assertEqual([], os.listdir(cache_dir))
+        self.assertIsNone(file_cache_2.get_value('k1'))
+        self.assertEqual(0, file_cache_2.size)
+        self.assertEqual(b'abc', mem_cache_2.get_value('k1'))
+
+        # Values evicted from the memory cache remain in the file cache
+        mem_cache_1.put_value('k2', b'x' * 400)
+        mem_cache_1.put_value('k3', b'x' * 400)
+        self.assertLessEqual(mem_cache_1.size, mem_cache_1.max_size)
+        self.assertEqual(['k2.dat', 'k3.dat'], sorted(os.listdir(cache_dir)))
+        self.assertEqual(b'x' * 400, mem_cache_1.get_value('k2'))
@@ -0,0 +1,129 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from xcube_server.chunkcache import ChunkCache, DiskChunkCache
+from xcube_server.metrics import REGISTRY
+
+
+class ChunkCacheTest(unittest.TestCase):
+    def test_put_and_get(self):
+        cache = ChunkCache(1000, name='test_put_and_get')
+        self.assertEqual('test_put_and_get', cache.name)
+        self.assertEqual(1000, cache.capacity)
+        self.assertEqual(0, cache.size)
+
+        cache.put('ds1', 'a/0.0', b'x' * 100)
+        cache.put('ds2', 'b/0.0', b'y' * 200)
+        self.assertEqual(b'x' * 100, cache.get('a/0.0'))
+        self.assertEqual(b'y' * 200, cache.get('b/0.0'))
+        self.assertIsNone(cache.get('a/0.1'))
+        self.assertEqual(300, cache.size)
+        self.assertEqual(100, cache.get_dataset_size('ds1'))
+        self.assertEqual(200, cache.get_dataset_size('ds2'))
+        self.assertEqual(0, cache.get_dataset_size('ds3'))
+        self.assertEqual({'ds1', 'ds2'}, set(cache.dataset_ids))
+
+        cache.put('ds1', 'a/0.0', b'x' * 50)
+        self.assertEqual(250, cache.size)
+        self.assertEqual(50, cache.get_dataset_size('ds1'))
+
+        self.assertEqual(2, REGISTRY.get('xcube_cache_hits_total').labels('test_put_and_get').value)
+        self.assertEqual(1, REGISTRY.get('xcube_cache_misses_total').labels('test_put_and_get').value)
+        self.assertEqual(250, REGISTRY.get('xcube_cache_size').labels('test_put_and_get').value)
+        self.assertEqual(200, REGISTRY.get('xcube_chunk_cache_dataset_size').labels('ds2').value)
+
+    def test_evicts_least_recently_used_chunks(self):
+        cache = ChunkCache(1000, name='test_evicts')
+        cache.put('ds1', 'a/0', b'x' * 400)
+        cache.put('ds1', 'a/1', b'x' * 400)
+        self.assertIsNotNone(cache.get('a/0'))
+        cache.put('ds2', 'b/0', b'x' * 400)
+        self.assertIsNotNone(cache.get('a/0'))
+        self.assertIsNone(cache.get('a/1'))
+        self.assertIsNotNone(cache.get('b/0'))
+        self.assertEqual(800, cache.size)
+        self.assertEqual(400, cache.get_dataset_size('ds1'))
+        self.assertEqual(1, REGISTRY.get('xcube_cache_evictions_total').labels('test_evicts').value)
+
+        # Too large
+        cache.put('ds2', 'b/1', b'x' * 1001)
+        self.assertIsNone(cache.get('b/1'))
+        self.assertEqual(800, cache.size)
+
+    def test_remove_dataset_and_clear(self):
+        cache = ChunkCache(1000)
+        cache.put('ds1', 'a/0', b'x' * 100)
+        cache.put('ds1', 'a/1', b'x' * 100)
+        cache.put('ds2', 'b/0', b'x' * 100)
+        cache.remove_dataset('ds1')
+        self.assertIsNone(cache.get('a/0'))
+        self.assertIsNone(cache.get('a/1'))
+        self.assertIsNotNone(cache.get('b/0'))
+        self.assertEqual(['ds2'], cache.dataset_ids)
+        self.assertEqual(100, cache.size)
+        cache.clear()
+        self.assertEqual([], cache.dataset_ids)
+        self.assertEqual(0, cache.size)
+
+    def test_invalid_capacity(self):
+        with self.assertRaises(ValueError):
+            ChunkCache(0)
+
+
+class DiskChunkCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def test_put_and_get(self):
+        cache = DiskChunkCache(self.cache_dir, 10000, name='test_disk_put_and_get')
+        self.assertEqual(self.cache_dir, cache.cache_dir)
+        self.assertEqual(10000, cache.capacity)
+        self.assertEqual(0, cache.size)
+
+        cache.put('bucket/cube.zarr/a/0.0', '"etag1"', b'x' * 100)
+        self.assertEqual(b'x' * 100, cache.get('bucket/cube.zarr/a/0.0', '"etag1"', 100))
+        self.assertIsNone(cache.get('bucket/cube.zarr/a/0.1', '"etag1"', 100))
+        # Object has changed
+        self.assertIsNone(cache.get('bucket/cube.zarr/a/0.0', '"etag2"', 100))
+        self.assertIsNone(cache.get('bucket/cube.zarr/a/0.0', '"etag1"', 99))
+        self.assertGreater(cache.size, 100)
+
+        self.assertEqual(1, REGISTRY.get('xcube_cache_hits_total').labels('test_disk_put_and_get').value)
+        self.assertEqual(3, REGISTRY.get('xcube_cache_misses_total').labels('test_disk_put_and_get').value)
+
+        self.assertIn('bucket/cube.zarr/a/0.0', cache)
+        self.assertNotIn('bucket/cube.zarr/a/0.1', cache)
+
+        # Chunks stored without an ETag are validated by their size only
+        cache.put('bucket/cube.zarr/a/0.1', '', b'y' * 50)
+        self.assertEqual(b'y' * 50, cache.get('bucket/cube.zarr/a/0.1', '"etag3"', 50))
+        self.assertIsNone(cache.get('bucket/cube.zarr/a/0.1', '"etag3"', 49))
+
+        # Persistent
+        cache = DiskChunkCache(self.cache_dir, 10000)
+        self.assertEqual(b'x' * 100, cache.get('bucket/cube.zarr/a/0.0', '"etag1"', 100))
+        self.assertGreater(cache.size, 100)
+
+        cache.clear()
+        self.assertEqual(0, cache.size)
+        self.assertIsNone(cache.get('bucket/cube.zarr/a/0.0', '"etag1"', 100))
+
+    def test_evicts_least_recently_used_chunks(self):
+        cache = DiskChunkCache(self.cache_dir, 1000, threshold=0.7, name='test_disk_evicts')
+        for i in range(3):
+            cache.put(f'a/{i}', '', b'x' * 200)
+            # Ensure distinct access times
+            os.utime(cache._get_file_path(f'a/{i}'), (i, i))
+        self.assertIsNotNone(cache.get('a/0', '', 200))
+        cache.put('a/3', '', b'x' * 200)
+        cache.put('a/4', '', b'x' * 200)
+        self.assertIsNone(cache.get('a/1', '', 200))
+        self.assertIsNone(cache.get('a/2', '', 200))
+        self.assertIsNotNone(cache.get('a/4', '', 200))
+        self.assertLessEqual(cache.size, 1000)
+        self.assertGreater(REGISTRY.get('xcube_cache_evictions_total').labels('test_disk_evicts').value, 0)
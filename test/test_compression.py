@@ -0,0 +1,74 @@
+import gzip
+import unittest
+
+from xcube_server.compression import select_content_encoding, is_compressible_content_type, compress, Compressor, \
+    get_content_encodings
+from xcube_server.encoded import EncodedDocument
+
+
+class SelectContentEncodingTest(unittest.TestCase):
+    def test_gzip(self):
+        self.assertEqual('gzip', select_content_encoding('gzip'))
+        self.assertEqual('gzip', select_content_encoding('deflate, gzip'))
+        self.assertEqual('gzip', select_content_encoding('gzip;q=0.5, identity'))
+        self.assertEqual('gzip', select_content_encoding('*'))
+
+    def test_none(self):
+        self.assertIsNone(select_content_encoding(None))
+        self.assertIsNone(select_content_encoding(''))
+        self.assertIsNone(select_content_encoding('identity'))
+        self.assertIsNone(select_content_encoding('deflate'))
+        self.assertIsNone(select_content_encoding('gzip;q=0'))
+        self.assertIsNone(select_content_encoding('*;q=0'))
+
+    def test_preference(self):
+        encoding = select_content_encoding('gzip, br')
+        self.assertEqual(get_content_encodings()[0], encoding)
+        self.assertEqual('gzip', select_content_encoding('gzip, br;q=0'))
+
+
+class IsCompressibleContentTypeTest(unittest.TestCase):
+    def test_it(self):
+        self.assertTrue(is_compressible_content_type('application/json'))
+        self.assertTrue(is_compressible_content_type('application/json; charset=UTF-8'))
+        self.assertTrue(is_compressible_content_type('application/x-ndjson'))
+        self.assertTrue(is_compressible_content_type('application/xml'))
+        self.assertTrue(is_compressible_content_type('text/html'))
+        self.assertFalse(is_compressible_content_type('image/png'))
+        self.assertFalse(is_compressible_content_type('image/jpg'))
+        self.assertFalse(is_compressible_content_type(None))
+
+
+class CompressTest(unittest.TestCase):
+    def test_compress(self):
+        data = 100 * b'{"name": "Station 1"}'
+        compressed_data = compress(data, 'gzip')
+        self.assertLess(len(compressed_data), len(data))
+        self.assertEqual(data, gzip.decompress(compressed_data))
+
+    def test_compressor(self):
+        compressor = Compressor('gzip')
+        chunks = [compressor.compress(b'{"a": 1}\n', False),
+                  compressor.compress(b'{"a": 2}\n', False),
+                  compressor.compress(b'', True)]
+        self.assertEqual(b'{"a": 1}\n{"a": 2}\n', gzip.decompress(b''.join(chunks)))
+
+    def test_unsupported(self):
+        with self.assertRaises(ValueError):
+            Compressor('deflate')
+
+
+class EncodedDocumentTest(unittest.TestCase):
+    def test_precompressed(self):
+        document = EncodedDocument(100 * '{"name": "Station 1"}', 'application/json')
+        # noinspection PyProtectedMember
+        self.assertEqual(set(get_content_encodings()), set(document._compressed_data.keys()))
+        self.assertEqual(document.data, gzip.decompress(document.gzipped_data))
+        self.assertIs(document.gzipped_data, document.get_compressed_data('gzip'))
+
+    def test_compressed_lazily(self):
+        document = EncodedDocument(100 * '{"name": "Station 1"}', 'application/json', precompress=False)
+        # noinspection PyProtectedMember
+        self.assertEqual({}, document._compressed_data)
+        self.assertEqual(document.data, gzip.decompress(document.gzipped_data))
+        self.assertIs(document.gzipped_data, document.get_compressed_data('gzip'))
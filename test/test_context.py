@@ -1,9 +1,28 @@
+import json
+import os
+import tempfile
+import threading
 import unittest
 
+import shapely.geometry
 import xarray as xr
 
-from test.helpers import new_test_service_context
-from xcube_server.errors import ServiceResourceNotFoundError
+from test.helpers import new_test_service_context, get_res_demo_dir
+from xcube_server.defaults import DEFAULT_EXECUTORS, DEFAULT_EXECUTOR_RETRY_AFTER
+from xcube_server.cache import SharedMemoryCacheStore
+from xcube_server.context import ServiceContext
+from xcube_server.errors import ServiceResourceNotFoundError, ServiceConfigError
+from xcube_server.mldataset import BaseMultiLevelDataset
+
+try:
+    import distributed
+except ImportError:
+    distributed = None
+
+
+def _list_cache_dir(cache_dir: str):
+    # Ignore the file that records the size of the cache directory
+    return sorted(name for name in os.listdir(cache_dir) if not name.startswith('.'))
 
 
 class ServiceContextTest(unittest.TestCase):
@@ -86,6 +105,44 @@ class ServiceContextTest(unittest.TestCase):
         self.assertEqual([str(i) for i in range(6)],
                          [f["id"] for f in place_group["features"] if "id" in f])
 
+    def test_get_place_group_stores(self):
+        ctx = new_test_service_context()
+        place_stores = ctx.get_place_group_stores()
+        self.assertEqual(2, len(place_stores))
+        self.assertEqual([3, 3], [place_store.num_features for place_store in place_stores])
+        self.assertEqual([0, 3], [place_store.first_feature_id for place_store in place_stores])
+        place_stores = ctx.get_place_group_stores("outside-cube")
+        self.assertEqual(1, len(place_stores))
+        features = place_stores[0].find_features(shapely.geometry.box(-1, 49, 2, 55))
+        self.assertEqual(['3'], [f["id"] for f in features])
+
+        with self.assertRaises(ServiceResourceNotFoundError) as cm:
+            ctx.get_place_group_stores("bibo")
+        self.assertEqual('HTTP 404: Place group "bibo" not found', f"{cm.exception}")
+
+    def test_place_group_masks_are_precomputed(self):
+        with tempfile.TemporaryDirectory() as base_dir:
+            with open(os.path.join(base_dir, "polygons.geojson"), "w") as fp:
+                json.dump(dict(type="FeatureCollection",
+                               features=[dict(type="Feature",
+                                              geometry=shapely.geometry.mapping(shapely.geometry.box(1, 51, 2, 52)),
+                                              properties={})]), fp)
+            ctx = ServiceContext(base_dir=base_dir,
+                                 config=dict(Datasets=[dict(Identifier='demo',
+                                                            Path=os.path.join(get_res_demo_dir(), "cube.nc"),
+                                                            PlaceGroups=[dict(Identifier='polygons',
+                                                                              Path="polygons.geojson")])]),
+                                 place_cache_dir=os.path.join(base_dir, "place-cache"))
+            ctx.get_dataset('demo')
+            # Wait for the background task
+            ctx.get_executor('places').shutdown(wait=True)
+            self.assertTrue(ctx.mask_cache.size > 0)
+            # Features have not been materialized into a cached feature collection
+            for place_group_descriptor in ctx._place_group_descriptors.values():
+                self.assertNotIn("placeGroup", place_group_descriptor)
+            self.assertEqual(1, len(ctx.get_dataset_place_group_stores('demo')))
+            self.assertEqual(1, len(ctx.get_dataset_place_groups('demo')[0]["features"]))
+
     def test_get_place_group_by_name(self):
         ctx = new_test_service_context()
         place_group = ctx.get_place_group(place_group_id="inside-cube")
@@ -101,3 +158,242 @@ class ServiceContextTest(unittest.TestCase):
         with self.assertRaises(ServiceResourceNotFoundError) as cm:
             ctx.get_place_group(place_group_id="bibo")
         self.assertEqual('HTTP 404: Place group "bibo" not found', f"{cm.exception}")
+
+    def test_get_executor(self):
+        ctx = new_test_service_context()
+        executor = ctx.get_executor("tiles")
+        self.assertEqual("tiles", executor.name)
+        self.assertEqual(DEFAULT_EXECUTORS["tiles"]["MaxWorkers"], executor.max_workers)
+        self.assertEqual(DEFAULT_EXECUTORS["tiles"]["MaxQueueSize"], executor.max_queue_size)
+        self.assertEqual(DEFAULT_EXECUTOR_RETRY_AFTER, executor.retry_after)
+        self.assertIs(executor, ctx.get_executor("tiles"))
+        self.assertIsNot(executor, ctx.get_executor("time_series"))
+
+        ctx.config = dict(ctx.config, Executors=dict(tiles=dict(MaxWorkers=3, MaxQueueSize=5, RetryAfter=2)))
+        new_executor = ctx.get_executor("tiles")
+        self.assertIsNot(executor, new_executor)
+        self.assertEqual(3, new_executor.max_workers)
+        self.assertEqual(5, new_executor.max_queue_size)
+        self.assertEqual(2, new_executor.retry_after)
+        self.assertIs(new_executor, ctx.get_executor("tiles"))
+
+        with self.assertRaises(ValueError):
+            ctx.get_executor("bibo")
+
+        ctx.config = dict(ctx.config, Executors=dict(tiles=dict(MaxWorkers=0)))
+        with self.assertRaises(ServiceConfigError) as cm:
+            ctx.get_executor("tiles")
+        self.assertEqual('HTTP 500: Invalid "Executors" entry in configuration: '
+                         "MaxWorkers of executor 'tiles' must be a positive integer", f"{cm.exception}")
+
+    def test_executors_and_place_groups_do_not_wait_for_context_lock(self):
+        ctx = new_test_service_context()
+        executor = ctx.get_executor("tiles")
+        locked = threading.Event()
+        unlock = threading.Event()
+
+        def hold_lock():
+            with ctx._lock:
+                locked.set()
+                unlock.wait(10)
+
+        thread = threading.Thread(target=hold_lock)
+        thread.start()
+        try:
+            self.assertTrue(locked.wait(10))
+            # Would otherwise wait for the thread that holds the context's lock
+            self.assertIs(executor, ctx.get_executor("tiles"))
+            self.assertIsNotNone(ctx.get_executor("time_series"))
+            self.assertEqual(2, len(ctx.get_place_group_stores()))
+            self.assertEqual(6, len(ctx.get_place_group()["features"]))
+        finally:
+            unlock.set()
+            thread.join(10)
+
+    def test_remote_tiles_executor(self):
+        ctx = ServiceContext(config=dict(Datasets=[dict(Identifier='local', Path='cube.nc'),
+                                                   dict(Identifier='remote', FileSystem='obs',
+                                                        Path='xcube/cube.zarr'),
+                                                   dict(Identifier='local-1w', FileSystem='memory',
+                                                        Path='script.py', InputDatasets=['local']),
+                                                   dict(Identifier='remote-1w', FileSystem='memory',
+                                                        Path='script.py', InputDatasets=['remote'])]))
+        self.assertFalse(ctx.is_remote_dataset('local'))
+        self.assertTrue(ctx.is_remote_dataset('remote'))
+        self.assertFalse(ctx.is_remote_dataset('local-1w'))
+        self.assertTrue(ctx.is_remote_dataset('remote-1w'))
+
+        executor = ctx.get_executor('remote_tiles')
+        self.assertEqual('threads', executor.dask_scheduler)
+        self.assertEqual(DEFAULT_EXECUTORS['remote_tiles']['DaskWorkers'], executor.dask_workers)
+        self.assertEqual('synchronous', ctx.get_executor('tiles').dask_scheduler)
+
+    @unittest.skipIf(distributed is not None, "package distributed is installed")
+    def test_get_dask_client_without_distributed(self):
+        ctx = ServiceContext(config=dict(Executors=dict(time_series=dict(DaskScheduler='distributed'))))
+        self.assertEqual('distributed', ctx.get_executor('time_series').dask_scheduler)
+        with self.assertRaises(ServiceConfigError) as cm:
+            ctx.get_dask_client()
+        self.assertRegex(cm.exception.reason,
+                         '^Invalid "DaskCluster" entry in configuration: a dask cluster requires the package')
+
+    def test_tile_caches(self):
+        ctx = ServiceContext()
+        self.assertIsNone(ctx.tile_cache)
+
+        ctx = ServiceContext(mem_tile_cache_capacity=1000)
+        self.assertIs(ctx.mem_tile_cache, ctx.tile_cache)
+        self.assertIsNone(ctx.mem_tile_cache.parent_cache)
+
+        cache_store = SharedMemoryCacheStore(1000)
+        ctx = ServiceContext(mem_tile_cache_capacity=1000, mem_tile_cache_store=cache_store)
+        self.assertIs(cache_store, ctx.mem_tile_cache.store)
+        cache_store.close()
+
+        with tempfile.TemporaryDirectory() as tile_cache_dir:
+            ctx = ServiceContext(file_tile_cache_capacity=1000, file_tile_cache_dir=tile_cache_dir)
+            self.assertIs(ctx.rgb_tile_cache, ctx.tile_cache)
+            self.assertEqual(tile_cache_dir, ctx.rgb_tile_cache.store.cache_dir)
+
+            ctx = ServiceContext(mem_tile_cache_capacity=1000,
+                                 file_tile_cache_capacity=1000,
+                                 file_tile_cache_dir=tile_cache_dir)
+            self.assertIs(ctx.mem_tile_cache, ctx.tile_cache)
+            self.assertIs(ctx.rgb_tile_cache, ctx.mem_tile_cache.parent_cache)
+            self.assertTrue(ctx.mem_tile_cache.write_through)
+
+    def test_chunk_cache(self):
+        self.assertIsNone(ServiceContext().chunk_cache)
+
+        ctx = ServiceContext(chunk_cache_capacity=1000,
+                             config=dict(Datasets=[dict(Identifier='ds1'), dict(Identifier='ds2')]))
+        self.assertEqual(1000, ctx.chunk_cache.capacity)
+        ctx.chunk_cache.put('ds1', 'a/0', b'x' * 100)
+        ctx.chunk_cache.put('ds2', 'b/0', b'x' * 100)
+
+        ctx.dataset_cache['ds1'] = BaseMultiLevelDataset(xr.Dataset()), dict(Identifier='ds1')
+        ctx.config = dict(Datasets=[dict(Identifier='ds2')])
+        self.assertEqual(['ds2'], ctx.chunk_cache.dataset_ids)
+
+        ctx.config = dict()
+        self.assertEqual([], ctx.chunk_cache.dataset_ids)
+
+    def test_mmap_access(self):
+        with tempfile.TemporaryDirectory() as raw_cache_dir:
+            ctx = ServiceContext(base_dir=new_test_service_context().base_dir,
+                                 config=dict(Datasets=[
+                                     dict(Identifier='demo',
+                                          Path="../../../xcube_server/res/demo/cube.nc"),
+                                     dict(Identifier='demo-mmap',
+                                          Path="../../../xcube_server/res/demo/cube.nc",
+                                          Access='mmap'),
+                                     dict(Identifier='demo-invalid',
+                                          Path="../../../xcube_server/res/demo/cube.nc",
+                                          Access='magic'),
+                                 ]),
+                                 raw_cache_dir=raw_cache_dir)
+            xr.testing.assert_equal(ctx.get_dataset('demo').load(), ctx.get_dataset('demo-mmap'))
+            self.assertEqual(1, len(os.listdir(raw_cache_dir)))
+
+            with self.assertRaises(ServiceConfigError) as cm:
+                ctx.get_dataset('demo-invalid')
+            self.assertEqual("Invalid access='magic' in dataset descriptor 'demo-invalid'", cm.exception.reason)
+
+    def test_datasets_are_opened_concurrently(self):
+        ctx = ServiceContext(base_dir=get_res_demo_dir(),
+                             config=dict(Datasets=[dict(Identifier='demo',
+                                                        Path="cube.nc"),
+                                                   dict(Identifier='demo-2',
+                                                        Path="cube.nc")]))
+        create_dataset_entry = ctx._create_dataset_entry
+        opening = threading.Event()
+        opened = threading.Event()
+
+        def create_dataset_entry_slowly(ds_id):
+            if ds_id == 'demo':
+                opening.set()
+                opened.wait(10)
+            return create_dataset_entry(ds_id)
+
+        ctx._create_dataset_entry = create_dataset_entry_slowly
+        thread = threading.Thread(target=ctx.get_dataset, args=('demo',))
+        thread.start()
+        try:
+            self.assertTrue(opening.wait(10))
+            # Opening another dataset does not wait for the first one
+            self.assertIsNotNone(ctx.get_dataset('demo-2'))
+            self.assertNotIn('demo', ctx.dataset_cache)
+        finally:
+            opened.set()
+            thread.join(10)
+        self.assertIn('demo', ctx.dataset_cache)
+
+    def test_materialize(self):
+        with tempfile.TemporaryDirectory() as materialization_cache_dir:
+            base_dir = new_test_service_context().base_dir
+            datasets = [dict(Identifier='demo',
+                             Path="../../../xcube_server/res/demo/cube.nc"),
+                        dict(Identifier='demo-1w',
+                             FileSystem='memory',
+                             Path='script.py',
+                             InputDatasets=['demo'],
+                             InputParameters=dict(period='1W'),
+                             Materialize='disk'),
+                        dict(Identifier='demo-invalid',
+                             FileSystem='memory',
+                             Path='script.py',
+                             InputDatasets=['demo'],
+                             InputParameters=dict(period='1W'),
+                             Materialize='magic')]
+            ctx = ServiceContext(base_dir=base_dir,
+                                 config=dict(Datasets=datasets),
+                                 materialization_cache_dir=materialization_cache_dir,
+                                 dataset_content_check_interval=0.)
+            content_key = ctx.get_dataset_content_key('demo-1w')
+            self.assertEqual(32, len(content_key))
+
+            conc_chl = ctx.get_variable_for_z('demo-1w', 'conc_chl', 0)
+            self.assertEqual([], _list_cache_dir(materialization_cache_dir))
+            conc_chl[0, :10, :10].values
+            self.assertEqual([content_key], _list_cache_dir(materialization_cache_dir))
+
+            with self.assertRaises(ServiceConfigError) as cm:
+                ctx.get_dataset('demo-invalid')
+            self.assertEqual("Invalid materialize='magic' in dataset descriptor 'demo-invalid'", cm.exception.reason)
+
+            ml_dataset = ctx.get_ml_dataset('demo-1w')
+            datasets[1] = dict(datasets[1], InputParameters=dict(period='2W'))
+            ctx.config = dict(Datasets=datasets)
+            new_content_key = ctx.get_dataset_content_key('demo-1w')
+            self.assertNotEqual(content_key, new_content_key)
+
+            # The dataset is reopened, so that its chunks are materialized under the new key
+            self.assertIsNot(ml_dataset, ctx.get_ml_dataset('demo-1w'))
+            ctx.get_variable_for_z('demo-1w', 'conc_chl', 0)[0, :10, :10].values
+            self.assertEqual(sorted([content_key, new_content_key]), _list_cache_dir(materialization_cache_dir))
+
+    def test_content_key_of_local_zarr(self):
+        with tempfile.TemporaryDirectory() as base_dir:
+            xr.open_dataset(os.path.join(get_res_demo_dir(), "cube.nc")).to_zarr(os.path.join(base_dir, "cube.zarr"))
+            ctx = ServiceContext(base_dir=base_dir,
+                                 config=dict(Datasets=[dict(Identifier='demo', Path="cube.zarr")]))
+            content_key = ctx.get_dataset_content_key('demo')
+            self.assertEqual(content_key, ctx.get_dataset_content_key('demo'))
+
+            # Rewriting metadata in place does not change the modification time of the zarr directory itself
+            metadata_path = os.path.join(base_dir, "cube.zarr", ".zmetadata")
+            stat = os.stat(metadata_path)
+            os.utime(metadata_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+            self.assertNotEqual(content_key, ctx.get_dataset_content_key('demo'))
+
+    def test_dependent_datasets_are_removed(self):
+        ctx = new_test_service_context()
+        ctx.get_dataset('demo-1w')
+        self.assertIn('demo', ctx.dataset_cache)
+        self.assertIn('demo-1w', ctx.dataset_cache)
+
+        dataset_descriptors = ctx.config['Datasets']
+        ctx.config = dict(ctx.config, Datasets=[dataset_descriptor for dataset_descriptor in dataset_descriptors
+                                                if dataset_descriptor['Identifier'] != 'demo'])
+        self.assertNotIn('demo', ctx.dataset_cache)
+        self.assertNotIn('demo-1w', ctx.dataset_cache)
@@ -2,7 +2,8 @@ import unittest
 
 from tornado.web import HTTPError
 
-from xcube_server.errors import ServiceError, ServiceConfigError, ServiceBadRequestError, ServiceResourceNotFoundError
+from xcube_server.errors import ServiceError, ServiceConfigError, ServiceBadRequestError, ServiceResourceNotFoundError, \
+    ServiceUnavailableError
 
 
 class ErrorsTest(unittest.TestCase):
@@ -20,3 +21,8 @@ class ErrorsTest(unittest.TestCase):
 
         self.assertIsInstance(ServiceResourceNotFoundError(''), ServiceError)
         self.assertEqual(404, ServiceResourceNotFoundError('').status_code)
+
+        self.assertIsInstance(ServiceUnavailableError(''), ServiceError)
+        self.assertEqual(503, ServiceUnavailableError('').status_code)
+        self.assertIsNone(ServiceUnavailableError('').retry_after)
+        self.assertEqual(5, ServiceUnavailableError('', retry_after=5).retry_after)
@@ -0,0 +1,181 @@
+import threading
+import unittest
+
+import dask
+import dask.local
+
+from xcube_server.errors import ServiceUnavailableError
+from xcube_server.executors import WorkloadExecutor, new_executor, new_dask_client
+from xcube_server.metrics import REGISTRY
+
+try:
+    import distributed
+except ImportError:
+    distributed = None
+
+
+def _compute_thread_name() -> str:
+    return dask.delayed(lambda: threading.current_thread().name)().compute()
+
+
+class WorkloadExecutorTest(unittest.TestCase):
+
+    def test_admission_control(self):
+        executor = WorkloadExecutor("test_admission", max_workers=1, max_queue_size=1, retry_after=3)
+        rejected_tasks = REGISTRY.get("xcube_executor_rejected_tasks_total").labels("test_admission")
+        queued_tasks = REGISTRY.get("xcube_executor_queued_tasks").labels("test_admission")
+        started = threading.Event()
+        release = threading.Event()
+
+        def block():
+            started.set()
+            release.wait(10)
+            return "done"
+
+        try:
+            future1 = executor.submit(block)
+            self.assertTrue(started.wait(10))
+            future2 = executor.submit(lambda x: x + 1, 1)
+            self.assertEqual(1, executor.num_queued_tasks)
+            self.assertEqual(1.0, queued_tasks.value)
+
+            with self.assertRaises(ServiceUnavailableError) as cm:
+                executor.submit(lambda: None)
+            self.assertEqual(503, cm.exception.status_code)
+            self.assertEqual(3, cm.exception.retry_after)
+            self.assertEqual(1.0, rejected_tasks.value)
+
+            release.set()
+            self.assertEqual("done", future1.result(10))
+            self.assertEqual(2, future2.result(10))
+            self.assertEqual(0, executor.num_queued_tasks)
+            self.assertEqual(0.0, queued_tasks.value)
+            self.assertEqual(4, executor.submit(lambda x: x * 2, 2).result(10))
+        finally:
+            release.set()
+            executor.shutdown()
+
+    def test_admitted_tasks_are_not_rejected(self):
+        executor = WorkloadExecutor("test_admitted", max_workers=1, max_queue_size=1)
+        started = threading.Event()
+        release = threading.Event()
+
+        def block():
+            started.set()
+            release.wait(10)
+            return "done"
+
+        try:
+            future1 = executor.submit(block)
+            self.assertTrue(started.wait(10))
+            future2 = executor.submit(lambda x: x + 1, 1)
+            with self.assertRaises(ServiceUnavailableError):
+                executor.submit(lambda: None)
+            # Further blocks of an admitted request are queued even if the queue is full
+            future3 = executor.submit_admitted(lambda x: x + 2, 1)
+            self.assertEqual(2, executor.num_queued_tasks)
+
+            release.set()
+            self.assertEqual("done", future1.result(10))
+            self.assertEqual(2, future2.result(10))
+            self.assertEqual(3, future3.result(10))
+            self.assertEqual(0, executor.num_queued_tasks)
+        finally:
+            release.set()
+            executor.shutdown()
+
+    def test_unlimited_queue(self):
+        executor = WorkloadExecutor("test_unlimited", max_workers=2)
+        try:
+            futures = [executor.submit(lambda x: x * x, i) for i in range(100)]
+            self.assertEqual([i * i for i in range(100)], [future.result(10) for future in futures])
+        finally:
+            executor.shutdown()
+
+    def test_task_errors_are_propagated(self):
+        executor = WorkloadExecutor("test_errors", max_workers=1, max_queue_size=0)
+
+        def fail():
+            raise ValueError("failed")
+
+        try:
+            # With a queue size of zero, tasks are rejected even if a worker is idle
+            with self.assertRaises(ServiceUnavailableError):
+                executor.submit(fail)
+        finally:
+            executor.shutdown()
+
+        executor = WorkloadExecutor("test_errors", max_workers=1)
+        try:
+            with self.assertRaises(ValueError):
+                executor.submit(fail).result(10)
+            self.assertEqual(0, executor.num_queued_tasks)
+        finally:
+            executor.shutdown()
+
+    def test_new_executor(self):
+        executor = new_executor("test_new", dict(MaxWorkers=2, MaxQueueSize=10), default_retry_after=1)
+        try:
+            self.assertEqual("test_new", executor.name)
+            self.assertEqual(2, executor.max_workers)
+            self.assertEqual(10, executor.max_queue_size)
+            self.assertEqual(1, executor.retry_after)
+        finally:
+            executor.shutdown()
+
+        with self.assertRaises(ValueError):
+            new_executor("test_new", dict(MaxWorkers=-1))
+        with self.assertRaises(ValueError):
+            new_executor("test_new", dict(MaxWorkers=1, MaxQueueSize="10"))
+        with self.assertRaises(ValueError):
+            new_executor("test_new", dict(MaxWorkers=1, DaskScheduler="magic"))
+        with self.assertRaises(ValueError):
+            new_executor("test_new", dict(MaxWorkers=1, DaskScheduler="threads", DaskWorkers=0))
+        with self.assertRaises(ValueError):
+            new_executor("test_new", dict(MaxWorkers=1, DaskScheduler="distributed"))
+
+    def test_dask_schedulers(self):
+        executor = new_executor("test_sync", dict(MaxWorkers=1, DaskScheduler="synchronous"))
+        try:
+            self.assertEqual("synchronous", executor.dask_scheduler)
+            self.assertRegex(executor.submit(_compute_thread_name).result(10), "^xcube-test_sync_")
+        finally:
+            executor.shutdown()
+
+        executor = new_executor("test_threads", dict(MaxWorkers=1, DaskScheduler="threads", DaskWorkers=2))
+        try:
+            self.assertEqual("threads", executor.dask_scheduler)
+            self.assertEqual(2, executor.dask_workers)
+            self.assertRegex(executor.submit(_compute_thread_name).result(10), "^xcube-test_threads-dask_")
+        finally:
+            executor.shutdown()
+
+        computed_graphs = []
+
+        class TestClient:
+            @classmethod
+            def get(cls, dsk, keys, **kwargs):
+                computed_graphs.append(dsk)
+                return dask.local.get_sync(dsk, keys, **kwargs)
+
+        executor = new_executor("test_distributed", dict(MaxWorkers=1, DaskScheduler="distributed"),
+                                dask_client_getter=lambda: TestClient)
+        try:
+            self.assertRegex(executor.submit(_compute_thread_name).result(10), "^xcube-test_distributed_")
+            self.assertEqual(1, len(computed_graphs))
+        finally:
+            executor.shutdown()
+
+        # Threads not owned by an executor use dask's threaded scheduler
+        self.assertNotRegex(_compute_thread_name(), "^xcube-")
+
+    @unittest.skipIf(distributed is None, "package distributed not installed")
+    def test_new_dask_client(self):
+        client = new_dask_client(dict(NumWorkers=1, ThreadsPerWorker=2))
+        try:
+            self.assertEqual(6, client.submit(lambda x: 2 * x, 3).result(10))
+        finally:
+            client.shutdown()
+
+        with self.assertRaises(ValueError):
+            new_dask_client(dict(NumWorkers=0))
@@ -1,3 +1,6 @@
+import gzip
+import json
+
 from tornado.testing import AsyncHTTPTestCase
 
 from test.helpers import new_test_service_context
@@ -29,6 +32,84 @@ class HandlersTest(AsyncHTTPTestCase):
         response = self.fetch(self.prefix + '/')
         self.assertResponseOK(response)
 
+    def test_fetch_metrics(self):
+        response = self.fetch(self.prefix + '/datasets/demo/vars/conc_chl/tiles/0/0/0.png')
+        self.assertResponseOK(response)
+        response = self.fetch(self.prefix + '/metrics')
+        self.assertResponseOK(response)
+        self.assertTrue(response.headers.get('Content-Type').startswith('text/plain; version=0.0.4'))
+        text = response.body.decode('utf-8')
+        self.assertIn('xcube_request_seconds_count{handler="GetDatasetVarTileHandler",method="GET",status="200"}',
+                      text)
+        self.assertIn('xcube_tile_stage_seconds_count{image="ColorMappedRgbaImage",stage="encode PNG"}', text)
+        self.assertIn('xcube_dataset_open_seconds_count{fs_type="local"}', text)
+        self.assertIn('xcube_cache_size{cache="mask"}', text)
+        self.assertIn('xcube_executor_queued_tasks{executor="tiles"} 0.0', text)
+
+    def test_fetch_tile_rejected_if_executor_queue_is_full(self):
+        ctx = self._app.service_context
+        ctx.config = dict(ctx.config, Executors=dict(tiles=dict(MaxQueueSize=0, RetryAfter=2)))
+        response = self.fetch(self.prefix + '/datasets/demo/vars/conc_chl/tiles/0/0/0.png')
+        self.assertEqual(503, response.code)
+        self.assertEqual('2', response.headers.get('Retry-After'))
+        self.assertEqual('Too many pending tiles requests, please retry later', response.reason)
+        # Other workloads are not affected
+        response = self.fetch(self.prefix + '/datasets/demo/vars/conc_chl/legend.png')
+        self.assertResponseOK(response)
+
+    def test_fetch_metadata_and_places_run_in_executors(self):
+        ctx = self._app.service_context
+        ctx.config = dict(ctx.config, Executors=dict(metadata=dict(MaxQueueSize=0), places=dict(MaxQueueSize=0)))
+        for path in ('/datasets', '/datasets/demo', '/datasets/demo/coords/time',
+                     '/datasets/demo/vars/conc_chl/tilegrid', '/places', '/places/all', '/places/all/demo'):
+            response = self.fetch(self.prefix + path)
+            self.assertEqual(503, response.code, path)
+
+    def test_fetch_traces_if_tracing_is_disabled(self):
+        response = self.fetch(self.prefix + '/datasets/demo/vars/conc_chl/tiles/0/0/0.png?debug=1')
+        self.assertResponseOK(response)
+        self.assertIsNone(response.headers.get('X-Trace-Id'))
+        response = self.fetch(self.prefix + '/traces')
+        self.assertResourceNotFoundResponse(response, 'Tracing is not enabled')
+
+    def test_fetch_traces(self):
+        ctx = self._app.service_context
+        ctx.config = dict(ctx.config, Tracing=dict(AllowDebug=True))
+        response = self.fetch(self.prefix + '/datasets/demo/vars/conc_chl/tiles/0/0/0.png?debug=1')
+        self.assertResponseOK(response)
+        trace_id = response.headers.get('X-Trace-Id')
+        self.assertIsNotNone(trace_id)
+
+        response = self.fetch(self.prefix + f'/traces/{trace_id}')
+        self.assertResponseOK(response)
+        trace = json.loads(response.body.decode('utf-8'))
+        self.assertEqual(trace_id, trace.get('id'))
+        self.assertTrue(trace.get('name').endswith('/tiles/0/0/0.png'))
+        self.assertEqual(200, trace.get('attributes', {}).get('status'))
+        span_names = set()
+
+        def collect_span_names(span):
+            span_names.add(span['name'])
+            for child in span.get('children', []):
+                collect_span_names(child)
+
+        collect_span_names(trace)
+        self.assertIn('dataset tile', span_names)
+        self.assertIn('encode PNG', span_names)
+
+        response = self.fetch(self.prefix + f'/traces/{trace_id}?format=chrome')
+        self.assertResponseOK(response)
+        self.assertIn('traceEvents', json.loads(response.body.decode('utf-8')))
+
+        response = self.fetch(self.prefix + '/traces')
+        self.assertResponseOK(response)
+        self.assertIn(trace_id, [trace['id'] for trace in json.loads(response.body.decode('utf-8'))['traces']])
+
+        response = self.fetch(self.prefix + '/traces/-1')
+        self.assertEqual(404, response.code)
+        response = self.fetch(self.prefix + '/traces?format=xml')
+        self.assertBadRequestResponse(response, 'Parameter "format" must be either "json" or "chrome"')
+
     def test_fetch_wmts_kvp_capabilities(self):
         response = self.fetch(self.prefix + '/wmts/kvp'
                                             '?SERVICE=WMTS'
@@ -115,6 +196,18 @@ class HandlersTest(AsyncHTTPTestCase):
         response = self.fetch(self.prefix + '/wmts/1.0.0/WMTSCapabilities.xml')
         self.assertResponseOK(response)
 
+    def test_fetch_wmts_capabilities_gzipped(self):
+        response = self.fetch(self.prefix + '/wmts/1.0.0/WMTSCapabilities.xml',
+                              headers={'Accept-Encoding': 'gzip'}, decompress_response=False)
+        self.assertResponseOK(response)
+        self.assertEqual('gzip', response.headers.get('Content-Encoding'))
+        self.assertTrue(gzip.decompress(response.body).startswith(b'<?xml'))
+        response = self.fetch(self.prefix + '/wmts/1.0.0/WMTSCapabilities.xml',
+                              headers={'Accept-Encoding': 'identity'}, decompress_response=False)
+        self.assertResponseOK(response)
+        self.assertIsNone(response.headers.get('Content-Encoding'))
+        self.assertTrue(response.body.startswith(b'<?xml'))
+
     def test_fetch_wmts_tile(self):
         response = self.fetch(self.prefix + '/wmts/1.0.0/tile/demo/conc_chl/0/0/0.png')
         self.assertResponseOK(response)
@@ -145,10 +238,27 @@ class HandlersTest(AsyncHTTPTestCase):
         response = self.fetch(self.prefix + '/datasets/demo/coords/time')
         self.assertResponseOK(response)
 
+    def test_fetch_coords_json_pretty(self):
+        response = self.fetch(self.prefix + '/datasets/demo/coords/time')
+        self.assertResponseOK(response)
+        self.assertEqual('application/json', response.headers.get('Content-Type'))
+        self.assertNotIn(b'\n', response.body)
+        pretty_response = self.fetch(self.prefix + '/datasets/demo/coords/time?pretty=1')
+        self.assertResponseOK(pretty_response)
+        self.assertIn(b'\n  "name": "time",\n', pretty_response.body)
+        self.assertEqual(json.loads(response.body), json.loads(pretty_response.body))
+
     def test_fetch_dataset_tile(self):
         response = self.fetch(self.prefix + '/datasets/demo/vars/conc_chl/tiles/0/0/0.png')
         self.assertResponseOK(response)
 
+    def test_fetch_dataset_tile_not_gzipped(self):
+        response = self.fetch(self.prefix + '/datasets/demo/vars/conc_chl/tiles/0/0/0.png',
+                              headers={'Accept-Encoding': 'gzip'}, decompress_response=False)
+        self.assertResponseOK(response)
+        self.assertIsNone(response.headers.get('Content-Encoding'))
+        self.assertTrue(response.body.startswith(b'\x89PNG'))
+
     def test_fetch_dataset_tile_with_params(self):
         response = self.fetch(self.prefix + '/datasets/demo/vars/conc_chl/tiles/0/0/0.png?time=current&cbar=jet&debug=1')
         self.assertResponseOK(response)
@@ -187,6 +297,20 @@ class HandlersTest(AsyncHTTPTestCase):
         response = self.fetch(self.prefix + '/places/all?bbox=10,10,20,20')
         self.assertResponseOK(response)
 
+    def test_fetch_features_paginated(self):
+        response = self.fetch(self.prefix + '/places/all?query=Name:Station*&limit=4&properties=Name')
+        self.assertResponseOK(response)
+        result = json.loads(response.body)
+        self.assertEqual(4, len(result["features"]))
+        self.assertEqual({"Name": "Station 1"}, result["features"][0]["properties"])
+        response = self.fetch(self.prefix + '/places/all?query=Name:Station*&limit=4&cursor=' + result["nextCursor"])
+        self.assertResponseOK(response)
+        result = json.loads(response.body)
+        self.assertEqual(2, len(result["features"]))
+        self.assertNotIn("nextCursor", result)
+        response = self.fetch(self.prefix + '/places/all?limit=x')
+        self.assertBadRequestResponse(response, 'Parameter "limit" must be an integer, but was \'x\'')
+
     def test_fetch_features_for_dataset(self):
         response = self.fetch(self.prefix + '/places/all/demo')
         self.assertResponseOK(response)
@@ -201,6 +325,14 @@ class HandlersTest(AsyncHTTPTestCase):
         response = self.fetch(self.prefix + '/ts')
         self.assertResponseOK(response)
 
+    def test_fetch_time_series_info_gzipped(self):
+        response = self.fetch(self.prefix + '/ts',
+                              headers={'Accept-Encoding': 'gzip'}, decompress_response=False)
+        self.assertResponseOK(response)
+        self.assertEqual('gzip', response.headers.get('Content-Encoding'))
+        self.assertEqual('Accept-Encoding', response.headers.get('Vary'))
+        self.assertIn('layers', json.loads(gzip.decompress(response.body)))
+
     def test_fetch_time_series_point(self):
         response = self.fetch(self.prefix + '/ts/demo/conc_chl/point')
         self.assertBadRequestResponse(response, 'Missing query parameter "lon"')
@@ -211,6 +343,22 @@ class HandlersTest(AsyncHTTPTestCase):
         response = self.fetch(self.prefix + '/ts/demo/conc_chl/point?lon=2.1&lat=51.1')
         self.assertResponseOK(response)
 
+    def test_fetch_time_series_point_stream(self):
+        response = self.fetch(self.prefix + '/ts/demo/conc_chl/point?lon=2.1&lat=51.1&stream=1')
+        self.assertResponseOK(response)
+        self.assertEqual('application/x-ndjson', response.headers['Content-Type'])
+        lines = response.body.decode('utf-8').splitlines()
+        self.assertEqual(5, len(lines))
+        self.assertEqual({'result', 'date'}, set(json.loads(lines[0]).keys()))
+
+    def test_fetch_time_series_geometry_stream(self):
+        response = self.fetch(self.prefix + '/ts/demo/conc_chl/geometry?stream=1', method="POST",
+                              body='{"type":"Polygon", "coordinates": [[[1, 51], [2, 51], [2, 52], [1, 51]]]}')
+        self.assertResponseOK(response)
+        self.assertEqual('application/x-ndjson', response.headers['Content-Type'])
+        lines = response.body.decode('utf-8').splitlines()
+        self.assertEqual(5, len(lines))
+
     def test_fetch_time_series_geometry(self):
         response = self.fetch(self.prefix + '/ts/demo/conc_chl/geometry', method="POST",
                               body='')
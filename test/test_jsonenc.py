@@ -0,0 +1,32 @@
+import json
+import unittest
+
+import numpy as np
+
+from xcube_server.jsonenc import to_json, to_json_bytes
+
+
+class ToJsonTest(unittest.TestCase):
+    def test_compact(self):
+        self.assertEqual('{"a":[1,2],"b":{"c":"x"}}', to_json(dict(a=[1, 2], b=dict(c="x"))))
+        self.assertEqual(b'{"a":[1,2],"b":{"c":"x"}}', to_json_bytes(dict(a=[1, 2], b=dict(c="x"))))
+
+    def test_pretty(self):
+        self.assertEqual({"a": [1, 2], "b": {"c": "x"}},
+                         json.loads(to_json(dict(a=[1, 2], b=dict(c="x")), pretty=True)))
+        self.assertIn('\n  "a": [\n', to_json(dict(a=[1, 2], b=dict(c="x")), pretty=True))
+        self.assertIn(b'\n  "a": [\n', to_json_bytes(dict(a=[1, 2], b=dict(c="x")), pretty=True))
+
+    def test_numpy(self):
+        obj = dict(f=np.float64(0.5),
+                   f32=np.float32(0.25),
+                   i=np.int16(3),
+                   b=np.bool_(True),
+                   a=np.array([[1, 2], [3, 4]], dtype=np.int32),
+                   t=np.array(["2018-09-05T10:35:42"], dtype="datetime64[s]"))
+        self.assertEqual(dict(f=0.5, f32=0.25, i=3, b=True, a=[[1, 2], [3, 4]], t=["2018-09-05T10:35:42"]),
+                         json.loads(to_json(obj)))
+
+    def test_not_serializable(self):
+        with self.assertRaises(TypeError):
+            to_json(dict(a=object()))
@@ -0,0 +1,41 @@
+import asyncio
+import time
+
+from tornado.testing import AsyncTestCase, gen_test
+
+from xcube_server.loopmon import EventLoopLagMonitor
+from xcube_server.metrics import REGISTRY
+
+
+class EventLoopLagMonitorTest(AsyncTestCase):
+
+    def block_event_loop(self):
+        time.sleep(0.3)
+
+    @gen_test
+    async def test_reports_blocked_event_loop(self):
+        blocked = REGISTRY.get('xcube_event_loop_blocked_total').labels()
+        lag_seconds = REGISTRY.get('xcube_event_loop_lag_seconds').labels()
+        blocked_count = blocked.value
+        lag_count = sum(lag_seconds.snapshot()[0])
+
+        monitor = EventLoopLagMonitor(threshold=0.1, interval=0.02)
+        monitor.start()
+        try:
+            await asyncio.sleep(0.1)
+            self.assertEqual(blocked_count, blocked.value)
+            self.assertTrue(sum(lag_seconds.snapshot()[0]) > lag_count)
+
+            with self.assertLogs('xcube', level='WARNING') as cm:
+                self.block_event_loop()
+                await asyncio.sleep(0.1)
+        finally:
+            monitor.stop()
+
+        self.assertEqual(blocked_count + 1, blocked.value)
+        self.assertEqual(2, len(cm.output))
+        # The watchdog reports the stack of the blocking call
+        self.assertIn('event loop blocked for more than 0.100 seconds', cm.output[0])
+        self.assertIn('block_event_loop', cm.output[0])
+        # The monitor reports the duration once the loop runs again
+        self.assertIn('event loop was blocked for', cm.output[1])
@@ -0,0 +1,51 @@
+import tempfile
+import unittest
+
+import dask.array as da
+import numpy as np
+import xarray as xr
+
+from xcube_server.cache import Cache, MemoryCacheStore, NdarrayFileCacheStore
+from xcube_server.materialize import materialize_dataset
+
+
+class MaterializeDatasetTest(unittest.TestCase):
+    def setUp(self):
+        self.num_computed_chunks = 0
+
+        def compute_chunk(block):
+            self.num_computed_chunks += 1
+            return block * 2
+
+        conc_chl = da.from_array(np.arange(4 * 6, dtype=np.float64).reshape((4, 6)), chunks=(2, 3))
+        self.dataset = xr.Dataset(dict(conc_chl=(("lat", "lon"), conc_chl.map_blocks(compute_chunk, meta=np.array(()))),
+                                       mask=(("lat", "lon"), np.ones((4, 6), dtype=np.uint8))),
+                                  coords=dict(lat=np.arange(4), lon=np.arange(6)))
+
+    def test_chunks_are_computed_once(self):
+        cache = Cache(MemoryCacheStore(), capacity=1000000)
+        dataset = materialize_dataset(self.dataset, cache, "ds/0")
+        self.assertEqual(((2, 2), (3, 3)), dataset.conc_chl.chunks)
+        self.assertIs(self.dataset.mask.data, dataset.mask.data)
+        self.assertEqual(0, self.num_computed_chunks)
+
+        np.testing.assert_equal(np.arange(4 * 6).reshape((4, 6)) * 2, dataset.conc_chl.values)
+        self.assertEqual(4, self.num_computed_chunks)
+
+        dataset.conc_chl.values
+        materialize_dataset(self.dataset, cache, "ds/0").conc_chl[2:, 3:].values
+        self.assertEqual(4, self.num_computed_chunks)
+
+        # A different key does not hit cached chunks
+        materialize_dataset(self.dataset, cache, "ds2/0").conc_chl[2:, 3:].values
+        self.assertEqual(5, self.num_computed_chunks)
+
+    def test_chunks_are_reloaded_from_disk(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = Cache(NdarrayFileCacheStore(cache_dir), capacity=1000000)
+            expected = materialize_dataset(self.dataset, cache, "ds/0").conc_chl.values
+            self.assertEqual(4, self.num_computed_chunks)
+
+            cache = Cache(NdarrayFileCacheStore(cache_dir), capacity=1000000)
+            np.testing.assert_equal(expected, materialize_dataset(self.dataset, cache, "ds/0").conc_chl.values)
+            self.assertEqual(4, self.num_computed_chunks)
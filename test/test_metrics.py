@@ -0,0 +1,66 @@
+import unittest
+
+from xcube_server.metrics import MetricsRegistry
+
+
+class MetricsRegistryTest(unittest.TestCase):
+    def test_counter(self):
+        registry = MetricsRegistry()
+        counter = registry.counter('test_requests_total', 'Number of "test" requests', ('handler',))
+        self.assertIs(counter, registry.counter('test_requests_total', 'Number of "test" requests', ('handler',)))
+        counter.labels('A').inc()
+        counter.labels(handler='A').inc(2)
+        counter.labels('B\n"x"').inc()
+        with self.assertRaises(ValueError):
+            counter.labels('A').inc(-1)
+        with self.assertRaises(ValueError):
+            counter.labels('A', 'B')
+        self.assertEqual('# HELP test_requests_total Number of "test" requests\n'
+                         '# TYPE test_requests_total counter\n'
+                         'test_requests_total{handler="A"} 3.0\n'
+                         'test_requests_total{handler="B\\n\\"x\\""} 1.0\n',
+                         registry.to_text())
+
+    def test_gauge(self):
+        registry = MetricsRegistry()
+        gauge = registry.gauge('test_queue_size', 'Queue size').labels()
+        gauge.inc()
+        gauge.inc()
+        gauge.dec()
+        self.assertEqual(1, gauge.value)
+        gauge.set_function(lambda: 42)
+        self.assertEqual('# HELP test_queue_size Queue size\n'
+                         '# TYPE test_queue_size gauge\n'
+                         'test_queue_size 42.0\n',
+                         registry.to_text())
+
+    def test_histogram(self):
+        registry = MetricsRegistry()
+        histogram = registry.histogram('test_seconds', 'Durations', ('stage',), buckets=(0.1, 1.0))
+        histogram.labels('load').observe(0.05)
+        histogram.labels('load').observe(0.1)
+        histogram.labels('load').observe(0.5)
+        histogram.labels('load').observe(5.0)
+        with histogram.labels('encode').time():
+            pass
+        self.assertEqual(['# HELP test_seconds Durations',
+                          '# TYPE test_seconds histogram',
+                          'test_seconds_bucket{stage="encode",le="0.1"} 1.0',
+                          'test_seconds_bucket{stage="encode",le="1.0"} 1.0',
+                          'test_seconds_bucket{stage="encode",le="+Inf"} 1.0'],
+                         registry.to_text().split('\n')[0:5])
+        self.assertEqual(['test_seconds_bucket{stage="load",le="0.1"} 2.0',
+                          'test_seconds_bucket{stage="load",le="1.0"} 3.0',
+                          'test_seconds_bucket{stage="load",le="+Inf"} 4.0',
+                          'test_seconds_sum{stage="load"} 5.65',
+                          'test_seconds_count{stage="load"} 4.0',
+                          ''],
+                         registry.to_text().split('\n')[7:])
+
+    def test_conflicting_registration(self):
+        registry = MetricsRegistry()
+        registry.counter('test_total', 'Test')
+        with self.assertRaises(ValueError):
+            registry.gauge('test_total', 'Test')
+        with self.assertRaises(ValueError):
+            registry.counter('test_total', 'Test', ('label',))
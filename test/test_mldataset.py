@@ -5,8 +5,9 @@ import numpy as np
 import pandas as pd
 import xarray as xr
 
+from xcube_server.cache import Cache, MemoryCacheStore
 from xcube_server.im import TileGrid
-from xcube_server.mldataset import BaseMultiLevelDataset, ComputedMultiLevelDataset
+from xcube_server.mldataset import BaseMultiLevelDataset, ComputedMultiLevelDataset, get_storage_chunks
 
 
 class BaseMultiLevelDatasetTest(unittest.TestCase):
@@ -31,6 +32,27 @@ class BaseMultiLevelDatasetTest(unittest.TestCase):
 
         ml_ds.close()
 
+    def test_tile_grid_is_aligned_with_chunks(self):
+        ds = _get_test_dataset().chunk(dict(time=1, lat=240, lon=240))
+
+        ml_ds = BaseMultiLevelDataset(ds)
+        self.assertEqual(TileGrid(2, 3, 3, 240, 120, (-180, -90, 180, 90), inv_y=False),
+                         ml_ds.tile_grid)
+
+        ml_ds.close()
+
+
+class GetStorageChunksTest(unittest.TestCase):
+    def test_it(self):
+        ds = _get_test_dataset()
+        self.assertIsNone(get_storage_chunks(ds))
+
+        ds.noise.encoding.update(chunksizes=(1, 90, 180))
+        self.assertEqual(dict(time=1, lat=90, lon=180), get_storage_chunks(ds))
+
+        ds = ds.chunk(dict(time=2, lat=180, lon=360))
+        self.assertEqual(dict(time=2, lat=180, lon=360), get_storage_chunks(ds))
+
 
 class ComputedMultiLevelDatasetTest(unittest.TestCase):
     def test_it(self):
@@ -65,6 +87,27 @@ class ComputedMultiLevelDatasetTest(unittest.TestCase):
         ml_ds1.close()
         ml_ds2.close()
 
+    def test_materialization(self):
+        ml_ds1 = BaseMultiLevelDataset(_get_test_dataset().chunk(dict(time=1, lat=180, lon=180)))
+        cache = Cache(MemoryCacheStore(), capacity=100 * 1024 * 1024)
+        script_path = os.path.join(os.path.dirname(__file__), "res", "test", "script.py")
+
+        with self.assertRaises(ValueError) as cm:
+            ComputedMultiLevelDataset("ml_ds2", script_path, "compute_dataset", ["ml_ds1"], lambda ds_id: ml_ds1,
+                                      input_parameters=dict(period='1W'), materialization_cache=cache)
+        self.assertEqual("materialization_key must be given", f"{cm.exception}")
+
+        ml_ds2 = ComputedMultiLevelDataset("ml_ds2", script_path, "compute_dataset", ["ml_ds1"], lambda ds_id: ml_ds1,
+                                           input_parameters=dict(period='1W'),
+                                           materialization_cache=cache, materialization_key="key")
+        ds2 = ml_ds2.get_dataset(2)
+        self.assertEqual({'time': 3, 'lat': 180, 'lon': 360}, ds2.dims)
+        ds2.noise[0, :10, :10].values
+        self.assertTrue(cache.size > 0)
+
+        ml_ds1.close()
+        ml_ds2.close()
+
 
 def _get_test_dataset():
     w = 1440
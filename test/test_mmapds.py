@@ -0,0 +1,76 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from xcube_server.mmapds import open_mmap_dataset
+
+
+def new_dataset() -> xr.Dataset:
+    conc_chl = np.arange(3 * 4 * 6, dtype=np.float32).reshape((3, 4, 6))
+    conc_chl[:, 0, 0] = np.nan
+    return xr.Dataset(dict(conc_chl=(("time", "lat", "lon"), conc_chl, dict(units="mg/m^3"))),
+                      coords=dict(time=pd.date_range("2017-01-01", periods=3, freq="D").values,
+                                  lat=np.linspace(53.5, 50.5, 4),
+                                  lon=np.linspace(0.5, 5.5, 6)),
+                      attrs=dict(title="Test dataset"))
+
+
+class OpenMmapDatasetTest(unittest.TestCase):
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+        self.raw_cache_dir = os.path.join(self.base_dir, "raw")
+
+    def tearDown(self):
+        shutil.rmtree(self.base_dir, ignore_errors=True)
+
+    def test_netcdf3_is_mapped_directly(self):
+        path = os.path.join(self.base_dir, "cube.nc")
+        new_dataset().to_netcdf(path, format="NETCDF3_64BIT")
+
+        dataset = open_mmap_dataset(path, data_format="nc", raw_cache_dir=self.raw_cache_dir)
+        xr.testing.assert_identical(xr.open_dataset(path).load(), dataset)
+        self.assertFalse(os.path.exists(self.raw_cache_dir))
+
+    def test_raw_zarr_is_mapped_directly(self):
+        path = os.path.join(self.base_dir, "cube.zarr")
+        new_dataset().to_zarr(path, encoding=dict(conc_chl=dict(compressor=None, chunks=(3, 4, 6))))
+
+        dataset = open_mmap_dataset(path, data_format="zarr", raw_cache_dir=self.raw_cache_dir)
+        xr.testing.assert_identical(xr.open_zarr(path).load(), dataset)
+        self.assertFalse(os.path.exists(self.raw_cache_dir))
+
+        # Writes into the chunk file are seen through the memory map
+        conc_chl = np.memmap(os.path.join(path, "conc_chl", "0.0.0"), dtype=np.float32, mode="r+", shape=(3, 4, 6))
+        conc_chl[2, 3, 5] = -1.0
+        conc_chl.flush()
+        self.assertEqual(-1.0, dataset.conc_chl[2, 3, 5])
+
+    def test_compressed_dataset_is_converted(self):
+        path = os.path.join(self.base_dir, "cube.zarr")
+        new_dataset().to_zarr(path, encoding=dict(conc_chl=dict(chunks=(1, 2, 3))))
+
+        dataset = open_mmap_dataset(path, data_format="zarr", raw_cache_dir=self.raw_cache_dir)
+        xr.testing.assert_identical(xr.open_zarr(path).load(), dataset)
+        raw_paths = os.listdir(self.raw_cache_dir)
+        self.assertEqual(1, len(raw_paths))
+
+        open_mmap_dataset(path, data_format="zarr", raw_cache_dir=self.raw_cache_dir)
+        self.assertEqual(raw_paths, os.listdir(self.raw_cache_dir))
+
+        # A modified dataset is converted again, replacing the outdated raw dataset
+        new_dataset().assign(conc_chl=lambda ds: ds.conc_chl + 1).to_zarr(path, mode="w")
+        os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 1000000000))
+        dataset = open_mmap_dataset(path, data_format="zarr", raw_cache_dir=self.raw_cache_dir)
+        self.assertEqual(2.0, float(dataset.conc_chl[0, 0, 1]))
+        self.assertEqual(1, len(os.listdir(self.raw_cache_dir)))
+        self.assertNotEqual(raw_paths, os.listdir(self.raw_cache_dir))
+
+    def test_invalid_format(self):
+        with self.assertRaises(ValueError) as cm:
+            open_mmap_dataset(self.base_dir, data_format="levels")
+        self.assertEqual("illegal data format 'levels'", f"{cm.exception}")
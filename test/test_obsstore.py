@@ -0,0 +1,163 @@
+import tempfile
+import unittest
+
+import fsspec
+import numpy as np
+import xarray as xr
+
+from xcube_server.chunkcache import ChunkCache, DiskChunkCache
+from xcube_server.metrics import REGISTRY
+from xcube_server.obsstore import ObjectStorageStore
+
+try:
+    import moto.server
+except ImportError:
+    moto = None
+
+
+def _write_cube(fs: fsspec.AbstractFileSystem, path: str) -> xr.Dataset:
+    cube = xr.Dataset(dict(conc_chl=(('time', 'lat', 'lon'), np.arange(4 * 8 * 8, dtype=np.float32).reshape(4, 8, 8))))
+    cube.to_zarr(fs.get_mapper(path), encoding=dict(conc_chl=dict(chunks=(1, 4, 4))), mode='w')
+    return cube
+
+
+class ObjectStorageStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.fs = fsspec.filesystem('memory')
+        self.cube = _write_cube(self.fs, 'xcube/cube.zarr')
+
+    def tearDown(self):
+        self.fs.rm('xcube', recursive=True)
+
+    def test_open_zarr(self):
+        store = ObjectStorageStore(self.fs, 'xcube/cube.zarr')
+        self.assertIn('.zgroup', store)
+        self.assertIn('conc_chl/0.0.0', list(store))
+        self.assertEqual(len(self.fs.find('xcube/cube.zarr')), len(store))
+        ds = xr.open_zarr(store)
+        np.testing.assert_equal(self.cube.conc_chl.values, ds.conc_chl.values)
+
+    def test_getitems(self):
+        chunk_cache = ChunkCache(2 ** 20, name='test_getitems')
+        store = ObjectStorageStore(self.fs, 'xcube/cube.zarr', chunk_cache=chunk_cache, dataset_id='cube')
+        self.assertIs(chunk_cache, store.chunk_cache)
+        chunks_fetched = REGISTRY.get('xcube_obs_chunks_fetched_total').labels()
+        cache_hits = REGISTRY.get('xcube_cache_hits_total').labels('test_getitems')
+        num_fetched = chunks_fetched.value
+
+        keys = ['conc_chl/0.0.0', 'conc_chl/1.0.0', 'conc_chl/9.0.0']
+        values = store.getitems(keys)
+        self.assertEqual({'conc_chl/0.0.0', 'conc_chl/1.0.0'}, set(values.keys()))
+        self.assertEqual(values['conc_chl/0.0.0'], self.fs.cat('xcube/cube.zarr/conc_chl/0.0.0'))
+        self.assertEqual(num_fetched + 2, chunks_fetched.value)
+        self.assertEqual(sum(len(v) for v in values.values()), chunk_cache.get_dataset_size('cube'))
+
+        self.assertEqual(values, store.getitems(keys))
+        self.assertEqual(num_fetched + 2, chunks_fetched.value)
+        self.assertEqual(2, cache_hits.value)
+
+        self.assertEqual(values['conc_chl/1.0.0'], store['conc_chl/1.0.0'])
+        with self.assertRaises(KeyError):
+            # noinspection PyStatementEffect
+            store['conc_chl/9.0.0']
+
+    def test_disk_chunk_cache(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            disk_chunk_cache = DiskChunkCache(cache_dir, 2 ** 20)
+            chunks_fetched = REGISTRY.get('xcube_obs_chunks_fetched_total').labels()
+            keys = ['conc_chl/0.0.0', 'conc_chl/1.0.0']
+
+            store = ObjectStorageStore(self.fs, 'xcube/cube.zarr', disk_chunk_cache=disk_chunk_cache)
+            self.assertIs(disk_chunk_cache, store.disk_chunk_cache)
+            fetch_object_infos = store._fetch_object_infos
+            requested_paths = []
+
+            def record_fetch_object_infos(paths):
+                requested_paths.extend(paths)
+                return fetch_object_infos(paths)
+
+            store._fetch_object_infos = record_fetch_object_infos
+            values = store.getitems(keys)
+            self.assertEqual(2, len(values))
+            self.assertGreater(disk_chunk_cache.size, 0)
+            # Chunks that are not on disk are fetched without requesting their ETags and sizes first
+            self.assertEqual([], requested_paths)
+            self.assertIn(store.root + '/conc_chl/0.0.0', disk_chunk_cache)
+
+            # A restarted service reads the chunks from disk
+            num_fetched = chunks_fetched.value
+            store = ObjectStorageStore(self.fs, 'xcube/cube.zarr',
+                                       chunk_cache=ChunkCache(2 ** 20),
+                                       disk_chunk_cache=DiskChunkCache(cache_dir, 2 ** 20))
+            self.assertEqual(values, store.getitems(keys))
+            self.assertEqual(num_fetched, chunks_fetched.value)
+
+            # A changed object is fetched again
+            self.fs.pipe('xcube/cube.zarr/conc_chl/0.0.0', b'changed')
+            store = ObjectStorageStore(self.fs, 'xcube/cube.zarr', disk_chunk_cache=DiskChunkCache(cache_dir, 2 ** 20))
+            self.assertEqual(b'changed', store.getitems(keys)['conc_chl/0.0.0'])
+            self.assertEqual(num_fetched + 1, chunks_fetched.value)
+
+    def test_object_infos_expire(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            keys = ['conc_chl/0.0.0', 'conc_chl/9.0.0']
+            store = ObjectStorageStore(self.fs, 'xcube/cube.zarr', disk_chunk_cache=DiskChunkCache(cache_dir, 2 ** 20))
+            values = store.getitems(keys)
+            self.assertEqual({'conc_chl/0.0.0'}, set(values.keys()))
+            # Requests the ETags and sizes of the chunks on disk
+            self.assertEqual(values, store.getitems(keys))
+
+            # Within their time to live, ETags and sizes are not requested again
+            self.fs.pipe('xcube/cube.zarr/conc_chl/0.0.0', b'changed')
+            self.assertEqual(values, store.getitems(keys))
+
+            store = ObjectStorageStore(self.fs, 'xcube/cube.zarr', disk_chunk_cache=DiskChunkCache(cache_dir, 2 ** 20),
+                                       object_info_ttl=0.)
+            self.assertEqual(b'changed', store.getitems(keys)['conc_chl/0.0.0'])
+            self.fs.pipe('xcube/cube.zarr/conc_chl/0.0.0', b'changed again')
+            self.assertEqual(b'changed again', store.getitems(keys)['conc_chl/0.0.0'])
+
+    def test_without_chunk_cache(self):
+        store = ObjectStorageStore(self.fs, 'xcube/cube.zarr')
+        self.assertIsNone(store.chunk_cache)
+        self.assertEqual({'conc_chl/0.0.0'}, set(store.getitems(['conc_chl/0.0.0']).keys()))
+
+    def test_read_only(self):
+        store = ObjectStorageStore(self.fs, 'xcube/cube.zarr')
+        self.assertFalse(store.is_writeable())
+        with self.assertRaises(NotImplementedError):
+            store['conc_chl/0.0.0'] = b''
+        with self.assertRaises(NotImplementedError):
+            del store['conc_chl/0.0.0']
+
+
+@unittest.skipIf(moto is None, 'requires moto')
+class ObjectStorageStoreS3Test(unittest.TestCase):
+    """Test against a local S3 stand-in provided by moto."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = moto.server.ThreadedMotoServer(ip_address='127.0.0.1', port=0)
+        cls.server.start()
+        host, port = cls.server.get_host_and_port()
+        cls.endpoint_url = f'http://{host}:{port}'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def test_open_zarr(self):
+        import s3fs
+        fs = s3fs.S3FileSystem(key='testing', secret='testing',
+                               client_kwargs=dict(endpoint_url=self.endpoint_url, region_name='us-east-1'),
+                               config_kwargs=dict(max_pool_connections=4))
+        fs.mkdir('xcube')
+        cube = _write_cube(fs, 'xcube/cube.zarr')
+        fs.invalidate_cache()
+
+        store = ObjectStorageStore(fs, 'xcube/cube.zarr', max_concurrency=4)
+        values = store.getitems([f'conc_chl/{i}.{j}.{k}' for i in range(4) for j in range(2) for k in range(2)])
+        self.assertEqual(16, len(values))
+
+        ds = xr.open_zarr(store)
+        np.testing.assert_equal(cube.conc_chl.values, ds.conc_chl.values)
@@ -1,7 +1,9 @@
+import threading
 import time
 from unittest import TestCase
 
-from xcube_server.perf import measure_time_cm
+from xcube_server.perf import measure_time_cm, start_trace, trace_span, is_tracing, get_trace, \
+    get_recent_traces, traces_to_chrome_trace_json_object
 
 
 class MeasureTimeTest(TestCase):
@@ -18,3 +20,69 @@ class MeasureTimeTest(TestCase):
             time.sleep(0.05)
         self.assertTrue(hasattr(cm, "duration"))
         self.assertIsNone(cm.duration)
+
+    def test_observed(self):
+        durations = []
+        for disabled in (False, True):
+            measure_time = measure_time_cm(disabled=disabled)
+            with measure_time("hello", observe=durations.append) as cm:
+                time.sleep(0.01)
+            self.assertTrue(cm.duration > 0.005)
+        self.assertEqual(2, len(durations))
+
+
+class TraceTest(TestCase):
+    def test_no_trace(self):
+        self.assertFalse(is_tracing())
+        span1 = trace_span("a")
+        span2 = trace_span("b", attributes=dict(x=1))
+        self.assertIs(span1, span2)
+        with span1 as span:
+            self.assertFalse(span.is_recording)
+            span.set_attribute("x", 2)
+
+        durations = []
+        with trace_span("c", observe=durations.append) as span:
+            self.assertFalse(span.is_recording)
+        self.assertEqual(1, len(durations))
+
+    def test_trace(self):
+        durations = []
+        with start_trace("GET /test", attributes=dict(handler="TestHandler")) as trace:
+            self.assertTrue(is_tracing())
+            with trace_span("a", observe=durations.append) as span:
+                self.assertTrue(span.is_recording)
+                span.set_attribute("tile", "0/0/0")
+                with trace_span("b"):
+                    pass
+            with trace_span("c"):
+                pass
+        self.assertFalse(is_tracing())
+        self.assertEqual(1, len(durations))
+
+        trace_dict = trace.to_dict()
+        self.assertEqual(trace.id, trace_dict.get("id"))
+        self.assertEqual("GET /test", trace_dict.get("name"))
+        self.assertEqual(dict(handler="TestHandler"), trace_dict.get("attributes"))
+        self.assertIsInstance(trace_dict.get("duration"), float)
+        children = trace_dict.get("children")
+        self.assertEqual(["a", "c"], [child["name"] for child in children])
+        self.assertEqual(dict(tile="0/0/0"), children[0].get("attributes"))
+        self.assertEqual(["b"], [child["name"] for child in children[0]["children"]])
+
+        self.assertIs(trace, get_trace(trace.id))
+        self.assertIs(trace, get_recent_traces()[-1])
+        self.assertIsNone(get_trace("-1"))
+
+    def test_chrome_trace_events(self):
+        with start_trace("GET /test") as trace:
+            with trace_span("a"):
+                pass
+        json_object = traces_to_chrome_trace_json_object([trace])
+        events = json_object.get("traceEvents")
+        self.assertEqual(["GET /test", "a"], [event["name"] for event in events])
+        for event in events:
+            self.assertEqual("X", event["ph"])
+            self.assertEqual(threading.get_ident(), event["tid"])
+            self.assertEqual(trace.id, event["args"]["trace"])
+            self.assertTrue(event["dur"] >= 0)
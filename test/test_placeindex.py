@@ -0,0 +1,52 @@
+import unittest
+
+import numpy as np
+
+from xcube_server.placeindex import PackedRTree
+
+
+def _query_by_scan(bounds, box):
+    x_min, y_min, x_max, y_max = box
+    x_overlaps = (bounds[:, 0] <= x_max) & (bounds[:, 2] >= x_min)
+    y_overlaps = (bounds[:, 1] <= y_max) & (bounds[:, 3] >= y_min)
+    return np.nonzero(x_overlaps & y_overlaps)[0]
+
+
+class PackedRTreeTest(unittest.TestCase):
+
+    def test_query(self):
+        bounds = np.array([[0.5, 0.5, 0.5, 0.5],
+                           [2, 2, 3, 3],
+                           [np.nan, np.nan, np.nan, np.nan],
+                           [4, 0, 6, 2],
+                           [1.5, 0.5, 1.5, 0.5]])
+        tree = PackedRTree.build(bounds, node_capacity=2)
+        self.assertEqual(4, len(tree))
+        self.assertEqual([4, 2, 1], tree.level_sizes)
+
+        self.assertEqual([0, 1, 4], list(tree.query((0, 0, 2.5, 2.5))))
+        self.assertEqual([1], list(tree.query((2.5, 2.5, 2.5, 2.5))))
+        self.assertEqual([3], list(tree.query((4.5, 1.5, 4.5, 1.5))))
+        self.assertEqual([], list(tree.query((10, 10, 12, 12))))
+
+    def test_query_equals_scan(self):
+        random = np.random.RandomState(0)
+        x = random.uniform(-180, 180, 10000)
+        y = random.uniform(-90, 90, 10000)
+        size = random.uniform(0, 0.5, 10000)
+        bounds = np.stack([x, y, x + size, y + size], axis=1)
+        tree = PackedRTree.build(bounds)
+        self.assertEqual([10000, 625, 40, 3, 1], tree.level_sizes)
+        for box in [(0, 0, 10, 10), (-180, -90, 180, 90), (-10.5, 20.25, -10.5, 20.25), (170, 80, 200, 100)]:
+            np.testing.assert_equal(_query_by_scan(bounds, box), tree.query(box))
+
+    def test_restored_tree(self):
+        bounds = np.array([[0, 0, 1, 1], [2, 2, 3, 3], [4, 4, 5, 5]], dtype=np.float64)
+        tree = PackedRTree.build(bounds, node_capacity=2)
+        tree = PackedRTree(tree.order, tree.nodes, tree.level_sizes, node_capacity=tree.node_capacity)
+        self.assertEqual([1, 2], list(tree.query((2.5, 2.5, 4.5, 4.5))))
+
+    def test_empty(self):
+        tree = PackedRTree.build(np.zeros((0, 4)))
+        self.assertEqual(0, len(tree))
+        self.assertEqual([], list(tree.query((0, 0, 1, 1))))
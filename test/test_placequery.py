@@ -0,0 +1,79 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from xcube_server.placequery import PlaceQuery
+from xcube_server.placestore import PlaceStore
+
+
+class PlaceQueryTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.temp_dir = tempfile.mkdtemp(prefix="xcube-place-query-test-")
+        path = os.path.join(cls.temp_dir, "places.geojson")
+        properties_list = [dict(name="Lake Constance", depth=251.0, country="DE"),
+                           dict(name="Lake Geneva", depth=310, country="CH"),
+                           dict(name="Loch Ness", depth=227, country=None),
+                           dict(name="Steinhuder Meer", country="DE")]
+        features = [dict(type="Feature",
+                         geometry=dict(type="Point", coordinates=[float(i), 0.0]),
+                         properties=properties)
+                    for i, properties in enumerate(properties_list)]
+        with open(path, "w") as fp:
+            json.dump(dict(type="FeatureCollection", features=features), fp)
+        cls.place_store = PlaceStore(path, os.path.join(cls.temp_dir, "cache"))
+        cls.place_store.sync()
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.temp_dir, ignore_errors=True)
+
+    def _eval(self, query_expr, comb_op="and"):
+        mask = PlaceQuery.parse(query_expr, comb_op=comb_op).get_mask(self.place_store)
+        return [int(i) for i in np.nonzero(mask)[0]]
+
+    def test_parse(self):
+        query = PlaceQuery.parse('name:"Lake *" depth>=250', comb_op="or")
+        self.assertEqual([("name", ":", "Lake *"), ("depth", ">=", "250")], query.terms)
+        self.assertEqual("or", query.comb_op)
+
+        with self.assertRaises(ValueError):
+            PlaceQuery.parse("name")
+        with self.assertRaises(ValueError):
+            PlaceQuery.parse("   ")
+        with self.assertRaises(ValueError):
+            PlaceQuery.parse("name:x", comb_op="xor")
+
+    def test_property_columns(self):
+        values, valid = self.place_store.get_property_column("depth")
+        self.assertEqual(np.float64, values.dtype)
+        self.assertEqual([True, True, True, False], list(valid))
+        values, valid = self.place_store.get_property_column("country")
+        self.assertEqual(["DE", "CH", "", "DE"], list(values))
+        self.assertEqual([True, True, False, True], list(valid))
+        self.assertIsNone(self.place_store.get_property_column("bibo"))
+
+    def test_match(self):
+        self.assertEqual([0, 1], self._eval("name:lake*"))
+        self.assertEqual([2], self._eval("name:?och*"))
+        self.assertEqual([2], self._eval("depth:227"))
+        self.assertEqual([], self._eval("depth:deep"))
+        self.assertEqual([], self._eval("bibo:*"))
+
+    def test_compare(self):
+        self.assertEqual([0, 3], self._eval("country=DE"))
+        self.assertEqual([1], self._eval("country!=DE"))
+        self.assertEqual([0, 1], self._eval("depth>=250"))
+        self.assertEqual([2], self._eval("depth<250"))
+        self.assertEqual([0, 3], self._eval("country>CZ"))
+        with self.assertRaises(ValueError):
+            self._eval("depth>deep")
+
+    def test_comb_op(self):
+        self.assertEqual([0], self._eval("name:lake* country=DE"))
+        self.assertEqual([0, 1, 3], self._eval("name:lake* country=DE", comb_op="or"))
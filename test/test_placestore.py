@@ -0,0 +1,131 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import shapely.geometry
+
+from xcube_server.placestore import PlaceStore
+
+
+def _new_feature(name: str, geometry):
+    return dict(type="Feature",
+                id=name,
+                geometry=shapely.geometry.mapping(geometry),
+                properties=dict(name=name, ID=name))
+
+
+class PlaceStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp(prefix="xcube-place-store-test-")
+        self.cache_dir = os.path.join(self.temp_dir, "cache")
+        self.path = os.path.join(self.temp_dir, "places.geojson")
+        self._write_places([_new_feature("A", shapely.geometry.Point(0.5, 0.5)),
+                            _new_feature("B", shapely.geometry.box(2, 2, 3, 3)),
+                            _new_feature("C", shapely.geometry.Polygon(((4, 0), (6, 0), (6, 2), (4, 0)))),
+                            _new_feature("D", shapely.geometry.Point(1.5, 0.5))])
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def _write_places(self, features):
+        with open(self.path, "w") as fp:
+            json.dump(dict(type="FeatureCollection", features=features), fp)
+
+    def test_read_features(self):
+        store = PlaceStore(self.path, self.cache_dir)
+        with self.assertRaises(RuntimeError):
+            store.read_features()
+        self.assertTrue(store.sync())
+        self.assertFalse(store.sync())
+        store.first_feature_id = 10
+        self.assertEqual(4, store.num_features)
+
+        features = list(store.read_features())
+        self.assertEqual(["10", "11", "12", "13"], [f["id"] for f in features])
+        self.assertEqual(["A", "B", "C", "D"], [f["properties"]["name"] for f in features])
+        self.assertNotIn("ID", features[0]["properties"])
+        self.assertEqual("Point", features[0]["geometry"]["type"])
+
+        features = list(store.read_features([3, 1]))
+        self.assertEqual(["D", "B"], [f["properties"]["name"] for f in features])
+
+    def test_find_features(self):
+        store = PlaceStore(self.path, self.cache_dir)
+        store.sync()
+        self.assertEqual(["A", "B", "D"], self._names(store.find_features(shapely.geometry.box(0, 0, 2.5, 2.5))))
+        self.assertEqual(["B"], self._names(store.find_features(shapely.geometry.Point(2.5, 2.5))))
+        self.assertEqual([], self._names(store.find_features(shapely.geometry.box(10, 10, 12, 12))))
+        # Within the bounding box but outside of the triangle of feature "C"
+        self.assertEqual([], self._names(store.find_features(shapely.geometry.Point(4.5, 1.5))))
+        self.assertEqual(["C"], self._names(store.find_features(shapely.geometry.Point(5.5, 0.5))))
+        # Query parts are pre-filtered separately
+        query_geometry = shapely.geometry.MultiPolygon([shapely.geometry.box(0, 0, 1, 1),
+                                                        shapely.geometry.box(5, 0, 7, 1)])
+        self.assertEqual(["A", "C"], self._names(store.find_features(query_geometry)))
+
+    def test_prepared_geometries_are_reused(self):
+        store = PlaceStore(self.path, self.cache_dir)
+        store.sync()
+        self.assertEqual(["C"], self._names(store.find_features(shapely.geometry.Point(5.5, 0.5))))
+        prepared_geometries = dict(store._snapshot.prepared_geometries)
+        self.assertEqual([2], list(prepared_geometries.keys()))
+        self.assertEqual(["B", "C"], self._names(store.find_features(shapely.geometry.box(2.5, 0.5, 5.5, 2.5))))
+        self.assertIs(prepared_geometries[2], store._snapshot.prepared_geometries[2])
+
+        # A new version of the store has its own prepared geometries
+        self._write_places([_new_feature("E", shapely.geometry.Point(8.5, 8.5))])
+        stat = os.stat(self.path)
+        os.utime(self.path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+        store.sync()
+        self.assertEqual({}, store._snapshot.prepared_geometries)
+        self.assertEqual(["E"], self._names(store.find_features(shapely.geometry.box(8, 8, 9, 9))))
+
+    def test_index_files_are_reused(self):
+        store = PlaceStore(self.path, self.cache_dir)
+        store.sync()
+        index_files = sorted(os.listdir(self.cache_dir))
+        self.assertEqual(7, len(index_files))
+        index_mtimes = [os.stat(os.path.join(self.cache_dir, f)).st_mtime_ns for f in index_files]
+
+        store = PlaceStore(self.path, self.cache_dir)
+        store.sync()
+        self.assertEqual(index_files, sorted(os.listdir(self.cache_dir)))
+        self.assertEqual(index_mtimes, [os.stat(os.path.join(self.cache_dir, f)).st_mtime_ns for f in index_files])
+        self.assertEqual(4, store.num_features)
+
+    def test_reload_if_modified(self):
+        store = PlaceStore(self.path, self.cache_dir)
+        store.sync()
+        self.assertEqual(1, store.version)
+
+        self._write_places([_new_feature("E", shapely.geometry.Point(8.5, 8.5))])
+        stat = os.stat(self.path)
+        os.utime(self.path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+
+        self.assertTrue(store.sync())
+        self.assertEqual(2, store.version)
+        self.assertEqual(1, store.num_features)
+        self.assertEqual(["E"], self._names(store.read_features()))
+
+    def test_readers_are_not_affected_by_reload(self):
+        store = PlaceStore(self.path, self.cache_dir)
+        store.sync()
+        features = store.read_features()
+        self.assertEqual("A", next(features)["properties"]["name"])
+
+        self._write_places([_new_feature("E", shapely.geometry.Point(8.5, 8.5))])
+        stat = os.stat(self.path)
+        os.utime(self.path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+        self.assertTrue(store.sync())
+        # Files of the previous version have been removed
+        self.assertEqual(7, len(os.listdir(self.cache_dir)))
+
+        self.assertEqual(["B", "C", "D"], self._names(features))
+        self.assertEqual(["E"], self._names(store.read_features()))
+
+    @classmethod
+    def _names(cls, features):
+        return [feature["properties"]["name"] for feature in features]
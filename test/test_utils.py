@@ -4,8 +4,9 @@ import numpy as np
 import shapely.geometry
 import xarray as xr
 
+from xcube_server.cache import Cache, MemoryCacheStore
 from xcube_server.utils import get_dataset_geometry, get_dataset_bounds, get_geometry_mask, \
-    timestamp_to_iso_string
+    get_dataset_geometry_mask, timestamp_to_iso_string, timestamps_to_iso_strings
 
 
 class TimestampToIsoStringTest(unittest.TestCase):
@@ -26,6 +27,26 @@ class TimestampToIsoStringTest(unittest.TestCase):
                          timestamp_to_iso_string(np.datetime64("2018-09-05 10:35:42.164"), freq="H"))
 
 
+class TimestampsToIsoStringsTest(unittest.TestCase):
+    def test_it(self):
+        times = np.array(["2018-09-05", "2018-09-05 10:35:42", "2018-09-05 10:35:42.164", "NaT"],
+                         dtype="datetime64[ns]")
+        for freq in ("S", "H", "L"):
+            self.assertEqual([timestamp_to_iso_string(time, freq=freq) for time in times],
+                             timestamps_to_iso_strings(times, freq=freq))
+        self.assertEqual(["2018-09-05T00:00:00Z", "2018-09-05T11:00:00Z", "2018-09-05T11:00:00Z", "NaTZ"],
+                         timestamps_to_iso_strings(times, freq="H"))
+
+    def test_it_memoized(self):
+        times = np.array(["2018-09-05", "2018-09-06"], dtype="datetime64[ns]")
+        iso_strings = timestamps_to_iso_strings(times, memoize=True)
+        self.assertEqual(["2018-09-05T00:00:00Z", "2018-09-06T00:00:00Z"], iso_strings)
+        self.assertIs(iso_strings, timestamps_to_iso_strings(times, memoize=True))
+        self.assertIsNot(iso_strings, timestamps_to_iso_strings(times, freq="H", memoize=True))
+        self.assertIsNot(iso_strings, timestamps_to_iso_strings(times))
+        self.assertIsNot(iso_strings, timestamps_to_iso_strings(times.copy(), memoize=True))
+
+
 class GetDatasetGeometryTest(unittest.TestCase):
 
     def test_nominal(self):
@@ -129,3 +150,40 @@ class GetGeometryMaskTest(unittest.TestCase):
                                   [0, 0, 0, 0, 0, 0, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0],
                                   [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]], dtype=np.byte)
         np.testing.assert_array_almost_equal(expected_mask, actual_mask)
+
+    def test_get_geometry_mask_with_cache(self):
+        w = 13
+        h = 7
+        res = 0.5
+        triangle = shapely.geometry.Polygon(((0.0, 0.0), (6.5, 0.0), (6.5, 3.5), (0.0, 0.0)))
+        mask_cache = Cache(MemoryCacheStore(), capacity=1000)
+
+        expected_mask = get_geometry_mask(w, h, triangle, 0.0, 0.0, res)
+        actual_mask = get_geometry_mask(w, h, triangle, 0.0, 0.0, res, mask_cache=mask_cache)
+        self.assertEqual(np.bool_, actual_mask.dtype)
+        np.testing.assert_equal(expected_mask, actual_mask)
+        # 13 x 7 mask pixels are stored in 12 bytes
+        self.assertEqual(12, mask_cache.size)
+
+        # Cache hit, restored from bit-packed form, also for the GeoJSON form of the geometry
+        actual_mask = get_geometry_mask(w, h, shapely.geometry.mapping(triangle), 0.0, 0.0, res,
+                                        mask_cache=mask_cache)
+        self.assertEqual(np.bool_, actual_mask.dtype)
+        np.testing.assert_equal(expected_mask, actual_mask)
+        self.assertEqual(12, mask_cache.size)
+
+        # Different grid, different mask
+        get_geometry_mask(w, h, triangle, 0.5, 0.0, res, mask_cache=mask_cache)
+        self.assertEqual(24, mask_cache.size)
+
+
+class GetDatasetGeometryMaskTest(unittest.TestCase):
+    def test_get_dataset_geometry_mask(self):
+        dataset = xr.Dataset(coords=dict(lon=np.linspace(0.25, 7.75, 16), lat=np.linspace(3.75, 0.25, 8)))
+
+        indexers, mask = get_dataset_geometry_mask(dataset, shapely.geometry.box(1.1, 1.1, 2.9, 2.4))
+        self.assertEqual(dict(lon=slice(2, 7), lat=slice(3, 7)), indexers)
+        self.assertEqual((4, 5), mask.shape)
+        self.assertEqual(12, np.count_nonzero(mask))
+
+        self.assertIsNone(get_dataset_geometry_mask(dataset, shapely.geometry.box(10.0, 10.0, 12.0, 12.0)))
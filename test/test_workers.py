@@ -0,0 +1,72 @@
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+from xcube_server.workers import get_num_workers, fork_workers
+
+_WORKER_SCRIPT = """
+import os, sys, time
+from xcube_server.workers import fork_workers
+out_dir = sys.argv[1]
+worker_id = fork_workers(2, max_restarts=1)
+path = os.path.join(out_dir, f"worker-{worker_id}")
+restarted = os.path.exists(path)
+with open(path, "a") as fp:
+    fp.write(f"{os.getpid()}\\n")
+if worker_id == 1 and not restarted:
+    # Simulate a crash, the worker must be restarted
+    sys.exit(3)
+while True:
+    time.sleep(0.1)
+"""
+
+
+class GetNumWorkersTest(unittest.TestCase):
+    def test_get_num_workers(self):
+        self.assertEqual(1, get_num_workers(None))
+        self.assertEqual(1, get_num_workers(1))
+        self.assertEqual(4, get_num_workers(4))
+        self.assertEqual(os.cpu_count() or 1, get_num_workers(0))
+        self.assertEqual(os.cpu_count() or 1, get_num_workers(-1))
+
+    def test_invalid_num_workers(self):
+        with self.assertRaises(ValueError):
+            fork_workers(0)
+
+
+@unittest.skipIf(sys.platform == 'win32', 'requires os.fork()')
+class ForkWorkersTest(unittest.TestCase):
+    def test_restart_and_terminate(self):
+        with tempfile.TemporaryDirectory() as out_dir:
+            process = subprocess.Popen([sys.executable, '-c', _WORKER_SCRIPT, out_dir])
+            try:
+                self._wait_for(lambda: self._num_pids(out_dir, 0) == 1 and self._num_pids(out_dir, 1) == 2)
+                process.send_signal(signal.SIGTERM)
+                self.assertEqual(0, process.wait(timeout=10))
+            finally:
+                if process.poll() is None:
+                    process.kill()
+            for worker_id in (0, 1):
+                with open(os.path.join(out_dir, f'worker-{worker_id}')) as fp:
+                    for pid in fp.read().split():
+                        with self.assertRaises(ProcessLookupError):
+                            os.kill(int(pid), 0)
+
+    def _wait_for(self, condition, timeout=10.0):
+        t0 = time.monotonic()
+        while not condition():
+            if time.monotonic() - t0 > timeout:
+                self.fail('timeout')
+            time.sleep(0.05)
+
+    @staticmethod
+    def _num_pids(out_dir: str, worker_id: int) -> int:
+        try:
+            with open(os.path.join(out_dir, f'worker-{worker_id}')) as fp:
+                return len(fp.read().split())
+        except FileNotFoundError:
+            return 0
@@ -23,13 +23,14 @@ import os
 
 from tornado.web import Application, StaticFileHandler
 
+from xcube_server.compression import ContentEncoding
 from xcube_server.defaults import DEFAULT_NAME, API_PREFIX
 from xcube_server.handlers import GetNE2TileHandler, GetDatasetVarTileHandler, InfoHandler, GetNE2TileGridHandler, \
     GetDatasetVarTileGridHandler, GetWMTSCapabilitiesXmlHandler, GetColorBarsJsonHandler, GetColorBarsHtmlHandler, \
     GetDatasetsHandler, FindPlacesHandler, FindDatasetPlacesHandler, \
     GetDatasetCoordsHandler, GetTimeSeriesInfoHandler, GetTimeSeriesForPointHandler, WMTSKvpHandler, \
     GetTimeSeriesForGeometryHandler, GetTimeSeriesForFeaturesHandler, GetTimeSeriesForGeometriesHandler, \
-    GetPlaceGroupsHandler, GetDatasetVarLegendHandler, GetDatasetHandler
+    GetPlaceGroupsHandler, GetDatasetVarLegendHandler, GetDatasetHandler, MetricsHandler, GetTracesHandler, GetTraceHandler
 from xcube_server.service import url_pattern
 
 __author__ = "Norman Fomferra (Brockmann Consult GmbH)"
@@ -42,6 +43,12 @@ def new_application(name: str = DEFAULT_NAME):
          StaticFileHandler, {'path': os.path.join(os.path.dirname(__file__), 'res')}),
         (prefix + url_pattern('/'),
          InfoHandler),
+        (prefix + url_pattern('/metrics'),
+         MetricsHandler),
+        (prefix + url_pattern('/traces'),
+         GetTracesHandler),
+        (prefix + url_pattern('/traces/{{trace_id}}'),
+         GetTraceHandler),
 
         (prefix + url_pattern('/wmts/1.0.0/WMTSCapabilities.xml'),
          GetWMTSCapabilitiesXmlHandler),
@@ -101,4 +108,5 @@ def new_application(name: str = DEFAULT_NAME):
         (prefix + url_pattern('/ts/{{ds_id}}/{{var_name}}/places'),
          GetTimeSeriesForFeaturesHandler),
     ])
+    application.add_transform(ContentEncoding)
     return application
@@ -20,18 +20,38 @@
 # SOFTWARE.
 
 
+import fcntl
+import hashlib
+import io
+import mmap
 import os
 import os.path
+import struct
 import sys
+import tempfile
+import threading
 import time
+import weakref
 from abc import ABCMeta, abstractmethod
 from threading import RLock
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from .metrics import REGISTRY
 
 __author__ = "Norman Fomferra (Brockmann Consult GmbH)"
 
 # _DEBUG_CACHE = True
 _DEBUG_CACHE = False
 
+_CACHE_HITS = REGISTRY.counter('xcube_cache_hits_total', 'Number of cache hits', ('cache',))
+_CACHE_MISSES = REGISTRY.counter('xcube_cache_misses_total', 'Number of cache misses', ('cache',))
+_CACHE_EVICTIONS = REGISTRY.counter('xcube_cache_evictions_total',
+                                    'Number of values discarded from a cache to free space', ('cache',))
+_CACHE_SIZE = REGISTRY.gauge('xcube_cache_size', 'Current size of a cache in units of its store, usually bytes',
+                             ('cache',))
+
 
 class CacheStore(metaclass=ABCMeta):
     """
@@ -85,6 +105,13 @@ class CacheStore(metaclass=ABCMeta):
         """
         pass
 
+    def clear(self):
+        """
+        Discard all values kept by the store on its own, e.g. values stored by other processes sharing the store,
+        which are not discarded by :meth:`discard_value`. Does nothing by default.
+        """
+        pass
+
 
 class MemoryCacheStore(CacheStore):
     """
@@ -131,11 +158,35 @@ class MemoryCacheStore(CacheStore):
 class FileCacheStore(CacheStore):
     """
     Simple file store for values which can be written and read as bytes, e.g. encoded PNG images.
+
+    Values are written atomically, so that multiple processes can share the same cache directory.
+
+    If a capacity is given, it limits the size of all files in the cache directory, including those
+    written by other processes. The size is recorded in a file in the cache directory, which is updated
+    by all processes under a file lock. If the capacity is exceeded, the least recently used files are removed
+    until the size drops below *threshold* times the capacity. The access time of a file is recorded as its
+    modification time, so that it is shared by all processes using the same directory.
+
+    :param cache_dir: the cache directory
+    :param ext: the file name extension of values
+    :param capacity: optional maximum size of all files in the cache directory in bytes
+    :param threshold: fraction of the capacity to which the directory is trimmed if it is full
     """
 
-    def __init__(self, cache_dir: str, ext: str):
+    _SIZE_FILE_NAME = '.size'
+    _SIZE = struct.Struct('<Q')
+
+    def __init__(self, cache_dir: str, ext: str, capacity: int = None, threshold: float = 0.75):
         self.cache_dir = cache_dir
         self.ext = ext
+        self._capacity = capacity
+        self._threshold = threshold
+        self._size_fd = None  # type: Optional[int]
+        self._size_lock = threading.Lock()
+
+    @property
+    def capacity(self) -> Optional[int]:
+        return self._capacity
 
     def can_load_from_key(self, key) -> bool:
         path = self._key_to_path(key)
@@ -150,26 +201,323 @@ class FileCacheStore(CacheStore):
         dir_path = os.path.dirname(path)
         if not os.path.exists(dir_path):
             os.makedirs(dir_path, exist_ok=True)
-        with open(path, 'wb') as fp:
+        # Write to a temporary file first, so other processes never read a partially written file
+        temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(temp_path, 'wb') as fp:
             fp.write(value)
-        return path, os.path.getsize(path)
+        os.replace(temp_path, path)
+        if self._capacity is not None:
+            self._update_size(len(value))
+        return path, len(value)
 
     def restore_value(self, key, stored_value):
         path = self._key_to_path(key)
         with open(path, 'rb') as fp:
-            return fp.read()
+            value = fp.read()
+        if self._capacity is not None:
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+        return value
 
     def discard_value(self, key, stored_value):
         path = self._key_to_path(key)
         try:
+            size = os.path.getsize(path)
             os.remove(path)
             # TODO (forman): also remove empty directories up to self.cache_dir
         except IOError:
-            pass
+            return
+        if self._capacity is not None:
+            self._update_size(-size)
+
+    def clear(self):
+        # Only files with the extension of this store are removed, other files may belong to someone else
+        for path, _, _ in self._scan():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        if self._capacity is not None:
+            self._update_size(0, rescan=True)
 
     def _key_to_path(self, key):
         return os.path.join(self.cache_dir, str(key) + self.ext)
 
+    def _update_size(self, delta: int, rescan: bool = False):
+        with self._size_lock:
+            if self._size_fd is None:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                self._size_fd = os.open(os.path.join(self.cache_dir, self._SIZE_FILE_NAME), os.O_RDWR | os.O_CREAT)
+            # Record locks are owned by processes, threads are serialized by the thread lock
+            fcntl.lockf(self._size_fd, fcntl.LOCK_EX)
+            try:
+                data = os.pread(self._size_fd, self._SIZE.size, 0)
+                if len(data) == self._SIZE.size and not rescan:
+                    size = max(0, self._SIZE.unpack(data)[0] + delta)
+                else:
+                    # An initial scan of the cache directory already includes the change
+                    size = sum(file_size for _, file_size, _ in self._scan())
+                if size > self._capacity:
+                    size = self._trim()
+                os.pwrite(self._size_fd, self._SIZE.pack(size), 0)
+            finally:
+                fcntl.lockf(self._size_fd, fcntl.LOCK_UN)
+
+    def _trim(self) -> int:
+        # Scan the directory, which also corrects the recorded size, e.g. if a process died while writing a file
+        entries = sorted(self._scan(), key=lambda entry: entry[2])
+        size = sum(file_size for _, file_size, _ in entries)
+        max_size = self._threshold * self._capacity
+        for path, file_size, _ in entries:
+            if size <= max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            size -= file_size
+        return size
+
+    def _scan(self) -> List[Tuple[str, int, float]]:
+        entries = []
+        for dir_path, _, file_names in os.walk(self.cache_dir):
+            for file_name in file_names:
+                if file_name.endswith(self.ext):
+                    path = os.path.join(dir_path, file_name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    entries.append((path, stat.st_size, stat.st_mtime))
+        return entries
+
+
+class NdarrayFileCacheStore(FileCacheStore):
+    """
+    File store for numpy arrays, written in NumPy's ".npy" format.
+
+    :param cache_dir: the cache directory
+    :param capacity: optional maximum size of all files in the cache directory in bytes, see :class:`FileCacheStore`
+    :param threshold: fraction of the capacity to which the directory is trimmed if it is full
+    """
+
+    def __init__(self, cache_dir: str, capacity: int = None, threshold: float = 0.75):
+        super().__init__(cache_dir, ".npy", capacity=capacity, threshold=threshold)
+
+    def store_value(self, key, value):
+        buffer = io.BytesIO()
+        np.save(buffer, value, allow_pickle=False)
+        return super().store_value(key, buffer.getvalue())
+
+    def restore_value(self, key, stored_value):
+        return np.load(io.BytesIO(super().restore_value(key, stored_value)), allow_pickle=False)
+
+
+class SharedMemoryCacheStore(CacheStore):
+    """
+    Store for values which can be written and read as bytes, e.g. encoded PNG images, kept in a
+    shared memory arena. The arena is shared by all processes forked after the store has been created,
+    so that worker processes share one cache budget and one set of cached values.
+
+    The arena comprises a hash index and a data area used as ring buffer. If the data area is full,
+    new values overwrite the oldest ones, so the store evicts values on its own and
+    :meth:`discard_value` does nothing. :meth:`clear` discards the values of all processes. Values read from the oldest quarter of the data area
+    are written again, so that frequently used values stay in the arena.
+
+    Reads are lock-free: a reader validates the index entry and the data it has copied against
+    sequence numbers and the ring buffer's write position. Writes are serialized by a POSIX record lock
+    on an unnamed file, which the operating system releases if its holder dies, so that a crashed worker
+    cannot block the writes of the other workers. If the lock cannot be acquired in time, values are not stored.
+
+    :param capacity: size of the data area in bytes
+    :param num_slots: number of index slots, defaults to one slot per 4 KiB of data area
+    :param lock_timeout: maximum time in seconds to wait for the write lock
+    """
+
+    _MAGIC = b'XCSHMC01'
+    # magic, data area size, number of slots, write position
+    _HEADER = struct.Struct('<8sQQQ')
+    # sequence number (odd while being updated), key hash, record position, record size
+    _SLOT = struct.Struct('<QQQQ')
+    # key length, followed by key and value bytes
+    _RECORD_HEADER = struct.Struct('<I')
+    _WAYS = 4
+    _WRITE_POS_OFFSET = 24
+
+    def __init__(self, capacity: int, num_slots: int = None, lock_timeout: float = 1.0):
+        if capacity <= 0:
+            raise ValueError('capacity must be greater than zero')
+        if num_slots is None:
+            num_slots = max(1024, capacity // 4096)
+        num_slots = max(self._WAYS, num_slots - num_slots % self._WAYS)
+        self._data_size = capacity
+        self._num_buckets = num_slots // self._WAYS
+        self._slots_offset = self._HEADER.size
+        self._data_offset = self._slots_offset + num_slots * self._SLOT.size
+        self._lock_timeout = lock_timeout
+        # An anonymous shared mapping is inherited by forked processes, like the lock file.
+        # Record locks are owned by processes, so threads of a process are serialized by a thread lock.
+        self._mm = mmap.mmap(-1, self._data_offset + capacity, flags=mmap.MAP_SHARED)
+        self._HEADER.pack_into(self._mm, 0, self._MAGIC, capacity, num_slots, 0)
+        self._lock_file = tempfile.TemporaryFile()
+        self._thread_lock = threading.Lock()
+        # The thread lock may be held by another thread of the parent while forking
+        store_ref = weakref.ref(self)
+        os.register_at_fork(after_in_child=lambda: SharedMemoryCacheStore._reset_thread_lock(store_ref))
+
+    @property
+    def capacity(self) -> int:
+        return self._data_size
+
+    @property
+    def num_slots(self) -> int:
+        return self._num_buckets * self._WAYS
+
+    def can_load_from_key(self, key) -> bool:
+        return self._find(key) is not None
+
+    def load_from_key(self, key):
+        found = self._find(key)
+        # The value may have been overwritten since can_load_from_key() was called
+        return key, len(found[0]) if found is not None else 0
+
+    def store_value(self, key, value):
+        if not isinstance(value, (bytes, bytearray, memoryview)):
+            raise TypeError(f'value for key {key!r} must be bytes-like')
+        self._put(key, value, self._lock_timeout)
+        return key, len(value)
+
+    def restore_value(self, key, stored_value):
+        found = self._find(key)
+        if found is None:
+            return None
+        value, pos = found
+        if pos < self._get_write_pos() - (3 * self._data_size) // 4:
+            # Value will be overwritten soon, give it a second chance if nobody else is writing
+            self._put(key, value, None)
+        return value
+
+    def discard_value(self, key, stored_value):
+        # Values are evicted by the ring buffer
+        pass
+
+    def clear(self):
+        # Records more than one data area size behind the write position count as overwritten,
+        # for readers as well as for writers, so advancing the write position discards all values
+        if not self._acquire_lock(self._lock_timeout):
+            return
+        try:
+            struct.pack_into('<Q', self._mm, self._WRITE_POS_OFFSET, self._get_write_pos() + self._data_size)
+        finally:
+            self._release_lock()
+
+    def close(self):
+        self._mm.close()
+        self._lock_file.close()
+
+    @staticmethod
+    def _reset_thread_lock(store_ref: weakref.ref):
+        store = store_ref()
+        if store is not None:
+            store._thread_lock = threading.Lock()
+
+    def _acquire_lock(self, timeout: Optional[float]) -> bool:
+        deadline = time.monotonic() + (timeout or 0.0)
+        if not self._thread_lock.acquire(timeout=timeout or 0.0):
+            return False
+        while True:
+            try:
+                fcntl.lockf(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return True
+            except OSError:
+                if time.monotonic() >= deadline:
+                    self._thread_lock.release()
+                    return False
+                time.sleep(0.001)
+
+    def _release_lock(self):
+        fcntl.lockf(self._lock_file, fcntl.LOCK_UN)
+        self._thread_lock.release()
+
+    def _find(self, key) -> Optional[Tuple[bytes, int]]:
+        key_bytes = str(key).encode('utf-8')
+        key_hash = self._hash(key_bytes)
+        mm = self._mm
+        for slot_offset in self._get_slot_offsets(key_hash):
+            seq, slot_key_hash, pos, size = self._SLOT.unpack_from(mm, slot_offset)
+            if seq == 0 or seq % 2 == 1 or slot_key_hash != key_hash:
+                continue
+            data_offset = self._data_offset + pos % self._data_size
+            record = mm[data_offset: data_offset + size]
+            # Validate the copy: the record must not have been overwritten, nor the slot updated meanwhile
+            if self._get_write_pos() > pos + self._data_size or self._SLOT.unpack_from(mm, slot_offset)[0] != seq:
+                continue
+            key_size, = self._RECORD_HEADER.unpack_from(record, 0)
+            value_offset = self._RECORD_HEADER.size + key_size
+            if record[self._RECORD_HEADER.size: value_offset] != key_bytes:
+                continue
+            return record[value_offset:], pos
+        return None
+
+    def _put(self, key, value, timeout: Optional[float]):
+        key_bytes = str(key).encode('utf-8')
+        size = self._RECORD_HEADER.size + len(key_bytes) + len(value)
+        if size > self._data_size // 4:
+            # Value too large for this store
+            return
+        if not self._acquire_lock(timeout):
+            return
+        try:
+            mm = self._mm
+            data_size = self._data_size
+            pos = self._get_write_pos()
+            if pos % data_size + size > data_size:
+                # Records do not wrap around, continue at the start of the data area
+                pos += data_size - pos % data_size
+            # Claim the range first, so readers detect records that are going to be overwritten
+            struct.pack_into('<Q', mm, self._WRITE_POS_OFFSET, pos + size)
+            data_offset = self._data_offset + pos % data_size
+            self._RECORD_HEADER.pack_into(mm, data_offset, len(key_bytes))
+            data_offset += self._RECORD_HEADER.size
+            mm[data_offset: data_offset + len(key_bytes)] = key_bytes
+            data_offset += len(key_bytes)
+            mm[data_offset: data_offset + len(value)] = value
+
+            key_hash = self._hash(key_bytes)
+            min_pos = pos + size - data_size
+            target_offset = None
+            target_pos = None
+            for slot_offset in self._get_slot_offsets(key_hash):
+                seq, slot_key_hash, slot_pos, _ = self._SLOT.unpack_from(mm, slot_offset)
+                if seq == 0 or slot_key_hash == key_hash or slot_pos < min_pos:
+                    # Empty slot, slot of the same key, or slot of an overwritten record
+                    target_offset = slot_offset
+                    break
+                if target_pos is None or slot_pos < target_pos:
+                    target_offset, target_pos = slot_offset, slot_pos
+            seq, = struct.unpack_from('<Q', mm, target_offset)
+            # A process may have died while updating the slot, leaving an odd sequence number
+            seq += seq % 2
+            struct.pack_into('<Q', mm, target_offset, seq + 1)
+            self._SLOT.pack_into(mm, target_offset, seq + 1, key_hash, pos, size)
+            struct.pack_into('<Q', mm, target_offset, seq + 2)
+        finally:
+            self._release_lock()
+
+    def _get_write_pos(self) -> int:
+        return struct.unpack_from('<Q', self._mm, self._WRITE_POS_OFFSET)[0]
+
+    def _get_slot_offsets(self, key_hash: int):
+        bucket_offset = self._slots_offset + (key_hash % self._num_buckets) * self._WAYS * self._SLOT.size
+        return range(bucket_offset, bucket_offset + self._WAYS * self._SLOT.size, self._SLOT.size)
+
+    @staticmethod
+    def _hash(key_bytes: bytes) -> int:
+        # Python's hash() of str differs between processes that are not forked, so use a stable hash
+        return int.from_bytes(hashlib.blake2b(key_bytes, digest_size=8).digest(), 'little')
+
 
 def _policy_lru(item):
     return item.access_time
@@ -254,7 +602,8 @@ class Cache:
             self.access_time = time.process_time() - _T0
             self.access_count += 1
 
-    def __init__(self, store=MemoryCacheStore(), capacity=1000, threshold=0.75, policy=POLICY_LRU, parent_cache=None):
+    def __init__(self, store=MemoryCacheStore(), capacity=1000, threshold=0.75, policy=POLICY_LRU, parent_cache=None,
+                 write_through=False, name=None):
         """
         Constructor.
 
@@ -264,17 +613,38 @@ class Cache:
         :param policy: cache replacement policy. This is a function that maps a :py:class:`Cache.Item`
                        to a numerical value. See :py:data:`POLICY_LRU`,
                        :py:data:`POLICY_MRU`, :py:data:`POLICY_LFU`, :py:data:`POLICY_RR`
+        :param parent_cache: optional cache that takes over values discarded from this cache
+        :param write_through: if True, values put into this cache are immediately put into the parent cache too,
+                              rather than when they are discarded from this cache. Values found in the parent cache
+                              are then kept in this cache. This allows for sharing a parent cache
+                              such as a file cache between processes.
+        :param name: optional cache name. If given, hits, misses, evictions, and the size of this cache
+                     are recorded in the metrics labelled with this name.
         """
         self._store = store
         self._capacity = capacity
         self._threshold = threshold
         self._policy = policy
         self._parent_cache = parent_cache
+        self._write_through = write_through
         self._size = 0
         self._max_size = self._capacity * self._threshold
         self._item_dict = {}
         self._item_list = []
         self._lock = RLock()
+        self._name = name
+        if name is not None:
+            self._hits = _CACHE_HITS.labels(name)
+            self._misses = _CACHE_MISSES.labels(name)
+            self._evictions = _CACHE_EVICTIONS.labels(name)
+            cache_ref = weakref.ref(self)
+            _CACHE_SIZE.labels(name).set_function(lambda: _get_cache_size(cache_ref))
+        else:
+            self._hits = self._misses = self._evictions = None
+
+    @property
+    def name(self):
+        return self._name
 
     @property
     def policy(self):
@@ -288,6 +658,14 @@ class Cache:
     def capacity(self):
         return self._capacity
 
+    @property
+    def parent_cache(self):
+        return self._parent_cache
+
+    @property
+    def write_through(self):
+        return self._write_through
+
     @property
     def threshold(self):
         return self._threshold
@@ -306,15 +684,23 @@ class Cache:
         value = None
         restored = False
         if item:
-            value = item.restore(self._store, key)
-            restored = True
-            if _DEBUG_CACHE:
-                _debug_print('restored value for key "%s" from cache' % key)
-        elif self._parent_cache:
-            item = self._parent_cache.get_value(key)
-            if item:
-                value = item.restore(self._parent_cache.store, key)
+            try:
+                value = item.restore(self._store, key)
+            except FileNotFoundError:
+                value = None
+            if value is not None:
+                restored = True
+                if _DEBUG_CACHE:
+                    _debug_print('restored value for key "%s" from cache' % key)
+            else:
+                # The stored value has been removed, e.g. by another process sharing the store
+                self._remove_item(item)
+        if not restored and self._parent_cache:
+            value = self._parent_cache.get_value(key)
+            if value is not None:
                 restored = True
+                if self._write_through:
+                    self._store_value(key, value)
                 if _DEBUG_CACHE:
                     _debug_print('restored value for key "%s" from parent cache' % key)
         if not restored:
@@ -325,13 +711,25 @@ class Cache:
                 if _DEBUG_CACHE:
                     _debug_print('restored value for key "%s" from cache' % key)
         self._lock.release()
+        if self._hits is not None:
+            if value is not None:
+                self._hits.inc()
+            else:
+                self._misses.inc()
         return value
 
     def put_value(self, key, value):
         self._lock.acquire()
         if self._parent_cache:
-            # remove value from parent cache, because this cache will now take over
-            self._parent_cache.remove_value(key)
+            if self._write_through:
+                self._parent_cache.put_value(key, value)
+            else:
+                # remove value from parent cache, because this cache will now take over
+                self._parent_cache.remove_value(key)
+        self._store_value(key, value)
+        self._lock.release()
+
+    def _store_value(self, key, value):
         item = self._item_dict.get(key)
         if item:
             self._remove_item(item)
@@ -344,19 +742,21 @@ class Cache:
         if _DEBUG_CACHE:
             _debug_print('stored value for key "%s" in cache' % key)
         self._add_item(item)
-        self._lock.release()
 
     def remove_value(self, key):
         self._lock.acquire()
         if self._parent_cache:
             self._parent_cache.remove_value(key)
+        self._discard_value(key)
+        self._lock.release()
+
+    def _discard_value(self, key):
         item = self._item_dict.get(key)
         if item:
             self._remove_item(item)
             item.discard(self._store, key)
             if _DEBUG_CACHE:
                 _debug_print('Cache: discarded value for key "%s" from parent cache' % key)
-        self._lock.release()
 
     def _add_item(self, item):
         self._item_dict[item.key] = item
@@ -385,8 +785,13 @@ class Cache:
         self._lock.release()
         # release lock to give another thread a chance then require lock again
         self._lock.acquire()
+        if self._evictions is not None and keys:
+            self._evictions.inc(len(keys))
         for key in keys:
-            if self._parent_cache:
+            if self._write_through:
+                # The parent cache, if any, already has the value
+                self._discard_value(key)
+            elif self._parent_cache:
                 # Before discarding item fully, put its value into the parent cache
                 value = self.get_value(key)
                 self.remove_value(key)
@@ -408,6 +813,13 @@ class Cache:
                 if value:
                     self._parent_cache.put_value(key, value)
             self.remove_value(key)
+        # Values not known to this cache may still be found in the store
+        self._store.clear()
+
+
+def _get_cache_size(cache_ref) -> float:
+    cache = cache_ref()
+    return cache.size if cache is not None else 0
 
 
 def _debug_print(msg):
@@ -0,0 +1,341 @@
+# The MIT License (MIT)
+# Copyright (c) 2018 by the xcube development team and contributors
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies
+# of the Software, and to permit persons to whom the Software is furnished to do
+# so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Caches for the compressed chunks of remote zarr datasets: a process-wide in-memory cache
+and a persistent cache on local disk.
+"""
+
+import collections
+import hashlib
+import os
+import struct
+import threading
+from typing import List, Optional, Tuple
+
+from .cache import _CACHE_HITS, _CACHE_MISSES, _CACHE_EVICTIONS, _CACHE_SIZE
+from .metrics import REGISTRY
+
+__author__ = "Norman Fomferra (Brockmann Consult GmbH)"
+
+_CHUNK_CACHE_DATASET_SIZE = REGISTRY.gauge('xcube_chunk_cache_dataset_size',
+                                           'Size of the chunks of a dataset in the chunk cache, in bytes',
+                                           ('dataset',))
+
+
+class ChunkCache:
+    """
+    A byte-budgeted LRU cache for compressed chunks, shared by all zarr stores of remote datasets
+    in a process. The size of cached chunks is also accounted per dataset.
+
+    Chunks are identified by their paths, so stores sharing a cache must use distinct paths.
+    Hits, misses, evictions and the size of the cache are recorded in the cache metrics labelled
+    with *name*, and the size per dataset in the metric ``xcube_chunk_cache_dataset_size``.
+
+    :param capacity: maximum size of all cached chunks in bytes
+    :param name: cache name used as label of the cache metrics
+    """
+
+    def __init__(self, capacity: int, name: str = 'chunk'):
+        if capacity <= 0:
+            raise ValueError('capacity must be greater than zero')
+        self._capacity = capacity
+        self._name = name
+        # maps chunk paths to tuples of the form (dataset_id, chunk)
+        self._entries = collections.OrderedDict()  # type: Dict[str, Tuple[str, bytes]]
+        self._size = 0
+        self._dataset_sizes = dict()  # type: Dict[str, int]
+        self._lock = threading.Lock()
+        self._hits = _CACHE_HITS.labels(name)
+        self._misses = _CACHE_MISSES.labels(name)
+        self._evictions = _CACHE_EVICTIONS.labels(name)
+        self._size_gauge = _CACHE_SIZE.labels(name)
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @property
+    def capacity(self) -> int:
+        return self._capacity
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    @property
+    def dataset_ids(self) -> List[str]:
+        with self._lock:
+            return list(self._dataset_sizes.keys())
+
+    def get_dataset_size(self, dataset_id: str) -> int:
+        """Get the size in bytes of the cached chunks of the dataset with given identifier."""
+        return self._dataset_sizes.get(dataset_id, 0)
+
+    def get(self, path: str) -> Optional[bytes]:
+        """
+        Get a chunk.
+
+        :param path: the chunk path
+        :return: the chunk, or None if not cached
+        """
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None:
+                self._entries.move_to_end(path)
+        if entry is None:
+            self._misses.inc()
+            return None
+        self._hits.inc()
+        return entry[1]
+
+    def put(self, dataset_id: str, path: str, chunk: bytes):
+        """
+        Put a chunk into the cache, evicting the least recently used chunks if the capacity is exceeded.
+        Chunks larger than the capacity are not cached.
+
+        :param dataset_id: identifier of the dataset the chunk belongs to
+        :param path: the chunk path
+        :param chunk: the chunk
+        """
+        size = len(chunk)
+        if size > self._capacity:
+            return
+        with self._lock:
+            self._remove_entry(path)
+            num_evicted = 0
+            while self._entries and self._size + size > self._capacity:
+                self._remove_entry(next(iter(self._entries)))
+                num_evicted += 1
+            self._entries[path] = dataset_id, chunk
+            self._update_size(dataset_id, size)
+        if num_evicted:
+            self._evictions.inc(num_evicted)
+
+    def remove_dataset(self, dataset_id: str):
+        """Remove all chunks of the dataset with given identifier."""
+        with self._lock:
+            paths = [path for path, (entry_dataset_id, _) in self._entries.items() if entry_dataset_id == dataset_id]
+            for path in paths:
+                self._remove_entry(path)
+
+    def clear(self):
+        """Remove all chunks."""
+        with self._lock:
+            for path in list(self._entries.keys()):
+                self._remove_entry(path)
+
+    def _remove_entry(self, path: str):
+        entry = self._entries.pop(path, None)
+        if entry is not None:
+            dataset_id, chunk = entry
+            self._update_size(dataset_id, -len(chunk))
+
+    def _update_size(self, dataset_id: str, delta: int):
+        self._size += delta
+        dataset_size = self._dataset_sizes.get(dataset_id, 0) + delta
+        if dataset_size > 0:
+            self._dataset_sizes[dataset_id] = dataset_size
+        else:
+            self._dataset_sizes.pop(dataset_id, None)
+        self._size_gauge.set(self._size)
+        _CHUNK_CACHE_DATASET_SIZE.labels(dataset_id).set(dataset_size)
+
+
+class DiskChunkCache:
+    """
+    A persistent cache for compressed chunks in a local directory, so that chunks fetched from
+    object storage survive restarts and can be shared by all processes on a host.
+
+    Each chunk is stored in a file together with the object's ETag and size, which must match
+    the given ones when it is read, so that chunks of objects changed in the object storage are
+    not used. Chunks stored without an ETag, because it was not known when they were fetched,
+    are validated by their size only. If the cache exceeds its capacity, the least recently used files are removed
+    until the size drops below *threshold* times the capacity. The access time of a file is recorded as its
+    modification time, so that it is shared by all processes using the same directory.
+
+    :param cache_dir: the cache directory
+    :param capacity: maximum size of all cached chunks in bytes
+    :param threshold: fraction of the capacity to which the cache is trimmed if it is full
+    :param name: cache name used as label of the cache metrics
+    """
+
+    _MAGIC = b'XCDC'
+    # magic, ETag length, chunk size
+    _HEADER = struct.Struct('<4sHQ')
+
+    def __init__(self, cache_dir: str, capacity: int, threshold: float = 0.75, name: str = 'disk_chunk'):
+        if capacity <= 0:
+            raise ValueError('capacity must be greater than zero')
+        self._cache_dir = cache_dir
+        self._capacity = capacity
+        self._threshold = threshold
+        self._name = name
+        self._size = None  # type: Optional[int]
+        self._lock = threading.Lock()
+        self._hits = _CACHE_HITS.labels(name)
+        self._misses = _CACHE_MISSES.labels(name)
+        self._evictions = _CACHE_EVICTIONS.labels(name)
+        self._size_gauge = _CACHE_SIZE.labels(name)
+
+    @property
+    def cache_dir(self) -> str:
+        return self._cache_dir
+
+    @property
+    def capacity(self) -> int:
+        return self._capacity
+
+    @property
+    def size(self) -> int:
+        """The size of all files in the cache directory, as far as known to this process."""
+        with self._lock:
+            return self._get_size()
+
+    def get(self, path: str, etag: str, size: int) -> Optional[bytes]:
+        """
+        Get a chunk.
+
+        :param path: the chunk path
+        :param etag: the current ETag of the chunk's object, or an empty string
+        :param size: the current size of the chunk's object in bytes
+        :return: the chunk, or None if not cached or if the cached chunk is out of date
+        """
+        file_path = self._get_file_path(path)
+        try:
+            with open(file_path, 'rb') as fp:
+                data = fp.read()
+            os.utime(file_path)
+        except OSError:
+            self._misses.inc()
+            return None
+        chunk = self._decode(data, etag, size)
+        if chunk is None:
+            self._misses.inc()
+            return None
+        self._hits.inc()
+        return chunk
+
+    def __contains__(self, path: str) -> bool:
+        """Test whether a chunk is stored for *path*, regardless of whether it is out of date."""
+        return os.path.exists(self._get_file_path(path))
+
+    def put(self, path: str, etag: str, chunk: bytes):
+        """
+        Put a chunk into the cache.
+
+        :param path: the chunk path
+        :param etag: the current ETag of the chunk's object, or an empty string if unknown
+        :param chunk: the chunk
+        """
+        etag_bytes = etag.encode('utf-8')
+        data = self._HEADER.pack(self._MAGIC, len(etag_bytes), len(chunk)) + etag_bytes + chunk
+        if len(data) > self._capacity:
+            return
+        file_path = self._get_file_path(path)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        # Write to a temporary file first, so other processes never read a partially written file
+        temp_path = f'{file_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            with open(temp_path, 'wb') as fp:
+                fp.write(data)
+            os.replace(temp_path, file_path)
+        except OSError:
+            return
+        with self._lock:
+            # An initial scan of the cache directory already includes the new file
+            size = self._get_size() if self._size is None else self._size + len(data)
+            if size > self._capacity:
+                self._trim()
+            else:
+                self._set_size(size)
+
+    def clear(self):
+        """Remove all chunks."""
+        with self._lock:
+            for file_path, _, _ in self._scan():
+                _remove_file(file_path)
+            self._set_size(0)
+
+    def _get_size(self) -> int:
+        if self._size is None:
+            self._set_size(sum(file_size for _, file_size, _ in self._scan()))
+        return self._size
+
+    def _set_size(self, size: int):
+        self._size = size
+        self._size_gauge.set(size)
+
+    def _trim(self):
+        # Other processes may have added or removed files, so scan the directory
+        entries = sorted(self._scan(), key=lambda entry: entry[2])
+        size = sum(file_size for _, file_size, _ in entries)
+        max_size = self._threshold * self._capacity
+        num_evicted = 0
+        for file_path, file_size, _ in entries:
+            if size <= max_size:
+                break
+            if _remove_file(file_path):
+                num_evicted += 1
+            size -= file_size
+        self._set_size(size)
+        if num_evicted:
+            self._evictions.inc(num_evicted)
+
+    def _scan(self) -> List[Tuple[str, int, float]]:
+        entries = []
+        if not os.path.isdir(self._cache_dir):
+            return entries
+        for dir_entry in os.scandir(self._cache_dir):
+            if not dir_entry.is_dir():
+                continue
+            for file_entry in os.scandir(dir_entry.path):
+                if file_entry.name.endswith('.chunk'):
+                    try:
+                        stat = file_entry.stat()
+                    except OSError:
+                        continue
+                    entries.append((file_entry.path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def _decode(self, data: bytes, etag: str, size: int) -> Optional[bytes]:
+        if len(data) < self._HEADER.size:
+            return None
+        magic, etag_size, chunk_size = self._HEADER.unpack_from(data, 0)
+        offset = self._HEADER.size + etag_size
+        if magic != self._MAGIC \
+                or chunk_size != size \
+                or len(data) != offset + chunk_size \
+                or (etag_size and data[self._HEADER.size: offset] != etag.encode('utf-8')):
+            return None
+        return data[offset:]
+
+    def _get_file_path(self, path: str) -> str:
+        name = hashlib.sha256(path.encode('utf-8')).hexdigest()
+        return os.path.join(self._cache_dir, name[:2], name + '.chunk')
+
+
+def _remove_file(file_path: str) -> bool:
+    try:
+        os.remove(file_path)
+        return True
+    except OSError:
+        return False
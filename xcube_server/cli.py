@@ -23,7 +23,8 @@ import click
 
 from xcube_server import __version__, __description__
 from xcube_server.defaults import DEFAULT_PORT, DEFAULT_NAME, DEFAULT_ADDRESS, DEFAULT_UPDATE_PERIOD, \
-    DEFAULT_CONFIG_FILE, DEFAULT_TILE_CACHE_SIZE, DEFAULT_TILE_COMP_MODE
+    DEFAULT_CONFIG_FILE, DEFAULT_TILE_CACHE_SIZE, DEFAULT_TILE_COMP_MODE, DEFAULT_NUM_WORKERS, \
+    DEFAULT_FILE_TILE_CACHE_SIZE, DEFAULT_CHUNK_CACHE_SIZE, DISK_CHUNK_CACHE_PATH
 
 __author__ = "Norman Fomferra (Brockmann Consult GmbH)"
 
@@ -46,9 +47,32 @@ __author__ = "Norman Fomferra (Brockmann Consult GmbH)"
                    f'Defaults to {DEFAULT_CONFIG_FILE!r}.')
 @click.option('--tilecache', metavar='SIZE', default=DEFAULT_TILE_CACHE_SIZE,
               help=f'In-memory tile cache size in bytes. '
+                   f'Multiple worker processes share the in-memory tile cache. '
                    f'Unit suffixes {"K"!r}, {"M"!r}, {"G"!r} may be used. '
                    f'Defaults to {DEFAULT_TILE_CACHE_SIZE!r}. '
                    f'The special value {"OFF"!r} disables tile caching.')
+@click.option('--filetilecache', metavar='SIZE', default=None,
+              help=f'Size in bytes of the file tile cache shared by all worker processes. '
+                   f'Unit suffixes {"K"!r}, {"M"!r}, {"G"!r} may be used. '
+                   f'Defaults to {"OFF"!r} for a single process and to {DEFAULT_FILE_TILE_CACHE_SIZE!r} '
+                   f'for multiple worker processes.')
+@click.option('--chunkcache', metavar='SIZE', default=DEFAULT_CHUNK_CACHE_SIZE,
+              help=f'Size in bytes of the in-memory cache for chunks of remote datasets, shared by all datasets. '
+                   f'Unit suffixes {"K"!r}, {"M"!r}, {"G"!r} may be used. '
+                   f'Defaults to {DEFAULT_CHUNK_CACHE_SIZE!r}. '
+                   f'The special value {"OFF"!r} disables chunk caching.')
+@click.option('--diskchunkcache', metavar='SIZE', default=None,
+              help=f'Size in bytes of the persistent disk cache for chunks of remote datasets. '
+                   f'Unit suffixes {"K"!r}, {"M"!r}, {"G"!r} may be used. '
+                   f'By default, chunks are not cached on disk.')
+@click.option('--diskchunkcachedir', metavar='DIR', default=None,
+              help='Directory of the disk chunk cache. '
+                   f'Defaults to {DISK_CHUNK_CACHE_PATH!r}.')
+@click.option('--workers', '-w', metavar='NUM', default=DEFAULT_NUM_WORKERS, type=int,
+              help='Number of worker processes serving requests on the same port. '
+                   'Zero or a negative value will start one worker process per CPU. '
+                   'Sending SIGHUP to the service will reload the configuration in all worker processes. '
+                   f'Defaults to {DEFAULT_NUM_WORKERS!r}.')
 @click.option('--tilemode', metavar='MODE', default=None, type=int,
               help='Tile computation mode. '
                    'This is an internal option used to switch between different tile computation implementations. '
@@ -63,6 +87,11 @@ def run_server(name: str,
                update: float,
                config: str,
                tilecache: str,
+               filetilecache: str,
+               chunkcache: str,
+               diskchunkcache: str,
+               diskchunkcachedir: str,
+               workers: int,
                tilemode: int,
                verbose: bool,
                traceperf: bool):
@@ -81,7 +110,12 @@ def run_server(name: str,
                           address=address,
                           config_file=config,
                           tile_cache_size=tilecache,
+                          file_tile_cache_size=filetilecache,
+                          chunk_cache_size=chunkcache,
+                          disk_chunk_cache_size=diskchunkcache,
+                          disk_chunk_cache_dir=diskchunkcachedir,
                           tile_comp_mode=tilemode,
+                          num_workers=workers,
                           update_period=update,
                           log_to_stderr=verbose,
                           trace_perf=traceperf)
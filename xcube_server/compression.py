@@ -0,0 +1,209 @@
+# The MIT License (MIT)
+# Copyright (c) 2018 by the xcube development team and contributors
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies
+# of the Software, and to permit persons to whom the Software is furnished to do
+# so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import zlib
+from typing import Optional, Tuple, List
+
+from tornado import httputil
+from tornado.web import OutputTransform
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+GZIP = 'gzip'
+BROTLI = 'br'
+
+# Content types that are compressed, in addition to all "text/*" types.
+# Images such as PNG and JPEG are already compressed and are sent as they are.
+COMPRESSIBLE_CONTENT_TYPES = {
+    'application/json',
+    'application/x-ndjson',
+    'application/xml',
+    'application/javascript',
+    'image/svg+xml',
+}
+
+# Compression levels used for responses computed per request, fast rather than small
+_GZIP_LEVEL = 6
+_BROTLI_QUALITY = 4
+
+
+def get_content_encodings() -> List[str]:
+    """
+    Get the supported content encodings, in order of preference.
+    Brotli is supported only if the "brotli" package is installed.
+
+    :return: list of content encodings
+    """
+    return [BROTLI, GZIP] if brotli is not None else [GZIP]
+
+
+def select_content_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """
+    Select a content encoding given the value of a request's "Accept-Encoding" header.
+
+    :param accept_encoding: value of the "Accept-Encoding" header, may be None
+    :return: the preferred supported content encoding accepted by the client, or None
+    """
+    if not accept_encoding:
+        return None
+    accepted = dict()
+    for item in accept_encoding.split(','):
+        coding, _, params = item.strip().partition(';')
+        coding = coding.strip().lower()
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[coding] = quality
+    best_encoding = None
+    best_quality = 0.0
+    for encoding in get_content_encodings():
+        quality = accepted.get(encoding, accepted.get('*', 0.0))
+        if quality > best_quality:
+            best_encoding = encoding
+            best_quality = quality
+    return best_encoding
+
+
+def is_compressible_content_type(content_type: Optional[str]) -> bool:
+    """
+    Test whether responses of the given content type should be compressed.
+
+    :param content_type: value of a response's "Content-Type" header, may be None
+    :return: True, if the content should be compressed
+    """
+    if not content_type:
+        return False
+    content_type = content_type.split(';')[0].strip().lower()
+    return content_type.startswith('text/') or content_type in COMPRESSIBLE_CONTENT_TYPES
+
+
+def compress(data: bytes, encoding: str, level: int = None) -> bytes:
+    """
+    Compress *data* at once.
+
+    :param data: the data
+    :param encoding: the content encoding, see :func:`get_content_encodings`
+    :param level: optional compression level, defaults to the encoding's maximum level
+    :return: the compressed data
+    """
+    compressor = Compressor(encoding, level=level if level is not None else _get_max_level(encoding))
+    return compressor.compress(data, True)
+
+
+class Compressor:
+    """
+    Incrementally compresses the chunks of a response body.
+
+    :param encoding: the content encoding, see :func:`get_content_encodings`
+    :param level: optional compression level
+    """
+
+    def __init__(self, encoding: str, level: int = None):
+        if encoding == GZIP:
+            # wbits = 16 + MAX_WBITS produces a gzip header and trailer
+            self._compressobj = zlib.compressobj(level if level is not None else _GZIP_LEVEL,
+                                                 zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            self._brotli_compressor = None
+        elif encoding == BROTLI and brotli is not None:
+            self._compressobj = None
+            self._brotli_compressor = brotli.Compressor(quality=level if level is not None else _BROTLI_QUALITY)
+        else:
+            raise ValueError(f'unsupported content encoding {encoding!r}')
+
+    def compress(self, chunk: bytes, finishing: bool) -> bytes:
+        """
+        Compress the next *chunk*. Unless *finishing*, the compressed data is flushed,
+        so clients can decompress all chunks received so far.
+
+        :param chunk: the next chunk
+        :param finishing: whether this is the last chunk
+        :return: the compressed chunk
+        """
+        if self._compressobj is not None:
+            data = self._compressobj.compress(chunk)
+            return data + self._compressobj.flush(zlib.Z_FINISH if finishing else zlib.Z_SYNC_FLUSH)
+        data = self._brotli_compressor.process(chunk)
+        return data + (self._brotli_compressor.finish() if finishing else self._brotli_compressor.flush())
+
+
+class ContentEncoding(OutputTransform):
+    """
+    Compresses responses using the content encoding preferred by the client.
+    Only responses of a compressible content type are compressed, see :func:`is_compressible_content_type`.
+    Responses that already have a "Content-Encoding" header, such as pre-compressed documents, are
+    sent as they are.
+
+    Similar to Tornado's ``GZipContentEncoding`` which is used if the application setting
+    "compress_response" is true, but supports Brotli compression and streamed NDJSON responses.
+    """
+
+    # Responses that are too short are unlikely to benefit from compression
+    MIN_LENGTH = 1024
+
+    def __init__(self, request: httputil.HTTPServerRequest):
+        super().__init__(request)
+        self._encoding = select_content_encoding(request.headers.get('Accept-Encoding'))
+        self._compressor = None
+
+    def transform_first_chunk(self,
+                              status_code: int,
+                              headers: httputil.HTTPHeaders,
+                              chunk: bytes,
+                              finishing: bool) -> Tuple[int, httputil.HTTPHeaders, bytes]:
+        if not is_compressible_content_type(headers.get('Content-Type')):
+            return status_code, headers, chunk
+        vary = headers.get('Vary')
+        if not vary:
+            headers['Vary'] = 'Accept-Encoding'
+        elif 'accept-encoding' not in vary.lower():
+            headers['Vary'] = vary + ', Accept-Encoding'
+        if self._encoding \
+                and 'Content-Encoding' not in headers \
+                and (not finishing or len(chunk) >= self.MIN_LENGTH):
+            self._compressor = Compressor(self._encoding)
+            headers['Content-Encoding'] = self._encoding
+            chunk = self.transform_chunk(chunk, finishing)
+            if 'Content-Length' in headers:
+                if finishing:
+                    headers['Content-Length'] = str(len(chunk))
+                else:
+                    del headers['Content-Length']
+        return status_code, headers, chunk
+
+    def transform_chunk(self, chunk: bytes, finishing: bool) -> bytes:
+        if self._compressor is not None:
+            chunk = self._compressor.compress(chunk, finishing)
+        return chunk
+
+
+def _get_max_level(encoding: str) -> Optional[int]:
+    if encoding == GZIP:
+        return 9
+    if encoding == BROTLI:
+        return 11
+    return None
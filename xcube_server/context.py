@@ -19,37 +19,56 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import collections
 import glob
+import hashlib
+import json
 import logging
 import os
 import threading
 import time
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
 
-import fiona
 import numpy as np
 import pandas as pd
 import s3fs
+import shapely.geometry
 import xarray as xr
-import zarr
 
 from xcube_server.im import TileGrid
 from . import __version__
-from .cache import MemoryCacheStore, Cache, FileCacheStore
+from .cache import MemoryCacheStore, Cache, FileCacheStore, CacheStore, NdarrayFileCacheStore
+from .chunkcache import ChunkCache, DiskChunkCache
 from .defaults import DEFAULT_CMAP_CBAR, DEFAULT_CMAP_VMIN, \
     DEFAULT_CMAP_VMAX, FILE_TILE_CACHE_PATH, \
-    API_PREFIX, DEFAULT_NAME, DEFAULT_TRACE_PERF
+    API_PREFIX, DEFAULT_NAME, DEFAULT_TRACE_PERF, MEM_MASK_CACHE_CAPACITY, PLACE_CACHE_PATH, DEFAULT_EXECUTORS, \
+    DEFAULT_EXECUTOR_RETRY_AFTER, OBS_MAX_CONCURRENCY, DISK_CHUNK_CACHE_PATH, RAW_CACHE_PATH, \
+    MEM_MATERIALIZATION_CACHE_CAPACITY, DISK_MATERIALIZATION_CACHE_CAPACITY, MATERIALIZATION_CACHE_PATH, \
+    MAX_DOCUMENT_VARIANTS, DATASET_CONTENT_CHECK_INTERVAL
 from .errors import ServiceConfigError, ServiceError, ServiceBadRequestError, ServiceResourceNotFoundError
+from .executors import WorkloadExecutor, new_executor, new_dask_client
+from .metrics import REGISTRY
+from .mmapds import open_mmap_dataset, get_modification_time
+from .obsstore import ObjectStorageStore
 from .mldataset import FileStorageMultiLevelDataset, BaseMultiLevelDataset, MultiLevelDataset, \
-    ComputedMultiLevelDataset, ObjectStorageMultiLevelDataset
+    ComputedMultiLevelDataset, ObjectStorageMultiLevelDataset, get_storage_chunks
 from .perf import measure_time
+from .placestore import PlaceStore
 from .reqparams import RequestParams
+from .utils import get_dataset_geometry_mask
 
 COMPUTE_DATASET = 'compute_dataset'
+# Dataset descriptor entries that determine the content of a dataset
+_DATASET_CONTENT_KEYS = ('FileSystem', 'Path', 'Format', 'Access', 'Endpoint', 'Region',
+                         'Function', 'InputDatasets', 'InputParameters')
 ALL_PLACES = "all"
 
 _LOG = logging.getLogger('xcube')
 
+_DATASET_OPEN_SECONDS = REGISTRY.histogram('xcube_dataset_open_seconds',
+                                           'Time spent opening datasets, in seconds',
+                                           ('fs_type',))
+
 Config = Dict[str, Any]
 
 
@@ -63,34 +82,108 @@ class ServiceContext:
                  trace_perf: bool = DEFAULT_TRACE_PERF,
                  tile_comp_mode: int = None,
                  mem_tile_cache_capacity: int = None,
-                 file_tile_cache_capacity: int = None):
+                 mem_tile_cache_store: CacheStore = None,
+                 file_tile_cache_capacity: int = None,
+                 file_tile_cache_dir: str = None,
+                 mem_mask_cache_capacity: int = MEM_MASK_CACHE_CAPACITY,
+                 chunk_cache_capacity: int = None,
+                 disk_chunk_cache_capacity: int = None,
+                 disk_chunk_cache_dir: str = None,
+                 place_cache_dir: str = None,
+                 raw_cache_dir: str = None,
+                 mem_materialization_cache_capacity: int = MEM_MATERIALIZATION_CACHE_CAPACITY,
+                 disk_materialization_cache_capacity: int = DISK_MATERIALIZATION_CACHE_CAPACITY,
+                 materialization_cache_dir: str = None,
+                 dataset_content_check_interval: float = DATASET_CONTENT_CHECK_INTERVAL):
         self._name = name
         self.base_dir = os.path.abspath(base_dir or '')
         self._config = config if config is not None else dict()
-        self._place_group_cache = dict()
+        self._place_group_descriptors = dict()
+        # Place stores may convert whole feature collection files when they are synced,
+        # so place groups are guarded by their own lock rather than by the context's lock
+        self._place_groups_lock = threading.RLock()
+        self._place_cache_dir = place_cache_dir or os.path.join(PLACE_CACHE_PATH, 'v%s' % __version__, 'places')
+        self._raw_cache_dir = raw_cache_dir or RAW_CACHE_PATH
         self._feature_index = 0
         self._tile_comp_mode = tile_comp_mode
         self._trace_perf = trace_perf
         self._lock = threading.RLock()
 
         self.dataset_cache = dict()  # contains tuples of form (MultiLevelDataset, ds_descriptor)
+        # maps dataset identifiers to the locks held while opening the datasets, which may take long,
+        # e.g. if a dataset is converted for memory-mapped access
+        self._dataset_open_locks = dict()
+        # maps the identifiers of opened materialized datasets to tuples of form (content key, time of last check)
+        self._dataset_content_keys = dict()
+        self._dataset_content_check_interval = dataset_content_check_interval
+        # maps (ds_id, fragment_id) to the most recently used variants of a fragment,
+        # which are tuples of form (ds_descriptor, dataset entry, dependencies, fragment)
+        self._dataset_fragment_cache = dict()
+        # maps document_id to the most recently used variants of a document,
+        # which are tuples of form (dependencies, fragments, document)
+        self._document_cache = dict()
+        # contains tuples of form (executor settings, executor)
+        self._executors = dict()
+        self._executors_lock = threading.Lock()
+        # tuple of form (dask cluster settings, dask client), if a dask cluster has been started
+        self._dask_client = None
+        self._dask_client_lock = threading.Lock()
         # TODO by forman: move pyramid_cache, mem_tile_cache, rgb_tile_cache into dataset_cache values
         self.image_cache = dict()
 
+        if file_tile_cache_capacity and file_tile_cache_capacity > 0:
+            tile_cache_dir = file_tile_cache_dir or os.path.join(FILE_TILE_CACHE_PATH, 'v%s' % __version__, 'tiles')
+            # Worker processes share the cache directory, so its size is limited by the store,
+            # which scans the directory, rather than by the tiles known to this process only.
+            self.rgb_tile_cache = Cache(FileCacheStore(tile_cache_dir, ".png", capacity=file_tile_cache_capacity),
+                                        capacity=file_tile_cache_capacity,
+                                        threshold=0.75,
+                                        name='file_tile')
+        else:
+            self.rgb_tile_cache = None
+
         if mem_tile_cache_capacity and mem_tile_cache_capacity > 0:
-            self.mem_tile_cache = Cache(MemoryCacheStore(),
+            # If there is a file tile cache, tiles are written through to it,
+            # so that worker processes sharing the cache directory can reuse them.
+            self.mem_tile_cache = Cache(mem_tile_cache_store or MemoryCacheStore(),
                                         capacity=mem_tile_cache_capacity,
-                                        threshold=0.75)
+                                        threshold=0.75,
+                                        parent_cache=self.rgb_tile_cache,
+                                        write_through=self.rgb_tile_cache is not None,
+                                        name='mem_tile')
         else:
             self.mem_tile_cache = None
 
-        if file_tile_cache_capacity and file_tile_cache_capacity > 0:
-            tile_cache_dir = os.path.join(FILE_TILE_CACHE_PATH, 'v%s' % __version__, 'tiles')
-            self.rgb_tile_cache = Cache(FileCacheStore(tile_cache_dir, ".png"),
-                                        capacity=file_tile_cache_capacity,
-                                        threshold=0.75)
+        if mem_mask_cache_capacity and mem_mask_cache_capacity > 0:
+            self.mask_cache = Cache(MemoryCacheStore(),
+                                    capacity=mem_mask_cache_capacity,
+                                    threshold=0.75,
+                                    name='mask')
         else:
-            self.rgb_tile_cache = None
+            self.mask_cache = None
+
+        # Shared by all computed datasets whose "Materialize" entry is "memory" or "disk"
+        self.materialization_caches = dict(
+            memory=Cache(MemoryCacheStore(),
+                         capacity=mem_materialization_cache_capacity,
+                         threshold=0.75,
+                         name='mem_materialization'),
+            # The store limits the size of the cache directory, which includes chunks stored under the keys
+            # of previous contents of datasets, and chunks stored by other processes.
+            disk=Cache(NdarrayFileCacheStore(materialization_cache_dir or MATERIALIZATION_CACHE_PATH,
+                                             capacity=disk_materialization_cache_capacity),
+                       capacity=disk_materialization_cache_capacity,
+                       threshold=0.75,
+                       name='disk_materialization'),
+        )
+
+        # Shared by the zarr stores of all remote datasets
+        self.chunk_cache = ChunkCache(chunk_cache_capacity) if chunk_cache_capacity else None
+        if disk_chunk_cache_capacity and disk_chunk_cache_capacity > 0:
+            self.disk_chunk_cache = DiskChunkCache(disk_chunk_cache_dir or DISK_CHUNK_CACHE_PATH,
+                                                   disk_chunk_cache_capacity)
+        else:
+            self.disk_chunk_cache = None
 
     @property
     def config(self) -> Config:
@@ -108,23 +201,75 @@ class ServiceContext:
                 for ml_dataset, _ in self.dataset_cache.values():
                     ml_dataset.close()
                 self.dataset_cache.clear()
+                self._dataset_content_keys.clear()
+                if self.chunk_cache is not None:
+                    self.chunk_cache.clear()
 
             if new_dataset_descriptors and old_dataset_descriptors:
-                ds_names = list(self.dataset_cache.keys())
-                for ds_name in ds_names:
+                removed_ds_names = set()
+                for ds_name in self.dataset_cache.keys():
                     dataset_descriptor = self.find_dataset_descriptor(new_dataset_descriptors, ds_name)
                     if dataset_descriptor is None:
-                        ml_dataset, _ = self.dataset_cache[ds_name]
-                        ml_dataset.close()
-                        del self.dataset_cache[ds_name]
+                        removed_ds_names.add(ds_name)
+                clean_image_caches = self._close_datasets(removed_ds_names)
+
+            new_ds_names = {dataset_descriptor.get('Identifier')
+                            for dataset_descriptor in (new_dataset_descriptors or [])}
+            for fragment_key in list(self._dataset_fragment_cache.keys()):
+                if fragment_key[0] not in new_ds_names:
+                    del self._dataset_fragment_cache[fragment_key]
 
             if clean_image_caches:
-                self.image_cache.clear()
-                if self.rgb_tile_cache is not None:
-                    self.rgb_tile_cache.clear()
+                self._clear_image_caches()
 
         self._config = config
 
+    def _close_datasets(self, ds_ids: Set[str]) -> bool:
+        """
+        Close the datasets *ds_ids* and all opened datasets computed from them, so that they are reopened
+        on next access.
+
+        :param ds_ids: the dataset identifiers
+        :return: True, if datasets computed from datasets *ds_ids* have been closed
+        """
+        ds_ids = set(ds_ids)
+        closed_dependent_datasets = False
+        closed_dataset_entries = []
+        # Only the bookkeeping is done under the lock, closing the datasets themselves may take long
+        with self._lock:
+            # Computed datasets can no longer be computed from closed input datasets
+            while True:
+                dependent_ds_ids = set()
+                for ds_id, (_, dataset_descriptor) in self.dataset_cache.items():
+                    input_ds_ids = dataset_descriptor.get('InputDatasets') or []
+                    if ds_id not in ds_ids and ds_ids.intersection(input_ds_ids):
+                        dependent_ds_ids.add(ds_id)
+                if not dependent_ds_ids:
+                    break
+                ds_ids.update(dependent_ds_ids)
+                closed_dependent_datasets = True
+            for ds_id in ds_ids:
+                self._dataset_content_keys.pop(ds_id, None)
+                dataset_entry = self.dataset_cache.pop(ds_id, None)
+                if dataset_entry is not None:
+                    closed_dataset_entries.append((ds_id, dataset_entry))
+        for ds_id, (ml_dataset, _) in closed_dataset_entries:
+            ml_dataset.close()
+            if self.chunk_cache is not None:
+                self.chunk_cache.remove_dataset(ds_id)
+        return closed_dependent_datasets
+
+    def _clear_image_caches(self):
+        self.image_cache.clear()
+        if self.tile_cache is not None:
+            # Also clears the file tile cache, if it is the parent of the in-memory tile cache
+            self.tile_cache.clear()
+
+    @property
+    def tile_cache(self) -> Optional[Cache]:
+        """The cache for encoded tiles: the in-memory tile cache if any, otherwise the file tile cache, if any."""
+        return self.mem_tile_cache if self.mem_tile_cache is not None else self.rgb_tile_cache
+
     @property
     def tile_comp_mode(self) -> int:
         return self._tile_comp_mode
@@ -133,6 +278,15 @@ class ServiceContext:
     def trace_perf(self) -> bool:
         return self._trace_perf
 
+    @property
+    def tracing_enabled(self) -> bool:
+        """
+        Whether clients may request traces using the query parameter "debug" and read recent traces.
+        This is the case if performance tracing is enabled, or if the configuration's "Tracing" entry
+        has "AllowDebug" set.
+        """
+        return self._trace_perf or bool((self._config.get('Tracing') or {}).get('AllowDebug', False))
+
     def get_service_url(self, base_url, *path: str):
         return base_url + '/' + self._name + API_PREFIX + '/' + '/'.join(path)
 
@@ -172,6 +326,17 @@ class ServiceContext:
             raise ServiceResourceNotFoundError(f'Dataset "{ds_id}" not found')
         return dataset_descriptor
 
+    def is_remote_dataset(self, ds_id: str) -> bool:
+        """
+        Test whether dataset *ds_id* is read from object storage or is computed from such a dataset.
+
+        :param ds_id: the dataset identifier
+        :return: True, if the dataset is remote
+        """
+        ds_ids = {ds_id}.union(self._get_input_dataset_ids(ds_id))
+        return any(self.get_dataset_descriptor(other_ds_id).get('FileSystem', 'local') == 'obs'
+                   for other_ds_id in ds_ids)
+
     def get_tile_grid(self, ds_id: str) -> TileGrid:
         ml_dataset, _ = self._get_dataset_entry(ds_id)
         return ml_dataset.tile_grid
@@ -199,10 +364,83 @@ class ServiceContext:
         return DEFAULT_CMAP_CBAR, DEFAULT_CMAP_VMIN, DEFAULT_CMAP_VMAX
 
     def _get_dataset_entry(self, ds_id: str) -> Tuple[MultiLevelDataset, Dict[str, Any]]:
-        if ds_id not in self.dataset_cache:
-            with self._lock:
-                self.dataset_cache[ds_id] = self._create_dataset_entry(ds_id)
-        return self.dataset_cache[ds_id]
+        if ds_id in self._dataset_content_keys and self._has_dataset_content_changed(ds_id):
+            _LOG.info(f'content of dataset {ds_id!r} has changed, reopening it')
+            # Input datasets may have changed too, e.g. if their files have been modified
+            self._close_datasets({ds_id}.union(self._get_input_dataset_ids(ds_id)))
+            self._clear_image_caches()
+        # Datasets may be closed concurrently, so the cache is looked up only once
+        dataset_entry = self.dataset_cache.get(ds_id)
+        if dataset_entry is None:
+            # Only requests for the same dataset wait for it to be opened
+            with self._get_dataset_open_lock(ds_id):
+                dataset_entry = self.dataset_cache.get(ds_id)
+                if dataset_entry is None:
+                    dataset_entry = self._create_dataset_entry(ds_id)
+                    with self._lock:
+                        self.dataset_cache[ds_id] = dataset_entry
+                    self._submit_place_group_mask_precomputation(ds_id, dataset_entry[0])
+        return dataset_entry
+
+    def _get_dataset_open_lock(self, ds_id: str) -> threading.RLock:
+        with self._lock:
+            dataset_open_lock = self._dataset_open_locks.get(ds_id)
+            if dataset_open_lock is None:
+                dataset_open_lock = threading.RLock()
+                self._dataset_open_locks[ds_id] = dataset_open_lock
+            return dataset_open_lock
+
+    def _has_dataset_content_changed(self, ds_id: str) -> bool:
+        content_key_entry = self._dataset_content_keys.get(ds_id)
+        if content_key_entry is None:
+            return False
+        content_key, checked_at = content_key_entry
+        now = time.monotonic()
+        if now - checked_at < self._dataset_content_check_interval:
+            return False
+        # Record the check first, so that concurrent requests do not check too
+        self._dataset_content_keys[ds_id] = content_key, now
+        try:
+            return self.get_dataset_content_key(ds_id) != content_key
+        except Exception as e:
+            _LOG.warning(f'failed to check whether content of dataset {ds_id!r} has changed: {e}')
+            return False
+
+    def _get_input_dataset_ids(self, ds_id: str) -> Set[str]:
+        input_ds_ids = set()
+        ds_ids = [ds_id]
+        while ds_ids:
+            dataset_descriptor = self.find_dataset_descriptor(self.config.get('Datasets') or [], ds_ids.pop())
+            for input_ds_id in (dataset_descriptor or {}).get('InputDatasets') or []:
+                if input_ds_id not in input_ds_ids:
+                    input_ds_ids.add(input_ds_id)
+                    ds_ids.append(input_ds_id)
+        return input_ds_ids
+
+    def _submit_place_group_mask_precomputation(self, ds_id: str, ml_dataset: MultiLevelDataset):
+        if self.mask_cache is None or not self.get_dataset_descriptor(ds_id).get("PlaceGroups"):
+            return
+        try:
+            self.get_executor('places').submit(self._precompute_place_group_masks, ds_id, ml_dataset)
+        except ServiceError as e:
+            _LOG.warning(f'failed to precompute place group masks for dataset {ds_id!r}: {e}')
+
+    def _precompute_place_group_masks(self, ds_id: str, ml_dataset: MultiLevelDataset):
+        """Rasterize the features of the place groups of dataset *ds_id* into the mask cache."""
+        try:
+            with measure_time(tag=f"precomputed place group masks for dataset {ds_id!r}"):
+                dataset = ml_dataset.get_dataset(0)
+                for place_store in self.get_dataset_place_group_stores(ds_id):
+                    # Features are read one by one, they are not kept in memory
+                    for feature in place_store.read_features():
+                        geometry = feature.get("geometry")
+                        if not geometry or geometry.get("type") == "Point":
+                            continue
+                        get_dataset_geometry_mask(dataset,
+                                                  shapely.geometry.shape(geometry),
+                                                  mask_cache=self.mask_cache)
+        except Exception as e:
+            _LOG.warning(f'failed to precompute place group masks for dataset {ds_id!r}: {e}')
 
     def _create_dataset_entry(self, ds_id: str) -> Tuple[MultiLevelDataset, Dict[str, Any]]:
 
@@ -217,21 +455,20 @@ class ServiceContext:
         fs_type = dataset_descriptor.get('FileSystem', 'local')
         if fs_type == 'obs':
             data_format = dataset_descriptor.get('Format', 'zarr')
-            s3_client_kwargs = {}
-            if 'Endpoint' in dataset_descriptor:
-                s3_client_kwargs['endpoint_url'] = dataset_descriptor['Endpoint']
-            if 'Region' in dataset_descriptor:
-                s3_client_kwargs['region_name'] = dataset_descriptor['Region']
-            obs_file_system = s3fs.S3FileSystem(anon=True, client_kwargs=s3_client_kwargs)
+            obs_file_system = self._get_obs_file_system(dataset_descriptor)
             if data_format == 'zarr':
-                store = s3fs.S3Map(root=path, s3=obs_file_system, check=False)
-                cached_store = zarr.LRUStoreCache(store, max_size=2 ** 28)
+                store = ObjectStorageStore(obs_file_system, path,
+                                           chunk_cache=self.chunk_cache,
+                                           disk_chunk_cache=self.disk_chunk_cache,
+                                           dataset_id=ds_id)
                 with measure_time(tag=f"opened remote zarr dataset {path}"):
-                    ds = xr.open_zarr(cached_store)
+                    ds = xr.open_zarr(store)
                 ml_dataset = BaseMultiLevelDataset(ds)
             elif data_format == 'levels':
                 with measure_time(tag=f"opened remote levels dataset {path}"):
                     ml_dataset = ObjectStorageMultiLevelDataset(ds_id, obs_file_system, path,
+                                                                chunk_cache=self.chunk_cache,
+                                                                disk_chunk_cache=self.disk_chunk_cache,
                                                                 exception_type=ServiceConfigError)
             else:
                 raise ServiceConfigError(f"Invalid format={data_format!r} in dataset descriptor {ds_id!r}")
@@ -240,9 +477,24 @@ class ServiceContext:
                 path = os.path.join(self.base_dir, path)
 
             data_format = dataset_descriptor.get('Format', 'nc')
-            if data_format == 'nc':
+            access_mode = dataset_descriptor.get('Access', 'lazy')
+            if access_mode not in ('lazy', 'mmap'):
+                raise ServiceConfigError(f"Invalid access={access_mode!r} in dataset descriptor {ds_id!r}")
+            if access_mode == 'mmap' and data_format not in ('nc', 'zarr'):
+                raise ServiceConfigError(f"Invalid access={access_mode!r} for format={data_format!r}"
+                                         f" in dataset descriptor {ds_id!r}")
+
+            if access_mode == 'mmap':
+                with measure_time(tag=f"opened memory-mapped local dataset {path}"):
+                    ds = open_mmap_dataset(path, data_format=data_format, raw_cache_dir=self._raw_cache_dir)
+                    ml_dataset = BaseMultiLevelDataset(ds)
+            elif data_format == 'nc':
                 with measure_time(tag=f"opened local NetCDF dataset {path}"):
                     ds = xr.open_dataset(path)
+                    storage_chunks = get_storage_chunks(ds)
+                    if storage_chunks:
+                        # Align dask chunks with the NetCDF chunks, so that the tile grid is aligned with both
+                        ds = ds.chunk(storage_chunks)
                     ml_dataset = BaseMultiLevelDataset(ds)
             elif data_format == 'zarr':
                 with measure_time(tag=f"opened local zarr dataset {path}"):
@@ -267,6 +519,14 @@ class ServiceContext:
                                              f"Input dataset {input_dataset_id!r} of callable {callable_name!r} "
                                              f"must reference another dataset")
 
+            materialize = dataset_descriptor.get('Materialize')
+            if materialize is not None and materialize not in self.materialization_caches:
+                raise ServiceConfigError(f"Invalid materialize={materialize!r} in dataset descriptor {ds_id!r}")
+            materialization_cache = self.materialization_caches[materialize] if materialize else None
+            materialization_key = self.get_dataset_content_key(ds_id) if materialize else None
+            if materialization_key is not None:
+                self._dataset_content_keys[ds_id] = materialization_key, time.monotonic()
+
             with measure_time(tag=f"opened memory dataset {path}"):
                 ml_dataset = ComputedMultiLevelDataset(ds_id,
                                                        path,
@@ -274,6 +534,8 @@ class ServiceContext:
                                                        input_dataset_ids,
                                                        self.get_ml_dataset,
                                                        input_parameters,
+                                                       materialization_cache=materialization_cache,
+                                                       materialization_key=materialization_key,
                                                        exception_type=ServiceConfigError)
 
         else:
@@ -281,11 +543,215 @@ class ServiceContext:
 
         t2 = time.perf_counter()
 
+        _DATASET_OPEN_SECONDS.labels(fs_type).observe(t2 - t1)
+
         if self.config.get("trace_perf", False):
             _LOG.info(f'Opening {ds_id!r} took {t2 - t1} seconds')
 
         return ml_dataset, dataset_descriptor
 
+    def _get_obs_file_system(self, dataset_descriptor: Dict[str, Any]) -> s3fs.S3FileSystem:
+        s3_client_kwargs = {}
+        if 'Endpoint' in dataset_descriptor:
+            s3_client_kwargs['endpoint_url'] = dataset_descriptor['Endpoint']
+        if 'Region' in dataset_descriptor:
+            s3_client_kwargs['region_name'] = dataset_descriptor['Region']
+        return s3fs.S3FileSystem(anon=True,
+                                 client_kwargs=s3_client_kwargs,
+                                 config_kwargs=dict(max_pool_connections=OBS_MAX_CONCURRENCY))
+
+    def get_dataset_content_key(self, ds_id: str) -> str:
+        """
+        Get a key that identifies the content of dataset *ds_id*. It changes if the entries of the dataset
+        descriptor that determine its content change, if local files of the dataset are modified, if the
+        metadata object of a remote zarr dataset is replaced, or if the key of an input dataset changes.
+        Hence it also covers the input parameters and the script of computed datasets.
+
+        :param ds_id: the dataset identifier
+        :return: a hexadecimal digest
+        """
+        return hashlib.sha256(json.dumps(self._get_dataset_identity(ds_id),
+                                         sort_keys=True, default=str).encode('utf-8')).hexdigest()[:32]
+
+    def _get_dataset_identity(self, ds_id: str, input_ds_ids: Tuple[str, ...] = ()) -> Dict[str, Any]:
+        if ds_id in input_ds_ids:
+            raise ServiceConfigError(f"Invalid dataset descriptor {ds_id!r}: dataset depends on itself")
+        dataset_descriptor = self.get_dataset_descriptor(ds_id)
+        identity = {key: dataset_descriptor[key] for key in _DATASET_CONTENT_KEYS if key in dataset_descriptor}
+        path = dataset_descriptor.get('Path')
+        fs_type = dataset_descriptor.get('FileSystem', 'local')
+        if path and fs_type in ('local', 'memory'):
+            path = os.path.join(self.base_dir, path)
+            if os.path.exists(path):
+                identity['Modified'] = get_modification_time(path)
+        elif path and fs_type == 'obs':
+            identity['ETag'] = self._get_obs_dataset_etag(dataset_descriptor)
+        input_ds_ids = input_ds_ids + (ds_id,)
+        identity['InputDatasets'] = [self._get_dataset_identity(input_ds_id, input_ds_ids)
+                                     for input_ds_id in dataset_descriptor.get('InputDatasets') or []]
+        return identity
+
+    def _get_obs_dataset_etag(self, dataset_descriptor: Dict[str, Any]) -> Optional[str]:
+        obs_file_system = self._get_obs_file_system(dataset_descriptor)
+        path = dataset_descriptor['Path']
+        if dataset_descriptor.get('Format', 'zarr') == 'levels':
+            metadata_paths = [f'{path}/0.zarr/.zmetadata', f'{path}/0.link']
+        else:
+            metadata_paths = [f'{path}/.zmetadata']
+        for metadata_path in metadata_paths:
+            # Listings are cached by the file system, but the object may have been replaced meanwhile
+            obs_file_system.invalidate_cache(metadata_path)
+            try:
+                info = obs_file_system.info(metadata_path)
+            except FileNotFoundError:
+                continue
+            return info.get('ETag') or str(info.get('LastModified'))
+        return None
+
+    def get_dataset_fragment(self,
+                             ds_id: str,
+                             fragment_id: str,
+                             fragment_factory: Callable[[], Any],
+                             dependencies: Tuple = (),
+                             variant: str = None,
+                             dataset_descriptor: Dict[str, Any] = None) -> Any:
+        """
+        Get a cached fragment derived from dataset *ds_id*, e.g. a part of a capabilities document.
+        The fragment is recomputed only if the dataset's descriptor has changed, if the dataset
+        has been reopened since the fragment was computed, or if one of the additional *dependencies*
+        is neither identical nor equal to the one the fragment has been computed from.
+
+        Only the ``MAX_DOCUMENT_VARIANTS`` most recently used variants of a fragment are cached.
+
+        :param ds_id: the dataset identifier
+        :param fragment_id: identifies the type of fragment
+        :param fragment_factory: computes the fragment, called without arguments
+        :param dependencies: other objects the fragment is computed from, e.g. configuration entries
+        :param variant: identifies a variant of the fragment, e.g. for a given base URL taken from a request
+        :param dataset_descriptor: the descriptor of dataset *ds_id*, if already known
+        :return: the fragment
+        """
+        if dataset_descriptor is None:
+            dataset_descriptor = self.get_dataset_descriptor(ds_id)
+        fragment_key = (ds_id, fragment_id)
+        with self._lock:
+            cached_value = _get_variant(self._dataset_fragment_cache, fragment_key, variant)
+            if cached_value is not None:
+                old_dataset_descriptor, old_dataset_entry, old_dependencies, fragment = cached_value
+                if old_dataset_descriptor == dataset_descriptor \
+                        and self.dataset_cache.get(ds_id, old_dataset_entry) is old_dataset_entry \
+                        and _equal_dependencies(old_dependencies, dependencies):
+                    return fragment
+        fragment = fragment_factory()
+        with self._lock:
+            _put_variant(self._dataset_fragment_cache, fragment_key, variant,
+                         (dict(dataset_descriptor), self.dataset_cache.get(ds_id), dependencies, fragment))
+        return fragment
+
+    def get_document(self,
+                     document_id: str,
+                     dependencies: Tuple,
+                     document_factory: Callable[[], Any],
+                     variant: str = None,
+                     fragments: Tuple = ()) -> Any:
+        """
+        Get a cached document, e.g. a capabilities document assembled from dataset fragments.
+        The document is recomputed only if one of its *dependencies* is neither identical nor equal
+        to the one it has been computed from, or if one of its *fragments* is not identical to the one
+        it has been computed from.
+
+        Only the ``MAX_DOCUMENT_VARIANTS`` most recently used variants of a document are cached,
+        so that request-dependent variants, e.g. for the base URLs derived from the "Host" header,
+        cannot grow the cache.
+
+        :param document_id: the document identifier
+        :param dependencies: the objects the document is computed from
+        :param document_factory: computes the document, called without arguments
+        :param variant: identifies a variant of the document, e.g. for a given base URL taken from a request
+        :param fragments: the cached fragments the document is assembled from, see :meth:`get_dataset_fragment`.
+            They are compared by identity only, because they may contain values such as arrays that cannot
+            be compared for equality.
+        :return: the document
+        """
+        with self._lock:
+            cached_value = _get_variant(self._document_cache, document_id, variant)
+            if cached_value is not None:
+                old_dependencies, old_fragments, document = cached_value
+                if _equal_dependencies(old_dependencies, dependencies) \
+                        and _identical_fragments(old_fragments, fragments):
+                    return document
+        document = document_factory()
+        with self._lock:
+            _put_variant(self._document_cache, document_id, variant, (dependencies, fragments, document))
+        return document
+
+    def get_executor(self, name: str) -> WorkloadExecutor:
+        """
+        Get the executor for the workload *name*, e.g. "tiles". The executor's settings are taken
+        from the configuration's "Executors" entry, and default to the ones in DEFAULT_EXECUTORS.
+        If the settings have changed, a new executor is created, and the old one is shut down
+        once its pending tasks are done.
+
+        :param name: the workload name
+        :return: the executor
+        :raise ServiceConfigError: if the executor's settings are invalid
+        """
+        default_settings = DEFAULT_EXECUTORS.get(name)
+        if default_settings is None:
+            raise ValueError(f'unknown executor {name!r}')
+        settings = (self._config.get('Executors') or {}).get(name) or {}
+        # Called for every request on the IOLoop thread, so no lock is acquired if the executor exists
+        executor_entry = self._executors.get(name)
+        if executor_entry is not None and executor_entry[0] == settings:
+            return executor_entry[1]
+        old_executor = None
+        with self._executors_lock:
+            if name in self._executors:
+                old_settings, executor = self._executors[name]
+                if old_settings == settings:
+                    return executor
+                old_executor = executor
+            try:
+                executor = new_executor(name, dict(default_settings, **settings),
+                                        default_retry_after=DEFAULT_EXECUTOR_RETRY_AFTER,
+                                        dask_client_getter=self.get_dask_client)
+            except ValueError as e:
+                raise ServiceConfigError(f'Invalid "Executors" entry in configuration: {e}') from e
+            self._executors[name] = (dict(settings), executor)
+        if old_executor is not None:
+            old_executor.shutdown(wait=False)
+        return executor
+
+    def get_dask_client(self):
+        """
+        Get the client of the local dask cluster used by executors whose "DaskScheduler" is "distributed".
+        The cluster is started on first use. Its settings are taken from the configuration's "DaskCluster" entry.
+        If the settings have changed, a new cluster is started, and the old one is shut down.
+
+        :return: a ``distributed.Client``
+        :raise ServiceConfigError: if the cluster's settings are invalid
+        """
+        settings = self._config.get('DaskCluster') or {}
+        # Called for every computation of the "distributed" scheduler, so the current client is read without locking
+        dask_client = self._dask_client
+        if dask_client is not None and dask_client[0] == settings:
+            return dask_client[1]
+        old_client = None
+        with self._dask_client_lock:
+            if self._dask_client is not None:
+                old_settings, client = self._dask_client
+                if old_settings == settings:
+                    return client
+                old_client = client
+            try:
+                client = new_dask_client(settings)
+            except ValueError as e:
+                raise ServiceConfigError(f'Invalid "DaskCluster" entry in configuration: {e}') from e
+            self._dask_client = (dict(settings), client)
+        if old_client is not None:
+            old_client.shutdown()
+        return client
+
     def get_legend_label(self, ds_name: str, var_name: str):
         dataset = self.get_dataset(ds_name)
         if var_name in dataset:
@@ -302,61 +768,140 @@ class ServiceContext:
                                      title=features_config.get("Title")))
         return place_groups
 
-    def get_dataset_place_groups(self, ds_id: str) -> List[Dict]:
-        dataset_descriptor = self.get_dataset_descriptor(ds_id)
+    def get_dataset_place_groups(self, ds_id: str, dataset_descriptor: Dict[str, Any] = None) -> List[Dict]:
+        with self._place_groups_lock:
+            return [self._get_place_group(place_group_descriptor)
+                    for place_group_descriptor in self._get_dataset_place_group_descriptors(ds_id,
+                                                                                            dataset_descriptor)]
+
+    def get_dataset_place_group_stores(self, ds_id: str) -> List[PlaceStore]:
+        """
+        Get the opened stores of the features of the place groups of dataset *ds_id*.
+        In contrast to :meth:`get_dataset_place_groups`, features are not read from disk.
+
+        :param ds_id: the dataset identifier
+        :return: the list of place stores, one for each feature collection file
+        """
+        with self._place_groups_lock:
+            place_stores = []
+            for place_group_descriptor in self._get_dataset_place_group_descriptors(ds_id):
+                place_stores.extend(place_group_descriptor["stores"])
+        for place_store in place_stores:
+            self._sync_place_store(place_store)
+        return place_stores
+
+    def _get_dataset_place_group_descriptors(self,
+                                             ds_id: str,
+                                             dataset_descriptor: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+        if dataset_descriptor is None:
+            dataset_descriptor = self.get_dataset_descriptor(ds_id)
         place_group_configs = dataset_descriptor.get("PlaceGroups")
         if not place_group_configs:
             return []
 
         place_group_id_prefix = f"DS-{ds_id}-"
 
-        place_groups = []
-        for k, v in self._place_group_cache.items():
+        place_group_descriptors = []
+        for k, v in self._place_group_descriptors.items():
             if k.startswith(place_group_id_prefix):
-                place_groups.append(v)
-        if place_groups:
-            return place_groups
-
-        place_groups = self._load_place_groups(place_group_configs)
-        for place_group in place_groups:
-            self._place_group_cache[place_group_id_prefix + place_group["id"]] = place_group
-
-        return place_groups
+                place_group_descriptors.append(v)
+        if not place_group_descriptors:
+            place_group_descriptors = self._load_place_group_descriptors(place_group_configs)
+            for place_group_descriptor in place_group_descriptors:
+                self._place_group_descriptors[place_group_id_prefix + place_group_descriptor["id"]] = \
+                    place_group_descriptor
+        return place_group_descriptors
 
     def get_place_group(self, place_group_id: str = ALL_PLACES) -> Dict:
-        if ALL_PLACES not in self._place_group_cache:
+        with self._place_groups_lock:
+            return self._get_place_group(self._get_global_place_group_descriptor(place_group_id))
+
+    def get_place_group_stores(self, place_group_id: str = ALL_PLACES) -> List[PlaceStore]:
+        """
+        Get the opened stores of the features of a global place group.
+        In contrast to :meth:`get_place_group`, features are not read from disk.
+
+        :param place_group_id: the place group identifier
+        :return: the list of place stores, one for each feature collection file
+        """
+        with self._place_groups_lock:
+            place_stores = list(self._get_global_place_group_descriptor(place_group_id)["stores"])
+        for place_store in place_stores:
+            self._sync_place_store(place_store)
+        return place_stores
+
+    def _get_global_place_group_descriptor(self, place_group_id: str) -> Dict[str, Any]:
+        if ALL_PLACES not in self._place_group_descriptors:
             place_group_configs = self._config.get("PlaceGroups", [])
-            place_groups = self._load_place_groups(place_group_configs)
+            place_group_descriptors = self._load_place_group_descriptors(place_group_configs)
 
-            all_features = []
-            for place_group in place_groups:
-                all_features.extend(place_group["features"])
-                self._place_group_cache[place_group["id"]] = place_group
+            all_place_stores = []
+            for place_group_descriptor in place_group_descriptors:
+                all_place_stores.extend(place_group_descriptor["stores"])
+                self._place_group_descriptors[place_group_descriptor["id"]] = place_group_descriptor
 
-            self._place_group_cache[ALL_PLACES] = dict(type="FeatureCollection", features=all_features)
+            self._place_group_descriptors[ALL_PLACES] = dict(stores=all_place_stores)
 
-        if place_group_id not in self._place_group_cache:
+        if place_group_id not in self._place_group_descriptors:
             raise ServiceResourceNotFoundError(f'Place group "{place_group_id}" not found')
 
-        return self._place_group_cache[place_group_id]
-
-    def _load_place_groups(self, place_group_configs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-        place_groups = []
+        return self._place_group_descriptors[place_group_id]
+
+    def _get_place_group(self, place_group_descriptor: Dict[str, Any]) -> Dict:
+        # Place groups are materialized from their stores on first access and
+        # again only if one of their collection files has changed.
+        versions = self._sync_place_group(place_group_descriptor)
+        if place_group_descriptor.get("versions") != versions:
+            features = []
+            for place_store in place_group_descriptor["stores"]:
+                features.extend(place_store.read_features())
+            if "id" in place_group_descriptor:
+                place_group = dict(type="FeatureCollection",
+                                   features=features,
+                                   id=place_group_descriptor["id"],
+                                   title=place_group_descriptor["title"],
+                                   propertyMapping=place_group_descriptor["propertyMapping"])
+                sub_place_group_descriptors = place_group_descriptor.get("placeGroups")
+                if sub_place_group_descriptors:
+                    place_group["placeGroups"] = [self._get_place_group(sub_place_group_descriptor)
+                                                  for sub_place_group_descriptor in sub_place_group_descriptors]
+            else:
+                place_group = dict(type="FeatureCollection", features=features)
+            place_group_descriptor["placeGroup"] = place_group
+            place_group_descriptor["versions"] = versions
+        return place_group_descriptor["placeGroup"]
+
+    def _sync_place_group(self, place_group_descriptor: Dict[str, Any]) -> Tuple:
+        versions = [self._sync_place_store(place_store) for place_store in place_group_descriptor["stores"]]
+        for sub_place_group_descriptor in place_group_descriptor.get("placeGroups", []):
+            versions.append(self._sync_place_group(sub_place_group_descriptor))
+        return tuple(versions)
+
+    def _sync_place_store(self, place_store: PlaceStore) -> int:
+        if place_store.sync():
+            # (Re)opened stores get a new range of feature identifiers
+            with self._place_groups_lock:
+                place_store.first_feature_id = self._feature_index
+                self._feature_index += place_store.num_features
+        return place_store.version
+
+    def _load_place_group_descriptors(self, place_group_configs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        place_group_descriptors = []
         for place_group_config in place_group_configs:
-            place_group = self._load_place_group(place_group_config)
-            place_groups.append(place_group)
-        return place_groups
+            place_group_descriptor = self._load_place_group_descriptor(place_group_config)
+            place_group_descriptors.append(place_group_descriptor)
+        return place_group_descriptors
 
-    def _load_place_group(self, place_group_config: Dict[str, Any]) -> Dict[str, Any]:
+    def _load_place_group_descriptor(self, place_group_config: Dict[str, Any]) -> Dict[str, Any]:
         ref_id = place_group_config.get("PlaceGroupRef")
         if ref_id:
             # Trigger loading of all global "PlaceGroup" entries
-            self.get_place_group()
+            self._get_global_place_group_descriptor(ALL_PLACES)
             if len(place_group_config) > 1:
                 raise ServiceError("'PlaceGroupRef' if present, must be the only entry in a 'PlaceGroups' item")
-            if ref_id not in self._place_group_cache:
+            if ref_id not in self._place_group_descriptors:
                 raise ServiceError("Invalid 'PlaceGroupRef' entry in a 'PlaceGroups' item")
-            return self._place_group_cache[ref_id]
+            return self._place_group_descriptors[ref_id]
 
         place_group_id = place_group_config.get("Identifier")
         if not place_group_id:
@@ -375,41 +920,24 @@ class ServiceContext:
         property_mapping = place_group_config.get("PropertyMapping")
         character_encoding = place_group_config.get("CharacterEncoding", "utf-8")
 
-        features = []
+        place_stores = []
         collection_files = glob.glob(place_path_wc)
         for collection_file in collection_files:
-            with fiona.open(collection_file, encoding=character_encoding) as feature_collection:
-                for feature in feature_collection:
-                    self._remove_feature_id(feature)
-                    feature["id"] = str(self._feature_index)
-                    self._feature_index += 1
-                    features.append(feature)
-
-        place_group = dict(type="FeatureCollection",
-                           features=features,
-                           id=place_group_id,
-                           title=place_group_title,
-                           propertyMapping=property_mapping)
+            place_store = PlaceStore(collection_file, self._place_cache_dir, character_encoding=character_encoding)
+            self._sync_place_store(place_store)
+            place_stores.append(place_store)
+
+        place_group_descriptor = dict(id=place_group_id,
+                                      title=place_group_title,
+                                      propertyMapping=property_mapping,
+                                      stores=place_stores)
 
         sub_place_group_configs = place_group_config.get("Places")
         if sub_place_group_configs:
-            sub_place_groups = self._load_place_groups(sub_place_group_configs)
-            place_group["placeGroups"] = sub_place_groups
-
-        return place_group
+            sub_place_group_descriptors = self._load_place_group_descriptors(sub_place_group_configs)
+            place_group_descriptor["placeGroups"] = sub_place_group_descriptors
 
-    @classmethod
-    def _remove_feature_id(cls, feature: Dict):
-        cls._remove_id(feature)
-        if "properties" in feature:
-            cls._remove_id(feature["properties"])
-
-    @classmethod
-    def _remove_id(cls, properties: Dict):
-        if "id" in properties:
-            del properties["id"]
-        if "ID" in properties:
-            del properties["ID"]
+        return place_group_descriptor
 
     def get_dataset_and_coord_variable(self, ds_name: str, dim_name: str):
         ds = self.get_dataset(ds_name)
@@ -456,3 +984,31 @@ class ServiceContext:
                                 ds_name: str) -> Optional[Dict[str, Any]]:
         # TODO: optimize by dict/key lookup
         return next((dsd for dsd in dataset_descriptors if dsd['Identifier'] == ds_name), None)
+
+
+def _get_variant(cache: Dict[Any, collections.OrderedDict], key: Any, variant: Optional[str]) -> Optional[Tuple]:
+    variants = cache.get(key)
+    if variants is None or variant not in variants:
+        return None
+    variants.move_to_end(variant)
+    return variants[variant]
+
+
+def _put_variant(cache: Dict[Any, collections.OrderedDict], key: Any, variant: Optional[str], value: Tuple):
+    variants = cache.setdefault(key, collections.OrderedDict())
+    variants[variant] = value
+    variants.move_to_end(variant)
+    while len(variants) > MAX_DOCUMENT_VARIANTS:
+        variants.popitem(last=False)
+
+
+def _equal_dependencies(old_dependencies: Tuple, dependencies: Tuple) -> bool:
+    if len(old_dependencies) != len(dependencies):
+        return False
+    return all(d1 is d2 or d1 == d2 for d1, d2 in zip(old_dependencies, dependencies))
+
+
+def _identical_fragments(old_fragments: Tuple, fragments: Tuple) -> bool:
+    if len(old_fragments) != len(fragments):
+        return False
+    return all(f1 is f2 for f1, f2 in zip(old_fragments, fragments))
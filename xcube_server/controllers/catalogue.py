@@ -1,16 +1,19 @@
 import json
-from typing import Dict
+from typing import Any, Dict
 
 import numpy as np
 
 from ..context import ServiceContext
-from ..controllers.tiles import get_tile_source_options, get_dataset_tile_url
+from ..controllers.tiles import get_tile_source_options, get_dataset_tile_url, TILE_CLIENTS
+from ..encoded import EncodedDocument
 from ..errors import ServiceBadRequestError
 from ..im.cmaps import get_cmaps
-from ..utils import get_dataset_bounds, timestamp_to_iso_string
+from ..jsonenc import to_json
+from ..utils import get_dataset_bounds, timestamps_to_iso_strings
 
 
 def get_datasets(ctx: ServiceContext, details=False, client=None, base_url: str = None) -> Dict:
+    _assert_tile_client(client)
     dataset_descriptors = ctx.get_dataset_descriptors()
 
     dataset_dicts = list()
@@ -35,14 +38,132 @@ def get_datasets(ctx: ServiceContext, details=False, client=None, base_url: str
         dataset_dicts.append(dataset_dict)
 
     if details:
+        # Avoid a linear search for the descriptor of each dataset
+        dataset_descriptors_by_id = _get_dataset_descriptors_by_id(dataset_descriptors)
         for dataset_dict in dataset_dicts:
             ds_id = dataset_dict["id"]
-            dataset_dict.update(get_dataset(ctx, ds_id, client, base_url))
+            dataset_dict.update(get_dataset(ctx, ds_id, client, base_url,
+                                            dataset_descriptor=dataset_descriptors_by_id[ds_id]))
 
     return dict(datasets=dataset_dicts)
 
 
-def get_dataset(ctx: ServiceContext, ds_id: str, client=None, base_url: str = None) -> Dict:
+def get_datasets_document(ctx: ServiceContext,
+                          details=False,
+                          client=None,
+                          base_url: str = None,
+                          pretty=False) -> EncodedDocument:
+    """
+    Get the JSON-encoded response of :func:`get_datasets`.
+    The document is cached and re-encoded only if the configured datasets, one of the
+    cached dataset fragments, or one of the datasets' place groups have changed.
+
+    :param ctx: the service context
+    :param details: whether to include dataset details
+    :param client: the tile client, if any
+    :param base_url: the service's base URL
+    :param pretty: whether to indent the JSON output
+    :return: the encoded document
+    """
+    _assert_tile_client(client)
+    dataset_descriptors = ctx.get_dataset_descriptors()
+    dependencies = [dataset_descriptors]
+    fragments = []
+    if details:
+        for dataset_descriptor in dataset_descriptors:
+            ds_id = dataset_descriptor['Identifier']
+            fragments.append(_get_dataset_fragment(ctx, ds_id, client, base_url, dataset_descriptor))
+            dependencies.append(tuple(ctx.get_dataset_place_groups(ds_id, dataset_descriptor=dataset_descriptor)))
+
+    def new_document():
+        response = get_datasets(ctx, details=details, client=client, base_url=base_url)
+        return EncodedDocument(to_json(response, pretty=pretty), 'application/json')
+
+    return ctx.get_document(f'catalogue:datasets:{bool(details)}:{client}:{bool(pretty)}',
+                            tuple(dependencies),
+                            new_document,
+                            variant=base_url,
+                            fragments=tuple(fragments))
+
+
+def get_dataset_document(ctx: ServiceContext,
+                         ds_id: str,
+                         client=None,
+                         base_url: str = None,
+                         pretty=False) -> EncodedDocument:
+    """
+    Get the JSON-encoded response of :func:`get_dataset`.
+    The document is cached and re-encoded only if the cached dataset fragment
+    or the dataset's place groups have changed.
+
+    :param ctx: the service context
+    :param ds_id: the dataset identifier
+    :param client: the tile client, if any
+    :param base_url: the service's base URL
+    :param pretty: whether to indent the JSON output
+    :return: the encoded document
+    """
+    _assert_tile_client(client)
+    # Raises if there is no such dataset, so that only documents of configured datasets are cached
+    dataset_descriptor = ctx.get_dataset_descriptor(ds_id)
+    fragment = _get_dataset_fragment(ctx, ds_id, client, base_url, dataset_descriptor)
+    dependencies = (tuple(ctx.get_dataset_place_groups(ds_id, dataset_descriptor=dataset_descriptor)),)
+
+    def new_document():
+        response = get_dataset(ctx, ds_id, client=client, base_url=base_url)
+        return EncodedDocument(to_json(response, pretty=pretty), 'application/json')
+
+    return ctx.get_document(f'catalogue:dataset:{ds_id}:{client}:{bool(pretty)}',
+                            dependencies,
+                            new_document,
+                            variant=base_url,
+                            fragments=(fragment,))
+
+
+def get_dataset(ctx: ServiceContext,
+                ds_id: str,
+                client=None,
+                base_url: str = None,
+                dataset_descriptor: Dict[str, Any] = None) -> Dict:
+    _assert_tile_client(client)
+    if dataset_descriptor is None:
+        dataset_descriptor = ctx.get_dataset_descriptor(ds_id)
+
+    # Shallow copy, so callers may add or replace entries without modifying the cached fragment
+    dataset_dict = dict(_get_dataset_fragment(ctx, ds_id, client, base_url, dataset_descriptor))
+
+    place_groups = ctx.get_dataset_place_groups(ds_id, dataset_descriptor=dataset_descriptor)
+    if place_groups:
+        dataset_dict["placeGroups"] = place_groups
+
+    return dataset_dict
+
+
+def _assert_tile_client(client):
+    if client is not None and client not in TILE_CLIENTS:
+        raise ServiceBadRequestError(f'Unknown tile client "{client}"')
+
+
+def _get_dataset_descriptors_by_id(dataset_descriptors) -> Dict[str, Dict[str, Any]]:
+    return {dataset_descriptor['Identifier']: dataset_descriptor for dataset_descriptor in dataset_descriptors}
+
+
+def _get_dataset_fragment(ctx: ServiceContext,
+                          ds_id: str,
+                          client,
+                          base_url: str,
+                          dataset_descriptor: Dict[str, Any]) -> Dict:
+    # Place groups are not part of the fragment, because their stores may change independently
+    # of the dataset. Color mappings are taken from the "Styles" configuration.
+    return ctx.get_dataset_fragment(ds_id,
+                                    f'catalogue:{client}',
+                                    lambda: _new_dataset_fragment(ctx, ds_id, client, base_url),
+                                    dependencies=(ctx.config.get('Styles'),),
+                                    variant=base_url,
+                                    dataset_descriptor=dataset_descriptor)
+
+
+def _new_dataset_fragment(ctx: ServiceContext, ds_id: str, client, base_url: str) -> Dict:
     dataset_descriptor = ctx.get_dataset_descriptor(ds_id)
 
     ds_id = dataset_descriptor['Identifier']
@@ -87,24 +208,15 @@ def get_dataset(ctx: ServiceContext, ds_id: str, client=None, base_url: str = No
     dim_names = ds.data_vars[list(ds.data_vars)[0]].dims if len(ds.data_vars) > 0 else ds.dims.keys()
     dataset_dict["dimensions"] = [get_dataset_coordinates(ctx, ds_id, dim_name) for dim_name in dim_names]
 
-    place_groups = ctx.get_dataset_place_groups(ds_id)
-    if place_groups:
-        dataset_dict["placeGroups"] = place_groups
-
     return dataset_dict
 
 
 def get_dataset_coordinates(ctx: ServiceContext, ds_id: str, dim_name: str) -> Dict:
     ds, var = ctx.get_dataset_and_coord_variable(ds_id, dim_name)
-    values = list()
-    if np.issubdtype(var.dtype, np.floating):
-        converter = float
-    elif np.issubdtype(var.dtype, np.integer):
-        converter = int
+    if np.issubdtype(var.dtype, np.floating) or np.issubdtype(var.dtype, np.integer):
+        values = var.values
     else:
-        converter = timestamp_to_iso_string
-    for value in var.values:
-        values.append(converter(value))
+        values = timestamps_to_iso_strings(var.values, memoize=True)
     return dict(name=dim_name,
                 size=len(values),
                 dtype=str(var.dtype),
@@ -1,5 +1,7 @@
+import base64
+import binascii
 import logging
-from typing import Any, Dict
+from typing import Any, Dict, List, Optional, Tuple
 
 import shapely.geometry
 import shapely.wkt
@@ -8,6 +10,7 @@ from shapely.errors import WKTReadingError
 from ..context import ServiceContext
 from ..errors import ServiceBadRequestError
 from ..perf import measure_time
+from ..placequery import PlaceQuery
 from ..utils import get_dataset_geometry, get_box_split_bounds_geometry
 
 _LOG = logging.getLogger('xcube')
@@ -20,13 +23,18 @@ def find_dataset_places(ctx: ServiceContext,
                         collection_name: str,
                         ds_id: str,
                         query_expr: Any = None,
-                        comb_op: str = "and") -> GeoJsonFeatureCollection:
+                        comb_op: str = "and",
+                        limit: int = None,
+                        offset: int = 0,
+                        cursor: str = None,
+                        property_names: List[str] = None) -> GeoJsonFeatureCollection:
     dataset = ctx.get_dataset(ds_id)
     query_geometry = get_dataset_geometry(dataset)
     return _find_places(ctx,
                         collection_name,
                         query_geometry=query_geometry,
-                        query_expr=query_expr, comb_op=comb_op)
+                        query_expr=query_expr, comb_op=comb_op,
+                        limit=limit, offset=offset, cursor=cursor, property_names=property_names)
 
 
 def find_places(ctx: ServiceContext,
@@ -35,7 +43,28 @@ def find_places(ctx: ServiceContext,
                 geom_wkt: str = None,
                 query_expr: Any = None,
                 geojson_obj: Dict = None,
-                comb_op: str = "and") -> GeoJsonFeatureCollection:
+                comb_op: str = "and",
+                limit: int = None,
+                offset: int = 0,
+                cursor: str = None,
+                property_names: List[str] = None) -> GeoJsonFeatureCollection:
+    """
+    Find places of a place group.
+
+    :param ctx: service context
+    :param collection_name: the place group identifier
+    :param box_coords: optional query bounding box given as "x1,y1,x2,y2"
+    :param geom_wkt: optional query geometry given as WKT
+    :param query_expr: optional query expression for property values, see :class:`PlaceQuery`
+    :param geojson_obj: optional query geometry given as GeoJSON object
+    :param comb_op: "and" or "or", how to combine the query geometry and the terms of the query expression
+    :param limit: maximum number of places to be returned. If more places match, the result has
+           a "nextCursor" entry that can be passed as *cursor* to obtain the next places.
+    :param offset: number of matching places to be skipped
+    :param cursor: the "nextCursor" of a previous result, resumes the query where that result ended
+    :param property_names: names of the place properties to be included in the result
+    :return: a GeoJSON feature collection
+    """
     query_geometry = None
     if box_coords:
         try:
@@ -57,38 +86,108 @@ def find_places(ctx: ServiceContext,
                 query_geometry = shapely.geometry.shape(geojson_obj)
         except (IndexError, ValueError, KeyError) as e:
             raise ServiceBadRequestError("Received invalid GeoJSON object") from e
-    return _find_places(ctx, collection_name, query_geometry, query_expr, comb_op)
+    return _find_places(ctx, collection_name, query_geometry, query_expr, comb_op,
+                        limit=limit, offset=offset, cursor=cursor, property_names=property_names)
 
 
 def _find_places(ctx: ServiceContext,
                  collection_name: str,
                  query_geometry: shapely.geometry.base.BaseGeometry = None,
                  query_expr: Any = None,
-                 comb_op: str = "and") -> GeoJsonFeatureCollection:
+                 comb_op: str = "and",
+                 limit: int = None,
+                 offset: int = 0,
+                 cursor: str = None,
+                 property_names: List[str] = None) -> GeoJsonFeatureCollection:
     with measure_time() as cm:
-        features = __find_places(ctx, collection_name, query_geometry, query_expr, comb_op)
-    _LOG.info(f"{len(features)} places found within {cm.duration} seconds")
+        features = __find_places(ctx, collection_name, query_geometry, query_expr, comb_op,
+                                 limit, offset, cursor, property_names)
+    _LOG.info(f"{len(features['features'])} places found within {cm.duration} seconds")
     return features
 
 
 def __find_places(ctx: ServiceContext,
                   collection_name: str,
-                  query_geometry: shapely.geometry.base.BaseGeometry = None,
-                  query_expr: Any = None,
-                  comb_op: str = "and") -> GeoJsonFeatureCollection:
-    place_group = ctx.get_place_group(collection_name)
-    if query_geometry is None:
-        if query_expr is None:
-            return place_group
-        else:
-            raise NotImplementedError()
-    else:
-        matching_places = []
-        if query_expr is None:
-            for place in place_group["features"]:
-                geometry = shapely.geometry.shape(place["geometry"])
-                if geometry.intersects(query_geometry):
-                    matching_places.append(place)
-        else:
-            raise NotImplementedError()
-        return dict(type="FeatureCollection", features=matching_places)
+                  query_geometry: Optional[shapely.geometry.base.BaseGeometry],
+                  query_expr: Optional[str],
+                  comb_op: str,
+                  limit: Optional[int],
+                  offset: int,
+                  cursor: Optional[str],
+                  property_names: Optional[List[str]]) -> GeoJsonFeatureCollection:
+    if comb_op not in ("and", "or"):
+        raise ServiceBadRequestError(f'Invalid combination operation "{comb_op}", must be "and" or "or"')
+    if limit is not None and limit < 0:
+        raise ServiceBadRequestError("Limit must not be negative")
+    offset = offset or 0
+    if offset < 0:
+        raise ServiceBadRequestError("Offset must not be negative")
+    if offset and cursor:
+        raise ServiceBadRequestError('Only one of "offset" and "cursor" may be given')
+
+    if query_geometry is None and not query_expr and limit is None and not offset and not cursor \
+            and property_names is None:
+        return ctx.get_place_group(collection_name)
+
+    place_query = None
+    if query_expr:
+        try:
+            place_query = PlaceQuery.parse(query_expr, comb_op=comb_op)
+        except ValueError as e:
+            raise ServiceBadRequestError(f"Invalid query expression: {e}") from e
+
+    place_stores = ctx.get_place_group_stores(collection_name)
+
+    start_store_index, start_feature_index = 0, 0
+    if cursor:
+        start_store_index, start_feature_index, version = _decode_cursor(cursor)
+        if start_store_index >= len(place_stores) or place_stores[start_store_index].version != version:
+            raise ServiceBadRequestError("Cursor has expired, places have changed")
+
+    features = []
+    next_cursor = None
+    for store_index in range(start_store_index, len(place_stores)):
+        place_store = place_stores[store_index]
+        property_mask = None
+        if place_query is not None:
+            try:
+                property_mask = place_query.get_mask(place_store)
+            except ValueError as e:
+                raise ServiceBadRequestError(f"Invalid query expression: {e}") from e
+        matching_features = place_store.iter_matching_features(
+            query_geometry=query_geometry,
+            property_mask=property_mask,
+            comb_op=comb_op,
+            start_index=start_feature_index if store_index == start_store_index else 0
+        )
+        for feature_index, feature in matching_features:
+            if offset > 0:
+                offset -= 1
+                continue
+            if limit is not None and len(features) >= limit:
+                next_cursor = _encode_cursor(store_index, feature_index, place_store.version)
+                break
+            if property_names is not None:
+                properties = feature.get("properties") or {}
+                feature["properties"] = {name: properties[name] for name in property_names if name in properties}
+            features.append(feature)
+        if next_cursor is not None:
+            break
+
+    feature_collection = dict(type="FeatureCollection", features=features)
+    if next_cursor is not None:
+        feature_collection["nextCursor"] = next_cursor
+    return feature_collection
+
+
+def _encode_cursor(store_index: int, feature_index: int, version: int) -> str:
+    return base64.urlsafe_b64encode(f"{store_index}.{feature_index}.{version}".encode("ascii")).decode("ascii")
+
+
+def _decode_cursor(cursor: str) -> Tuple[int, int, int]:
+    try:
+        decoded_cursor = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("ascii")
+        store_index, feature_index, version = decoded_cursor.split(".")
+        return int(store_index), int(feature_index), int(version)
+    except (binascii.Error, UnicodeError, ValueError) as e:
+        raise ServiceBadRequestError("Invalid cursor") from e
@@ -14,11 +14,14 @@ from ..defaults import DEFAULT_CMAP_WIDTH, DEFAULT_CMAP_HEIGHT
 from ..errors import ServiceBadRequestError, ServiceResourceNotFoundError
 from ..im import NdarrayImage, TransformArrayImage, ColorMappedRgbaImage, ColorMappedRgbaImage2, TileGrid
 from ..ne2 import NaturalEarth2Image
-from ..perf import measure_time_cm
+from ..perf import trace_span
 from ..reqparams import RequestParams
 
 _LOG = logging.getLogger('xcube')
 
+# Tile clients for which tile source options can be generated, see get_tile_source_options()
+TILE_CLIENTS = ('ol4', 'cesium')
+
 
 def get_dataset_tile(ctx: ServiceContext,
                      ds_id: str,
@@ -32,8 +35,6 @@ def get_dataset_tile(ctx: ServiceContext,
     tile_comp_mode = params.get_query_argument_int('mode', ctx.tile_comp_mode)
     trace_perf = params.get_query_argument_int('debug', ctx.trace_perf) != 0
 
-    measure_time = measure_time_cm(logger=_LOG, disabled=not trace_perf)
-
     var = ctx.get_variable_for_z(ds_id, var_name, z)
 
     dim_names = list(var.dims)
@@ -105,7 +106,7 @@ def get_dataset_tile(ctx: ServiceContext,
                                          cmap_name=cmap_cbar,
                                          encode=True,
                                          format='PNG',
-                                         tile_cache=ctx.mem_tile_cache,
+                                         tile_cache=ctx.tile_cache,
                                          trace_perf=trace_perf)
         else:
             image = ColorMappedRgbaImage2(array,
@@ -118,7 +119,7 @@ def get_dataset_tile(ctx: ServiceContext,
                                           flip_y=tile_grid.inv_y,
                                           no_data_value=no_data_value,
                                           valid_range=valid_range,
-                                          tile_cache=ctx.mem_tile_cache,
+                                          tile_cache=ctx.tile_cache,
                                           trace_perf=trace_perf)
 
         ctx.image_cache[image_id] = image
@@ -130,15 +131,12 @@ def get_dataset_tile(ctx: ServiceContext,
             _LOG.info(f'  geo_extent: {tile_grid.geo_extent}')
             _LOG.info(f'  inv_y: {tile_grid.inv_y}')
 
-    if trace_perf:
-        _LOG.info(f'>>> tile {image_id}/{z}/{y}/{x}')
-
-    with measure_time() as measured_time:
+    with trace_span('dataset tile') as span:
+        if span.is_recording:
+            span.set_attribute('image_id', image_id)
+            span.set_attribute('tile', f'{z}/{y}/{x}')
         tile = image.get_tile(x, y)
 
-    if trace_perf:
-        _LOG.info(f'<<< tile {image_id}/{z}/{y}/{x}: took ' + '%.2f seconds' % measured_time.duration)
-
     return tile
 
 
@@ -190,7 +188,7 @@ def get_dataset_tile_grid(ctx: ServiceContext,
                           tile_client: str,
                           base_url: str) -> Dict[str, Any]:
     tile_grid = ctx.get_tile_grid(ds_id)
-    if tile_client == 'ol4' or tile_client == 'cesium':
+    if tile_client in TILE_CLIENTS:
         return get_tile_source_options(tile_grid,
                                        get_dataset_tile_url(ctx, ds_id, var_name, base_url),
                                        client=tile_client)
@@ -19,8 +19,8 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-import math
-from typing import Dict, List
+import warnings
+from typing import Dict, List, Iterator
 
 import numpy as np
 import shapely.geometry
@@ -28,8 +28,15 @@ import xarray as xr
 
 from ..context import ServiceContext
 from ..errors import ServiceBadRequestError
-from ..utils import get_dataset_bounds, get_dataset_geometry, get_box_split_bounds_geometry, get_geometry_mask, \
-    GeoJSON, timestamp_to_iso_string
+from ..cache import Cache
+from ..utils import get_dataset_bounds, get_dataset_geometry, get_dataset_geometry_mask, GeoJSON, \
+    timestamps_to_iso_strings
+
+# Number of time steps loaded and computed at once
+_TIME_BLOCK_SIZE = 32
+
+#: An iterator of blocks of time-series results, where each block is a list of result dicts
+TimeSeriesBlocks = Iterator[List[Dict]]
 
 
 def get_time_series_info(ctx: ServiceContext) -> Dict:
@@ -41,10 +48,7 @@ def get_time_series_info(ctx: ServiceContext) -> Dict:
             if 'time' not in dataset.variables:
                 continue
             xmin, ymin, xmax, ymax = get_dataset_bounds(dataset)
-            time_data = dataset.variables['time'].data
-            time_stamps = []
-            for time in time_data:
-                time_stamps.append(timestamp_to_iso_string(time))
+            time_stamps = timestamps_to_iso_strings(dataset.variables['time'].values, memoize=True)
             for variable in dataset.data_vars.variables:
                 variable_dict = {'name': '{0}.{1}'.format(descriptor['Identifier'], variable),
                                  'dates': time_stamps,
@@ -70,13 +74,11 @@ def get_time_series_for_geometry(ctx: ServiceContext,
                                  start_date: np.datetime64 = None,
                                  end_date: np.datetime64 = None) -> Dict:
     dataset, variable = ctx.get_dataset_and_variable(ds_name, var_name)
-    if not GeoJSON.is_geometry(geometry):
-        raise ServiceBadRequestError("Invalid GeoJSON geometry")
-    if isinstance(geometry, dict):
-        geometry = shapely.geometry.shape(geometry)
+    geometry = _to_geometry_shape(geometry)
     return _get_time_series_for_geometry(dataset, variable,
                                          geometry,
-                                         start_date=start_date, end_date=end_date)
+                                         start_date=start_date, end_date=end_date,
+                                         mask_cache=ctx.mask_cache)
 
 
 def get_time_series_for_geometry_collection(ctx: ServiceContext,
@@ -85,6 +87,95 @@ def get_time_series_for_geometry_collection(ctx: ServiceContext,
                                             start_date: np.datetime64 = None,
                                             end_date: np.datetime64 = None) -> Dict:
     dataset, variable = ctx.get_dataset_and_variable(ds_name, var_name)
+    shapes = _to_geometry_collection_shapes(geometry_collection)
+    return _get_time_series_for_geometries(dataset, variable, shapes, start_date, end_date,
+                                           mask_cache=ctx.mask_cache)
+
+
+def get_time_series_for_feature_collection(ctx: ServiceContext,
+                                           ds_name: str, var_name: str,
+                                           feature_collection: Dict,
+                                           start_date: np.datetime64 = None,
+                                           end_date: np.datetime64 = None) -> Dict:
+    dataset, variable = ctx.get_dataset_and_variable(ds_name, var_name)
+    shapes = _to_feature_collection_shapes(feature_collection)
+    return _get_time_series_for_geometries(dataset, variable, shapes, start_date, end_date,
+                                           mask_cache=ctx.mask_cache)
+
+
+def iter_time_series_for_point(ctx: ServiceContext,
+                               ds_name: str, var_name: str,
+                               lon: float, lat: float,
+                               start_date: np.datetime64 = None,
+                               end_date: np.datetime64 = None) -> TimeSeriesBlocks:
+    """
+    Like :func:`get_time_series_for_point`, but the results are computed lazily
+    and returned as an iterator of result blocks.
+    """
+    dataset, variable = ctx.get_dataset_and_variable(ds_name, var_name)
+    return _iter_time_series_for_point(dataset, variable,
+                                       shapely.geometry.Point(lon, lat),
+                                       start_date=start_date, end_date=end_date)
+
+
+def iter_time_series_for_geometry(ctx: ServiceContext,
+                                  ds_name: str, var_name: str,
+                                  geometry: Dict,
+                                  start_date: np.datetime64 = None,
+                                  end_date: np.datetime64 = None) -> TimeSeriesBlocks:
+    """
+    Like :func:`get_time_series_for_geometry`, but the results are computed lazily
+    and returned as an iterator of result blocks.
+    """
+    dataset, variable = ctx.get_dataset_and_variable(ds_name, var_name)
+    geometry = _to_geometry_shape(geometry)
+    return _iter_time_series_for_geometry(dataset, variable,
+                                          geometry,
+                                          start_date=start_date, end_date=end_date,
+                                          mask_cache=ctx.mask_cache)
+
+
+def iter_time_series_for_geometry_collection(ctx: ServiceContext,
+                                             ds_name: str, var_name: str,
+                                             geometry_collection: Dict,
+                                             start_date: np.datetime64 = None,
+                                             end_date: np.datetime64 = None) -> TimeSeriesBlocks:
+    """
+    Like :func:`get_time_series_for_geometry_collection`, but the results are computed lazily
+    and returned as an iterator of result blocks. Each result has an additional
+    "geometryIndex" entry that refers to the geometry in *geometry_collection*.
+    """
+    dataset, variable = ctx.get_dataset_and_variable(ds_name, var_name)
+    shapes = _to_geometry_collection_shapes(geometry_collection)
+    return _iter_time_series_for_geometries(dataset, variable, shapes, start_date, end_date,
+                                            mask_cache=ctx.mask_cache)
+
+
+def iter_time_series_for_feature_collection(ctx: ServiceContext,
+                                            ds_name: str, var_name: str,
+                                            feature_collection: Dict,
+                                            start_date: np.datetime64 = None,
+                                            end_date: np.datetime64 = None) -> TimeSeriesBlocks:
+    """
+    Like :func:`get_time_series_for_feature_collection`, but the results are computed lazily
+    and returned as an iterator of result blocks. Each result has an additional
+    "geometryIndex" entry that refers to the feature in *feature_collection*.
+    """
+    dataset, variable = ctx.get_dataset_and_variable(ds_name, var_name)
+    shapes = _to_feature_collection_shapes(feature_collection)
+    return _iter_time_series_for_geometries(dataset, variable, shapes, start_date, end_date,
+                                            mask_cache=ctx.mask_cache)
+
+
+def _to_geometry_shape(geometry: Dict) -> shapely.geometry.base.BaseGeometry:
+    if not GeoJSON.is_geometry(geometry):
+        raise ServiceBadRequestError("Invalid GeoJSON geometry")
+    if isinstance(geometry, dict):
+        geometry = shapely.geometry.shape(geometry)
+    return geometry
+
+
+def _to_geometry_collection_shapes(geometry_collection: Dict) -> List[shapely.geometry.base.BaseGeometry]:
     geometries = GeoJSON.get_geometry_collection_geometries(geometry_collection)
     if geometries is None:
         raise ServiceBadRequestError("Invalid GeoJSON geometry collection")
@@ -95,15 +186,10 @@ def get_time_series_for_geometry_collection(ctx: ServiceContext,
         except (TypeError, ValueError) as e:
             raise ServiceBadRequestError("Invalid GeoJSON geometry collection") from e
         shapes.append(geometry)
-    return _get_time_series_for_geometries(dataset, variable, shapes, start_date, end_date)
+    return shapes
 
 
-def get_time_series_for_feature_collection(ctx: ServiceContext,
-                                           ds_name: str, var_name: str,
-                                           feature_collection: Dict,
-                                           start_date: np.datetime64 = None,
-                                           end_date: np.datetime64 = None) -> Dict:
-    dataset, variable = ctx.get_dataset_and_variable(ds_name, var_name)
+def _to_feature_collection_shapes(feature_collection: Dict) -> List[shapely.geometry.base.BaseGeometry]:
     features = GeoJSON.get_feature_collection_features(feature_collection)
     if features is None:
         raise ServiceBadRequestError("Invalid GeoJSON feature collection")
@@ -115,7 +201,7 @@ def get_time_series_for_feature_collection(ctx: ServiceContext,
         except (TypeError, ValueError) as e:
             raise ServiceBadRequestError("Invalid GeoJSON feature collection") from e
         shapes.append(geometry)
-    return _get_time_series_for_geometries(dataset, variable, shapes, start_date, end_date)
+    return shapes
 
 
 def _get_time_series_for_point(dataset: xr.Dataset,
@@ -123,105 +209,137 @@ def _get_time_series_for_point(dataset: xr.Dataset,
                                point: shapely.geometry.Point,
                                start_date: np.datetime64 = None,
                                end_date: np.datetime64 = None) -> Dict:
-    bounds = get_dataset_geometry(dataset)
-    if not bounds.contains(point):
-        return {'results': []}
-
-    point_subset = variable.sel(lon=point.x, lat=point.y, method='Nearest')
-    # noinspection PyTypeChecker
-    time_subset = point_subset.sel(time=slice(start_date, end_date))
-    time_series = []
-    for entry in time_subset:
-        statistics = {'totalCount': 1}
-        item = entry.values.item()
-        if np.isnan(item):
-            statistics['validCount'] = 0
-            statistics['average'] = None
-        else:
-            statistics['validCount'] = 1
-            statistics['average'] = item
-        result = {'result': statistics, 'date': timestamp_to_iso_string(entry.time.data)}
-        time_series.append(result)
-    return {'results': time_series}
+    return _collect_time_series(_iter_time_series_for_point(dataset, variable,
+                                                            point,
+                                                            start_date=start_date, end_date=end_date))
 
 
 def _get_time_series_for_geometry(dataset: xr.Dataset,
                                   variable: xr.DataArray,
                                   geometry: shapely.geometry.base.BaseGeometry,
                                   start_date: np.datetime64 = None,
-                                  end_date: np.datetime64 = None) -> Dict:
-    if isinstance(geometry, shapely.geometry.Point):
-        return _get_time_series_for_point(dataset, variable,
-                                          geometry,
-                                          start_date=start_date, end_date=end_date)
-
-    ds_lon_min, ds_lat_min, ds_lon_max, ds_lat_max = get_dataset_bounds(dataset)
-    dataset_geometry = get_box_split_bounds_geometry(ds_lon_min, ds_lat_min, ds_lon_max, ds_lat_max)
-    # TODO: split geometry
-    split_geometry = geometry
-    actual_geometry = dataset_geometry.intersection(split_geometry)
-    if actual_geometry.is_empty:
-        return {'results': []}
-
-    width = len(dataset.lon)
-    height = len(dataset.lat)
-    res = (ds_lat_max - ds_lat_min) / height
-
-    g_lon_min, g_lat_min, g_lon_max, g_lat_max = actual_geometry.bounds
-    x1 = _clamp(int(math.floor((g_lon_min - ds_lon_min) / res)), 0, width - 1)
-    x2 = _clamp(int(math.ceil((g_lon_max - ds_lon_min) / res)) + 1, 0, width - 1)
-    y1 = _clamp(int(math.floor((ds_lat_max - g_lat_max) / res)), 0, height - 1)
-    y2 = _clamp(int(math.ceil((ds_lat_max - g_lat_min) / res)) + 1, 0, height - 1)
-    ds_subset = dataset.isel(lon=slice(x1, x2), lat=slice(y1, y2))
-    ds_subset = ds_subset.sel(time=slice(start_date, end_date))
-    subset_ds_lon_min, subset_ds_lat_min, subset_ds_lon_max, subset_ds_lat_max = get_dataset_bounds(ds_subset)
-    subset_variable = ds_subset[variable.name]
-    subset_width = len(ds_subset.lon)
-    subset_height = len(ds_subset.lat)
-
-    mask = get_geometry_mask(subset_width, subset_height, actual_geometry, subset_ds_lon_min, subset_ds_lat_min, res)
-    total_count = np.count_nonzero(mask)
-    variable = subset_variable.sel(time=slice(start_date, end_date))
-    num_times = len(variable.time)
-
-    time_series = []
-    for time_index in range(num_times):
-        variable_slice = variable.isel(time=time_index)
-
-        masked_var = variable_slice.where(mask)
-        valid_count = len(np.where(np.isfinite(masked_var))[0])
-        mean_ts_var = variable_slice.mean(["lat", "lon"]).values.item()
-
-        statistics = {'totalCount': total_count}
-        if np.isnan(mean_ts_var):
-            statistics['validCount'] = 0
-            statistics['average'] = None
-        else:
-            statistics['validCount'] = valid_count
-            statistics['average'] = float(mean_ts_var)
-        result = {'result': statistics, 'date': timestamp_to_iso_string(variable_slice.time.data)}
-        time_series.append(result)
-
-    return {'results': time_series}
+                                  end_date: np.datetime64 = None,
+                                  mask_cache: Cache = None) -> Dict:
+    return _collect_time_series(_iter_time_series_for_geometry(dataset, variable,
+                                                               geometry,
+                                                               start_date=start_date, end_date=end_date,
+                                                               mask_cache=mask_cache))
 
 
 def _get_time_series_for_geometries(dataset: xr.Dataset,
                                     variable: xr.DataArray,
                                     geometries: List[shapely.geometry.base.BaseGeometry],
                                     start_date: np.datetime64 = None,
-                                    end_date: np.datetime64 = None) -> Dict:
+                                    end_date: np.datetime64 = None,
+                                    mask_cache: Cache = None) -> Dict:
     time_series = []
     for geometry in geometries:
         result = _get_time_series_for_geometry(dataset, variable,
                                                geometry,
-                                               start_date=start_date, end_date=end_date)
+                                               start_date=start_date, end_date=end_date,
+                                               mask_cache=mask_cache)
         time_series.append(result["results"])
     return {'results': time_series}
 
 
-def _clamp(x, x1, x2):
-    if x < x1:
-        return x1
-    if x > x2:
-        return x2
-    return x
+def _collect_time_series(blocks: TimeSeriesBlocks) -> Dict:
+    time_series = []
+    for block in blocks:
+        time_series.extend(block)
+    return {'results': time_series}
+
+
+def _iter_time_series_for_point(dataset: xr.Dataset,
+                                variable: xr.DataArray,
+                                point: shapely.geometry.Point,
+                                start_date: np.datetime64 = None,
+                                end_date: np.datetime64 = None) -> TimeSeriesBlocks:
+    bounds = get_dataset_geometry(dataset)
+    if not bounds.contains(point):
+        return
+
+    point_subset = variable.sel(lon=point.x, lat=point.y, method='Nearest')
+    # noinspection PyTypeChecker
+    time_subset = point_subset.sel(time=slice(start_date, end_date))
+    num_times = len(time_subset.time)
+
+    for time_index in range(0, num_times, _TIME_BLOCK_SIZE):
+        time_block = time_subset.isel(time=slice(time_index, time_index + _TIME_BLOCK_SIZE))
+        values = time_block.values
+        dates = timestamps_to_iso_strings(time_block.time.values)
+        time_series = []
+        for i in range(len(dates)):
+            statistics = {'totalCount': 1}
+            item = values[i]
+            if np.isnan(item):
+                statistics['validCount'] = 0
+                statistics['average'] = None
+            else:
+                statistics['validCount'] = 1
+                statistics['average'] = item
+            result = {'result': statistics, 'date': dates[i]}
+            time_series.append(result)
+        yield time_series
+
+
+def _iter_time_series_for_geometry(dataset: xr.Dataset,
+                                   variable: xr.DataArray,
+                                   geometry: shapely.geometry.base.BaseGeometry,
+                                   start_date: np.datetime64 = None,
+                                   end_date: np.datetime64 = None,
+                                   mask_cache: Cache = None) -> TimeSeriesBlocks:
+    if isinstance(geometry, shapely.geometry.Point):
+        yield from _iter_time_series_for_point(dataset, variable,
+                                               geometry,
+                                               start_date=start_date, end_date=end_date)
+        return
+
+    dataset_mask = get_dataset_geometry_mask(dataset, geometry, mask_cache=mask_cache)
+    if dataset_mask is None:
+        return
+    indexers, mask = dataset_mask
+    subset_variable = variable.isel(**indexers)
+    total_count = np.count_nonzero(mask)
+    variable = subset_variable.sel(time=slice(start_date, end_date))
+    num_times = len(variable.time)
+
+    for time_index in range(0, num_times, _TIME_BLOCK_SIZE):
+        # Load all time steps of a block at once, but compute statistics per time step
+        time_block = variable.isel(time=slice(time_index, time_index + _TIME_BLOCK_SIZE))
+        values = time_block.transpose('time', 'lat', 'lon').values
+        dates = timestamps_to_iso_strings(time_block.time.values)
+        time_series = []
+        for i in range(len(dates)):
+            values_slice = values[i]
+            valid_count = np.count_nonzero(np.logical_and(np.isfinite(values_slice), mask))
+            with warnings.catch_warnings():
+                # Suppress "Mean of empty slice" warning, we handle NaN below
+                warnings.simplefilter("ignore", category=RuntimeWarning)
+                mean_ts_var = np.nanmean(values_slice)
+
+            statistics = {'totalCount': total_count}
+            if np.isnan(mean_ts_var):
+                statistics['validCount'] = 0
+                statistics['average'] = None
+            else:
+                statistics['validCount'] = valid_count
+                statistics['average'] = mean_ts_var
+            result = {'result': statistics, 'date': dates[i]}
+            time_series.append(result)
+        yield time_series
+
+
+def _iter_time_series_for_geometries(dataset: xr.Dataset,
+                                     variable: xr.DataArray,
+                                     geometries: List[shapely.geometry.base.BaseGeometry],
+                                     start_date: np.datetime64 = None,
+                                     end_date: np.datetime64 = None,
+                                     mask_cache: Cache = None) -> TimeSeriesBlocks:
+    for geometry_index, geometry in enumerate(geometries):
+        for block in _iter_time_series_for_geometry(dataset, variable,
+                                                    geometry,
+                                                    start_date=start_date, end_date=end_date,
+                                                    mask_cache=mask_cache):
+            for result in block:
+                result['geometryIndex'] = geometry_index
+            yield block
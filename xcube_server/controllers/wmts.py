@@ -1,6 +1,13 @@
+import functools
 import math
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import xarray as xr
 
 from ..context import ServiceContext
+from ..encoded import EncodedDocument
+from ..im import TileGrid
 
 # WGS84 ellipsoid semi-major axis
 _WGS84_MEAN_EARTH_RADIUS_IN_METERS = 6378137.0
@@ -8,8 +15,62 @@ _WGS84_MEAN_EARTH_PERIMETER_IN_METERS = 2.0 * math.pi * _WGS84_MEAN_EARTH_RADIUS
 _WGS84_METERS_PER_DEGREE = _WGS84_MEAN_EARTH_PERIMETER_IN_METERS / 360.0
 _STD_PIXEL_SIZE_IN_METERS = 0.28e-3
 
+XmlLines = List[Tuple[int, str]]
+# A layer's tile grid and its XML lines before and after the tile matrix set link
+LayerFragment = Tuple[Optional[TileGrid], XmlLines, XmlLines]
+# A dataset's layer fragments and theme XML lines
+DatasetFragment = Tuple[List[LayerFragment], XmlLines]
+
+
+def get_wmts_capabilities_xml(ctx: ServiceContext, base_url: str) -> str:
+    """
+    Get the WMTS GetCapabilities document.
+
+    :param ctx: service context
+    :param base_url: the service's base URL
+    :return: the XML document
+    """
+    return get_wmts_capabilities(ctx, base_url).text
+
+
+def get_wmts_capabilities(ctx: ServiceContext, base_url: str) -> EncodedDocument:
+    """
+    Get the WMTS GetCapabilities document in pre-encoded form.
+
+    The document is assembled from cached per-dataset fragments, which are recomputed only for datasets
+    whose configuration has changed or which have been reopened. The assembled document is cached too
+    and reused as long as none of its fragments has changed.
 
-def get_wmts_capabilities_xml(ctx: ServiceContext, base_url: str):
+    :param ctx: service context
+    :param base_url: the service's base URL
+    :return: the XML document
+    """
+    layer_base_url = ctx.get_service_url(base_url, 'wmts/1.0.0/tile/%s/%s/{TileMatrix}/{TileRow}/{TileCol}.png')
+    dataset_fragments = []
+    for dataset_descriptor in ctx.get_dataset_descriptors():
+        ds_name = dataset_descriptor['Identifier']
+        dataset_fragments.append(ctx.get_dataset_fragment(ds_name,
+                                                          'wmts',
+                                                          functools.partial(_get_dataset_fragment,
+                                                                            ctx,
+                                                                            dataset_descriptor,
+                                                                            layer_base_url),
+                                                          variant=layer_base_url))
+    service_provider = ctx.config['ServiceProvider']
+    return ctx.get_document('wmts',
+                            (service_provider,),
+                            lambda: EncodedDocument(_new_wmts_capabilities_xml(ctx, base_url,
+                                                                               service_provider,
+                                                                               dataset_fragments),
+                                                    content_type='application/xml'),
+                            variant=base_url,
+                            fragments=tuple(dataset_fragments))
+
+
+def _new_wmts_capabilities_xml(ctx: ServiceContext,
+                               base_url: str,
+                               service_provider: Dict,
+                               dataset_fragments: List[DatasetFragment]) -> str:
     service_identification_xml = (
         f"\n"
         f"    <ows:ServiceIdentification>\n"
@@ -27,7 +88,6 @@ def get_wmts_capabilities_xml(ctx: ServiceContext, base_url: str):
         f"    </ows:ServiceIdentification>\n"
     )
 
-    service_provider = ctx.config['ServiceProvider']
     service_contact = service_provider['ServiceContact']
     contact_info = service_contact['ContactInfo']
     phone = contact_info['Phone']
@@ -110,24 +170,12 @@ def get_wmts_capabilities_xml(ctx: ServiceContext, base_url: str):
         f"    </ows:OperationsMetadata>\n"
     )
 
-    dataset_descriptors = ctx.get_dataset_descriptors()
     written_tile_grids = []
     indent = '    '
 
-    layer_base_url = ctx.get_service_url(base_url, 'wmts/1.0.0/tile/%s/%s/{TileMatrix}/{TileRow}/{TileCol}.png')
-
-    dimensions_xml_cache = dict()
-
     contents_xml_lines = [(0, '<Contents>')]
-    for dataset_descriptor in dataset_descriptors:
-        ds_name = dataset_descriptor['Identifier']
-        ds = ctx.get_dataset(ds_name)
-        for var_name in ds.data_vars:
-            var = ds[var_name]
-            if len(var.shape) <= 2 or var.dims[-1] != 'lon' or var.dims[-2] != 'lat':
-                continue
-
-            tile_grid = ctx.get_tile_grid(ds_name)
+    for layer_fragments, _ in dataset_fragments:
+        for tile_grid, layer_xml_lines_1, layer_xml_lines_2 in layer_fragments:
             tile_grid_written = tile_grid in written_tile_grids
             if tile_grid_written:
                 tile_grid_index = written_tile_grids.index(tile_grid)
@@ -136,132 +184,21 @@ def get_wmts_capabilities_xml(ctx: ServiceContext, base_url: str):
                 written_tile_grids.append(tile_grid)
             tile_grid_id = f"TileGrid_{tile_grid_index}"
 
-            supported_crs = "urn:ogc:def:crs:OGC:1.3:CRS84"
-            # supported_crs = "http://www.opengis.net/def/crs/EPSG/9.5.3/4326"
-
             if tile_grid is not None:
                 if not tile_grid_written:
-                    tile_size_x, tile_size_y = tile_grid.tile_size
-                    lon1, lat1, lon2, lat2 = tile_grid.geo_extent
-                    tile_span_y = (lat2 - lat1) / tile_grid.num_level_zero_tiles_y
-                    pixel_span = tile_span_y / tile_size_y
-                    scale_denominator_0 = pixel_span * _WGS84_METERS_PER_DEGREE / _STD_PIXEL_SIZE_IN_METERS
-
-                    contents_xml_lines.append((2, '<TileMatrixSet>'))
-                    contents_xml_lines.append((3, f'<ows:Identifier>{tile_grid_id}</ows:Identifier>'))
-                    contents_xml_lines.append((3, f'<ows:SupportedCRS>{supported_crs}</ows:SupportedCRS>'))
-                    contents_xml_lines.append((3, '<ows:BoundingBox>'))
-                    contents_xml_lines.append((4, f'<ows:LowerCorner>{lon1} {lat1}</ows:LowerCorner>'))
-                    contents_xml_lines.append((4, f'<ows:UpperCorner>{lon2} {lat2}</ows:UpperCorner>'))
-                    contents_xml_lines.append((3, '</ows:BoundingBox>'))
-
-                    for level in range(tile_grid.num_levels):
-                        factor = 2 ** level
-                        num_tiles_x = tile_grid.num_level_zero_tiles_x * factor
-                        num_tiles_y = tile_grid.num_level_zero_tiles_y * factor
-                        scale_denominator = scale_denominator_0 / factor
-                        contents_xml_lines.append((3, '<TileMatrix>'))
-                        contents_xml_lines.append((4, f'<ows:Identifier>{level}</ows:Identifier>'))
-                        contents_xml_lines.append((4, f'<ScaleDenominator>{scale_denominator}</ScaleDenominator>'))
-                        contents_xml_lines.append((4, f'<TopLeftCorner>{lon1} {lat2}</TopLeftCorner>'))
-                        contents_xml_lines.append((4, f'<TileWidth>{tile_size_x}</TileWidth>'))
-                        contents_xml_lines.append((4, f'<TileHeight>{tile_size_y}</TileHeight>'))
-                        contents_xml_lines.append((4, f'<MatrixWidth>{num_tiles_x}</MatrixWidth>'))
-                        contents_xml_lines.append((4, f'<MatrixHeight>{num_tiles_y}</MatrixHeight>'))
-                        contents_xml_lines.append((3, '</TileMatrix>'))
-
-                    contents_xml_lines.append((2, '</TileMatrixSet>'))
-
-                var_title = ds_name + "/" + var.attrs.get('title', var.attrs.get('long_name', var_name))
-                var_abstract = var.attrs.get('comment', '')
-
-                layer_tile_url = layer_base_url % (ds_name, var_name)
-                contents_xml_lines.append((2, '<Layer>'))
-                contents_xml_lines.append((3, f'<ows:Identifier>{ds_name}.{var_name}</ows:Identifier>'))
-                contents_xml_lines.append((3, f'<ows:Title>{var_title}</ows:Title>'))
-                contents_xml_lines.append((3, f'<ows:Abstract>{var_abstract}</ows:Abstract>'))
-                contents_xml_lines.append((3, '<ows:WGS84BoundingBox>'))
-                contents_xml_lines.append((4, f'<ows:LowerCorner>{lon1} {lat1}</ows:LowerCorner>'))
-                contents_xml_lines.append((4, f'<ows:UpperCorner>{lon2} {lat2}</ows:UpperCorner>'))
-                contents_xml_lines.append((3, '</ows:WGS84BoundingBox>'))
-                contents_xml_lines.append(
-                    (3, '<Style isDefault="true"><ows:Identifier>Default</ows:Identifier></Style>'))
-                contents_xml_lines.append((3, '<Format>image/png</Format>'))
+                    contents_xml_lines.extend(_get_tile_matrix_set_xml_lines(tile_grid, tile_grid_id))
+                contents_xml_lines.extend(layer_xml_lines_1)
                 contents_xml_lines.append(
                     (3, f'<TileMatrixSetLink><TileMatrixSet>{tile_grid_id}</TileMatrixSet></TileMatrixSetLink>'))
-                contents_xml_lines.append(
-                    (3, f'<ResourceURL format="image/png" resourceType="tile" template="{layer_tile_url}"/>'))
-
-                non_spatial_dims = var.dims[0:-2]
-                for dim_name in non_spatial_dims:
-                    if dim_name not in ds.coords:
-                        continue
-                    dimension_xml_key = f'{ds_name}.{dim_name}'
-                    if dimension_xml_key in dimensions_xml_cache:
-                        dimensions_xml_lines = dimensions_xml_cache[dimension_xml_key]
-                    else:
-                        coord_var = ds.coords[dim_name]
-                        if len(coord_var.shape) != 1:
-                            # strange case
-                            continue
-                        coord_bnds_var_name = coord_var.attrs.get('bounds', dim_name + '_bnds')
-                        coord_bnds_var = ds.coords[coord_bnds_var_name] if coord_bnds_var_name in ds else None
-                        if coord_bnds_var is not None:
-                            if len(coord_bnds_var.shape) != 2 \
-                                    or coord_bnds_var.shape[0] != coord_bnds_var.shape[0] \
-                                    or coord_bnds_var.shape[1] != 2:
-                                # strange case
-                                coord_bnds_var = None
-                        var_title = coord_var.attrs.get('long_name', dim_name)
-                        units = 'ISO8601' if dim_name == 'time' else coord_var.attrs.get('units', '')
-                        default = 'current' if dim_name == 'time' else '0'
-                        current = 'true' if dim_name == 'time' else 'false'
-                        dimensions_xml_lines = [(3, '<Dimension>'),
-                                                (4, f'<ows:Identifier>{dim_name}</ows:Identifier>'),
-                                                (4, f'<ows:Title>{var_title}</ows:Title>'),
-                                                (4, f'<ows:UOM>{units}</ows:UOM>'),
-                                                (4, f'<Default>{default}</Default>'),
-                                                (4, f'<Current>{current}</Current>')]
-                        if coord_bnds_var is not None:
-                            coord_bnds_var_values = coord_bnds_var.values
-                            for i in range(len(coord_var)):
-                                value1 = coord_bnds_var_values[i, 0]
-                                value2 = coord_bnds_var_values[i, 1]
-                                dimensions_xml_lines.append((4, f'<Value>{value1}/{value2}</Value>'))
-                        else:
-                            coord_var_values = coord_var.values
-                            for i in range(len(coord_var)):
-                                value = coord_var_values[i]
-                                dimensions_xml_lines.append((4, f'<Value>{value}</Value>'))
-                        dimensions_xml_lines.append((3, '</Dimension>'))
-                        dimensions_xml_cache[dimension_xml_key] = dimensions_xml_lines
-
-                    contents_xml_lines.extend(dimensions_xml_lines)
-                contents_xml_lines.append((2, '</Layer>'))
+                contents_xml_lines.extend(layer_xml_lines_2)
 
     contents_xml_lines.append((1, '</Contents>'))
 
     contents_xml = '\n'.join(['%s%s' % (n * indent, xml) for n, xml in contents_xml_lines])
 
     themes_xml_lines = [(0, '<Themes>')]
-    for dataset_descriptor in dataset_descriptors:
-        ds_name = dataset_descriptor.get('Identifier')
-        ds = ctx.get_dataset(ds_name)
-        ds_title = dataset_descriptor.get('Title', ds.attrs.get('title', f'{ds_name} xcube dataset'))
-        ds_abstract = ds.attrs.get('comment', '')
-        themes_xml_lines.append((2, '<Theme>'))
-        themes_xml_lines.append((3, f'<ows:Title>{ds_title}</ows:Title>'))
-        themes_xml_lines.append((3, f'<ows:Abstract>{ds_abstract}</ows:Abstract>'))
-        themes_xml_lines.append((3, f'<ows:Identifier>{ds_name}</ows:Identifier>'))
-        for var_name in ds.data_vars:
-            var = ds[var_name]
-            var_title = var.attrs.get('title', var.attrs.get('long_name', var_name))
-            themes_xml_lines.append((3, '<Theme>'))
-            themes_xml_lines.append((4, f'<ows:Title>{var_title}</ows:Title>'))
-            themes_xml_lines.append((4, f'<ows:Identifier>{ds_name}.{var_name}</ows:Identifier>'))
-            themes_xml_lines.append((4, f'<LayerRef>{ds_name}.{var_name}</LayerRef>'))
-            themes_xml_lines.append((3, '</Theme>'))
-        themes_xml_lines.append((2, '</Theme>'))
+    for _, theme_xml_lines in dataset_fragments:
+        themes_xml_lines.extend(theme_xml_lines)
     themes_xml_lines.append((1, '</Themes>'))
     themes_xml = '\n'.join(['%s%s' % (n * indent, xml) for n, xml in themes_xml_lines])
 
@@ -285,3 +222,158 @@ def get_wmts_capabilities_xml(ctx: ServiceContext, base_url: str):
         f"    {service_metadata_url_xml}\n"
         f"</Capabilities>\n"
     )
+
+
+def _get_tile_matrix_set_xml_lines(tile_grid: TileGrid, tile_grid_id: str) -> XmlLines:
+    supported_crs = "urn:ogc:def:crs:OGC:1.3:CRS84"
+    # supported_crs = "http://www.opengis.net/def/crs/EPSG/9.5.3/4326"
+
+    tile_size_x, tile_size_y = tile_grid.tile_size
+    lon1, lat1, lon2, lat2 = tile_grid.geo_extent
+    tile_span_y = (lat2 - lat1) / tile_grid.num_level_zero_tiles_y
+    pixel_span = tile_span_y / tile_size_y
+    scale_denominator_0 = pixel_span * _WGS84_METERS_PER_DEGREE / _STD_PIXEL_SIZE_IN_METERS
+
+    xml_lines = [(2, '<TileMatrixSet>'),
+                 (3, f'<ows:Identifier>{tile_grid_id}</ows:Identifier>'),
+                 (3, f'<ows:SupportedCRS>{supported_crs}</ows:SupportedCRS>'),
+                 (3, '<ows:BoundingBox>'),
+                 (4, f'<ows:LowerCorner>{lon1} {lat1}</ows:LowerCorner>'),
+                 (4, f'<ows:UpperCorner>{lon2} {lat2}</ows:UpperCorner>'),
+                 (3, '</ows:BoundingBox>')]
+
+    for level in range(tile_grid.num_levels):
+        factor = 2 ** level
+        num_tiles_x = tile_grid.num_level_zero_tiles_x * factor
+        num_tiles_y = tile_grid.num_level_zero_tiles_y * factor
+        scale_denominator = scale_denominator_0 / factor
+        xml_lines.append((3, '<TileMatrix>'))
+        xml_lines.append((4, f'<ows:Identifier>{level}</ows:Identifier>'))
+        xml_lines.append((4, f'<ScaleDenominator>{scale_denominator}</ScaleDenominator>'))
+        xml_lines.append((4, f'<TopLeftCorner>{lon1} {lat2}</TopLeftCorner>'))
+        xml_lines.append((4, f'<TileWidth>{tile_size_x}</TileWidth>'))
+        xml_lines.append((4, f'<TileHeight>{tile_size_y}</TileHeight>'))
+        xml_lines.append((4, f'<MatrixWidth>{num_tiles_x}</MatrixWidth>'))
+        xml_lines.append((4, f'<MatrixHeight>{num_tiles_y}</MatrixHeight>'))
+        xml_lines.append((3, '</TileMatrix>'))
+
+    xml_lines.append((2, '</TileMatrixSet>'))
+    return xml_lines
+
+
+def _get_dataset_fragment(ctx: ServiceContext, dataset_descriptor: Dict, layer_base_url: str) -> DatasetFragment:
+    ds_name = dataset_descriptor['Identifier']
+    ds = ctx.get_dataset(ds_name)
+
+    dimensions_xml_cache = dict()
+
+    layer_fragments = []
+    for var_name in ds.data_vars:
+        var = ds[var_name]
+        if len(var.shape) <= 2 or var.dims[-1] != 'lon' or var.dims[-2] != 'lat':
+            continue
+
+        tile_grid = ctx.get_tile_grid(ds_name)
+        if tile_grid is None:
+            layer_fragments.append((None, [], []))
+            continue
+
+        lon1, lat1, lon2, lat2 = tile_grid.geo_extent
+
+        var_title = ds_name + "/" + var.attrs.get('title', var.attrs.get('long_name', var_name))
+        var_abstract = var.attrs.get('comment', '')
+
+        layer_tile_url = layer_base_url % (ds_name, var_name)
+        layer_xml_lines_1 = [(2, '<Layer>'),
+                             (3, f'<ows:Identifier>{ds_name}.{var_name}</ows:Identifier>'),
+                             (3, f'<ows:Title>{var_title}</ows:Title>'),
+                             (3, f'<ows:Abstract>{var_abstract}</ows:Abstract>'),
+                             (3, '<ows:WGS84BoundingBox>'),
+                             (4, f'<ows:LowerCorner>{lon1} {lat1}</ows:LowerCorner>'),
+                             (4, f'<ows:UpperCorner>{lon2} {lat2}</ows:UpperCorner>'),
+                             (3, '</ows:WGS84BoundingBox>'),
+                             (3, '<Style isDefault="true"><ows:Identifier>Default</ows:Identifier></Style>'),
+                             (3, '<Format>image/png</Format>')]
+        layer_xml_lines_2 = [
+            (3, f'<ResourceURL format="image/png" resourceType="tile" template="{layer_tile_url}"/>')
+        ]
+
+        non_spatial_dims = var.dims[0:-2]
+        for dim_name in non_spatial_dims:
+            if dim_name not in ds.coords:
+                continue
+            if dim_name in dimensions_xml_cache:
+                dimensions_xml_lines = dimensions_xml_cache[dim_name]
+            else:
+                dimensions_xml_lines = _get_dimension_xml_lines(ds, dim_name)
+                if dimensions_xml_lines is None:
+                    continue
+                dimensions_xml_cache[dim_name] = dimensions_xml_lines
+
+            layer_xml_lines_2.extend(dimensions_xml_lines)
+        layer_xml_lines_2.append((2, '</Layer>'))
+
+        layer_fragments.append((tile_grid, layer_xml_lines_1, layer_xml_lines_2))
+
+    ds_title = dataset_descriptor.get('Title', ds.attrs.get('title', f'{ds_name} xcube dataset'))
+    ds_abstract = ds.attrs.get('comment', '')
+    theme_xml_lines = [(2, '<Theme>'),
+                       (3, f'<ows:Title>{ds_title}</ows:Title>'),
+                       (3, f'<ows:Abstract>{ds_abstract}</ows:Abstract>'),
+                       (3, f'<ows:Identifier>{ds_name}</ows:Identifier>')]
+    for var_name in ds.data_vars:
+        var = ds[var_name]
+        var_title = var.attrs.get('title', var.attrs.get('long_name', var_name))
+        theme_xml_lines.append((3, '<Theme>'))
+        theme_xml_lines.append((4, f'<ows:Title>{var_title}</ows:Title>'))
+        theme_xml_lines.append((4, f'<ows:Identifier>{ds_name}.{var_name}</ows:Identifier>'))
+        theme_xml_lines.append((4, f'<LayerRef>{ds_name}.{var_name}</LayerRef>'))
+        theme_xml_lines.append((3, '</Theme>'))
+    theme_xml_lines.append((2, '</Theme>'))
+
+    return layer_fragments, theme_xml_lines
+
+
+def _get_dimension_xml_lines(ds: xr.Dataset, dim_name: str) -> Optional[XmlLines]:
+    coord_var = ds.coords[dim_name]
+    if len(coord_var.shape) != 1:
+        # strange case
+        return None
+    coord_bnds_var_name = coord_var.attrs.get('bounds', dim_name + '_bnds')
+    coord_bnds_var = ds.coords[coord_bnds_var_name] if coord_bnds_var_name in ds else None
+    if coord_bnds_var is not None:
+        if len(coord_bnds_var.shape) != 2 \
+                or coord_bnds_var.shape[0] != coord_bnds_var.shape[0] \
+                or coord_bnds_var.shape[1] != 2:
+            # strange case
+            coord_bnds_var = None
+    var_title = coord_var.attrs.get('long_name', dim_name)
+    units = 'ISO8601' if dim_name == 'time' else coord_var.attrs.get('units', '')
+    default = 'current' if dim_name == 'time' else '0'
+    current = 'true' if dim_name == 'time' else 'false'
+    dimensions_xml_lines = [(3, '<Dimension>'),
+                            (4, f'<ows:Identifier>{dim_name}</ows:Identifier>'),
+                            (4, f'<ows:Title>{var_title}</ows:Title>'),
+                            (4, f'<ows:UOM>{units}</ows:UOM>'),
+                            (4, f'<Default>{default}</Default>'),
+                            (4, f'<Current>{current}</Current>')]
+    if coord_bnds_var is not None:
+        coord_bnds_var_values = _get_dimension_value_strings(coord_bnds_var.values)
+        for i in range(len(coord_var)):
+            value1 = coord_bnds_var_values[i, 0]
+            value2 = coord_bnds_var_values[i, 1]
+            dimensions_xml_lines.append((4, f'<Value>{value1}/{value2}</Value>'))
+    else:
+        coord_var_values = _get_dimension_value_strings(coord_var.values)
+        for i in range(len(coord_var)):
+            value = coord_var_values[i]
+            dimensions_xml_lines.append((4, f'<Value>{value}</Value>'))
+    dimensions_xml_lines.append((3, '</Dimension>'))
+    return dimensions_xml_lines
+
+
+def _get_dimension_value_strings(values: np.ndarray) -> np.ndarray:
+    if np.issubdtype(values.dtype, np.datetime64):
+        # Format all timestamps at once, same as str(value) but without a conversion per value
+        return np.datetime_as_string(values)
+    return values
@@ -20,6 +20,7 @@
 # SOFTWARE.
 
 import os
+import tempfile
 
 from . import __version__
 
@@ -28,10 +29,13 @@ DEFAULT_ADDRESS = 'localhost'
 DEFAULT_PORT = 8080
 DEFAULT_CONFIG_FILE = os.path.abspath('xcube_server.yml')
 DEFAULT_TILE_CACHE_SIZE = "512M"
+DEFAULT_CHUNK_CACHE_SIZE = "1G"
 DEFAULT_UPDATE_PERIOD = 2.
 DEFAULT_LOG_PREFIX = os.path.abspath('xcube_server.log')
 DEFAULT_TILE_COMP_MODE = 0
 DEFAULT_TRACE_PERF = False
+DEFAULT_NUM_WORKERS = 1
+DEFAULT_MAX_WORKER_RESTARTS = 100
 
 DEFAULT_CMAP_CBAR = 'jet'
 DEFAULT_CMAP_VMIN = 0.
@@ -39,12 +43,66 @@ DEFAULT_CMAP_VMAX = 1.
 DEFAULT_CMAP_WIDTH = 1
 DEFAULT_CMAP_HEIGHT = 5
 
+_MEGAS = 1000 * 1000
 _GIGAS = 1000 * 1000 * 1000
 
 FILE_TILE_CACHE_CAPACITY = 20 * _GIGAS
+# Default size of the file tile cache shared by multiple worker processes
+DEFAULT_FILE_TILE_CACHE_SIZE = "20G"
 FILE_TILE_CACHE_ENABLED = False
 FILE_TILE_CACHE_PATH = './image-cache'
 
 MEM_TILE_CACHE_CAPACITY = 2 * _GIGAS
 
+MEM_MASK_CACHE_CAPACITY = 256 * _MEGAS
+
+# Maximum number of variants of a cached document or dataset fragment, e.g. for different base URLs
+MAX_DOCUMENT_VARIANTS = 4
+
+PLACE_CACHE_PATH = os.path.join(tempfile.gettempdir(), 'xcube-server-place-cache')
+
+DISK_CHUNK_CACHE_PATH = os.path.join(tempfile.gettempdir(), 'xcube-server-chunk-cache')
+
+# Caches for the chunks of computed datasets materialized in memory or on disk
+MEM_MATERIALIZATION_CACHE_CAPACITY = 512 * _MEGAS
+DISK_MATERIALIZATION_CACHE_CAPACITY = 10 * _GIGAS
+MATERIALIZATION_CACHE_PATH = os.path.join(tempfile.gettempdir(), 'xcube-server-materialization-cache')
+# Minimum number of seconds between checks whether the content of a materialized dataset has changed
+DATASET_CONTENT_CHECK_INTERVAL = 10.0
+
+# Raw copies of local datasets that are memory-mapped but cannot be mapped directly
+RAW_CACHE_PATH = os.path.join(tempfile.gettempdir(), 'xcube-server-raw-cache')
+
+# Default settings of the executors per workload, see xcube_server.executors.
+# Tile computations are CPU-bound and short, so tiles get most of the workers and a long queue.
+# Time-series requests may take long, so their queue is short to reject requests early under load.
+# Tiles are small, so their dask arrays are computed synchronously rather than in another thread pool,
+# while time-series reductions over many chunks are computed in parallel. Tiles of remote datasets
+# are computed in a thread pool, so that the chunks of a tile are fetched concurrently.
+_NUM_CPUS = os.cpu_count() or 1
+DEFAULT_EXECUTORS = {
+    'tiles': dict(MaxWorkers=min(32, _NUM_CPUS + 4), MaxQueueSize=256, DaskScheduler='synchronous'),
+    'remote_tiles': dict(MaxWorkers=min(32, _NUM_CPUS + 4), MaxQueueSize=256, DaskScheduler='threads',
+                         DaskWorkers=16),
+    'time_series': dict(MaxWorkers=max(2, _NUM_CPUS // 2), MaxQueueSize=32, DaskScheduler='threads'),
+    'metadata': dict(MaxWorkers=4, MaxQueueSize=64, DaskScheduler='synchronous'),
+    'legends': dict(MaxWorkers=2, MaxQueueSize=64, DaskScheduler='synchronous'),
+    'places': dict(MaxWorkers=4, MaxQueueSize=64, DaskScheduler='synchronous'),
+}
+# Seconds after which clients may retry a request that was rejected because an executor's queue was full
+DEFAULT_EXECUTOR_RETRY_AFTER = 1
+
+# The event loop lag monitor checks the event loop every EVENT_LOOP_CHECK_INTERVAL seconds and
+# reports if it has been blocked for more than EVENT_LOOP_LAG_THRESHOLD seconds
+EVENT_LOOP_CHECK_INTERVAL = 0.1
+EVENT_LOOP_LAG_THRESHOLD = 0.25
+
+# Number of recent request traces kept for the /traces operations
+TRACE_HISTORY_SIZE = 100
+
+# Maximum number of concurrent requests and connections to an object storage per dataset
+OBS_MAX_CONCURRENCY = 32
+# Seconds for which the ETags and sizes of objects are used to validate chunks in the disk chunk cache
+OBS_OBJECT_INFO_TTL = 60.0
+
 API_PREFIX = f"/api/{__version__}"
@@ -0,0 +1,85 @@
+# The MIT License (MIT)
+# Copyright (c) 2018 by the xcube development team and contributors
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies
+# of the Software, and to permit persons to whom the Software is furnished to do
+# so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import threading
+
+from .compression import GZIP, Compressor, compress, get_content_encodings
+
+
+class EncodedDocument:
+    """
+    A text document that is encoded once, so it can be sent many times without re-encoding it.
+
+    The document data is compressed for all supported content encodings when the document is created,
+    using the encodings' maximum levels. As documents are created by executor tasks, this keeps
+    compression off the IOLoop thread. Other encodings are compressed with fast levels when they are
+    first requested.
+
+    :param text: the document text
+    :param content_type: the document's MIME type
+    :param precompress: whether to compress the data for all supported content encodings at once
+    """
+
+    def __init__(self, text: str, content_type: str, precompress: bool = True):
+        self._text = text
+        self._content_type = content_type
+        self._data = text.encode('utf-8')
+        self._compressed_data = {encoding: compress(self._data, encoding)
+                                 for encoding in get_content_encodings()} if precompress else dict()
+        self._lock = threading.Lock()
+
+    @property
+    def text(self) -> str:
+        """The document text."""
+        return self._text
+
+    @property
+    def content_type(self) -> str:
+        """The document's MIME type."""
+        return self._content_type
+
+    @property
+    def data(self) -> bytes:
+        """The UTF-8 encoded document text."""
+        return self._data
+
+    @property
+    def gzipped_data(self) -> bytes:
+        """The gzip-compressed, UTF-8 encoded document text."""
+        return self.get_compressed_data(GZIP)
+
+    def get_compressed_data(self, encoding: str) -> bytes:
+        """
+        Get the compressed, UTF-8 encoded document text.
+
+        :param encoding: the content encoding, see :func:`xcube_server.compression.get_content_encodings`
+        :return: the compressed data
+        """
+        compressed_data = self._compressed_data.get(encoding)
+        if compressed_data is not None:
+            return compressed_data
+        with self._lock:
+            compressed_data = self._compressed_data.get(encoding)
+            if compressed_data is None:
+                # Fast default level, as this may run on the IOLoop thread
+                compressed_data = Compressor(encoding).compress(self._data, True)
+                self._compressed_data[encoding] = compressed_data
+            return compressed_data
@@ -56,3 +56,18 @@ class ServiceResourceNotFoundError(ServiceError):
 
     def __init__(self, reason: str, log_message: str = None):
         super().__init__(reason, status_code=404, log_message=log_message)
+
+
+class ServiceUnavailableError(ServiceError):
+    """
+    Exception raised by tile service request handlers if a request cannot be served temporarily,
+    e.g. because the service is overloaded.
+
+    :param reason: the reason
+    :param retry_after: optional number of seconds after which the client may retry the request
+    :param log_message: optional log message
+    """
+
+    def __init__(self, reason: str, retry_after: int = None, log_message: str = None):
+        super().__init__(reason, status_code=503, log_message=log_message)
+        self.retry_after = retry_after
@@ -0,0 +1,288 @@
+# The MIT License (MIT)
+# Copyright (c) 2018 by the xcube development team and contributors
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies
+# of the Software, and to permit persons to whom the Software is furnished to do
+# so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Executors per workload.
+
+Request handlers run blocking computations in an executor dedicated to the computation's workload,
+so that e.g. long-running time-series requests cannot occupy the workers needed for tile requests.
+Each executor has a limited number of workers and a limited queue of waiting tasks. If the queue
+is full, new tasks are rejected with a :class:`ServiceUnavailableError`, so that clients get an
+immediate "503 Service Unavailable" response rather than waiting for a growing backlog.
+
+Each executor also has a dask scheduler that computes the dask arrays loaded by its tasks:
+"synchronous" computes them in the task's thread, "threads" in a thread pool, "distributed" in a
+local dask cluster, and "default" uses dask's default scheduler.
+"""
+
+import functools
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+import dask
+import dask.local
+import dask.threaded
+
+from .errors import ServiceUnavailableError
+from .metrics import REGISTRY
+
+__author__ = "Norman Fomferra (Brockmann Consult GmbH)"
+
+EXECUTOR_TILES = 'tiles'
+EXECUTOR_REMOTE_TILES = 'remote_tiles'
+EXECUTOR_TIME_SERIES = 'time_series'
+EXECUTOR_METADATA = 'metadata'
+EXECUTOR_LEGENDS = 'legends'
+EXECUTOR_PLACES = 'places'
+
+DASK_SCHEDULER_DEFAULT = 'default'
+DASK_SCHEDULER_SYNCHRONOUS = 'synchronous'
+DASK_SCHEDULER_THREADS = 'threads'
+DASK_SCHEDULER_DISTRIBUTED = 'distributed'
+DASK_SCHEDULERS = (DASK_SCHEDULER_DEFAULT, DASK_SCHEDULER_SYNCHRONOUS, DASK_SCHEDULER_THREADS,
+                   DASK_SCHEDULER_DISTRIBUTED)
+
+# The dask scheduler of the executor that owns the current thread, see _dispatch_dask_get()
+_THREAD_STATE = threading.local()
+_DASK_DISPATCH_LOCK = threading.Lock()
+_dask_dispatch_installed = False
+
+_EXECUTOR_QUEUED_TASKS = REGISTRY.gauge('xcube_executor_queued_tasks',
+                                        'Number of tasks waiting to be run by an executor',
+                                        ('executor',))
+_EXECUTOR_ACTIVE_TASKS = REGISTRY.gauge('xcube_executor_active_tasks',
+                                        'Number of tasks being run by an executor',
+                                        ('executor',))
+_EXECUTOR_REJECTED_TASKS = REGISTRY.counter('xcube_executor_rejected_tasks_total',
+                                            'Number of tasks rejected because the queue of an executor was full',
+                                            ('executor',))
+
+
+class WorkloadExecutor(ThreadPoolExecutor):
+    """
+    A thread pool executor for a given workload with a limited queue of waiting tasks.
+
+    :param name: the workload name, e.g. "tiles"
+    :param max_workers: the maximum number of worker threads
+    :param max_queue_size: the maximum number of tasks waiting for a worker, None for no limit
+    :param retry_after: seconds after which clients may retry a request whose task was rejected
+    :param dask_scheduler: the dask scheduler used by the tasks, one of ``DASK_SCHEDULERS``
+    :param dask_workers: the number of threads of the "threads" scheduler, None for dask's default thread pool
+    :param dask_client_getter: returns the client of the local dask cluster used by the "distributed" scheduler
+    """
+
+    def __init__(self, name: str, max_workers: int, max_queue_size: Optional[int] = None, retry_after: int = None,
+                 dask_scheduler: str = DASK_SCHEDULER_DEFAULT,
+                 dask_workers: Optional[int] = None,
+                 dask_client_getter: Callable[[], Any] = None):
+        if dask_scheduler not in DASK_SCHEDULERS:
+            raise ValueError(f'dask_scheduler must be one of {DASK_SCHEDULERS}')
+        if dask_scheduler == DASK_SCHEDULER_DISTRIBUTED and dask_client_getter is None:
+            raise ValueError('dask_client_getter must be given for the distributed dask scheduler')
+        self._dask_pool = None
+        if dask_scheduler == DASK_SCHEDULER_SYNCHRONOUS:
+            dask_get = dask.local.get_sync
+        elif dask_scheduler == DASK_SCHEDULER_THREADS and dask_workers:
+            self._dask_pool = ThreadPoolExecutor(max_workers=dask_workers, thread_name_prefix=f'xcube-{name}-dask')
+            dask_get = functools.partial(dask.threaded.get, pool=self._dask_pool)
+        elif dask_scheduler == DASK_SCHEDULER_THREADS:
+            dask_get = dask.threaded.get
+        elif dask_scheduler == DASK_SCHEDULER_DISTRIBUTED:
+            def dask_get(dsk, keys, **kwargs):
+                return dask_client_getter().get(dsk, keys, **kwargs)
+        else:
+            dask_get = None
+        if dask_get is not None:
+            _install_dask_dispatch()
+        super().__init__(max_workers=max_workers, thread_name_prefix=f'xcube-{name}',
+                         initializer=_set_thread_dask_get, initargs=(dask_get,))
+        self._name = name
+        self._max_queue_size = max_queue_size
+        self._retry_after = retry_after
+        self._dask_scheduler = dask_scheduler
+        self._dask_workers = dask_workers
+        self._num_queued_tasks = 0
+        self._admission_lock = threading.Lock()
+        self._queued_tasks = _EXECUTOR_QUEUED_TASKS.labels(name)
+        self._active_tasks = _EXECUTOR_ACTIVE_TASKS.labels(name)
+        self._rejected_tasks = _EXECUTOR_REJECTED_TASKS.labels(name)
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @property
+    def max_workers(self) -> int:
+        return self._max_workers
+
+    @property
+    def max_queue_size(self) -> Optional[int]:
+        return self._max_queue_size
+
+    @property
+    def retry_after(self) -> Optional[int]:
+        return self._retry_after
+
+    @property
+    def dask_scheduler(self) -> str:
+        return self._dask_scheduler
+
+    @property
+    def dask_workers(self) -> Optional[int]:
+        return self._dask_workers
+
+    @property
+    def num_queued_tasks(self) -> int:
+        """The number of tasks waiting for a worker."""
+        return self._num_queued_tasks
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        """
+        Submit a task.
+
+        :raise ServiceUnavailableError: if the queue of waiting tasks is full
+        """
+        with self._admission_lock:
+            if self._max_queue_size is not None and self._num_queued_tasks >= self._max_queue_size:
+                self._rejected_tasks.inc()
+                raise ServiceUnavailableError(f'Too many pending {self._name} requests, please retry later',
+                                              retry_after=self._retry_after)
+            self._num_queued_tasks += 1
+        return self._submit_queued_task(fn, args, kwargs)
+
+    def submit_admitted(self, fn: Callable, *args, **kwargs) -> Future:
+        """
+        Submit a further task of a request that has already been admitted, e.g. the next block
+        of a streamed response. The task is queued even if the queue of waiting tasks is full,
+        because the request could otherwise not be completed.
+        """
+        with self._admission_lock:
+            self._num_queued_tasks += 1
+        return self._submit_queued_task(fn, args, kwargs)
+
+    def _submit_queued_task(self, fn: Callable, args, kwargs) -> Future:
+        self._queued_tasks.inc()
+        try:
+            return super().submit(self._run_task, fn, args, kwargs)
+        except BaseException:
+            self._task_started()
+            raise
+
+    def _run_task(self, fn: Callable, args, kwargs) -> Any:
+        self._task_started()
+        self._active_tasks.inc()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            self._active_tasks.dec()
+
+    def _task_started(self):
+        with self._admission_lock:
+            self._num_queued_tasks -= 1
+        self._queued_tasks.dec()
+
+    def shutdown(self, wait: bool = True, **kwargs):
+        super().shutdown(wait=wait, **kwargs)
+        if self._dask_pool is not None:
+            self._dask_pool.shutdown(wait=wait)
+
+
+def _set_thread_dask_get(dask_get: Optional[Callable]):
+    _THREAD_STATE.dask_get = dask_get
+
+
+def _dispatch_dask_get(dsk, keys, **kwargs):
+    """
+    A dask scheduler that dispatches to the scheduler of the executor that owns the current thread.
+    Other threads use dask's threaded scheduler.
+    """
+    dask_get = getattr(_THREAD_STATE, 'dask_get', None) or dask.threaded.get
+    return dask_get(dsk, keys, **kwargs)
+
+
+def _install_dask_dispatch():
+    global _dask_dispatch_installed
+    with _DASK_DISPATCH_LOCK:
+        if not _dask_dispatch_installed:
+            dask.config.set(scheduler=_dispatch_dask_get)
+            _dask_dispatch_installed = True
+
+
+def new_executor(name: str,
+                 settings: Dict[str, Any],
+                 default_retry_after: int = None,
+                 dask_client_getter: Callable[[], Any] = None) -> WorkloadExecutor:
+    """
+    Create an executor from its settings in the service configuration.
+
+    :param name: the workload name
+    :param settings: the settings with entries "MaxWorkers", and optionally "MaxQueueSize", "RetryAfter",
+        "DaskScheduler", and "DaskWorkers"
+    :param default_retry_after: the value used if "RetryAfter" is not given
+    :param dask_client_getter: returns the client of the local dask cluster used by the "distributed" scheduler
+    :return: a new executor
+    :raise ValueError: if the settings are invalid
+    """
+    max_workers = settings.get('MaxWorkers')
+    max_queue_size = settings.get('MaxQueueSize')
+    retry_after = settings.get('RetryAfter', default_retry_after)
+    dask_scheduler = settings.get('DaskScheduler', DASK_SCHEDULER_DEFAULT)
+    dask_workers = settings.get('DaskWorkers')
+    if not isinstance(max_workers, int) or max_workers <= 0:
+        raise ValueError(f'MaxWorkers of executor {name!r} must be a positive integer')
+    if max_queue_size is not None and (not isinstance(max_queue_size, int) or max_queue_size < 0):
+        raise ValueError(f'MaxQueueSize of executor {name!r} must be a non-negative integer')
+    if dask_scheduler not in DASK_SCHEDULERS:
+        raise ValueError(f'DaskScheduler of executor {name!r} must be one of {", ".join(DASK_SCHEDULERS)}')
+    if dask_workers is not None and (not isinstance(dask_workers, int) or dask_workers <= 0):
+        raise ValueError(f'DaskWorkers of executor {name!r} must be a positive integer')
+    if dask_scheduler == DASK_SCHEDULER_DISTRIBUTED and dask_client_getter is None:
+        raise ValueError(f'DaskScheduler of executor {name!r} must not be distributed')
+    return WorkloadExecutor(name, max_workers, max_queue_size=max_queue_size, retry_after=retry_after,
+                            dask_scheduler=dask_scheduler, dask_workers=dask_workers,
+                            dask_client_getter=dask_client_getter)
+
+
+def new_dask_client(settings: Dict[str, Any]) -> Any:
+    """
+    Start a local dask cluster from its settings in the service configuration and connect to it.
+    The cluster's workers run in threads of this process, unless "Processes" is true.
+
+    :param settings: the settings with optional entries "NumWorkers", "ThreadsPerWorker", and "Processes"
+    :return: a ``distributed.Client`` connected to the new cluster
+    :raise ValueError: if the settings are invalid or the package "distributed" is not installed
+    """
+    num_workers = settings.get('NumWorkers')
+    threads_per_worker = settings.get('ThreadsPerWorker')
+    processes = settings.get('Processes', False)
+    if num_workers is not None and (not isinstance(num_workers, int) or num_workers <= 0):
+        raise ValueError('NumWorkers of dask cluster must be a positive integer')
+    if threads_per_worker is not None and (not isinstance(threads_per_worker, int) or threads_per_worker <= 0):
+        raise ValueError('ThreadsPerWorker of dask cluster must be a positive integer')
+    try:
+        import distributed
+    except ImportError as e:
+        raise ValueError(f'a dask cluster requires the package "distributed": {e}') from e
+    cluster = distributed.LocalCluster(n_workers=num_workers,
+                                       threads_per_worker=threads_per_worker,
+                                       processes=bool(processes))
+    return distributed.Client(cluster, set_as_default=False)
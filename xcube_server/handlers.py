@@ -19,18 +19,25 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-import json
-
-from tornado.ioloop import IOLoop
+import functools
+from typing import Any, Dict
 
 from . import __version__, __description__
-from .controllers.catalogue import get_datasets, get_dataset_coordinates, get_color_bars, get_dataset
+from . import metrics
+from . import perf
+from .context import ServiceContext
+from .controllers.catalogue import get_datasets_document, get_dataset_coordinates, get_color_bars, \
+    get_dataset_document
 from .controllers.places import find_places, find_dataset_places
 from .controllers.tiles import get_dataset_tile, get_dataset_tile_grid, get_ne2_tile, get_ne2_tile_grid, get_legend
 from .controllers.time_series import get_time_series_info, get_time_series_for_point, get_time_series_for_geometry, \
-    get_time_series_for_geometry_collection, get_time_series_for_feature_collection
-from .controllers.wmts import get_wmts_capabilities_xml
-from .errors import ServiceBadRequestError
+    get_time_series_for_geometry_collection, get_time_series_for_feature_collection, iter_time_series_for_point, \
+    iter_time_series_for_geometry, iter_time_series_for_geometry_collection, iter_time_series_for_feature_collection
+from .controllers.wmts import get_wmts_capabilities
+from .errors import ServiceBadRequestError, ServiceResourceNotFoundError
+from .executors import EXECUTOR_TILES, EXECUTOR_REMOTE_TILES, EXECUTOR_TIME_SERIES, EXECUTOR_METADATA, \
+    EXECUTOR_LEGENDS, EXECUTOR_PLACES
+from .reqparams import RequestParams
 from .service import ServiceRequestHandler
 
 __author__ = "Norman Fomferra (Brockmann Consult GmbH)"
@@ -68,12 +75,10 @@ class WMTSKvpHandler(ServiceRequestHandler):
             version = self.params.get_query_argument("version", _WMTS_VERSION)
             if version != _WMTS_VERSION:
                 raise ServiceBadRequestError(f'Value for "version" parameter must be "{_WMTS_VERSION}"')
-            capabilities = await IOLoop.current().run_in_executor(None,
-                                                                  get_wmts_capabilities_xml,
-                                                                  self.service_context,
-                                                                  self.base_url)
-            self.set_header("Content-Type", "application/xml")
-            self.finish(capabilities)
+            capabilities = await self.run_in_executor(EXECUTOR_METADATA, get_wmts_capabilities,
+                                                      self.service_context,
+                                                      self.base_url)
+            self.finish_document(capabilities)
         elif request == "GetTile":
             version = self.params.get_query_argument("version", _WMTS_VERSION)
             if version != _WMTS_VERSION:
@@ -92,12 +97,11 @@ class WMTSKvpHandler(ServiceRequestHandler):
             x = self.params.get_query_argument_int("tilecol")
             y = self.params.get_query_argument_int("tilerow")
             z = self.params.get_query_argument_int("tilematrix")
-            tile = await IOLoop.current().run_in_executor(None,
-                                                          get_dataset_tile,
-                                                          self.service_context,
-                                                          ds_id, var_name,
-                                                          x, y, z,
-                                                          self.params)
+            tile = await self.run_in_executor(_get_tile_workload(self.service_context, ds_id), get_dataset_tile,
+                                              self.service_context,
+                                              ds_id, var_name,
+                                              x, y, z,
+                                              self.params)
             self.set_header("Content-Type", "image/png")
             self.finish(tile)
         elif request == "GetFeatureInfo":
@@ -121,53 +125,57 @@ class WMTSKvpHandler(ServiceRequestHandler):
 class GetWMTSCapabilitiesXmlHandler(ServiceRequestHandler):
 
     async def get(self):
-        capabilities = await IOLoop.current().run_in_executor(None,
-                                                              get_wmts_capabilities_xml,
-                                                              self.service_context,
-                                                              self.base_url)
-        self.set_header('Content-Type', 'application/xml')
-        self.finish(capabilities)
+        capabilities = await self.run_in_executor(EXECUTOR_METADATA, get_wmts_capabilities,
+                                                  self.service_context,
+                                                  self.base_url)
+        self.finish_document(capabilities)
 
 
 # noinspection PyAbstractClass
 class GetDatasetsHandler(ServiceRequestHandler):
 
-    def get(self):
+    async def get(self):
         details = bool(int(self.params.get_query_argument('details', '0')))
         tile_client = self.params.get_query_argument('tiles', None)
-        response = get_datasets(self.service_context, details=details, client=tile_client, base_url=self.base_url)
-        self.set_header('Content-Type', 'application/json')
-        self.write(json.dumps(response, indent=None if details else 2))
+        document = await self.run_in_executor(EXECUTOR_METADATA,
+                                              functools.partial(get_datasets_document,
+                                                                self.service_context,
+                                                                details=details, client=tile_client,
+                                                                base_url=self.base_url, pretty=self.pretty))
+        self.finish_document(document)
 
 
+# noinspection PyAbstractClass
 class GetDatasetHandler(ServiceRequestHandler):
 
-    def get(self, ds_id: str):
+    async def get(self, ds_id: str):
         tile_client = self.params.get_query_argument('tiles', None)
-        response = get_dataset(self.service_context, ds_id, client=tile_client, base_url=self.base_url)
-        self.set_header('Content-Type', 'application/json')
-        self.write(json.dumps(response, indent=2))
+        document = await self.run_in_executor(EXECUTOR_METADATA,
+                                              functools.partial(get_dataset_document,
+                                                                self.service_context, ds_id,
+                                                                client=tile_client, base_url=self.base_url,
+                                                                pretty=self.pretty))
+        self.finish_document(document)
 
 
 # noinspection PyAbstractClass
 class GetDatasetCoordsHandler(ServiceRequestHandler):
 
-    def get(self, ds_id: str, dim_name: str):
-        response = get_dataset_coordinates(self.service_context, ds_id, dim_name)
-        self.set_header('Content-Type', 'application/json')
-        self.write(json.dumps(response, indent=2))
+    async def get(self, ds_id: str, dim_name: str):
+        response = await self.run_in_executor(EXECUTOR_METADATA, get_dataset_coordinates,
+                                              self.service_context, ds_id, dim_name)
+        self.finish_json(response)
 
 
 # noinspection PyAbstractClass,PyBroadException
 class GetDatasetVarTileHandler(ServiceRequestHandler):
 
     async def get(self, ds_id: str, var_name: str, z: str, x: str, y: str):
-        tile = await IOLoop.current().run_in_executor(None,
-                                                      get_dataset_tile,
-                                                      self.service_context,
-                                                      ds_id, var_name,
-                                                      x, y, z,
-                                                      self.params)
+        tile = await self.run_in_executor(_get_tile_workload(self.service_context, ds_id), get_dataset_tile,
+                                          self.service_context,
+                                          ds_id, var_name,
+                                          x, y, z,
+                                          self.params)
         self.set_header('Content-Type', 'image/png')
         self.finish(tile)
 
@@ -176,11 +184,10 @@ class GetDatasetVarTileHandler(ServiceRequestHandler):
 class GetDatasetVarLegendHandler(ServiceRequestHandler):
 
     async def get(self, ds_id: str, var_name: str):
-        tile = await IOLoop.current().run_in_executor(None,
-                                                      get_legend,
-                                                      self.service_context,
-                                                      ds_id, var_name,
-                                                      self.params)
+        tile = await self.run_in_executor(EXECUTOR_LEGENDS, get_legend,
+                                          self.service_context,
+                                          ds_id, var_name,
+                                          self.params)
         self.set_header('Content-Type', 'image/png')
         self.finish(tile)
 
@@ -188,24 +195,23 @@ class GetDatasetVarLegendHandler(ServiceRequestHandler):
 # noinspection PyAbstractClass
 class GetDatasetVarTileGridHandler(ServiceRequestHandler):
 
-    def get(self, ds_id: str, var_name: str):
+    async def get(self, ds_id: str, var_name: str):
         tile_client = self.params.get_query_argument('tiles', "ol4")
-        response = get_dataset_tile_grid(self.service_context,
-                                         ds_id, var_name,
-                                         tile_client, self.base_url)
-        self.set_header('Content-Type', 'application/json')
-        self.write(json.dumps(response, indent=2))
+        response = await self.run_in_executor(EXECUTOR_METADATA, get_dataset_tile_grid,
+                                              self.service_context,
+                                              ds_id, var_name,
+                                              tile_client, self.base_url)
+        self.finish_json(response)
 
 
 # noinspection PyAbstractClass
 class GetNE2TileHandler(ServiceRequestHandler):
 
     async def get(self, z: str, x: str, y: str):
-        response = await IOLoop.current().run_in_executor(None,
-                                                          get_ne2_tile,
-                                                          self.service_context,
-                                                          x, y, z,
-                                                          self.params)
+        response = await self.run_in_executor(EXECUTOR_TILES, get_ne2_tile,
+                                              self.service_context,
+                                              x, y, z,
+                                              self.params)
         self.set_header('Content-Type', 'image/jpg')
         self.finish(response)
 
@@ -216,8 +222,7 @@ class GetNE2TileGridHandler(ServiceRequestHandler):
     def get(self):
         tile_client = self.params.get_query_argument('tiles', "ol4")
         response = get_ne2_tile_grid(self.service_context, tile_client, self.base_url)
-        self.set_header('Content-Type', 'application/json')
-        self.write(json.dumps(response, indent=2))
+        self.finish_json(response)
 
 
 # noinspection PyAbstractClass
@@ -246,74 +251,132 @@ class GetColorBarsHtmlHandler(ServiceRequestHandler):
 class GetPlaceGroupsHandler(ServiceRequestHandler):
 
     # noinspection PyShadowingBuiltins
-    def get(self):
-        response = self.service_context.get_place_groups()
-        self.set_header('Content-Type', "application/json")
-        self.write(json.dumps(response, indent=2))
+    async def get(self):
+        response = await self.run_in_executor(EXECUTOR_PLACES, self.service_context.get_place_groups)
+        self.finish_json(response)
 
 
 # noinspection PyAbstractClass
 class FindPlacesHandler(ServiceRequestHandler):
 
     # noinspection PyShadowingBuiltins
-    def get(self, collection_name: str):
+    async def get(self, collection_name: str):
         query_expr = self.params.get_query_argument("query", None)
         geom_wkt = self.params.get_query_argument("geom", None)
         box_coords = self.params.get_query_argument("bbox", None)
         comb_op = self.params.get_query_argument("comb", "and")
         if geom_wkt and box_coords:
             raise ServiceBadRequestError('Only one of "geom" and "bbox" may be given')
-        response = find_places(self.service_context,
-                               collection_name,
-                               geom_wkt=geom_wkt, box_coords=box_coords,
-                               query_expr=query_expr, comb_op=comb_op)
-        self.set_header('Content-Type', "application/json")
-        self.write(json.dumps(response, indent=2))
+        response = await self.run_in_executor(EXECUTOR_PLACES,
+                                              functools.partial(find_places,
+                                                                self.service_context,
+                                                                collection_name,
+                                                                geom_wkt=geom_wkt, box_coords=box_coords,
+                                                                query_expr=query_expr, comb_op=comb_op,
+                                                                **_get_place_page_params(self.params)))
+        self.finish_json(response)
 
     # noinspection PyShadowingBuiltins
-    def post(self, collection_name: str):
+    async def post(self, collection_name: str):
         query_expr = self.params.get_query_argument("query", None)
         comb_op = self.params.get_query_argument("comb", "and")
         geojson_obj = self.get_body_as_json_object()
-        response = find_places(self.service_context,
-                               collection_name,
-                               geojson_obj=geojson_obj,
-                               query_expr=query_expr, comb_op=comb_op)
-        self.set_header('Content-Type', "application/json")
-        self.write(json.dumps(response, indent=2))
+        response = await self.run_in_executor(EXECUTOR_PLACES,
+                                              functools.partial(find_places,
+                                                                self.service_context,
+                                                                collection_name,
+                                                                geojson_obj=geojson_obj,
+                                                                query_expr=query_expr, comb_op=comb_op,
+                                                                **_get_place_page_params(self.params)))
+        self.finish_json(response)
 
 
 # noinspection PyAbstractClass
 class FindDatasetPlacesHandler(ServiceRequestHandler):
 
     # noinspection PyShadowingBuiltins
-    def get(self, collection_name: str, ds_id: str):
+    async def get(self, collection_name: str, ds_id: str):
         query_expr = self.params.get_query_argument("query", None)
         comb_op = self.params.get_query_argument("comb", "and")
-        response = find_dataset_places(self.service_context,
-                                       collection_name, ds_id,
-                                       query_expr=query_expr, comb_op=comb_op)
-        self.set_header('Content-Type', "application/json")
-        self.write(json.dumps(response, indent=2))
+        response = await self.run_in_executor(EXECUTOR_PLACES,
+                                              functools.partial(find_dataset_places,
+                                                                self.service_context,
+                                                                collection_name, ds_id,
+                                                                query_expr=query_expr, comb_op=comb_op,
+                                                                **_get_place_page_params(self.params)))
+        self.finish_json(response)
+
+
+# noinspection PyAbstractClass
+class MetricsHandler(ServiceRequestHandler):
+
+    def get(self):
+        self.set_header('Content-Type', metrics.CONTENT_TYPE)
+        self.finish(metrics.REGISTRY.to_text())
+
+
+# noinspection PyAbstractClass
+class GetTracesHandler(ServiceRequestHandler):
+
+    def get(self):
+        _assert_tracing_enabled(self.service_context)
+        traces = perf.get_recent_traces()
+        if _is_chrome_trace_format(self.params):
+            self.finish_json(perf.traces_to_chrome_trace_json_object(traces))
+        else:
+            self.finish_json(dict(traces=[dict(id=trace.id,
+                                               name=trace.name,
+                                               duration=trace.duration,
+                                               attributes=trace.attributes) for trace in reversed(traces)]))
+
+
+# noinspection PyAbstractClass
+class GetTraceHandler(ServiceRequestHandler):
+
+    def get(self, trace_id: str):
+        _assert_tracing_enabled(self.service_context)
+        trace = perf.get_trace(trace_id)
+        if trace is None:
+            raise ServiceResourceNotFoundError(f'Trace "{trace_id}" not found')
+        if _is_chrome_trace_format(self.params):
+            self.finish_json(perf.traces_to_chrome_trace_json_object([trace]))
+        else:
+            self.finish_json(trace.to_dict())
+
+
+def _get_tile_workload(ctx: ServiceContext, ds_id: str) -> str:
+    # Chunks of remote datasets are fetched concurrently by the dask threads of the remote tiles executor
+    return EXECUTOR_REMOTE_TILES if ctx.is_remote_dataset(ds_id) else EXECUTOR_TILES
+
+
+def _assert_tracing_enabled(ctx: ServiceContext):
+    # Traces expose the paths and attributes of other clients' requests
+    if not ctx.tracing_enabled:
+        raise ServiceResourceNotFoundError('Tracing is not enabled')
+
+
+def _is_chrome_trace_format(params: RequestParams) -> bool:
+    trace_format = params.get_query_argument('format', default='json')
+    if trace_format not in ('json', 'chrome'):
+        raise ServiceBadRequestError('Parameter "format" must be either "json" or "chrome"')
+    return trace_format == 'chrome'
 
 
 # noinspection PyAbstractClass
 class InfoHandler(ServiceRequestHandler):
 
     def get(self):
-        self.set_header('Content-Type', 'application/json')
-        self.write(json.dumps(dict(name='xcube_server',
-                                   description=__description__,
-                                   version=__version__), indent=2))
+        self.finish_json(dict(name='xcube_server',
+                              description=__description__,
+                              version=__version__))
 
 
 # noinspection PyAbstractClass
 class GetTimeSeriesInfoHandler(ServiceRequestHandler):
 
     async def get(self):
-        response = await IOLoop.current().run_in_executor(None, get_time_series_info, self.service_context)
-        self.set_header('Content-Type', 'application/json')
-        self.finish(response)
+        response = await self.run_in_executor(EXECUTOR_METADATA, get_time_series_info, self.service_context)
+        self.finish_json(response)
 
 
 # noinspection PyAbstractClass
@@ -325,14 +388,21 @@ class GetTimeSeriesForPointHandler(ServiceRequestHandler):
         start_date = self.params.get_query_argument_datetime('startDate', default=None)
         end_date = self.params.get_query_argument_datetime('endDate', default=None)
 
-        response = await IOLoop.current().run_in_executor(None,
-                                                          get_time_series_for_point,
-                                                          self.service_context,
-                                                          ds_id, var_name,
-                                                          lon, lat,
-                                                          start_date, end_date)
-        self.set_header('Content-Type', 'application/json')
-        self.finish(response)
+        if self.params.get_query_argument_int('stream', 0) != 0:
+            blocks = await self.run_in_executor(EXECUTOR_TIME_SERIES, iter_time_series_for_point,
+                                                self.service_context,
+                                                ds_id, var_name,
+                                                lon, lat,
+                                                start_date, end_date)
+            await self.finish_ndjson(blocks)
+            return
+
+        response = await self.run_in_executor(EXECUTOR_TIME_SERIES, get_time_series_for_point,
+                                              self.service_context,
+                                              ds_id, var_name,
+                                              lon, lat,
+                                              start_date, end_date)
+        self.finish_json(response)
 
 
 # noinspection PyAbstractClass
@@ -343,14 +413,21 @@ class GetTimeSeriesForGeometryHandler(ServiceRequestHandler):
         end_date = self.params.get_query_argument_datetime('endDate', default=None)
         geometry = self.get_body_as_json_object("GeoJSON geometry")
 
-        response = await IOLoop.current().run_in_executor(None,
-                                                          get_time_series_for_geometry,
-                                                          self.service_context,
-                                                          ds_id, var_name,
-                                                          geometry,
-                                                          start_date, end_date)
-        self.set_header('Content-Type', 'application/json')
-        self.finish(response)
+        if self.params.get_query_argument_int('stream', 0) != 0:
+            blocks = await self.run_in_executor(EXECUTOR_TIME_SERIES, iter_time_series_for_geometry,
+                                                self.service_context,
+                                                ds_id, var_name,
+                                                geometry,
+                                                start_date, end_date)
+            await self.finish_ndjson(blocks)
+            return
+
+        response = await self.run_in_executor(EXECUTOR_TIME_SERIES, get_time_series_for_geometry,
+                                              self.service_context,
+                                              ds_id, var_name,
+                                              geometry,
+                                              start_date, end_date)
+        self.finish_json(response)
 
 
 # noinspection PyAbstractClass
@@ -361,14 +438,21 @@ class GetTimeSeriesForGeometriesHandler(ServiceRequestHandler):
         end_date = self.params.get_query_argument_datetime('endDate', default=None)
         geometry_collection = self.get_body_as_json_object("GeoJSON geometry collection")
 
-        response = await IOLoop.current().run_in_executor(None,
-                                                          get_time_series_for_geometry_collection,
-                                                          self.service_context,
-                                                          ds_id, var_name,
-                                                          geometry_collection,
-                                                          start_date, end_date)
-        self.set_header('Content-Type', 'application/json')
-        self.finish(response)
+        if self.params.get_query_argument_int('stream', 0) != 0:
+            blocks = await self.run_in_executor(EXECUTOR_TIME_SERIES, iter_time_series_for_geometry_collection,
+                                                self.service_context,
+                                                ds_id, var_name,
+                                                geometry_collection,
+                                                start_date, end_date)
+            await self.finish_ndjson(blocks)
+            return
+
+        response = await self.run_in_executor(EXECUTOR_TIME_SERIES, get_time_series_for_geometry_collection,
+                                              self.service_context,
+                                              ds_id, var_name,
+                                              geometry_collection,
+                                              start_date, end_date)
+        self.finish_json(response)
 
 
 # noinspection PyAbstractClass
@@ -379,11 +463,26 @@ class GetTimeSeriesForFeaturesHandler(ServiceRequestHandler):
         end_date = self.params.get_query_argument_datetime('endDate', default=None)
         feature_collection = self.get_body_as_json_object("GeoJSON feature collection")
 
-        response = await IOLoop.current().run_in_executor(None,
-                                                          get_time_series_for_feature_collection,
-                                                          self.service_context,
-                                                          ds_id, var_name,
-                                                          feature_collection,
-                                                          start_date, end_date)
-        self.set_header('Content-Type', 'application/json')
-        self.finish(response)
+        if self.params.get_query_argument_int('stream', 0) != 0:
+            blocks = await self.run_in_executor(EXECUTOR_TIME_SERIES, iter_time_series_for_feature_collection,
+                                                self.service_context,
+                                                ds_id, var_name,
+                                                feature_collection,
+                                                start_date, end_date)
+            await self.finish_ndjson(blocks)
+            return
+
+        response = await self.run_in_executor(EXECUTOR_TIME_SERIES, get_time_series_for_feature_collection,
+                                              self.service_context,
+                                              ds_id, var_name,
+                                              feature_collection,
+                                              start_date, end_date)
+        self.finish_json(response)
+
+
+def _get_place_page_params(params: RequestParams) -> Dict[str, Any]:
+    property_names = params.get_query_argument("properties", None)
+    return dict(limit=params.get_query_argument_int("limit", None),
+                offset=params.get_query_argument_int("offset", 0),
+                cursor=params.get_query_argument("cursor", None),
+                property_names=property_names.split(",") if property_names is not None else None)
@@ -33,12 +33,17 @@ from .cmaps import ensure_cmaps_loaded
 from .tilegrid import TileGrid, GeoExtent, GLOBAL_GEO_EXTENT
 from .utils import downsample_ndarray, aggregate_ndarray_first
 from ..cache import Cache
-from ..perf import measure_time_cm
+from ..metrics import REGISTRY
+from ..perf import measure_time_cm, trace_span
 
 __author__ = "Norman Fomferra (Brockmann Consult GmbH)"
 
 _LOG = logging.getLogger('xcube')
 
+_TILE_STAGE_SECONDS = REGISTRY.histogram('xcube_tile_stage_seconds',
+                                         'Time spent in the stages of tile computations, in seconds',
+                                         ('image', 'stage'))
+
 X = int
 Y = int
 Width = int
@@ -203,6 +208,7 @@ class OpImage(AbstractTiledImage, metaclass=ABCMeta):
         super().__init__(size, tile_size, num_tiles, mode=mode, format=format, image_id=image_id)
         self._tile_cache = tile_cache
         self._trace_perf = trace_perf
+        self._stage_observers = dict()
 
     @property
     def tile_cache(self) -> Cache:
@@ -210,26 +216,29 @@ class OpImage(AbstractTiledImage, metaclass=ABCMeta):
 
     def get_tile(self, tile_x: int, tile_y: int) -> Tile:
 
-        measure_time = self.measure_time
         tile_id = self.get_tile_id(tile_x, tile_y)
-        tile_tag = self.__get_tile_tag(tile_id)
         tile_cache = self._tile_cache
 
-        if tile_cache:
-            with measure_time(tile_tag + 'queried in tile cache'):
-                tile = tile_cache.get_value(tile_id)
-            if tile is not None:
-                if self._trace_perf:
-                    _LOG.info(tile_tag + 'restored from tile cache')
-                return tile
+        with trace_span('get tile') as span:
+            if span.is_recording:
+                span.set_attribute('image_type', type(self).__name__)
+                span.set_attribute('tile', tile_id)
+
+            if tile_cache:
+                with self.measure_stage('queried in tile cache'):
+                    tile = tile_cache.get_value(tile_id)
+                if tile is not None:
+                    if self._trace_perf:
+                        _LOG.info(self.__get_tile_tag(tile_id) + 'restored from tile cache')
+                    return tile
 
-        with measure_time(tile_tag + 'computed'):
-            tw, th = self.tile_size
-            tile = self.compute_tile(tile_x, tile_y, (tw * tile_x, th * tile_y, tw, th))
+            with self.measure_stage('computed'):
+                tw, th = self.tile_size
+                tile = self.compute_tile(tile_x, tile_y, (tw * tile_x, th * tile_y, tw, th))
 
-        if tile_cache:
-            with measure_time(tile_tag + 'stored in tile cache'):
-                tile_cache.put_value(tile_id, tile)
+            if tile_cache:
+                with self.measure_stage('stored in tile cache'):
+                    tile_cache.put_value(tile_id, tile)
 
         return tile
 
@@ -258,9 +267,19 @@ class OpImage(AbstractTiledImage, metaclass=ABCMeta):
         """ A context manager to measure execution time of code blocks. """
         return measure_time_cm(disabled=not self._trace_perf)
 
-    def _get_tile_tag(self, tile_x: int, tile_y: int) -> str:
-        """ Use to log tile computation info """
-        return self.__get_tile_tag(self.get_tile_id(tile_x, tile_y))
+    def measure_stage(self, stage: str):
+        """
+        A context manager to measure the execution time of a stage of a tile computation.
+        The time is always recorded in the tile stage metrics. If the current request is traced,
+        the stage is recorded as a span, see :func:`xcube_server.perf.trace_span`.
+
+        :param stage: the name of the stage, e.g. "map colors"
+        """
+        observe = self._stage_observers.get(stage)
+        if observe is None:
+            observe = _TILE_STAGE_SECONDS.labels(type(self).__name__, stage).observe
+            self._stage_observers[stage] = observe
+        return trace_span(stage, observe=observe)
 
     @staticmethod
     def __get_tile_tag(tile_id: str) -> str:
@@ -380,23 +399,20 @@ class TransformArrayImage(DecoratorImage):
         return target_tile
 
     def compute_tile_from_source_tile(self, tile_x: int, tile_y: int, rectangle: Rectangle2D, tile: Tile) -> Tile:
-        measure_time = self.measure_time
-        tile_tag = self._get_tile_tag(tile_x, tile_y)
-
         if self._force_2d and tile.ndim > 2:
-            with measure_time(tile_tag + "index"):
+            with self.measure_stage("index"):
                 # Create 2D subset using basic indexing
                 # noinspection PyTypeChecker
                 index = (tile.ndim - 2) * [0] + [slice(None), slice(None)]
                 tile = tile[index]
 
         if self._flip_y:
-            with measure_time(tile_tag + "flip y"):
+            with self.measure_stage("flip y"):
                 # Flip tile using fancy indexing
                 tile = tile[..., ::-1, :]
 
         if self._force_masked and not np.ma.is_masked(tile):
-            with measure_time(tile_tag + "mask"):
+            with self.measure_stage("mask"):
                 # if tile is not masked
                 if self._no_data_value is not None:
                     # and we have a fill value, return a masked tile
@@ -456,10 +472,7 @@ class ColorMappedRgbaImage(DecoratorImage):
     def compute_tile_from_source_tile(self,
                                       tile_x: int, tile_y: int,
                                       rectangle: Rectangle2D, source_tile: Tile) -> Tile:
-        measure_time = self.measure_time
-        tile_tag = self._get_tile_tag(tile_x, tile_y)
-
-        with measure_time(tile_tag + "mask"):
+        with self.measure_stage("mask"):
             value_min, value_max = self._value_range
             if not np.ma.is_masked(source_tile):
                 if self._no_data_value is not None:
@@ -485,18 +498,18 @@ class ColorMappedRgbaImage(DecoratorImage):
 
         # check if we can optimize the following calls by using Numexpr
         # see https://github.com/pydata/numexpr/wiki/Numexpr-Users-Guide
-        with measure_time(tile_tag + "normalise"):
+        with self.measure_stage("normalise"):
             array -= value_min
             array *= 1.0 / (value_max - value_min)
 
-        with measure_time(tile_tag + "map colors"):
+        with self.measure_stage("map colors"):
             array = self._cmap(array, bytes=True)
 
-        with measure_time(tile_tag + "create image"):
+        with self.measure_stage("create image"):
             image = Image.fromarray(array, mode=self.mode)
 
         if self._encode and self.format:
-            with measure_time(tile_tag + "encode PNG"):
+            with self.measure_stage("encode PNG"):
                 ostream = io.BytesIO()
                 image.save(ostream, format=self.format)
                 encoded_image = ostream.getvalue()
@@ -574,9 +587,6 @@ class ColorMappedRgbaImage2(OpImage):
                      tile_x: int, tile_y: int,
                      rectangle: Rectangle2D) -> Tile:
 
-        measure_time = self.measure_time
-        tile_tag = self._get_tile_tag(tile_x, tile_y)
-
         valid_min, valid_max = self._valid_range
         no_data_value = self._no_data_value
         cmap_min, cmap_max = self._cmap_range
@@ -590,19 +600,19 @@ class ColorMappedRgbaImage2(OpImage):
             y = tile_y * tile_size_y
             sy = -1
 
-        with measure_time(tile_tag + "subset"):
+        with self.measure_stage("subset"):
             tile = self._array[..., y:y + h:sy, x:x + w]
 
-        with measure_time(tile_tag + "values"):
+        with self.measure_stage("values"):
             # convert tile into numpy array
             if hasattr(tile, "values"):
                 tile = tile.values
 
-        with measure_time(tile_tag + "trim"):
+        with self.measure_stage("trim"):
             # ensure that our tile size is w x h
             tile = trim_tile(tile, self.tile_size)
 
-        with measure_time(tile_tag + "map colors"):
+        with self.measure_stage("map colors"):
             shape = tile.shape
             tile = tile.flatten()
             tile = map_colors(tile,
@@ -615,10 +625,10 @@ class ColorMappedRgbaImage2(OpImage):
                               no_data_value)
             tile = tile.reshape(shape + (4,))
 
-        with measure_time(tile_tag + "make image"):
+        with self.measure_stage("make image"):
             image = Image.fromarray(tile, mode=self.mode)
 
-        with measure_time(tile_tag + "save PNG"):
+        with self.measure_stage("save PNG"):
             if self._encode and self.format:
                 # Saving a PNG file is slow: https://github.com/python-pillow/Pillow/issues/1211
                 ostream = io.BytesIO()
@@ -829,9 +839,6 @@ class FastNdarrayDownsamplingImage(OpImage):
         self._empty_tile = None
 
     def compute_tile(self, tile_x: int, tile_y: int, rectangle: Rectangle2D) -> Tile:
-        measure_time = self.measure_time
-        tile_tag = self._get_tile_tag(tile_x, tile_y)
-
         x, y, w, h = rectangle
         s = self._step_size
         x *= s
@@ -860,21 +867,21 @@ class FastNdarrayDownsamplingImage(OpImage):
         # We could use slices with 'zoom' as step size, but this is incredibly slow when using xarray with dask!
         # 0.4 vs. 0.025 secs for 220x220 pixel tiles for chunked, compressed SST data.
         # tile = self._array[..., y:y + h:s, x:x + w:s]
-        with measure_time(tile_tag + "subset array"):
+        with self.measure_stage("subset array"):
             tile = self._array[..., y:y + h, x:x + w]
 
         # Let's see if it has the xarray.DataArray.load() method.
         # Pre-loading of tile data makes it easier to find bottlenecks in the image processing chain.
         if hasattr(tile, 'load'):
-            with measure_time(tile_tag + "load"):
+            with self.measure_stage("load"):
                 tile.load()
 
         # We do the resampling to lower resolution after loading the data, which is MUCH faster, see note above.
-        with measure_time(tile_tag + "down-sample"):
+        with self.measure_stage("down-sample"):
             tile = tile[..., ::s, ::s]
 
         # ensure that our tile size is w x h: resize and fill in background value.
-        with measure_time(tile_tag + "trim"):
+        with self.measure_stage("trim"):
             tile = trim_tile(tile, self.tile_size)
 
         return tile
@@ -34,6 +34,10 @@ GeoExtent = Tuple[float, float, float, float]
 
 GLOBAL_GEO_EXTENT = -180.0, -90.0, +180.0, +90.0
 
+# Range of tile sizes that are aligned with chunks, see get_aligned_tile_size()
+MIN_ALIGNED_TILE_SIZE = 64
+MAX_ALIGNED_TILE_SIZE = 1024
+
 
 class TileGrid:
     """
@@ -171,16 +175,23 @@ class TileGrid:
                w: int, h: int,
                tile_width: Optional[int], tile_height: Optional[int],
                geo_extent: GeoExtent,
-               inv_y: bool = False) -> 'TileGrid':
+               inv_y: bool = False,
+               chunk_width: Optional[int] = None,
+               chunk_height: Optional[int] = None) -> 'TileGrid':
         """
         Create a new TileGrid.
 
+        If *chunk_width* and *chunk_height* are given, tile sizes are chosen to be divisors of them, if possible,
+        so that a tile of the highest resolution level never spans multiple chunks.
+
         :param w: original image width
         :param h: original image height
         :param tile_width: optimal tile width
         :param tile_height: optimal tile height
         :param geo_extent: The geo-spatial extent
         :param inv_y: True, if the positive y-axis (latitude) points up
+        :param chunk_width: optional width of the chunks in which the image is stored
+        :param chunk_height: optional height of the chunks in which the image is stored
         :return: A new TilingScheme object
         """
         west, south, east, north = map(_adjust_to_floor, geo_extent)
@@ -191,11 +202,27 @@ class TileGrid:
         if south == -90.0 and north == 90.0:
             h_mode = MODE_EQ
 
+        tw_opt = min(w, tile_width or 256)
+        th_opt = min(h, tile_height or 256)
+        tw_min, tw_max, th_min, th_max = None, None, None, None
+        if chunk_width:
+            tw_aligned = get_aligned_tile_size(w, chunk_width, s_mode=w_mode, ts_opt=tw_opt)
+            if tw_aligned is not None:
+                tw_opt = tw_min = tw_max = tw_aligned
+        if chunk_height:
+            th_aligned = get_aligned_tile_size(h, chunk_height, s_mode=h_mode, ts_opt=th_opt)
+            if th_aligned is not None:
+                th_opt = th_min = th_max = th_aligned
+
         (w_new, h_new), (tw, th), (nt0x, nt0y), nl = pow2_2d_subdivision(w, h,
                                                                          w_mode=w_mode,
                                                                          h_mode=h_mode,
-                                                                         tw_opt=min(w, tile_width or 256),
-                                                                         th_opt=min(h, tile_height or 256))
+                                                                         tw_opt=tw_opt,
+                                                                         th_opt=th_opt,
+                                                                         tw_min=tw_min,
+                                                                         th_min=th_min,
+                                                                         tw_max=tw_max,
+                                                                         th_max=th_max)
 
         new_extent = cls._adjust_geo_extent((west, south, east, north), w, h, w_new, h_new, inv_y=inv_y)
         return TileGrid(nl, nt0x, nt0y, tw, th, new_extent, inv_y=inv_y)
@@ -249,6 +276,36 @@ def _adjust_to_floor(x: float) -> float:
     return fx if abs(fx - x) < 1e-10 else x
 
 
+@functools.lru_cache(maxsize=256)
+def get_aligned_tile_size(s: int,
+                          chunk_size: int,
+                          s_mode: int = MODE_EQ,
+                          ts_opt: Optional[int] = None) -> Optional[int]:
+    """
+    Get a tile size for an image of size *s* stored in chunks of size *chunk_size*, so that no tile spans
+    multiple chunks. The tile size is the divisor of *chunk_size* closest to *ts_opt* for which a pyramidal
+    subdivision of *s* exists, see :func:`pow2_1d_subdivisions`. Only divisors between
+    ``MIN_ALIGNED_TILE_SIZE`` (or *chunk_size*, if smaller) and ``MAX_ALIGNED_TILE_SIZE`` are considered.
+
+    :param s: image size
+    :param chunk_size: chunk size
+    :param s_mode: optional mode, -1: *s_act* <= *s*, 0: *s_act* == *s*, +1: *s_act* >= *s*
+    :param ts_opt: optional optimum tile size, defaults to *chunk_size*
+    :return: the tile size, or None, if there is no aligned subdivision
+    """
+    if chunk_size is None or chunk_size < 1:
+        raise ValueError('invalid chunk_size')
+    ts_opt = ts_opt or chunk_size
+    ts_min = min(chunk_size, MIN_ALIGNED_TILE_SIZE)
+    tile_sizes = [ts for ts in range(ts_min, min(chunk_size, MAX_ALIGNED_TILE_SIZE) + 1) if chunk_size % ts == 0]
+    for ts in sorted(tile_sizes, key=lambda ts: abs(ts - ts_opt)):
+        # Without a subdivision for ts, the whole image becomes a single tile
+        _, ts_act, _, nl = pow2_1d_subdivisions(s, s_mode=s_mode, ts_opt=ts, ts_min=ts, ts_max=ts)[0]
+        if ts_act == ts and (nl > 1 or s == ts):
+            return ts
+    return None
+
+
 @functools.lru_cache(maxsize=256)
 def pow2_2d_subdivision(w: int, h: int,
                         w_mode: int = MODE_EQ, h_mode: int = MODE_EQ,
@@ -0,0 +1,92 @@
+# The MIT License (MIT)
+# Copyright (c) 2018 by the xcube development team and contributors
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies
+# of the Software, and to permit persons to whom the Software is furnished to do
+# so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+JSON serialization of response objects.
+
+Uses `orjson <https://github.com/ijl/orjson>`_ if installed, otherwise the standard library's
+:mod:`json` module. Besides the standard JSON types, numpy scalars and arrays are serialized,
+so that results computed with numpy need not be converted into Python objects first.
+"""
+
+import json
+from typing import Any
+
+import numpy as np
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_COMPACT_SEPARATORS = (',', ':')
+
+
+def to_json(obj: Any, pretty: bool = False) -> str:
+    """
+    Serialize *obj* to a JSON string.
+
+    :param obj: the object to serialize, may contain numpy scalars and arrays
+    :param pretty: whether to indent the output, otherwise output is compact
+    :return: the JSON string
+    """
+    if orjson is not None:
+        return _orjson_dumps(obj, pretty).decode('utf-8')
+    return _json_dumps(obj, pretty)
+
+
+def to_json_bytes(obj: Any, pretty: bool = False) -> bytes:
+    """
+    Serialize *obj* to UTF-8 encoded JSON.
+
+    :param obj: the object to serialize, may contain numpy scalars and arrays
+    :param pretty: whether to indent the output, otherwise output is compact
+    :return: the UTF-8 encoded JSON
+    """
+    if orjson is not None:
+        return _orjson_dumps(obj, pretty)
+    return _json_dumps(obj, pretty).encode('utf-8')
+
+
+def _orjson_dumps(obj: Any, pretty: bool) -> bytes:
+    option = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+    if pretty:
+        option |= orjson.OPT_INDENT_2
+    return orjson.dumps(obj, default=_to_json_value, option=option)
+
+
+def _json_dumps(obj: Any, pretty: bool) -> str:
+    if pretty:
+        return json.dumps(obj, indent=2, default=_to_json_value)
+    return json.dumps(obj, separators=_COMPACT_SEPARATORS, default=_to_json_value)
+
+
+def _to_json_value(obj: Any) -> Any:
+    # Called for objects the JSON encoder cannot serialize itself
+    if isinstance(obj, np.ndarray):
+        if np.issubdtype(obj.dtype, np.datetime64):
+            return np.datetime_as_string(obj).tolist()
+        return obj.tolist()
+    if isinstance(obj, np.datetime64):
+        return str(np.datetime_as_string(obj))
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
@@ -0,0 +1,122 @@
+# The MIT License (MIT)
+# Copyright (c) 2018 by the xcube development team and contributors
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies
+# of the Software, and to permit persons to whom the Software is furnished to do
+# so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Monitoring of the Tornado event loop.
+
+All requests are served by a single event loop, so any blocking call made on the loop delays
+every concurrent request. The :class:`EventLoopLagMonitor` measures the delay (lag) of a periodic
+callback scheduled on the loop. If the loop is blocked for longer than a threshold, a watchdog
+thread logs the loop thread's current stack, so that the blocking call can be identified.
+"""
+
+import logging
+import sys
+import threading
+import time
+import traceback
+
+from tornado.ioloop import IOLoop
+
+from .defaults import EVENT_LOOP_CHECK_INTERVAL, EVENT_LOOP_LAG_THRESHOLD
+from .metrics import REGISTRY
+
+__author__ = "Norman Fomferra (Brockmann Consult GmbH)"
+
+_LOG = logging.getLogger('xcube')
+
+_EVENT_LOOP_LAG_SECONDS = REGISTRY.histogram('xcube_event_loop_lag_seconds',
+                                             'Delay of callbacks scheduled on the event loop, in seconds').labels()
+_EVENT_LOOP_BLOCKED = REGISTRY.counter('xcube_event_loop_blocked_total',
+                                       'Number of times the event loop has been blocked '
+                                       'for longer than the lag threshold').labels()
+
+
+class EventLoopLagMonitor:
+    """
+    Monitors the lag of an event loop.
+
+    :param threshold: the lag in seconds above which the loop is reported as blocked
+    :param interval: the interval in seconds between two checks
+    :param io_loop: the event loop, defaults to the current one when :meth:`start` is called
+    """
+
+    def __init__(self,
+                 threshold: float = EVENT_LOOP_LAG_THRESHOLD,
+                 interval: float = EVENT_LOOP_CHECK_INTERVAL,
+                 io_loop: IOLoop = None):
+        self._threshold = threshold
+        self._interval = interval
+        self._io_loop = io_loop
+        self._loop_thread_id = None
+        self._expected_time = None
+        self._blocked_reported = False
+        self._timeout_handle = None
+        self._watchdog = None  # type: Optional[threading.Thread]
+        self._stopped = threading.Event()
+
+    @property
+    def threshold(self) -> float:
+        return self._threshold
+
+    def start(self):
+        """Start monitoring. Must be called from the event loop's thread."""
+        if self._io_loop is None:
+            self._io_loop = IOLoop.current()
+        self._loop_thread_id = threading.get_ident()
+        self._stopped.clear()
+        self._expected_time = time.monotonic() + self._interval
+        self._timeout_handle = self._io_loop.call_later(self._interval, self._check)
+        self._watchdog = threading.Thread(target=self._watch, name='xcube-event-loop-watchdog', daemon=True)
+        self._watchdog.start()
+
+    def stop(self):
+        """Stop monitoring."""
+        self._stopped.set()
+        if self._timeout_handle is not None:
+            self._io_loop.remove_timeout(self._timeout_handle)
+            self._timeout_handle = None
+        if self._watchdog is not None:
+            self._watchdog.join()
+            self._watchdog = None
+
+    def _check(self):
+        now = time.monotonic()
+        lag = max(0.0, now - self._expected_time)
+        _EVENT_LOOP_LAG_SECONDS.observe(lag)
+        if lag > self._threshold:
+            _EVENT_LOOP_BLOCKED.inc()
+            _LOG.warning(f'event loop was blocked for {lag:.3f} seconds')
+        self._blocked_reported = False
+        self._expected_time = now + self._interval
+        if not self._stopped.is_set():
+            self._timeout_handle = self._io_loop.call_later(self._interval, self._check)
+
+    def _watch(self):
+        while not self._stopped.wait(self._interval):
+            lag = time.monotonic() - self._expected_time
+            if lag > self._threshold and not self._blocked_reported:
+                # Report only once per blocking call, _check() resets the flag once the loop runs again
+                self._blocked_reported = True
+                frame = sys._current_frames().get(self._loop_thread_id)
+                stack = ''.join(traceback.format_stack(frame)) if frame is not None else ''
+                _LOG.warning(f'event loop blocked for more than {self._threshold:.3f} seconds, '
+                             f'currently at:\n{stack}')
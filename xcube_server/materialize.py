@@ -0,0 +1,72 @@
+# The MIT License (MIT)
+# Copyright (c) 2018 by the xcube development team and contributors
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies
+# of the Software, and to permit persons to whom the Software is furnished to do
+# so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Materialization of computed datasets: chunks of dask arrays are computed once and then taken from a cache.
+"""
+
+import functools
+from typing import List
+
+import dask.array as da
+import numpy as np
+import xarray as xr
+from dask.base import tokenize
+from dask.highlevelgraph import HighLevelGraph
+
+from .cache import Cache
+
+__author__ = "Norman Fomferra (Brockmann Consult GmbH)"
+
+
+def materialize_dataset(dataset: xr.Dataset, cache: Cache, key: str) -> xr.Dataset:
+    """
+    Get a copy of *dataset* whose dask data variables take their chunks from *cache*.
+    A chunk is computed on first access and then stored in the cache, so that it is not computed again
+    as long as it is cached. Other variables are left unchanged.
+
+    :param dataset: the dataset, usually computed lazily from other datasets
+    :param cache: the cache for the computed chunks, whose values are numpy arrays
+    :param key: identifies the dataset's content, used as prefix of the keys of its chunks
+    :return: the materialized dataset
+    """
+    return dataset.copy(data={var_name: (_materialize_array(var.data, cache, f'{key}/{var_name}')
+                                         if isinstance(var.data, da.Array) else var.data)
+                              for var_name, var in dataset.data_vars.items()})
+
+
+def _materialize_array(array: da.Array, cache: Cache, key: str) -> da.Array:
+    name = 'materialized-' + tokenize(array, key)
+    get_chunk = functools.partial(_get_chunk, array, cache, key)
+    # Chunk tasks do not depend on the tasks of array, so that cached chunks are never computed
+    dsk = {(name,) + chunk_index: (get_chunk, list(chunk_index)) for chunk_index in np.ndindex(*array.numblocks)}
+    graph = HighLevelGraph.from_collections(name, dsk, dependencies=[])
+    return da.Array(graph, name, chunks=array.chunks, dtype=array.dtype,
+                    meta=np.empty((0,) * array.ndim, dtype=array.dtype))
+
+
+def _get_chunk(array: da.Array, cache: Cache, key: str, chunk_index: List[int]) -> np.ndarray:
+    chunk_key = f'{key}/{".".join(map(str, chunk_index))}'
+    chunk = cache.get_value(chunk_key)
+    if chunk is None:
+        chunk = np.asarray(array.blocks[tuple(chunk_index)].compute())
+        cache.put_value(chunk_key, chunk)
+    return chunk
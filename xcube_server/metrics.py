@@ -0,0 +1,329 @@
+# The MIT License (MIT)
+# Copyright (c) 2018 by the xcube development team and contributors
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies
+# of the Software, and to permit persons to whom the Software is furnished to do
+# so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Metrics in the Prometheus text exposition format.
+
+Metrics are registered once, usually at module level, and then updated on hot paths::
+
+    _REQUESTS = REGISTRY.counter('xcube_requests_total', 'Number of requests', ('handler',))
+    ...
+    _REQUESTS.labels(handler='GetDatasetsHandler').inc()
+
+See https://prometheus.io/docs/instrumenting/exposition_formats/
+"""
+
+import bisect
+import math
+import threading
+import time
+from contextlib import AbstractContextManager
+from typing import Callable, List, Optional, Sequence, Tuple
+
+#: Default histogram buckets in seconds, suitable for request and tile computation times
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+#: Content type of the text exposition format
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+LabelValues = Tuple[str, ...]
+
+
+class Metric:
+    """
+    Base class for metrics. A metric has a value per combination of label values.
+
+    :param name: the metric name
+    :param documentation: the metric's help text
+    :param label_names: the names of the metric's labels
+    """
+
+    type_name = None
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()):
+        self._name = name
+        self._documentation = documentation
+        self._label_names = tuple(label_names)
+        self._children = dict()
+        self._lock = threading.Lock()
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @property
+    def label_names(self) -> Tuple[str, ...]:
+        return self._label_names
+
+    def labels(self, *label_values, **label_kwargs):
+        """
+        Get the child metric for the given label values, given either positionally or by label name.
+        """
+        if label_kwargs:
+            label_values = tuple(label_kwargs[label_name] for label_name in self._label_names)
+        if len(label_values) != len(self._label_names):
+            raise ValueError(f'metric {self._name!r} expects labels {self._label_names!r}')
+        label_values = tuple(str(label_value) for label_value in label_values)
+        child = self._children.get(label_values)
+        if child is None:
+            with self._lock:
+                child = self._children.get(label_values)
+                if child is None:
+                    child = self._new_child()
+                    self._children[label_values] = child
+        return child
+
+    def collect(self) -> List[str]:
+        """Get the lines of the text exposition format for this metric."""
+        lines = [f'# HELP {self._name} {_escape_help(self._documentation)}',
+                 f'# TYPE {self._name} {self.type_name}']
+        with self._lock:
+            children = sorted(self._children.items())
+        for label_values, child in children:
+            labels = tuple(zip(self._label_names, label_values))
+            lines.extend(self._collect_child(labels, child))
+        return lines
+
+    def _new_child(self):
+        raise NotImplementedError()
+
+    def _collect_child(self, labels: Tuple[Tuple[str, str], ...], child) -> List[str]:
+        raise NotImplementedError()
+
+
+class _CounterChild:
+    __slots__ = ('_value', '_lock')
+
+    def __init__(self):
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def value(self) -> float:
+        return self._value
+
+    def inc(self, amount: float = 1.0):
+        if amount < 0:
+            raise ValueError('counters can only be incremented')
+        with self._lock:
+            self._value += amount
+
+
+class Counter(Metric):
+    """A monotonically increasing value, e.g. a number of requests."""
+
+    type_name = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def _collect_child(self, labels, child):
+        return [_format_sample(self._name, labels, child.value)]
+
+
+class _GaugeChild:
+    __slots__ = ('_value', '_function', '_lock')
+
+    def __init__(self):
+        self._value = 0.0
+        self._function = None
+        self._lock = threading.Lock()
+
+    @property
+    def value(self) -> float:
+        function = self._function
+        return function() if function is not None else self._value
+
+    def set(self, value: float):
+        self._value = value
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount: float = 1.0):
+        with self._lock:
+            self._value -= amount
+
+    def set_function(self, function: Optional[Callable[[], float]]):
+        """Compute the gauge's value by calling *function* whenever the metrics are collected."""
+        self._function = function
+
+
+class Gauge(Metric):
+    """A value that can go up and down, e.g. a queue length or a cache size."""
+
+    type_name = 'gauge'
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def _collect_child(self, labels, child):
+        return [_format_sample(self._name, labels, child.value)]
+
+
+class _HistogramChild:
+    __slots__ = ('_upper_bounds', '_bucket_counts', '_sum', '_lock')
+
+    def __init__(self, upper_bounds: Tuple[float, ...]):
+        self._upper_bounds = upper_bounds
+        self._bucket_counts = [0] * (len(upper_bounds) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self._upper_bounds, value)
+        with self._lock:
+            self._bucket_counts[index] += 1
+            self._sum += value
+
+    def time(self) -> '_Timer':
+        """A context manager that observes the execution time of a code block in seconds."""
+        return _Timer(self.observe)
+
+    def snapshot(self) -> Tuple[List[int], float]:
+        with self._lock:
+            return list(self._bucket_counts), self._sum
+
+
+class Histogram(Metric):
+    """
+    Counts observed values, e.g. durations, in buckets.
+
+    :param name: the metric name
+    :param documentation: the metric's help text
+    :param label_names: the names of the metric's labels
+    :param buckets: the upper bounds of the buckets, in increasing order
+    """
+
+    type_name = 'histogram'
+
+    def __init__(self,
+                 name: str,
+                 documentation: str,
+                 label_names: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self._upper_bounds = tuple(sorted(float(b) for b in buckets if not math.isinf(b)))
+
+    def _new_child(self):
+        return _HistogramChild(self._upper_bounds)
+
+    def _collect_child(self, labels, child):
+        bucket_counts, value_sum = child.snapshot()
+        lines = []
+        cumulative_count = 0
+        for upper_bound, bucket_count in zip(self._upper_bounds + (math.inf,), bucket_counts):
+            cumulative_count += bucket_count
+            bucket_labels = labels + (('le', _format_value(upper_bound)),)
+            lines.append(_format_sample(self._name + '_bucket', bucket_labels, cumulative_count))
+        lines.append(_format_sample(self._name + '_sum', labels, value_sum))
+        lines.append(_format_sample(self._name + '_count', labels, cumulative_count))
+        return lines
+
+
+class MetricsRegistry:
+    """
+    A registry of named metrics.
+    Registering a metric with the name of an already registered metric returns the existing metric.
+    """
+
+    def __init__(self):
+        self._metrics = dict()  # type: Dict[str, Metric]
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, documentation: str, label_names: Sequence[str] = ()) -> Counter:
+        return self._register(Counter, name, documentation, label_names)
+
+    def gauge(self, name: str, documentation: str, label_names: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge, name, documentation, label_names)
+
+    def histogram(self,
+                  name: str,
+                  documentation: str,
+                  label_names: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram, name, documentation, label_names, buckets=buckets)
+
+    def get(self, name: str) -> Optional[Metric]:
+        return self._metrics.get(name)
+
+    def to_text(self) -> str:
+        """Get all metrics in the text exposition format."""
+        with self._lock:
+            metrics = sorted(self._metrics.items())
+        lines = []
+        for _, metric in metrics:
+            lines.extend(metric.collect())
+        return '\n'.join(lines) + '\n'
+
+    def _register(self, metric_type, name: str, documentation: str, label_names: Sequence[str], **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = metric_type(name, documentation, label_names, **kwargs)
+                self._metrics[name] = metric
+            elif type(metric) is not metric_type or metric.label_names != tuple(label_names):
+                raise ValueError(f'metric {name!r} already registered with a different type or labels')
+            return metric
+
+
+#: The registry of the metrics exposed by the service
+REGISTRY = MetricsRegistry()
+
+
+class _Timer(AbstractContextManager):
+    __slots__ = ('_observe', '_start_time')
+
+    def __init__(self, observe: Callable[[float], None]):
+        self._observe = observe
+        self._start_time = None
+
+    def __enter__(self):
+        self._start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._observe(time.perf_counter() - self._start_time)
+
+
+def _format_sample(name: str, labels: Tuple[Tuple[str, str], ...], value: float) -> str:
+    if labels:
+        label_text = ','.join(f'{label_name}="{_escape_label_value(label_value)}"'
+                              for label_name, label_value in labels)
+        return f'{name}{{{label_text}}} {_format_value(value)}'
+    return f'{name} {_format_value(value)}'
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    if math.isnan(value):
+        return 'NaN'
+    return repr(float(value))
+
+
+def _escape_help(text: str) -> str:
+    return text.replace('\\', '\\\\').replace('\n', '\\n')
+
+
+def _escape_label_value(text: str) -> str:
+    return text.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
@@ -1,13 +1,17 @@
 import os
 import threading
 from abc import abstractmethod, ABCMeta
-from typing import Sequence, Any, Dict, Callable
+from typing import Sequence, Any, Dict, Callable, Optional
 
 import s3fs
 import xarray as xr
-import zarr
 
+from .cache import Cache
+from .chunkcache import ChunkCache, DiskChunkCache
 from .im import TileGrid
+from .im.utils import get_chunk_size
+from .materialize import materialize_dataset
+from .obsstore import ObjectStorageStore
 from .perf import measure_time
 from .utils import get_dataset_bounds
 
@@ -203,12 +207,16 @@ class ObjectStorageMultiLevelDataset(LazyMultiLevelDataset):
     A multi-level dataset whose level datasets are lazily read from object storage locations.
 
     :param dir_path: The directory containing the level datasets.
+    :param chunk_cache: Optional cache for the chunks of all levels.
+    :param disk_chunk_cache: Optional disk cache for the chunks of all levels.
     :param zarr_kwargs: Keyword arguments accepted by the ``xarray.open_zarr()`` function.
     """
 
     def __init__(self, ds_id: str,
                  obs_file_system: s3fs.S3FileSystem,
                  dir_path: str,
+                 chunk_cache: ChunkCache = None,
+                 disk_chunk_cache: DiskChunkCache = None,
                  zarr_kwargs: Dict[str, Any] = None, exception_type=ValueError):
 
         level_paths = {}
@@ -229,8 +237,11 @@ class ObjectStorageMultiLevelDataset(LazyMultiLevelDataset):
                 raise exception_type(f"Invalid dataset descriptor {ds_id!r}: missing level {level} in {dir_path}")
 
         super().__init__(kwargs=zarr_kwargs)
+        self._ds_id = ds_id
         self._obs_file_system = obs_file_system
         self._dir_path = dir_path
+        self._chunk_cache = chunk_cache
+        self._disk_chunk_cache = disk_chunk_cache
         self._level_paths = level_paths
         self._num_levels = num_levels
 
@@ -255,10 +266,12 @@ class ObjectStorageMultiLevelDataset(LazyMultiLevelDataset):
                     base_dir = os.path.dirname(self._dir_path)
                     level_path = os.path.join(base_dir, level_path)
 
-        store = s3fs.S3Map(root=level_path, s3=self._obs_file_system, check=False)
-        cached_store = zarr.LRUStoreCache(store, max_size=2 ** 28)
+        store = ObjectStorageStore(self._obs_file_system, level_path,
+                                   chunk_cache=self._chunk_cache,
+                                   disk_chunk_cache=self._disk_chunk_cache,
+                                   dataset_id=self._ds_id)
         with measure_time(tag=f"opened remote dataset {level_path} for level {index}"):
-            return xr.open_zarr(cached_store, **zarr_kwargs)
+            return xr.open_zarr(store, **zarr_kwargs)
 
     def _get_tile_grid_lazily(self):
         """
@@ -308,6 +321,13 @@ class BaseMultiLevelDataset(LazyMultiLevelDataset):
 class ComputedMultiLevelDataset(LazyMultiLevelDataset):
     """
     A multi-level dataset whose level datasets are a computed from the levels of other multi-level datasets.
+
+    If a *materialization_cache* is given, the chunks of the computed datasets are computed once and then
+    taken from the cache, see :func:`materialize_dataset`.
+
+    :param materialization_cache: optional cache for the chunks of the computed datasets
+    :param materialization_key: identifies the computed content, e.g. by the identities of the input datasets
+        and the input parameters, required if *materialization_cache* is given
     """
 
     def __init__(self,
@@ -317,7 +337,11 @@ class ComputedMultiLevelDataset(LazyMultiLevelDataset):
                  input_ml_dataset_ids: Sequence[str],
                  input_ml_dataset_getter: Callable[[str], MultiLevelDataset],
                  input_parameters: Dict[str, Any],
+                 materialization_cache: Cache = None,
+                 materialization_key: str = None,
                  exception_type=ValueError):
+        if materialization_cache is not None and not materialization_key:
+            raise ValueError('materialization_key must be given')
         super().__init__(kwargs=input_parameters)
 
         try:
@@ -361,6 +385,8 @@ class ComputedMultiLevelDataset(LazyMultiLevelDataset):
         self._callable_obj = callable_obj
         self._input_ml_dataset_ids = input_ml_dataset_ids
         self._input_ml_dataset_getter = input_ml_dataset_getter
+        self._materialization_cache = materialization_cache
+        self._materialization_key = materialization_key
         self._exception_type = exception_type
 
     def _get_tile_grid_lazily(self) -> TileGrid:
@@ -379,9 +405,30 @@ class ComputedMultiLevelDataset(LazyMultiLevelDataset):
             raise self._exception_type(f"Failed to compute in-memory dataset {self._ds_id!r} at level {index} "
                                        f"from function {self._callable_name!r}: "
                                        f"expected an xarray.Dataset but got {type(computed_value)}")
+        if self._materialization_cache is not None:
+            computed_value = materialize_dataset(computed_value, self._materialization_cache,
+                                                 f'{self._materialization_key}/{index}')
         return computed_value
 
 
+def get_storage_chunks(dataset: xr.Dataset) -> Optional[Dict[str, int]]:
+    """
+    Get the chunk sizes in which the spatial variables of *dataset* are stored,
+    e.g. as given by the "chunksizes" encoding of NetCDF4 variables.
+
+    :param dataset: the dataset
+    :return: a mapping from dimension names to chunk sizes, or None, if the spatial variables are not stored in chunks
+    """
+    for var_name in dataset.data_vars:
+        var = dataset[var_name]
+        if var.ndim < 2 or var.dims[-2:] != ("lat", "lon"):
+            continue
+        chunk_size = get_chunk_size(var)
+        if chunk_size and len(chunk_size) == var.ndim:
+            return dict(zip(var.dims, chunk_size))
+    return None
+
+
 def _get_dataset_tile_grid(dataset: xr.Dataset, num_levels: int = None):
     geo_extent = get_dataset_bounds(dataset)
     inv_y = float(dataset.lat[0]) < float(dataset.lat[-1])
@@ -402,7 +449,8 @@ def _get_dataset_tile_grid(dataset: xr.Dataset, num_levels: int = None):
         try:
             tile_grid = TileGrid.create(width, height,
                                         tile_width, tile_height,
-                                        geo_extent, inv_y)
+                                        geo_extent, inv_y,
+                                        chunk_width=tile_width, chunk_height=tile_height)
         except ValueError:
             num_levels = 1
             num_level_zero_tiles_x = 1
@@ -0,0 +1,268 @@
+# The MIT License (MIT)
+# Copyright (c) 2018 by the xcube development team and contributors
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies
+# of the Software, and to permit persons to whom the Software is furnished to do
+# so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Memory-mapped access to local datasets.
+
+Variable arrays of memory-mapped datasets are views of the files in the page cache, so slicing them
+requires neither decompression nor calls into a data format library.
+"""
+
+import glob
+import hashlib
+import logging
+import os
+import shutil
+import uuid
+import warnings
+from typing import Any, Dict, Optional
+
+import numpy as np
+import xarray as xr
+import zarr
+
+from .defaults import RAW_CACHE_PATH
+
+__author__ = "Norman Fomferra (Brockmann Consult GmbH)"
+
+_LOG = logging.getLogger('xcube')
+
+_NETCDF3_MAGICS = (b'CDF\x01', b'CDF\x02')
+
+# Maximum size of the slabs in which variables are copied into the raw cache
+_RAW_SLAB_SIZE = 64 * 1024 * 1024
+
+
+def open_mmap_dataset(path: str, data_format: str = 'nc', raw_cache_dir: str = None) -> xr.Dataset:
+    """
+    Open the local dataset at *path* with memory-mapped variable arrays.
+
+    NetCDF3 files and zarr datasets whose arrays are stored uncompressed in a single chunk are memory-mapped
+    directly. Any other dataset is converted once into such a raw zarr dataset in *raw_cache_dir*, which is
+    reused until the dataset at *path* is modified.
+
+    :param path: path of the dataset
+    :param data_format: either "nc" or "zarr"
+    :param raw_cache_dir: directory of the raw cache, defaults to ``RAW_CACHE_PATH``
+    :return: the dataset with CF-decoded variables
+    """
+    if data_format == 'nc':
+        dataset = _open_netcdf3(path) if _is_netcdf3(path) else None
+    elif data_format == 'zarr':
+        dataset = _open_raw_zarr(path)
+    else:
+        raise ValueError(f'illegal data format {data_format!r}')
+    if dataset is None:
+        dataset = _open_raw_zarr(_get_raw_cache_path(path, data_format, raw_cache_dir or RAW_CACHE_PATH))
+    return xr.decode_cf(dataset)
+
+
+def get_modification_time(path: str) -> int:
+    """
+    Get the modification time of the local dataset at *path* in nanoseconds. For a directory, e.g. of
+    a zarr dataset, it is the latest modification time of the directory and its entries, because the
+    modification times of a zarr directory's entries change when chunks or metadata are written.
+
+    :param path: path of a dataset file or directory
+    :return: the modification time in nanoseconds since the epoch
+    """
+    # Also covers entries whose names start with a dot, such as ".zmetadata"
+    entry_paths = [path] + ([os.path.join(path, name) for name in os.listdir(path)] if os.path.isdir(path) else [])
+    return max(os.stat(entry_path).st_mtime_ns for entry_path in entry_paths)
+
+
+def _is_netcdf3(path: str) -> bool:
+    with open(path, 'rb') as fp:
+        return fp.read(4) in _NETCDF3_MAGICS
+
+
+def _open_netcdf3(path: str) -> xr.Dataset:
+    import scipy.io
+
+    nc = scipy.io.netcdf_file(path, mode='r', mmap=True, maskandscale=False)
+    # noinspection PyProtectedMember
+    variables = {name: xr.Variable(var.dimensions, var.data, attrs=_decode_nc_attrs(var._attributes))
+                 for name, var in nc.variables.items()}
+    # noinspection PyProtectedMember
+    attrs = _decode_nc_attrs(nc._attributes)
+    # Closing the file keeps the memory map as long as arrays refer to it, but warns about it
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        nc.close()
+    return xr.Dataset(variables, attrs=attrs)
+
+
+def _decode_nc_attrs(attrs: Dict[str, Any]) -> Dict[str, Any]:
+    return {name: value.decode('utf-8') if isinstance(value, bytes) else value for name, value in attrs.items()}
+
+
+def _open_raw_zarr(path: str) -> Optional[xr.Dataset]:
+    """
+    Open the zarr dataset at *path* with memory-mapped arrays.
+
+    :return: the dataset with CF-encoded variables, or None if an array with more than one dimension
+        is compressed, filtered, or split into multiple chunks.
+    """
+    group = zarr.open_group(path, mode='r')
+    variables = dict()
+    for name, array in group.arrays():
+        attrs = dict(array.attrs)
+        dims = attrs.pop('_ARRAY_DIMENSIONS', None)
+        if dims is None:
+            raise ValueError(f'missing dimension names of array {name!r} in zarr dataset {path}')
+        if array.fill_value is not None:
+            attrs['_FillValue'] = array.fill_value
+        data = _mmap_zarr_array(os.path.join(path, name), array)
+        if data is None:
+            if array.ndim > 1:
+                return None
+            # Coordinates are small, so we just read them
+            data = array[...]
+        variables[name] = xr.Variable(dims, data, attrs=attrs)
+    return xr.Dataset(variables, attrs=dict(group.attrs))
+
+
+def _mmap_zarr_array(array_path: str, array: zarr.Array) -> Optional[np.ndarray]:
+    if array.compressor is not None or array.filters or array.chunks != array.shape or array.dtype.hasobject:
+        return None
+    if 0 in array.shape:
+        return np.empty(array.shape, dtype=array.dtype)
+    # noinspection PyProtectedMember
+    separator = array._dimension_separator or '.'
+    chunk_path = os.path.join(array_path, *(separator.join(['0'] * array.ndim) or '0').split('/'))
+    if not os.path.exists(chunk_path):
+        return np.full(array.shape, array.fill_value, dtype=array.dtype)
+    if os.path.getsize(chunk_path) != array.nbytes:
+        return None
+    return np.memmap(chunk_path, dtype=array.dtype, mode='r', shape=array.shape, order=array.order)
+
+
+def _get_raw_cache_path(path: str, data_format: str, raw_cache_dir: str) -> str:
+    """
+    Get the path of the raw zarr dataset converted from the dataset at *path*. Convert it,
+    if it does not exist yet. Raw datasets converted from previous versions of the dataset are removed.
+    """
+    path = os.path.abspath(path)
+    version = get_modification_time(path)
+    path_key = hashlib.sha256(path.encode('utf-8')).hexdigest()[:32]
+    version_key = hashlib.sha256(f'{data_format}:{version}'.encode('utf-8')).hexdigest()[:16]
+    raw_path = os.path.join(raw_cache_dir, f'{path_key}-{version_key}.zarr')
+    if not os.path.isdir(raw_path):
+        _LOG.info(f'converting {path} into raw dataset {raw_path}')
+        if data_format == 'nc':
+            dataset = xr.open_dataset(path)
+        else:
+            dataset = xr.open_zarr(path)
+        try:
+            _write_raw_zarr(dataset, raw_path)
+        finally:
+            dataset.close()
+        # Mapped files of outdated raw datasets remain valid after removal
+        for outdated_path in glob.glob(os.path.join(raw_cache_dir, f'{path_key}-*.zarr')):
+            if outdated_path != raw_path:
+                shutil.rmtree(outdated_path, ignore_errors=True)
+    return raw_path
+
+
+def _write_raw_zarr(dataset: xr.Dataset, raw_path: str):
+    """
+    Write *dataset* as zarr dataset whose arrays are stored uncompressed in a single chunk.
+    Variables are CF-encoded and copied in slabs along their first dimension.
+    The dataset is written into a temporary directory that is renamed when complete, so that concurrent
+    processes converting the same dataset never see incomplete datasets.
+    """
+    os.makedirs(os.path.dirname(raw_path), exist_ok=True)
+    temp_path = f'{raw_path}.{uuid.uuid4().hex}.tmp'
+    try:
+        variables, attrs = xr.conventions.encode_dataset_coordinates(dataset)
+        group = zarr.open_group(temp_path, mode='w')
+        group.attrs.update(_to_json_attrs(attrs))
+        for name, var in variables.items():
+            _write_raw_zarr_array(group, temp_path, name, var)
+        zarr.consolidate_metadata(temp_path)
+        try:
+            os.rename(temp_path, raw_path)
+        except OSError:
+            if not os.path.isdir(raw_path):
+                raise
+            # Another process was faster
+    finally:
+        shutil.rmtree(temp_path, ignore_errors=True)
+
+
+def _write_raw_zarr_array(group: zarr.Group, group_path: str, name: str, var: xr.Variable):
+    num_slices = var.shape[0] if var.ndim > 0 else 1
+    slice_size = var.nbytes // num_slices if num_slices > 0 else 0
+    slab_length = max(1, _RAW_SLAB_SIZE // slice_size) if slice_size > 0 else num_slices
+    if var.ndim == 0 or slab_length >= num_slices:
+        # Encode small variables at once, so that they are encoded consistently, e.g. with the same time units
+        slab_length = num_slices
+
+    array = None
+    chunk = None
+    encoding = dict(var.encoding)
+    for start in range(0, max(1, num_slices), slab_length):
+        slab = var[start: start + slab_length] if var.ndim > 0 else var
+        slab.encoding = encoding
+        encoded_slab = xr.conventions.encode_cf_variable(slab.load(), name=name)
+        data = encoded_slab.values
+        if data.dtype.hasobject:
+            data = data.astype(str)
+        if array is None:
+            attrs = _to_json_attrs(encoded_slab.attrs)
+            fill_value = attrs.pop('_FillValue', None)
+            for time_key in ('units', 'calendar'):
+                # Encode all slabs of time variables like the first
+                if time_key in attrs and var.dtype.kind in 'mM':
+                    encoding[time_key] = attrs[time_key]
+            attrs['_ARRAY_DIMENSIONS'] = list(var.dims)
+            array = group.create(name,
+                                 shape=var.shape,
+                                 chunks=tuple(max(1, size) for size in var.shape),
+                                 dtype=data.dtype,
+                                 compressor=None,
+                                 fill_value=fill_value,
+                                 order='C',
+                                 dimension_separator='.')
+            array.attrs.update(attrs)
+            if var.size == 0:
+                return
+            chunk_path = os.path.join(group_path, name, '.'.join(['0'] * var.ndim) or '0')
+            chunk = np.memmap(chunk_path, dtype=array.dtype, mode='w+', shape=var.shape)
+        if var.ndim > 0:
+            chunk[start: start + slab_length] = data
+        else:
+            chunk[...] = data
+    chunk.flush()
+
+
+def _to_json_attrs(attrs: Dict[str, Any]) -> Dict[str, Any]:
+    return {name: _to_json_value(value) for name, value in attrs.items()}
+
+
+def _to_json_value(value: Any) -> Any:
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    return value
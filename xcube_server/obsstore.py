@@ -0,0 +1,285 @@
+# The MIT License (MIT)
+# Copyright (c) 2018 by the xcube development team and contributors
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies
+# of the Software, and to permit persons to whom the Software is furnished to do
+# so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Zarr store for object storage that fetches multiple chunks concurrently.
+
+Zarr reads all chunks that overlap a selection, e.g. the chunks of a tile or of a time-series subset,
+using a single call of a store's ``getitems()`` method. :class:`ObjectStorageStore` implements this
+method by fetching the chunks not yet cached concurrently using the asynchronous implementation of the
+object storage file system, so that the number of requests in flight is no longer limited by the
+number of threads reading chunks.
+"""
+
+import asyncio
+import collections
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import fsspec
+import fsspec.asyn
+import zarr.storage
+
+from .chunkcache import ChunkCache, DiskChunkCache
+from .defaults import OBS_MAX_CONCURRENCY, OBS_OBJECT_INFO_TTL
+from .metrics import REGISTRY
+from .perf import trace_span
+
+__author__ = "Norman Fomferra (Brockmann Consult GmbH)"
+
+_OBS_FETCH_SECONDS = REGISTRY.histogram('xcube_obs_fetch_seconds',
+                                        'Time spent fetching a batch of chunks from object storage, in seconds').labels()
+_OBS_CHUNKS_FETCHED = REGISTRY.counter('xcube_obs_chunks_fetched_total',
+                                       'Number of chunks fetched from object storage').labels()
+
+
+class ObjectStorageStore(zarr.storage.BaseStore):
+    """
+    A read-only zarr store for a dataset in object storage.
+    Chunks are kept in an optional chunk cache, which is usually shared by all stores of a process,
+    and in an optional disk chunk cache, which may be shared by all processes on a host.
+    Chunks in the disk chunk cache are validated against the ETag and size of their objects,
+    which are requested for the chunks not found in the chunk cache, concurrently like the chunks themselves,
+    and then used for *object_info_ttl* seconds.
+
+    If the file system *fs* is asynchronous, such as ``s3fs.S3FileSystem``, chunks requested by a
+    single ``getitems()`` call are fetched concurrently, at most *max_concurrency* at a time.
+    The number of connections should be bounded accordingly, e.g. by passing
+    ``config_kwargs=dict(max_pool_connections=max_concurrency)`` to ``s3fs.S3FileSystem``.
+
+    :param fs: the object storage file system
+    :param root: the root path of the zarr dataset, e.g. "bucket/cube.zarr"
+    :param chunk_cache: optional chunk cache
+    :param disk_chunk_cache: optional disk chunk cache
+    :param dataset_id: identifier of the dataset, used to account the size of its chunks in *chunk_cache*
+    :param max_concurrency: maximum number of concurrent requests per ``getitems()`` call
+    :param object_info_ttl: seconds for which the ETags and sizes of objects are used
+    """
+
+    _writeable = False
+    _erasable = False
+
+    def __init__(self,
+                 fs: fsspec.AbstractFileSystem,
+                 root: str,
+                 chunk_cache: ChunkCache = None,
+                 disk_chunk_cache: DiskChunkCache = None,
+                 dataset_id: str = None,
+                 max_concurrency: int = OBS_MAX_CONCURRENCY,
+                 object_info_ttl: float = OBS_OBJECT_INFO_TTL):
+        self._fs = fs
+        # Normalize the root, so that it matches the paths returned by the file system
+        self._root = fs._strip_protocol(root).rstrip('/')
+        self._chunk_cache = chunk_cache
+        self._disk_chunk_cache = disk_chunk_cache
+        self._dataset_id = dataset_id or self._root
+        self._max_concurrency = max_concurrency
+        self._object_info_ttl = object_info_ttl
+        self._keys = None  # type: Optional[Sequence[str]]
+        # maps object paths to tuples of the form (time obtained, (ETag, size) or None if there is no object),
+        # ordered by the time obtained
+        self._object_infos = collections.OrderedDict()
+        self._object_infos_lock = threading.Lock()
+
+    @property
+    def fs(self) -> fsspec.AbstractFileSystem:
+        return self._fs
+
+    @property
+    def root(self) -> str:
+        return self._root
+
+    @property
+    def chunk_cache(self) -> Optional[ChunkCache]:
+        return self._chunk_cache
+
+    @property
+    def disk_chunk_cache(self) -> Optional[DiskChunkCache]:
+        return self._disk_chunk_cache
+
+    def getitems(self, keys: Sequence[str], on_error: str = "omit") -> Dict[str, bytes]:
+        """
+        Get the values for *keys*. Values not in the cache are fetched concurrently.
+        Missing keys are omitted from the result.
+
+        :param keys: the keys
+        :param on_error: only "omit" is supported
+        :return: dictionary that maps keys to values
+        """
+        chunk_cache = self._chunk_cache
+        disk_chunk_cache = self._disk_chunk_cache
+        values = dict()
+        missing_keys = keys
+        if chunk_cache is not None:
+            missing_keys = []
+            for key in keys:
+                value = chunk_cache.get(self._get_path(key))
+                if value is not None:
+                    values[key] = value
+                else:
+                    missing_keys.append(key)
+        object_infos = dict()
+        if disk_chunk_cache is not None and missing_keys:
+            # ETags and sizes are only needed to validate chunks on disk, other chunks are fetched right away
+            keys, missing_keys = missing_keys, []
+            cached_keys = []
+            for key in keys:
+                if self._get_path(key) in disk_chunk_cache:
+                    cached_keys.append(key)
+                else:
+                    missing_keys.append(key)
+            if cached_keys:
+                object_infos = self._get_object_infos(cached_keys)
+            for key in cached_keys:
+                object_info = object_infos.get(key)
+                value = disk_chunk_cache.get(self._get_path(key), *object_info) if object_info is not None else None
+                if value is not None:
+                    values[key] = value
+                    if chunk_cache is not None:
+                        chunk_cache.put(self._dataset_id, self._get_path(key), value)
+                else:
+                    missing_keys.append(key)
+        if missing_keys:
+            fetched_values = self._fetch(missing_keys)
+            for key, value in fetched_values.items():
+                path = self._get_path(key)
+                if chunk_cache is not None:
+                    chunk_cache.put(self._dataset_id, path, value)
+                if disk_chunk_cache is not None:
+                    object_info = object_infos.get(key)
+                    if object_info is None:
+                        # The ETag of a chunk fetched without a prior request for it is unknown,
+                        # so the chunk is validated by its size only
+                        disk_chunk_cache.put(path, '', value)
+                    elif object_info[1] == len(value):
+                        disk_chunk_cache.put(path, object_info[0], value)
+            values.update(fetched_values)
+        return values
+
+    def __getitem__(self, key: str) -> bytes:
+        values = self.getitems([key])
+        if key not in values:
+            raise KeyError(key)
+        return values[key]
+
+    def __contains__(self, key) -> bool:
+        path = self._get_path(key)
+        if self._chunk_cache is not None and self._chunk_cache.get(path) is not None:
+            return True
+        return self._fs.exists(path)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._get_keys())
+
+    def __len__(self) -> int:
+        return len(self._get_keys())
+
+    def __setitem__(self, key: str, value: bytes):
+        raise NotImplementedError(f'{type(self).__name__} is read-only')
+
+    def __delitem__(self, key: str):
+        raise NotImplementedError(f'{type(self).__name__} is read-only')
+
+    def _fetch(self, keys: Sequence[str]) -> Dict[str, bytes]:
+        paths = [self._get_path(key) for key in keys]
+        kwargs = dict(batch_size=self._max_concurrency) if getattr(self._fs, 'async_impl', False) else dict()
+        t0 = time.perf_counter()
+        with trace_span('fetch chunks', attributes=dict(num_chunks=len(paths))):
+            results = self._fs.cat(paths, on_error='return', **kwargs)
+        _OBS_FETCH_SECONDS.observe(time.perf_counter() - t0)
+        if isinstance(results, bytes):
+            # fsspec returns the value itself if there is a single path without wildcards
+            results = {paths[0]: results}
+        values = dict()
+        for key, path in zip(keys, paths):
+            value = results.get(path)
+            if isinstance(value, FileNotFoundError) or value is None:
+                continue
+            if isinstance(value, BaseException):
+                raise value
+            values[key] = value
+        _OBS_CHUNKS_FETCHED.inc(len(values))
+        return values
+
+    def _get_object_infos(self, keys: Sequence[str]) -> Dict[str, Tuple[str, int]]:
+        """Get the ETags and sizes of the objects of *keys*, omitting keys without objects."""
+        now = time.monotonic()
+        object_infos = dict()
+        missing_keys = []
+        with self._object_infos_lock:
+            # Remove expired entries, which are the oldest ones
+            while self._object_infos:
+                obtained_at, _ = next(iter(self._object_infos.values()))
+                if now - obtained_at < self._object_info_ttl:
+                    break
+                self._object_infos.popitem(last=False)
+            for key in keys:
+                entry = self._object_infos.get(self._get_path(key))
+                if entry is None:
+                    missing_keys.append(key)
+                elif entry[1] is not None:
+                    object_infos[key] = entry[1]
+        if missing_keys:
+            fetched_object_infos = self._fetch_object_infos([self._get_path(key) for key in missing_keys])
+            with self._object_infos_lock:
+                for key, object_info in zip(missing_keys, fetched_object_infos):
+                    self._object_infos[self._get_path(key)] = now, object_info
+                    if object_info is not None:
+                        object_infos[key] = object_info
+        return object_infos
+
+    def _fetch_object_infos(self, paths: Sequence[str]) -> List[Optional[Tuple[str, int]]]:
+        with trace_span('fetch object infos', attributes=dict(num_objects=len(paths))):
+            if getattr(self._fs, 'async_impl', False):
+                entries = fsspec.asyn.sync(self._fs.loop, self._fetch_entries_async, paths)
+            else:
+                entries = [self._fetch_entry(path) for path in paths]
+        return [(str(entry.get('ETag', '')), entry['size']) if entry is not None and entry.get('type') == 'file'
+                else None
+                for entry in entries]
+
+    def _fetch_entry(self, path: str) -> Optional[dict]:
+        try:
+            return self._fs.info(path)
+        except FileNotFoundError:
+            return None
+
+    async def _fetch_entries_async(self, paths: Sequence[str]) -> List[Optional[dict]]:
+        semaphore = asyncio.Semaphore(self._max_concurrency)
+
+        async def fetch_entry(path: str) -> Optional[dict]:
+            async with semaphore:
+                try:
+                    return await self._fs._info(path)
+                except FileNotFoundError:
+                    return None
+
+        return await asyncio.gather(*[fetch_entry(path) for path in paths])
+
+    def _get_keys(self) -> Sequence[str]:
+        if self._keys is None:
+            prefix_len = len(self._root) + 1
+            self._keys = [path[prefix_len:] for path in self._fs.find(self._root)]
+        return self._keys
+
+    def _get_path(self, key: str) -> str:
+        return f'{self._root}/{key}'
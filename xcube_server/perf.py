@@ -1,7 +1,15 @@
+import collections
+import contextvars
 import functools
 import logging
+import os
+import secrets
+import threading
 import time
 from contextlib import AbstractContextManager
+from typing import Any, Callable, Dict, List, Optional, Union
+
+from .defaults import TRACE_HISTORY_SIZE
 
 
 def measure_time_cm(logger=None, disabled=False):
@@ -31,8 +39,17 @@ def measure_time_cm(logger=None, disabled=False):
 
 
 class measure_time(AbstractContextManager):
-    def __init__(self, tag: str = None, logger=None):
+    """
+    A context manager that measures the execution time of a code block and logs it.
+
+    :param tag: the tag logged with the duration. If not given, nothing is logged.
+    :param logger: The logger to be used. May be a string or logger object. Defaults to "xcube".
+    :param observe: optional function called with the duration in seconds, e.g. to record it in a metric.
+    """
+
+    def __init__(self, tag: str = None, logger=None, observe: Optional[Callable[[float], None]] = None):
         self._tag = tag
+        self._observe = observe
         if isinstance(logger, str):
             self._logger = logging.getLogger(logger)
         elif logger is None:
@@ -48,6 +65,8 @@ class measure_time(AbstractContextManager):
 
     def __exit__(self, *exc):
         self.duration = time.perf_counter() - self._start_time
+        if self._observe is not None:
+            self._observe(self.duration)
         if self._tag:
             self._logger.info(self._tag + ": took " + "%.2fms" % (self.duration * 1000))
 
@@ -55,11 +74,261 @@ class measure_time(AbstractContextManager):
 class _do_not_measure_time_cm(AbstractContextManager):
 
     # noinspection PyUnusedLocal
-    def __init__(self, tag: str = None, logger=None):
+    def __init__(self, tag: str = None, logger=None, observe: Optional[Callable[[float], None]] = None):
+        # Nothing is logged, but the duration is still measured if it is observed
+        self._observe = observe
+        self._start_time = None
         self.duration = None
 
     def __enter__(self):
+        if self._observe is not None:
+            self._start_time = time.perf_counter()
         return self
 
     def __exit__(self, *exc):
+        if self._observe is not None:
+            self.duration = time.perf_counter() - self._start_time
+            self._observe(self.duration)
+
+
+# The innermost span of the current trace, if any. Context variables are copied into
+# executor tasks by ServiceRequestHandler.run_in_executor(), so spans recorded in executor
+# threads are added to the trace of the request that submitted the task.
+_CURRENT_SPAN = contextvars.ContextVar('xcube_current_span', default=None)
+
+_RECENT_TRACES = collections.deque(maxlen=TRACE_HISTORY_SIZE)
+_RECENT_TRACES_LOCK = threading.Lock()
+
+
+class Span(AbstractContextManager):
+    """
+    A timed operation within a trace. Spans form a tree, whose root is the span of a :class:`Trace`.
+    Use :func:`trace_span` to create spans.
+
+    :param name: the span name, e.g. "map colors"
+    :param attributes: optional span attributes
+    :param observe: optional function called with the duration in seconds, e.g. to record it in a metric.
+    """
+
+    __slots__ = ('name', 'attributes', 'start_ns', 'end_ns', 'thread_id', 'children', '_observe', '_parent')
+
+    def __init__(self, name: str, attributes: Dict[str, Any] = None, observe: Optional[Callable[[float], None]] = None):
+        self.name = name
+        self.attributes = attributes
+        self.start_ns = None
+        self.end_ns = None
+        self.thread_id = None
+        self.children = []  # type: List[Span]
+        self._observe = observe
+        self._parent = None
+
+    @property
+    def is_recording(self) -> bool:
+        """Whether this span is recorded in a trace."""
+        return True
+
+    @property
+    def duration(self) -> Optional[float]:
+        """Duration in seconds, or None if the span has not yet ended."""
+        if self.end_ns is None:
+            return None
+        return (self.end_ns - self.start_ns) / 1e9
+
+    def set_attribute(self, key: str, value: Any):
+        if self.attributes is None:
+            self.attributes = dict()
+        self.attributes[key] = value
+
+    def __enter__(self):
+        parent = _CURRENT_SPAN.get()
+        if parent is not None:
+            parent.children.append(self)
+        self._enter(parent)
+        return self
+
+    def __exit__(self, *exc):
+        self.end_ns = time.perf_counter_ns()
+        # Not ContextVar.reset(), because a span may end in another context than it started,
+        # e.g. if it is entered and exited by a generator run in different executor tasks
+        _CURRENT_SPAN.set(self._parent)
+        self._parent = None
+        if self._observe is not None:
+            self._observe((self.end_ns - self.start_ns) / 1e9)
+
+    def _enter(self, parent: Optional['Span']):
+        self._parent = parent
+        self.thread_id = threading.get_ident()
+        _CURRENT_SPAN.set(self)
+        self.start_ns = time.perf_counter_ns()
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert this span and its children into a JSON-serializable dictionary."""
+        span_dict = dict(name=self.name, duration=self.duration)
+        if self.attributes:
+            span_dict['attributes'] = dict(self.attributes)
+        if self.children:
+            span_dict['children'] = [child.to_dict() for child in self.children]
+        return span_dict
+
+
+class Trace(Span):
+    """
+    The root span of a trace, e.g. of the spans recorded while handling a single request.
+    Use :func:`start_trace` to create traces. When a trace ends, it is kept in the history of
+    recent traces, see :func:`get_recent_traces`.
+
+    :param name: the trace name, e.g. "GET /datasets"
+    :param attributes: optional trace attributes
+    """
+
+    __slots__ = ('id',)
+
+    def __init__(self, name: str, attributes: Dict[str, Any] = None):
+        super().__init__(name, attributes=attributes)
+        # Random, so that clients cannot guess the identifiers of other clients' traces
+        self.id = secrets.token_hex(8)
+
+    def __enter__(self):
+        # A trace is always a root span, but the current span is restored on exit
+        self._enter(_CURRENT_SPAN.get())
+        return self
+
+    def __exit__(self, *exc):
+        super().__exit__(*exc)
+        with _RECENT_TRACES_LOCK:
+            _RECENT_TRACES.append(self)
+
+    def to_dict(self) -> Dict[str, Any]:
+        trace_dict = super().to_dict()
+        trace_dict['id'] = self.id
+        return trace_dict
+
+    def to_chrome_trace_events(self) -> List[Dict[str, Any]]:
+        """
+        Convert this trace into a list of events in the Chrome trace event format,
+        which can be viewed using chrome://tracing or https://ui.perfetto.dev.
+        See https://docs.google.com/document/d/1CvAClvFfyA5R-PhYUmn5OOQtYMH4h6I0nSsKchNAySU
+        """
+        events = []
+        process_id = os.getpid()
+
+        def add_events(span: Span):
+            if span.end_ns is None:
+                return
+            event = dict(name=span.name,
+                         cat='xcube',
+                         ph='X',
+                         ts=span.start_ns / 1000,
+                         dur=(span.end_ns - span.start_ns) / 1000,
+                         pid=process_id,
+                         tid=span.thread_id,
+                         args=dict(span.attributes or {}, trace=self.id))
+            events.append(event)
+            for child in span.children:
+                add_events(child)
+
+        add_events(self)
+        return events
+
+
+class _NoOpSpan(AbstractContextManager):
+    """A span that records nothing, used if there is no current trace."""
+
+    __slots__ = ()
+
+    @property
+    def is_recording(self) -> bool:
+        return False
+
+    def set_attribute(self, key: str, value: Any):
         pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+class _ObservedSpan(_NoOpSpan):
+    """A span that is not recorded, but whose duration is observed."""
+
+    __slots__ = ('_observe', '_start_time')
+
+    def __init__(self, observe: Callable[[float], None]):
+        self._observe = observe
+        self._start_time = None
+
+    def __enter__(self):
+        self._start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._observe(time.perf_counter() - self._start_time)
+
+
+_NO_OP_SPAN = _NoOpSpan()
+
+
+def start_trace(name: str, attributes: Dict[str, Any] = None) -> Trace:
+    """
+    Create a new trace. Spans created by :func:`trace_span` while the trace is entered
+    as a context manager are recorded in the trace::
+
+        with start_trace("GET /datasets") as trace:
+            with trace_span("open dataset"):
+                ...
+
+    :param name: the trace name
+    :param attributes: optional trace attributes
+    :return: the trace, to be used as context manager
+    """
+    return Trace(name, attributes=attributes)
+
+
+def trace_span(name: str,
+               attributes: Dict[str, Any] = None,
+               observe: Optional[Callable[[float], None]] = None) -> Union[Span, _NoOpSpan]:
+    """
+    Get a context manager that records a span named *name* in the current trace.
+    If there is no current trace, a shared no-op span is returned, so the call is cheap.
+    Use the span's *is_recording* property to avoid computing attributes that are not recorded.
+
+    :param name: the span name
+    :param attributes: optional span attributes
+    :param observe: optional function called with the duration in seconds, even if there is no current trace
+    :return: the span, to be used as context manager
+    """
+    if _CURRENT_SPAN.get() is None:
+        return _NO_OP_SPAN if observe is None else _ObservedSpan(observe)
+    return Span(name, attributes=attributes, observe=observe)
+
+
+def is_tracing() -> bool:
+    """Test whether there is a current trace."""
+    return _CURRENT_SPAN.get() is not None
+
+
+def get_recent_traces() -> List[Trace]:
+    """Get the most recently ended traces, oldest first."""
+    with _RECENT_TRACES_LOCK:
+        return list(_RECENT_TRACES)
+
+
+def get_trace(trace_id: str) -> Optional[Trace]:
+    """Get a recently ended trace by its identifier, or None if it is no longer available."""
+    with _RECENT_TRACES_LOCK:
+        return next((trace for trace in _RECENT_TRACES if trace.id == trace_id), None)
+
+
+def traces_to_chrome_trace_json_object(traces: List[Trace]) -> Dict[str, Any]:
+    """
+    Convert the given *traces* into a JSON object in the Chrome trace event format.
+
+    :param traces: the traces
+    :return: a JSON-serializable dictionary
+    """
+    events = []
+    for trace in traces:
+        events.extend(trace.to_chrome_trace_events())
+    return dict(traceEvents=events, displayTimeUnit='ms')
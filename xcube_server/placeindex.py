@@ -0,0 +1,148 @@
+# The MIT License (MIT)
+# Copyright (c) 2018 by the xcube development team and contributors
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies
+# of the Software, and to permit persons to whom the Software is furnished to do
+# so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import math
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+# Maximum number of children of a node
+DEFAULT_NODE_CAPACITY = 16
+
+
+class PackedRTree:
+    """
+    A static R-tree for the bounding boxes of features, packed using the Sort-Tile-Recursive (STR) algorithm.
+
+    The tree is represented by two arrays, so that it can be saved to disk and accessed through memory maps:
+
+    * *order* - an int64 array of feature indexes in the order of the leaves;
+    * *nodes* - a float64 array of shape (M, 4) that holds the bounding boxes (x_min, y_min, x_max, y_max)
+      of all levels of the tree, starting with the leaves and ending with the root.
+      The children of node *i* of a level are nodes *i* × *node_capacity* to
+      (*i* + 1) × *node_capacity* - 1 of the level below.
+
+    Queries visit only the nodes that intersect the query box, so that their costs grow
+    logarithmically with the number of features.
+
+    :param order: feature indexes in the order of the leaves
+    :param nodes: bounding boxes of the nodes of all levels
+    :param level_sizes: number of nodes per level, starting with the leaves
+    :param node_capacity: maximum number of children of a node
+    """
+
+    def __init__(self,
+                 order: np.ndarray,
+                 nodes: np.ndarray,
+                 level_sizes: Sequence[int],
+                 node_capacity: int = DEFAULT_NODE_CAPACITY):
+        self._order = order
+        self._nodes = nodes
+        self._level_sizes = list(level_sizes)
+        self._node_capacity = node_capacity
+        self._level_offsets = [0]
+        for level_size in self._level_sizes[:-1]:
+            self._level_offsets.append(self._level_offsets[-1] + level_size)
+
+    @classmethod
+    def build(cls, bounds: np.ndarray, node_capacity: int = DEFAULT_NODE_CAPACITY) -> "PackedRTree":
+        """
+        Build a tree for the given feature bounds. Features with NaN bounds, e.g. features without geometry,
+        are not indexed.
+
+        :param bounds: float64 array of shape (N, 4) with the bounding boxes of N features
+        :param node_capacity: maximum number of children of a node
+        :return: a new tree
+        """
+        order = np.nonzero(~np.isnan(bounds).any(axis=1))[0].astype(np.int64)
+        if len(order) > 0:
+            order = order[_get_str_order(bounds[order], node_capacity)]
+        levels = [np.asarray(bounds[order], dtype=np.float64).reshape((len(order), 4))]
+        while len(levels[-1]) > 1:
+            children = levels[-1]
+            starts = np.arange(0, len(children), node_capacity)
+            levels.append(np.stack([np.minimum.reduceat(children[:, 0], starts),
+                                    np.minimum.reduceat(children[:, 1], starts),
+                                    np.maximum.reduceat(children[:, 2], starts),
+                                    np.maximum.reduceat(children[:, 3], starts)], axis=1))
+        return PackedRTree(order, np.concatenate(levels), [len(level) for level in levels], node_capacity)
+
+    @property
+    def order(self) -> np.ndarray:
+        """Feature indexes in the order of the leaves."""
+        return self._order
+
+    @property
+    def nodes(self) -> np.ndarray:
+        """Bounding boxes of the nodes of all levels, starting with the leaves."""
+        return self._nodes
+
+    @property
+    def level_sizes(self) -> List[int]:
+        """Number of nodes per level, starting with the leaves."""
+        return list(self._level_sizes)
+
+    @property
+    def node_capacity(self) -> int:
+        """Maximum number of children of a node."""
+        return self._node_capacity
+
+    def __len__(self) -> int:
+        return len(self._order)
+
+    def query(self, box: Tuple[float, float, float, float]) -> np.ndarray:
+        """
+        Find the features whose bounding boxes intersect *box*.
+
+        :param box: the query box (x_min, y_min, x_max, y_max)
+        :return: ascending feature indexes
+        """
+        if len(self._order) == 0:
+            return np.zeros(0, dtype=np.int64)
+        x_min, y_min, x_max, y_max = box
+        node_indexes = np.zeros(1, dtype=np.int64)
+        for level in range(len(self._level_sizes) - 1, -1, -1):
+            level_size = self._level_sizes[level]
+            if level < len(self._level_sizes) - 1:
+                first_child_indexes = node_indexes[:, np.newaxis] * self._node_capacity
+                node_indexes = (first_child_indexes + np.arange(self._node_capacity)).ravel()
+                node_indexes = node_indexes[node_indexes < level_size]
+            nodes = self._nodes[self._level_offsets[level] + node_indexes]
+            x_overlaps = (nodes[:, 0] <= x_max) & (nodes[:, 2] >= x_min)
+            y_overlaps = (nodes[:, 1] <= y_max) & (nodes[:, 3] >= y_min)
+            node_indexes = node_indexes[x_overlaps & y_overlaps]
+            if len(node_indexes) == 0:
+                break
+        return np.sort(self._order[node_indexes])
+
+
+def _get_str_order(bounds: np.ndarray, node_capacity: int) -> np.ndarray:
+    # Sort-Tile-Recursive: sort by x into vertical slices of whole leaf nodes, then sort each slice by y
+    num_items = len(bounds)
+    num_nodes = math.ceil(num_items / node_capacity)
+    slice_size = math.ceil(math.sqrt(num_nodes)) * node_capacity
+    x = bounds[:, 0] + bounds[:, 2]
+    y = bounds[:, 1] + bounds[:, 3]
+    order = np.argsort(x, kind="stable")
+    for start in range(0, num_items, slice_size):
+        slice_order = order[start:start + slice_size]
+        order[start:start + slice_size] = slice_order[np.argsort(y[slice_order], kind="stable")]
+    return order
@@ -0,0 +1,139 @@
+# The MIT License (MIT)
+# Copyright (c) 2018 by the xcube development team and contributors
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies
+# of the Software, and to permit persons to whom the Software is furnished to do
+# so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import fnmatch
+import operator
+import re
+import shlex
+from typing import List, Tuple
+
+import numpy as np
+
+from .placestore import PlaceStore
+
+_TERM_PATTERN = re.compile(r"^(?P<name>[^:<>=!]+)(?P<op>:|<=|>=|!=|=|<|>)(?P<value>.*)$", re.DOTALL)
+
+_COMPARISON_OPS = {
+    "=": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+}
+
+
+class PlaceQuery:
+    """
+    A query for places by their property values.
+
+    A query expression comprises one or more terms separated by whitespace, where each term compares
+    a property with a value. Values that contain whitespace must be quoted, e.g. ``NAME:"Lake *"``.
+    Supported terms are:
+
+    * ``name:pattern`` - property value matches *pattern*, case-insensitive,
+      where ``*`` and ``?`` are wildcards;
+    * ``name=value``, ``name!=value`` - property value equals (not) *value*;
+    * ``name<value``, ``name<=value``, ``name>value``, ``name>=value`` - property value compares
+      with *value*, numerically for numeric properties, lexicographically otherwise.
+
+    Features that do not have a property never match a term that refers to it.
+
+    :param terms: list of (name, op, value) tuples
+    :param comb_op: "and" or "or", how to combine the terms
+    """
+
+    def __init__(self, terms: List[Tuple[str, str, str]], comb_op: str = "and"):
+        if comb_op not in ("and", "or"):
+            raise ValueError(f"invalid combination operation {comb_op!r}")
+        self._terms = list(terms)
+        self._comb_op = comb_op
+
+    @classmethod
+    def parse(cls, query_expr: str, comb_op: str = "and") -> "PlaceQuery":
+        """
+        Parse a query expression.
+
+        :param query_expr: the query expression
+        :param comb_op: "and" or "or", how to combine the terms
+        :return: a new query
+        :raise ValueError: if *query_expr* is invalid
+        """
+        terms = []
+        for term in shlex.split(query_expr):
+            match = _TERM_PATTERN.match(term)
+            if match is None:
+                raise ValueError(f"invalid query term {term!r}")
+            terms.append((match.group("name"), match.group("op"), match.group("value")))
+        if not terms:
+            raise ValueError("empty query expression")
+        return PlaceQuery(terms, comb_op=comb_op)
+
+    @property
+    def terms(self) -> List[Tuple[str, str, str]]:
+        return list(self._terms)
+
+    @property
+    def comb_op(self) -> str:
+        return self._comb_op
+
+    def get_mask(self, place_store: PlaceStore) -> np.ndarray:
+        """
+        Evaluate this query against the columnar property table of *place_store*.
+
+        :param place_store: an opened place store
+        :return: a boolean array that is True for the matching features
+        :raise ValueError: if a value cannot be compared with a numeric property
+        """
+        mask = None
+        for name, op, value in self._terms:
+            term_mask = self._get_term_mask(place_store, name, op, value)
+            if mask is None:
+                mask = term_mask
+            elif self._comb_op == "and":
+                mask &= term_mask
+            else:
+                mask |= term_mask
+        return mask
+
+    @classmethod
+    def _get_term_mask(cls, place_store: PlaceStore, name: str, op: str, value: str) -> np.ndarray:
+        column = place_store.get_property_column(name)
+        if column is None:
+            return np.zeros(place_store.num_features, dtype=np.bool_)
+        values, valid = column
+        if op == ":":
+            if values.dtype.kind == "f":
+                try:
+                    return valid & (values == float(value))
+                except ValueError:
+                    return np.zeros(place_store.num_features, dtype=np.bool_)
+            regex = re.compile(fnmatch.translate(value), re.IGNORECASE)
+            # Match unique values only, property values are often repetitive
+            unique_values, inverse = np.unique(values, return_inverse=True)
+            unique_mask = np.array([regex.match(v) is not None for v in unique_values], dtype=np.bool_)
+            return valid & unique_mask[inverse]
+        if values.dtype.kind == "f":
+            try:
+                value = float(value)
+            except ValueError as e:
+                raise ValueError(f"property {name!r} is numeric, but {value!r} is not a number") from e
+        return valid & _COMPARISON_OPS[op](values, value)
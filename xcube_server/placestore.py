@@ -0,0 +1,407 @@
+# The MIT License (MIT)
+# Copyright (c) 2018 by the xcube development team and contributors
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies
+# of the Software, and to permit persons to whom the Software is furnished to do
+# so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import hashlib
+import json
+import mmap
+import os
+import threading
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+import fiona
+import numpy as np
+import shapely.geometry
+import shapely.prepared
+
+from .placeindex import PackedRTree
+
+GeoJsonFeature = Dict
+
+# Increment whenever the layout of the files written by PlaceStore changes
+_STORE_FORMAT_VERSION = 3
+
+_STORE_FILE_EXTS = (".features.jsonl", ".bounds.npy", ".offsets.npy", ".rtree-order.npy", ".rtree-nodes.npy",
+                    ".properties.npz", ".json")
+
+
+class PlaceStore:
+    """
+    A lazy store for the features of a single feature collection file, e.g. a Shapefile or GeoJSON file.
+
+    When opened, the features of the collection file are converted once into a compact on-disk
+    representation in *cache_dir*:
+
+    * ``<key>.<stamp>.features.jsonl`` - the features as JSON records, one per line;
+    * ``<key>.<stamp>.bounds.npy`` - the bounding boxes of the feature geometries as float64 array of shape (N, 4);
+    * ``<key>.<stamp>.offsets.npy`` - the byte offsets and sizes of the records as int64 array of shape (N, 2);
+    * ``<key>.<stamp>.properties.npz`` - a columnar table of the feature properties, see :meth:`get_property_column`;
+    * ``<key>.<stamp>.rtree-order.npy``, ``<key>.<stamp>.rtree-nodes.npy`` - a packed R-tree of the bounding
+      boxes, see :class:`PackedRTree`;
+    * ``<key>.<stamp>.json`` - metadata used to validate the other files against the collection file.
+
+    Records, bounds, offsets, and the R-tree are accessed through memory maps, property columns are loaded
+    on first use. The on-disk representation is rebuilt only if the collection file's modification time
+    or size changes, in which case the files of the new version are written next to the ones of the
+    previous version, whose memory maps remain valid for readers that are still using them.
+
+    :param path: path of the feature collection file
+    :param cache_dir: directory where the on-disk representation is stored
+    :param character_encoding: character encoding of the feature collection file
+    """
+
+    def __init__(self, path: str, cache_dir: str, character_encoding: str = "utf-8"):
+        self._path = os.path.abspath(path)
+        self._cache_dir = cache_dir
+        self._character_encoding = character_encoding
+        self._key = hashlib.sha1(f"{self._path}|{character_encoding}".encode("utf-8")).hexdigest()
+        self._snapshot = None  # type: Optional[_StoreSnapshot]
+        self._lock = threading.RLock()
+        self.version = 0
+        self.first_feature_id = 0
+
+    @property
+    def path(self) -> str:
+        """Path of the feature collection file."""
+        return self._path
+
+    @property
+    def num_features(self) -> int:
+        """Number of features in the store."""
+        return len(self._get_snapshot().offsets)
+
+    @property
+    def property_names(self) -> List[str]:
+        """Names of the feature properties in the store."""
+        return list(self._get_snapshot().property_names)
+
+    def sync(self) -> bool:
+        """
+        Open the store, or reopen it if the feature collection file has changed since it was last opened.
+        Readers that are still using the previous version of the store are not affected.
+
+        :return: True, if the store has been (re)opened, False if it was already up to date
+        """
+        stat = os.stat(self._path)
+        source_stamp = stat.st_mtime_ns, stat.st_size
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.source_stamp == source_stamp:
+            return False
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is not None and snapshot.source_stamp == source_stamp:
+                return False
+            base_path = self._get_base_path(source_stamp)
+            snapshot = _StoreSnapshot.load(base_path, self._path, source_stamp)
+            if snapshot is None:
+                self._write_index(base_path, source_stamp)
+                snapshot = _StoreSnapshot.load(base_path, self._path, source_stamp)
+                if snapshot is None:
+                    raise RuntimeError(f"failed to open place store for {self._path!r}")
+            # Replaced in a single step, readers use either the previous or the new snapshot
+            self._snapshot = snapshot
+            self.version += 1
+            self._remove_outdated_files(base_path)
+            return True
+
+    def read_features(self, indexes: Iterable[int] = None) -> Iterator[GeoJsonFeature]:
+        """
+        Read features from disk.
+
+        :param indexes: optional indexes of the features to be read, defaults to all features
+        :return: an iterator of GeoJSON features
+        """
+        snapshot = self._get_snapshot()
+        if indexes is None:
+            indexes = range(len(snapshot.offsets))
+        return self._iter_features(snapshot, indexes)
+
+    def _iter_features(self, snapshot: "_StoreSnapshot", indexes: Iterable[int]) -> Iterator[GeoJsonFeature]:
+        for index in indexes:
+            offset, size = snapshot.offsets[index]
+            feature = json.loads(snapshot.records[int(offset):int(offset) + int(size)].decode("utf-8"))
+            feature["id"] = str(self.first_feature_id + int(index))
+            yield feature
+
+    def get_property_column(self, property_name: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Get the values of a feature property for all features.
+
+        Properties whose values are all numbers are stored as float64 arrays,
+        all other properties are stored as string arrays.
+
+        :param property_name: the property name
+        :return: a tuple (values, valid) where *valid* is a boolean array that is False for features
+                 which do not have the property, or None, if no feature has the property
+        """
+        snapshot = self._get_snapshot()
+        if property_name not in snapshot.property_names:
+            return None
+        with self._lock:
+            property_columns = snapshot.property_columns
+            if property_name not in property_columns:
+                column_index = snapshot.property_names.index(property_name)
+                property_columns[property_name] = (snapshot.property_table[f"values_{column_index}"],
+                                                   snapshot.property_table[f"valid_{column_index}"])
+            return property_columns[property_name]
+
+    def find_features(self, query_geometry: shapely.geometry.base.BaseGeometry) -> List[GeoJsonFeature]:
+        """
+        Find the features that intersect *query_geometry*. Only features whose bounding boxes
+        intersect the bounding box of *query_geometry* or of one of its parts are read from disk.
+
+        :param query_geometry: the query geometry
+        :return: the intersecting features in the order of the feature collection file
+        """
+        return [feature for _, feature in self.iter_matching_features(query_geometry=query_geometry)]
+
+    def iter_matching_features(self,
+                               query_geometry: shapely.geometry.base.BaseGeometry = None,
+                               property_mask: np.ndarray = None,
+                               comb_op: str = "and",
+                               start_index: int = 0) -> Iterator[Tuple[int, GeoJsonFeature]]:
+        """
+        Lazily find the features that intersect *query_geometry* and/or are selected by *property_mask*.
+        If neither *query_geometry* nor *property_mask* is given, all features match.
+
+        :param query_geometry: optional query geometry
+        :param property_mask: optional boolean array that selects features, e.g. by property values
+        :param comb_op: "and" or "or", how to combine the geometry and the property criteria
+        :param start_index: index of the first feature to be considered
+        :return: an iterator of tuples (feature index, feature) in the order of the feature collection file
+        """
+        snapshot = self._get_snapshot()
+        num_features = len(snapshot.offsets)
+        if query_geometry is None:
+            candidate_mask = property_mask if property_mask is not None else np.ones(num_features, np.bool_)
+        elif property_mask is None:
+            candidate_mask = self._get_bounds_mask(snapshot, query_geometry)
+        elif comb_op == "or":
+            candidate_mask = self._get_bounds_mask(snapshot, query_geometry) | property_mask
+        else:
+            candidate_mask = self._get_bounds_mask(snapshot, query_geometry) & property_mask
+        candidates = np.nonzero(candidate_mask[start_index:])[0] + start_index
+        return self._iter_matching_features(snapshot, candidates, query_geometry, property_mask, comb_op)
+
+    def _iter_matching_features(self,
+                                snapshot: "_StoreSnapshot",
+                                candidates: np.ndarray,
+                                query_geometry: Optional[shapely.geometry.base.BaseGeometry],
+                                property_mask: Optional[np.ndarray],
+                                comb_op: str) -> Iterator[Tuple[int, GeoJsonFeature]]:
+        for index, feature in zip(candidates, self._iter_features(snapshot, candidates)):
+            if query_geometry is not None \
+                    and not (comb_op == "or" and property_mask is not None and property_mask[index]) \
+                    and not snapshot.get_prepared_geometry(int(index), feature).intersects(query_geometry):
+                continue
+            yield int(index), feature
+
+    @classmethod
+    def _get_bounds_mask(cls,
+                         snapshot: "_StoreSnapshot",
+                         query_geometry: shapely.geometry.base.BaseGeometry) -> np.ndarray:
+        mask = np.zeros(len(snapshot.offsets), dtype=np.bool_)
+        for part in getattr(query_geometry, "geoms", (query_geometry,)):
+            if not part.is_empty:
+                mask[snapshot.rtree.query(part.bounds)] = True
+        return mask
+
+    def _get_snapshot(self) -> "_StoreSnapshot":
+        snapshot = self._snapshot
+        if snapshot is None:
+            raise RuntimeError(f"place store for {self._path!r} has not been opened, call sync() first")
+        return snapshot
+
+    def _get_base_path(self, source_stamp: Tuple[int, int]) -> str:
+        mtime_ns, size = source_stamp
+        return os.path.join(self._cache_dir, f"{self._key}.{mtime_ns:x}-{size:x}")
+
+    def _remove_outdated_files(self, base_path: str):
+        # Memory maps of removed files remain valid on POSIX systems, elsewhere the files are removed later
+        base_name = os.path.basename(base_path)
+        for file_name in os.listdir(self._cache_dir):
+            if file_name.startswith(self._key + ".") and not file_name.startswith(base_name + ".") \
+                    and not file_name.endswith(".tmp"):
+                try:
+                    os.remove(os.path.join(self._cache_dir, file_name))
+                except OSError:
+                    pass
+
+    def _write_index(self, base_path: str, source_stamp: Tuple[int, int]):
+        os.makedirs(self._cache_dir, exist_ok=True)
+        # Write to temporary files first and rename them, so that concurrent readers never see partial files
+        suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+        bounds = []
+        offsets = []
+        property_table = _PropertyTableBuilder()
+        with open(base_path + ".features.jsonl" + suffix, "wb") as fp:
+            with fiona.open(self._path, encoding=self._character_encoding) as feature_collection:
+                for feature in feature_collection:
+                    feature = _normalize_feature(feature)
+                    record = json.dumps(feature, separators=(",", ":")).encode("utf-8")
+                    offsets.append((fp.tell(), len(record)))
+                    bounds.append(_get_feature_bounds(feature))
+                    property_table.append(feature["properties"])
+                    fp.write(record)
+                    fp.write(b"\n")
+        bounds = np.array(bounds, dtype=np.float64).reshape((len(bounds), 4))
+        rtree = PackedRTree.build(bounds)
+        with open(base_path + ".bounds.npy" + suffix, "wb") as fp:
+            np.save(fp, bounds)
+        with open(base_path + ".offsets.npy" + suffix, "wb") as fp:
+            np.save(fp, np.array(offsets, dtype=np.int64).reshape((len(offsets), 2)))
+        with open(base_path + ".rtree-order.npy" + suffix, "wb") as fp:
+            np.save(fp, rtree.order)
+        with open(base_path + ".rtree-nodes.npy" + suffix, "wb") as fp:
+            np.save(fp, rtree.nodes)
+        with open(base_path + ".properties.npz" + suffix, "wb") as fp:
+            property_names = property_table.save(fp)
+        with open(base_path + ".json" + suffix, "w") as fp:
+            json.dump(dict(format=_STORE_FORMAT_VERSION,
+                           path=self._path,
+                           stamp=list(source_stamp),
+                           properties=property_names,
+                           rtree=dict(level_sizes=rtree.level_sizes, node_capacity=rtree.node_capacity)), fp)
+        # Metadata is renamed last, it validates the other files
+        for ext in _STORE_FILE_EXTS:
+            os.replace(base_path + ext + suffix, base_path + ext)
+
+
+class _StoreSnapshot:
+    """An immutable, opened version of the on-disk representation of a :class:`PlaceStore`."""
+
+    def __init__(self,
+                 source_stamp: Tuple[int, int],
+                 records: Union[mmap.mmap, bytes],
+                 bounds: np.ndarray,
+                 offsets: np.ndarray,
+                 rtree: PackedRTree,
+                 property_names: List[str],
+                 property_table):
+        self.source_stamp = source_stamp
+        self.records = records
+        self.bounds = bounds
+        self.offsets = offsets
+        self.rtree = rtree
+        self.property_names = property_names
+        self.property_table = property_table
+        self.property_columns = dict()
+        # maps feature indexes to prepared geometries, built on first query and reused by later ones
+        self.prepared_geometries = dict()
+
+    def get_prepared_geometry(self, index: int, feature: GeoJsonFeature):
+        """
+        Get the prepared geometry of the feature at *index*.
+
+        :param index: the feature index
+        :param feature: the feature at *index*, used to build the prepared geometry if not yet done
+        :return: the prepared shapely geometry
+        """
+        prepared_geometry = self.prepared_geometries.get(index)
+        if prepared_geometry is None:
+            prepared_geometry = shapely.prepared.prep(shapely.geometry.shape(feature["geometry"]))
+            self.prepared_geometries[index] = prepared_geometry
+        return prepared_geometry
+
+    @classmethod
+    def load(cls, base_path: str, path: str, source_stamp: Tuple[int, int]) -> Optional["_StoreSnapshot"]:
+        try:
+            with open(base_path + ".json") as fp:
+                meta = json.load(fp)
+        except (OSError, ValueError):
+            return None
+        if meta.get("format") != _STORE_FORMAT_VERSION \
+                or meta.get("path") != path or tuple(meta.get("stamp", ())) != source_stamp:
+            return None
+        try:
+            with open(base_path + ".features.jsonl", "rb") as fp:
+                # Empty files cannot be memory-mapped
+                records = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) \
+                    if os.fstat(fp.fileno()).st_size > 0 else b""
+            bounds = np.load(base_path + ".bounds.npy", mmap_mode="r")
+            offsets = np.load(base_path + ".offsets.npy", mmap_mode="r")
+            rtree = PackedRTree(np.load(base_path + ".rtree-order.npy", mmap_mode="r"),
+                                np.load(base_path + ".rtree-nodes.npy", mmap_mode="r"),
+                                meta["rtree"]["level_sizes"],
+                                node_capacity=meta["rtree"]["node_capacity"])
+            property_table = np.load(base_path + ".properties.npz")
+        except (OSError, ValueError, KeyError):
+            return None
+        return _StoreSnapshot(source_stamp, records, bounds, offsets, rtree,
+                              list(meta.get("properties", [])), property_table)
+
+
+def _normalize_feature(feature: Dict) -> GeoJsonFeature:
+    properties = dict(feature.get("properties") or {})
+    properties.pop("id", None)
+    properties.pop("ID", None)
+    return dict(type="Feature",
+                geometry=feature.get("geometry"),
+                properties=properties)
+
+
+def _get_feature_bounds(feature: GeoJsonFeature) -> Tuple[float, float, float, float]:
+    geometry = feature.get("geometry")
+    if geometry:
+        shape = shapely.geometry.shape(geometry)
+        if not shape.is_empty:
+            return shape.bounds
+    return np.nan, np.nan, np.nan, np.nan
+
+
+class _PropertyTableBuilder:
+    """Collects feature properties row by row and saves them as columns."""
+
+    def __init__(self):
+        self._num_rows = 0
+        self._columns = dict()
+
+    def append(self, properties: Dict):
+        for name, value in properties.items():
+            if value is None:
+                continue
+            if name not in self._columns:
+                self._columns[name] = dict()
+            self._columns[name][self._num_rows] = value
+        self._num_rows += 1
+
+    def save(self, fp) -> List[str]:
+        names = list(self._columns.keys())
+        arrays = dict()
+        for column_index, name in enumerate(names):
+            column = self._columns[name]
+            valid = np.zeros(self._num_rows, dtype=np.bool_)
+            valid[list(column.keys())] = True
+            if all(_is_number(value) for value in column.values()):
+                values = np.full(self._num_rows, np.nan, dtype=np.float64)
+                values[list(column.keys())] = list(column.values())
+            else:
+                strings = [""] * self._num_rows
+                for row, value in column.items():
+                    strings[row] = str(value)
+                values = np.array(strings, dtype=np.str_)
+            arrays[f"values_{column_index}"] = values
+            arrays[f"valid_{column_index}"] = valid
+        np.savez(fp, **arrays)
+        return names
+
+
+def _is_number(value: Union[int, float, str]) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
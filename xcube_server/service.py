@@ -20,6 +20,7 @@
 # SOFTWARE.
 
 import asyncio
+import contextvars
 import json
 import logging
 import os
@@ -29,26 +30,43 @@ import time
 import traceback
 from datetime import datetime
 from json import JSONDecodeError
-from typing import Optional, Any, Dict
+from typing import Optional, Any, Dict, Iterator, List, Callable, Awaitable
 
 import tornado.escape
 import tornado.options
 import yaml
+from tornado.httpserver import HTTPServer
 from tornado.ioloop import IOLoop
 from tornado.log import enable_pretty_logging
+from tornado.netutil import bind_sockets
 from tornado.web import RequestHandler, Application
 
+from . import __version__
+from .cache import FileCacheStore, SharedMemoryCacheStore
+from .compression import select_content_encoding
 from .context import ServiceContext
+from .encoded import EncodedDocument
 from .defaults import DEFAULT_ADDRESS, DEFAULT_PORT, DEFAULT_CONFIG_FILE, DEFAULT_UPDATE_PERIOD, DEFAULT_LOG_PREFIX, \
-    DEFAULT_TILE_CACHE_SIZE, DEFAULT_NAME, DEFAULT_TRACE_PERF, DEFAULT_TILE_COMP_MODE
+    DEFAULT_TILE_CACHE_SIZE, DEFAULT_NAME, DEFAULT_TRACE_PERF, DEFAULT_TILE_COMP_MODE, DEFAULT_NUM_WORKERS, \
+    DEFAULT_FILE_TILE_CACHE_SIZE, FILE_TILE_CACHE_PATH, DEFAULT_CHUNK_CACHE_SIZE
 from .errors import ServiceBadRequestError
+from .executors import EXECUTOR_TIME_SERIES
+from .jsonenc import to_json, to_json_bytes
+from .loopmon import EventLoopLagMonitor
+from .metrics import REGISTRY
+from .perf import Trace, start_trace
 from .reqparams import RequestParams
 from .undefined import UNDEFINED
+from .workers import fork_workers, get_num_workers
 
 __author__ = "Norman Fomferra (Brockmann Consult GmbH)"
 
 _LOG = logging.getLogger('xcube')
 
+_REQUEST_SECONDS = REGISTRY.histogram('xcube_request_seconds',
+                                      'Time spent handling HTTP requests per route handler, in seconds',
+                                      ('handler', 'method', 'status'))
+
 
 class Service:
     """
@@ -62,7 +80,13 @@ class Service:
                  port: int = DEFAULT_PORT,
                  config_file: Optional[str] = None,
                  tile_cache_size: Optional[str] = DEFAULT_TILE_CACHE_SIZE,
+                 file_tile_cache_size: Optional[str] = None,
+                 file_tile_cache_dir: Optional[str] = None,
+                 chunk_cache_size: Optional[str] = DEFAULT_CHUNK_CACHE_SIZE,
+                 disk_chunk_cache_size: Optional[str] = None,
+                 disk_chunk_cache_dir: Optional[str] = None,
                  tile_comp_mode: int = DEFAULT_TILE_COMP_MODE,
+                 num_workers: int = DEFAULT_NUM_WORKERS,
                  update_period: Optional[float] = DEFAULT_UPDATE_PERIOD,
                  trace_perf: bool = DEFAULT_TRACE_PERF,
                  log_file_prefix: str = DEFAULT_LOG_PREFIX,
@@ -81,6 +105,18 @@ class Service:
         :param address: the address
         :param port: the port number
         :param config_file: optional configuration file
+        :param tile_cache_size: size of the in-memory tile cache, e.g. "512M", or "OFF".
+               Multiple worker processes share the in-memory tile cache.
+        :param file_tile_cache_size: size of the file tile cache shared by all processes, e.g. "20G", or "OFF".
+               Defaults to "OFF" for a single process and to DEFAULT_FILE_TILE_CACHE_SIZE for multiple worker processes.
+        :param file_tile_cache_dir: directory of the file tile cache
+        :param chunk_cache_size: size of the cache for chunks of remote datasets, e.g. "1G", or "OFF"
+        :param disk_chunk_cache_size: size of the persistent disk cache for chunks of remote datasets,
+               e.g. "50G", or "OFF", which is the default
+        :param disk_chunk_cache_dir: directory of the disk chunk cache
+        :param tile_comp_mode: tile computation mode
+        :param num_workers: number of worker processes that serve requests on the same port.
+               Zero or a negative value means one worker process per CPU.
         :param update_period: if not-None, time of idleness in seconds before service is updated
         :param log_file_prefix: Log file prefix, default is "xcube_server.log"
         :param log_to_stderr: Whether logging should be shown on stderr
@@ -95,7 +131,30 @@ class Service:
         options.log_to_stderr = log_to_stderr
         enable_pretty_logging()
 
+        num_workers = get_num_workers(num_workers)
+        if file_tile_cache_size is None:
+            file_tile_cache_size = DEFAULT_FILE_TILE_CACHE_SIZE if num_workers > 1 else "OFF"
         tile_cache_config = parse_tile_cache_config(tile_cache_size)
+        file_tile_cache_config = parse_tile_cache_config(file_tile_cache_size)
+        chunk_cache_config = parse_tile_cache_config(chunk_cache_size)
+        disk_chunk_cache_config = parse_tile_cache_config(disk_chunk_cache_size or "OFF")
+        file_tile_cache_dir = file_tile_cache_dir or os.path.join(FILE_TILE_CACHE_PATH, 'v%s' % __version__, 'tiles')
+        if file_tile_cache_config.get("capacity"):
+            # Tiles of a previous run may have been computed from other data or styles.
+            # Only tile files are removed, the directory may contain other files.
+            FileCacheStore(file_tile_cache_dir, ".png", capacity=file_tile_cache_config["capacity"]).clear()
+
+        sockets = None
+        mem_tile_cache_store = None
+        self.worker_id = None
+        if num_workers > 1:
+            if tile_cache_config.get("capacity"):
+                # Created before forking, so that all workers share the same in-memory tile cache
+                mem_tile_cache_store = SharedMemoryCacheStore(tile_cache_config["capacity"])
+            # Bind sockets before forking, so that all workers accept connections on the same sockets.
+            # Only the worker processes return from fork_workers().
+            sockets = bind_sockets(port, address=address or 'localhost')
+            self.worker_id = fork_workers(num_workers)
 
         self.config_file = os.path.abspath(config_file) if config_file else None
         self.config_mtime = None
@@ -105,36 +164,53 @@ class Service:
         self.service_info = dict(port=port,
                                  address=address,
                                  started=datetime.now().isoformat(sep=' '),
-                                 pid=os.getpid())
+                                 pid=os.getpid(),
+                                 worker_id=self.worker_id)
 
         self.context = ServiceContext(name=name,
                                       base_dir=os.path.dirname(self.config_file or os.path.abspath('')),
                                       tile_comp_mode=tile_comp_mode,
                                       trace_perf=trace_perf,
-                                      mem_tile_cache_capacity=tile_cache_config.get("capacity"))
+                                      mem_tile_cache_capacity=tile_cache_config.get("capacity"),
+                                      mem_tile_cache_store=mem_tile_cache_store,
+                                      file_tile_cache_capacity=file_tile_cache_config.get("capacity"),
+                                      file_tile_cache_dir=file_tile_cache_dir,
+                                      chunk_cache_capacity=chunk_cache_config.get("capacity"),
+                                      disk_chunk_cache_capacity=disk_chunk_cache_config.get("capacity"),
+                                      disk_chunk_cache_dir=disk_chunk_cache_dir)
         self._maybe_load_config()
 
         application.service_context = self.context
         application.time_of_last_activity = time.process_time()
         self.application = application
 
-        self.server = application.listen(port, address=address or 'localhost')
+        if sockets is not None:
+            self.server = HTTPServer(application)
+            self.server.add_sockets(sockets)
+        else:
+            self.server = application.listen(port, address=address or 'localhost')
         # Ensure we have the same event loop in all threads
         asyncio.set_event_loop_policy(_GlobalEventLoopPolicy(asyncio.get_event_loop()))
-        # Register handlers for common termination signals
+        # Register handlers for common termination signals and for SIGHUP, which forces a configuration reload
         signal.signal(signal.SIGINT, self._sig_handler)
         signal.signal(signal.SIGTERM, self._sig_handler)
+        if hasattr(signal, 'SIGHUP'):
+            signal.signal(signal.SIGHUP, self._sig_handler)
         self._maybe_load_config()
         self._maybe_install_update_check()
+        self.event_loop_lag_monitor = EventLoopLagMonitor()
 
     def start(self):
         address = self.service_info['address']
         port = self.service_info['port']
         test_url = self.context.get_service_url(f"http://{address}:{port}", "datasets")
+        if self.worker_id is not None:
+            _LOG.info(f'worker {self.worker_id} (pid {os.getpid()}) running')
         _LOG.info(f'service running, listening on {address}:{port}, try {test_url}')
         _LOG.info(f'press CTRL+C to stop service')
         if len(self.context.config.get('Datasets', {})) == 0:
             _LOG.warning('no datasets configured')
+        self.event_loop_lag_monitor.start()
         IOLoop.current().start()
 
     def stop(self, kill=False):
@@ -160,12 +236,22 @@ class Service:
             self.server.stop()
             self.server = None
 
+        self.event_loop_lag_monitor.stop()
+
         IOLoop.current().stop()
 
     # noinspection PyUnusedLocal
     def _sig_handler(self, sig, frame):
         _LOG.warning(f'caught signal {sig}')
-        IOLoop.current().add_callback_from_signal(self._on_shut_down)
+        if sig == getattr(signal, 'SIGHUP', None):
+            IOLoop.current().add_callback_from_signal(self._reload_config)
+        else:
+            IOLoop.current().add_callback_from_signal(self._on_shut_down)
+
+    def _reload_config(self):
+        # Force reloading even if the configuration file's modification time has not changed
+        self.config_mtime = None
+        self._maybe_load_config()
 
     def _maybe_install_update_check(self):
         if self.update_period is None or self.update_period <= 0:
@@ -207,6 +293,7 @@ class ServiceRequestHandler(RequestHandler):
     def __init__(self, application, request, **kwargs):
         super().__init__(application, request, **kwargs)
         self._params = ServiceRequestParams(self)
+        self._trace = None  # type: Optional[Trace]
 
     @property
     def service_context(self) -> ServiceContext:
@@ -229,6 +316,45 @@ class ServiceRequestHandler(RequestHandler):
         self.set_status(204)
         self.finish()
 
+    def prepare(self):
+        """
+        Start a trace of the request if performance tracing is enabled or the client requested it
+        using the query parameter "debug", which is honored only if tracing is enabled, see
+        :attr:`ServiceContext.tracing_enabled`. The trace's identifier is sent in the "X-Trace-Id" header,
+        and the trace can be retrieved using the "/traces/{trace_id}" operation.
+        """
+        ctx = self.service_context
+        if ctx.trace_perf or (ctx.tracing_enabled and self.params.get_query_argument_int('debug', 0) != 0):
+            self._trace = start_trace(f'{self.request.method} {self.request.path}',
+                                      attributes=dict(handler=type(self).__name__))
+            self._trace.__enter__()
+            self.set_header('X-Trace-Id', self._trace.id)
+
+    @property
+    def trace(self) -> Optional[Trace]:
+        """The trace of this request, or None if the request is not traced."""
+        return self._trace
+
+    def run_in_executor(self, workload: str, func: Callable, *args, admitted: bool = False) -> Awaitable:
+        """
+        Run *func* with the given *args* in the executor dedicated to *workload*, see
+        :meth:`ServiceContext.get_executor`. The numbers of queued and active executor tasks are
+        recorded in the metrics. *func* is run in a copy of the current context, so spans it records
+        are added to the request's trace.
+
+        :param workload: the workload name, e.g. EXECUTOR_TILES
+        :param func: the function to be run
+        :param args: the function's arguments
+        :param admitted: whether the request has already been admitted by a previous call, in which case
+            *func* is run even if the executor's queue is full
+        :return: an awaitable for the function's result
+        :raise ServiceUnavailableError: if the executor's queue is full and the request has not been admitted
+        """
+        executor = self.service_context.get_executor(workload)
+        if admitted:
+            return asyncio.wrap_future(executor.submit_admitted(contextvars.copy_context().run, func, *args))
+        return IOLoop.current().run_in_executor(executor, contextvars.copy_context().run, func, *args)
+
     def get_body_as_json_object(self, name="JSON object"):
         """ Get the body argument as JSON object. """
         try:
@@ -236,14 +362,78 @@ class ServiceRequestHandler(RequestHandler):
         except (JSONDecodeError, TypeError, ValueError) as e:
             raise ServiceBadRequestError(f"Invalid or missing {name} in request body") from e
 
+    @property
+    def pretty(self) -> bool:
+        """Whether the client requested pretty, i.e. indented, JSON output using the query parameter "pretty"."""
+        return self.params.get_query_argument_int('pretty', 0) != 0
+
+    def finish_json(self, obj: Any):
+        """
+        Finish the request by sending *obj* as JSON. The output is compact unless the client
+        requested pretty output, see :attr:`pretty`.
+
+        :param obj: the object to send, may contain numpy scalars and arrays
+        """
+        self.set_header('Content-Type', 'application/json')
+        self.finish(to_json_bytes(obj, pretty=self.pretty))
+
+    def finish_document(self, document: EncodedDocument):
+        """
+        Finish the request by sending a pre-encoded document. If the client accepts a supported
+        content encoding, the document data is sent pre-compressed.
+
+        :param document: the document
+        """
+        self.set_header('Content-Type', document.content_type)
+        self.set_header('Vary', 'Accept-Encoding')
+        encoding = select_content_encoding(self.request.headers.get('Accept-Encoding'))
+        if encoding is not None:
+            self.set_header('Content-Encoding', encoding)
+            self.finish(document.get_compressed_data(encoding))
+        else:
+            self.finish(document.data)
+
+    async def finish_ndjson(self, blocks: Iterator[List[Any]], workload: str = EXECUTOR_TIME_SERIES):
+        """
+        Finish the request by streaming the items of the given *blocks* as newline-delimited JSON (NDJSON),
+        one JSON object per line. Each block is computed in the executor and flushed immediately, so
+        clients receive first results before the entire response has been computed. Only the first block
+        is subject to the executor's admission control, so that a response that has been started is not
+        truncated if the executor's queue is full.
+
+        :param blocks: an iterator of lists of JSON-serializable objects
+        :param workload: the workload name of the executor used to compute the blocks
+        """
+        self.set_header('Content-Type', 'application/x-ndjson')
+        admitted = False
+        while True:
+            block = await self.run_in_executor(workload, next, blocks, None, admitted=admitted)
+            admitted = True
+            if block is None:
+                break
+            self.write(''.join(to_json(item) + '\n' for item in block))
+            await self.flush()
+        self.finish()
+
     def on_finish(self):
         """
         Store time of last activity so we can measure time of inactivity and then optionally auto-exit.
+        Record the request's duration in the metrics and end the request's trace, if any.
         """
         self.application.time_of_last_activity = time.process_time()
+        if self._trace is not None:
+            self._trace.set_attribute('status', self.get_status())
+            self._trace.__exit__(None, None, None)
+        _REQUEST_SECONDS.labels(type(self).__name__,
+                                self.request.method,
+                                self.get_status()).observe(self.request.request_time())
 
     def write_error(self, status_code, **kwargs):
         self.set_header('Content-Type', 'application/json')
+        if "exc_info" in kwargs:
+            retry_after = getattr(kwargs["exc_info"][1], "retry_after", None)
+            if retry_after is not None:
+                self.set_header('Retry-After', retry_after)
         # if self.settings.get("serve_traceback") and "exc_info" in kwargs:
         if "exc_info" in kwargs:
             # in debug mode, try to send a traceback
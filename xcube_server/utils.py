@@ -1,3 +1,7 @@
+import hashlib
+import math
+import threading
+import weakref
 from typing import Optional, Tuple, Union, Dict, Any, List
 
 import affine
@@ -8,9 +12,15 @@ import shapely.geometry
 import shapely.geometry
 import xarray as xr
 
+from .cache import Cache
+
 Bounds = Tuple[float, float, float, float]
 SplitBounds = Tuple[Bounds, Optional[Bounds]]
 
+# Memoized results of timestamps_to_iso_strings(): (id(times), freq) --> (weakref(times), iso_strings)
+_ISO_STRINGS_CACHE = dict()
+_ISO_STRINGS_CACHE_LOCK = threading.Lock()
+
 
 def get_dataset_geometry(dataset: Union[xr.Dataset, xr.DataArray]) -> shapely.geometry.base.BaseGeometry:
     return get_box_split_bounds_geometry(*get_dataset_bounds(dataset))
@@ -72,15 +82,102 @@ def get_box_split_bounds_geometry(lon_min: float, lat_min: float,
 
 def get_geometry_mask(width: int, height: int,
                       geometry: Union[shapely.geometry.base.BaseGeometry, Dict],
-                      lon_min: float, lat_min: float, res: float) -> np.ndarray:
+                      lon_min: float, lat_min: float, res: float,
+                      mask_cache: Cache = None) -> np.ndarray:
+    """
+    Rasterize *geometry* into a boolean mask of shape (*height*, *width*).
+
+    If *mask_cache* is given, masks are looked up in and stored into the cache using a key
+    formed by the geometry's hash, the grid's origin and resolution, and the mask shape.
+    Masks are cached in compact, bit-packed form.
+
+    :param width: mask width
+    :param height: mask height
+    :param geometry: the geometry, either a shapely geometry or a GeoJSON geometry dictionary
+    :param lon_min: minimum longitude of the grid
+    :param lat_min: minimum latitude of the grid
+    :param res: grid resolution in degrees
+    :param mask_cache: optional cache for bit-packed masks
+    :return: boolean mask array which is True for pixels that touch the geometry
+    """
     # noinspection PyTypeChecker
     transform = affine.Affine(res, 0.0, lon_min,
                               0.0, -res, lat_min + res * height)
-    return rasterio.features.geometry_mask([geometry],
+    mask_key = None
+    if mask_cache is not None:
+        mask_key = (get_geometry_hash(geometry), (res, lon_min, lat_min), (height, width))
+        packed_mask = mask_cache.get_value(mask_key)
+        if packed_mask is not None:
+            return np.unpackbits(packed_mask)[0:width * height].reshape((height, width)).astype(np.bool_)
+    mask = rasterio.features.geometry_mask([geometry],
                                            out_shape=(height, width),
                                            transform=transform,
                                            all_touched=True,
                                            invert=True)
+    if mask_cache is not None:
+        mask_cache.put_value(mask_key, np.packbits(mask))
+    return mask
+
+
+def get_dataset_geometry_mask(dataset: xr.Dataset,
+                              geometry: shapely.geometry.base.BaseGeometry,
+                              mask_cache: Cache = None) -> Optional[Tuple[Dict[str, slice], np.ndarray]]:
+    """
+    Compute the spatial subset of *dataset* that covers *geometry* and the geometry's mask
+    for that subset.
+
+    :param dataset: the dataset
+    :param geometry: the geometry
+    :param mask_cache: optional cache for bit-packed masks, see :func:`get_geometry_mask`
+    :return: a tuple (indexers, mask) where indexers are the "lon" and "lat" slices of the subset,
+             or None, if the geometry does not intersect the dataset's bounds
+    """
+    ds_lon_min, ds_lat_min, ds_lon_max, ds_lat_max = get_dataset_bounds(dataset)
+    dataset_geometry = get_box_split_bounds_geometry(ds_lon_min, ds_lat_min, ds_lon_max, ds_lat_max)
+    # TODO: split geometry
+    split_geometry = geometry
+    actual_geometry = dataset_geometry.intersection(split_geometry)
+    if actual_geometry.is_empty:
+        return None
+
+    width = len(dataset.lon)
+    height = len(dataset.lat)
+    res = (ds_lat_max - ds_lat_min) / height
+
+    g_lon_min, g_lat_min, g_lon_max, g_lat_max = actual_geometry.bounds
+    x1 = _clamp(int(math.floor((g_lon_min - ds_lon_min) / res)), 0, width - 1)
+    x2 = _clamp(int(math.ceil((g_lon_max - ds_lon_min) / res)) + 1, 0, width - 1)
+    y1 = _clamp(int(math.floor((ds_lat_max - g_lat_max) / res)), 0, height - 1)
+    y2 = _clamp(int(math.ceil((ds_lat_max - g_lat_min) / res)) + 1, 0, height - 1)
+    indexers = dict(lon=slice(x1, x2), lat=slice(y1, y2))
+    ds_subset = dataset.isel(**indexers)
+    subset_ds_lon_min, subset_ds_lat_min, subset_ds_lon_max, subset_ds_lat_max = get_dataset_bounds(ds_subset)
+    subset_width = len(ds_subset.lon)
+    subset_height = len(ds_subset.lat)
+
+    mask = get_geometry_mask(subset_width, subset_height, actual_geometry, subset_ds_lon_min, subset_ds_lat_min, res,
+                             mask_cache=mask_cache)
+    return indexers, mask
+
+
+def get_geometry_hash(geometry: Union[shapely.geometry.base.BaseGeometry, Dict]) -> str:
+    """
+    Compute a hash value for *geometry* from its WKB representation.
+
+    :param geometry: the geometry, either a shapely geometry or a GeoJSON geometry dictionary
+    :return: the hash value as hexadecimal string
+    """
+    if isinstance(geometry, dict):
+        geometry = shapely.geometry.shape(geometry)
+    return hashlib.sha1(geometry.wkb).hexdigest()
+
+
+def _clamp(x, x1, x2):
+    if x < x1:
+        return x1
+    if x > x2:
+        return x2
+    return x
 
 
 def timestamp_to_iso_string(time: np.datetime64, freq='S'):
@@ -97,6 +194,52 @@ def timestamp_to_iso_string(time: np.datetime64, freq='S'):
     return pd.Timestamp(time).round(freq).isoformat() + 'Z'
 
 
+def timestamps_to_iso_strings(times: np.ndarray, freq='S', memoize=False) -> List[str]:
+    """
+    Convert an array of UTC timestamps to ISO-format strings.
+    Same as :func:`timestamp_to_iso_string`, but all timestamps are rounded and formatted at once.
+
+    If *memoize* is true, the result is cached for as long as the given *times* array exists.
+    This should only be used for arrays that are not modified, such as coordinate variable
+    values of opened datasets. The returned list is then shared and must not be modified either.
+
+    :param times: array of UTC timestamps of type numpy datetime64.
+    :param freq: time rounding resolution. See pandas.Timestamp.round().
+    :param memoize: whether to memoize the result per identity of the *times* array.
+    :return: list of ISO-format strings.
+    """
+    if not memoize or not isinstance(times, np.ndarray):
+        return _timestamps_to_iso_strings(times, freq)
+
+    key = id(times), freq
+    with _ISO_STRINGS_CACHE_LOCK:
+        entry = _ISO_STRINGS_CACHE.get(key)
+    if entry is not None:
+        times_ref, iso_strings = entry
+        if times_ref() is times:
+            return iso_strings
+
+    iso_strings = _timestamps_to_iso_strings(times, freq)
+
+    def remove_entry(ref):
+        with _ISO_STRINGS_CACHE_LOCK:
+            if key in _ISO_STRINGS_CACHE and _ISO_STRINGS_CACHE[key][0] is ref:
+                del _ISO_STRINGS_CACHE[key]
+
+    with _ISO_STRINGS_CACHE_LOCK:
+        _ISO_STRINGS_CACHE[key] = weakref.ref(times, remove_entry), iso_strings
+    return iso_strings
+
+
+def _timestamps_to_iso_strings(times: np.ndarray, freq: str) -> List[str]:
+    times = pd.DatetimeIndex(np.asarray(times).ravel()).round(freq)
+    if np.any(times.asi8[~times.isna()] % 1_000_000_000 != 0):
+        # Sub-second resolution, format like pandas.Timestamp.isoformat()
+        return [time.isoformat() + 'Z' for time in times]
+    # All times are UTC (Z = Zulu Time Zone = UTC)
+    return [iso_string + 'Z' for iso_string in np.datetime_as_string(times.values, unit='s').tolist()]
+
+
 class GeoJSON:
     PRIMITIVE_GEOMETRY_TYPES = {"Point", "LineString", "Polygon",
                                 "MultiPoint", "MultiLineString", "MultiPolygon"}
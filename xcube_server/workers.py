@@ -0,0 +1,154 @@
+# The MIT License (MIT)
+# Copyright (c) 2018 by the xcube development team and contributors
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies
+# of the Software, and to permit persons to whom the Software is furnished to do
+# so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Pre-forked worker processes.
+
+A single Tornado process serves all requests on one event loop and therefore uses at most one core
+for the work done on the loop. In multi-process mode, the service binds its listening sockets once and
+then forks a number of worker processes that all accept connections on these sockets.
+The parent process only supervises the workers:
+
+* it restarts workers that exit abnormally,
+* it forwards ``SIGINT`` and ``SIGTERM`` to the workers and exits once all workers have stopped,
+* it forwards ``SIGHUP`` to the workers, which then reload their configuration.
+"""
+
+import logging
+import os
+import random
+import signal
+import sys
+import time
+from typing import Optional
+
+from .defaults import DEFAULT_MAX_WORKER_RESTARTS
+
+__author__ = "Norman Fomferra (Brockmann Consult GmbH)"
+
+_LOG = logging.getLogger('xcube')
+
+_FORWARDED_SIGNALS = (signal.SIGINT, signal.SIGTERM, signal.SIGHUP)
+
+
+def get_num_workers(num_workers: Optional[int]) -> int:
+    """
+    Get the effective number of worker processes.
+
+    :param num_workers: requested number of workers. Zero or a negative value means one worker per CPU.
+    :return: the number of worker processes
+    """
+    if num_workers is None:
+        return 1
+    if num_workers <= 0:
+        return os.cpu_count() or 1
+    return num_workers
+
+
+def fork_workers(num_workers: int, max_restarts: int = DEFAULT_MAX_WORKER_RESTARTS) -> int:
+    """
+    Fork *num_workers* worker processes.
+
+    Like Tornado's ``tornado.process.fork_processes()``, this function returns only in the workers.
+    The calling parent process supervises the workers and calls ``sys.exit()`` once all of them have exited.
+    Unlike Tornado's function, the parent forwards termination signals to the workers,
+    so that stopping the parent stops the service cleanly.
+
+    Sockets must be bound before calling this function, and no event loop or threads
+    must have been created yet.
+
+    :param num_workers: number of worker processes, must be greater than zero
+    :param max_restarts: maximum number of times abnormally exited workers are restarted
+    :return: the worker identifier, an integer in the range 0 to *num_workers* - 1
+    """
+    if num_workers <= 0:
+        raise ValueError('num_workers must be greater than zero')
+    if sys.platform == 'win32':
+        raise RuntimeError('multiple worker processes are not supported on Windows')
+    return _WorkerSupervisor(num_workers, max_restarts).run()
+
+
+class _WorkerSupervisor:
+
+    def __init__(self, num_workers: int, max_restarts: int):
+        self._num_workers = num_workers
+        self._max_restarts = max_restarts
+        self._num_restarts = 0
+        self._children = dict()  # type: Dict[int, int]
+        self._stopping = False
+
+    def run(self) -> int:
+        _LOG.info(f'starting {self._num_workers} worker processes')
+        for sig in _FORWARDED_SIGNALS:
+            signal.signal(sig, self._sig_handler)
+        for worker_id in range(self._num_workers):
+            if self._start_worker(worker_id):
+                return worker_id
+        while self._children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            worker_id = self._children.pop(pid, None)
+            if worker_id is None:
+                continue
+            if os.WIFSIGNALED(status):
+                _LOG.warning(f'worker {worker_id} (pid {pid}) killed by signal {os.WTERMSIG(status)}')
+            elif os.WEXITSTATUS(status) != 0:
+                _LOG.warning(f'worker {worker_id} (pid {pid}) exited with status {os.WEXITSTATUS(status)}')
+            else:
+                _LOG.info(f'worker {worker_id} (pid {pid}) exited')
+                continue
+            if self._stopping:
+                continue
+            self._num_restarts += 1
+            if self._num_restarts > self._max_restarts:
+                _LOG.error('too many worker restarts, stopping service')
+                self._stopping = True
+                self._signal_workers(signal.SIGTERM)
+                continue
+            if self._start_worker(worker_id):
+                return worker_id
+        sys.exit(0)
+
+    def _start_worker(self, worker_id: int) -> bool:
+        pid = os.fork()
+        if pid == 0:
+            # In the worker: restore default signal handling, the service installs its own handlers
+            for sig in _FORWARDED_SIGNALS:
+                signal.signal(sig, signal.SIG_DFL)
+            random.seed(int(time.time() * 1000) ^ os.getpid())
+            return True
+        self._children[pid] = worker_id
+        return False
+
+    # noinspection PyUnusedLocal
+    def _sig_handler(self, sig, frame):
+        if sig != signal.SIGHUP:
+            self._stopping = True
+        self._signal_workers(sig)
+
+    def _signal_workers(self, sig):
+        for pid in list(self._children.keys()):
+            try:
+                os.kill(pid, sig)
+            except ProcessLookupError:
+                pass